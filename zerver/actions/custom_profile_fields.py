@@ -8,6 +8,7 @@ from zerver.lib.exceptions import JsonableError
 from zerver.lib.external_accounts import DEFAULT_EXTERNAL_ACCOUNTS
 from zerver.lib.streams import render_stream_description
 from zerver.lib.types import ProfileDataElementUpdateDict, ProfileFieldData
+from zerver.lib.user_directory import flush_user_directory, flush_user_directory_entries
 from zerver.lib.users import get_user_ids_who_can_access_user
 from zerver.models import CustomProfileField, CustomProfileFieldValue, Realm, UserProfile
 from zerver.models.custom_profile_fields import custom_profile_fields_for_realm
@@ -87,11 +88,13 @@ def do_remove_realm_custom_profile_field(realm: Realm, field: CustomProfileField
     associated with it in CustomProfileFieldValue model.
     """
     field.delete()
+    flush_user_directory(realm.id)
     notify_realm_custom_profile_fields(realm)
 
 
 def do_remove_realm_custom_profile_fields(realm: Realm) -> None:
     CustomProfileField.objects.filter(realm=realm).delete()
+    flush_user_directory(realm.id)
 
 
 def remove_custom_profile_field_value_if_required(
@@ -141,6 +144,9 @@ def try_update_realm_custom_profile_field(
         if field_data is not None or field.field_data == "":
             field.field_data = orjson.dumps(field_data or {}).decode()
     field.save()
+    # Removing options removes users' values, and the field's type
+    # determines whether values are rendered.
+    flush_user_directory(realm.id)
     notify_realm_custom_profile_fields(realm)
 
 
@@ -165,6 +171,7 @@ def notify_user_update_custom_profile_data(
     if field["rendered_value"]:
         data["rendered_value"] = field["rendered_value"]
     payload = dict(user_id=user_profile.id, custom_profile_field=data)
+    flush_user_directory_entries(user_profile.realm_id, [user_profile.id])
     event = dict(type="realm_user", op="update", person=payload)
     send_event_on_commit(user_profile.realm, event, get_user_ids_who_can_access_user(user_profile))
 
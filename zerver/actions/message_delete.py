@@ -3,6 +3,7 @@ from collections.abc import Iterable
 from typing import TypedDict
 
 from zerver.lib import retention
+from zerver.lib.cache import flush_message_window_cache
 from zerver.lib.message import event_recipient_ids_for_action_on_messages
 from zerver.lib.retention import move_messages_to_archive
 from zerver.models import Message, Realm, Stream, UserProfile
@@ -93,6 +94,9 @@ def _process_grouped_messages_deletion(
         check_update_first_message_id(realm, stream, message_ids, users_to_notify)
 
     send_event_on_commit(realm, event, users_to_notify)
+    flush_message_window_cache(
+        users_to_notify, [stream.recipient_id] if stream is not None and stream.recipient_id else []
+    )
 
 
 def do_delete_messages(
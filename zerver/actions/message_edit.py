@@ -1,6 +1,6 @@
 import itertools
 from collections import defaultdict
-from collections.abc import Iterable
+from collections.abc import Callable, Iterable
 from collections.abc import Set as AbstractSet
 from dataclasses import dataclass
 from datetime import timedelta
@@ -26,6 +26,7 @@ from zerver.actions.message_send import (
 from zerver.actions.uploads import AttachmentChangeResult, check_attachment_reference_change
 from zerver.actions.user_topics import bulk_do_set_user_topic_visibility_policy
 from zerver.lib import utils
+from zerver.lib.cache import flush_message_window_cache, flush_unread_data_cache
 from zerver.lib.exceptions import (
     JsonableError,
     MessageMoveError,
@@ -48,7 +49,7 @@ from zerver.lib.message import (
     topic_wildcard_mention_allowed,
     truncate_topic,
 )
-from zerver.lib.message_cache import update_message_cache
+from zerver.lib.message_cache import update_message_cache, update_message_cache_for_ids
 from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.stream_subscription import get_active_subscriptions_for_stream_id
 from zerver.lib.stream_topic import StreamTopicTarget
@@ -80,6 +81,7 @@ from zerver.lib.topic import (
     update_messages_for_topic_edit,
 )
 from zerver.lib.topic_link_util import get_stream_topic_link_syntax
+from zerver.lib.topic_summaries import update_topic_summaries
 from zerver.lib.types import DirectMessageEditRequest, EditHistoryEvent, StreamMessageEditRequest
 from zerver.lib.url_encoding import stream_message_url
 from zerver.lib.user_message import bulk_insert_all_ums
@@ -436,6 +438,7 @@ def update_user_message_flags(
 
     for um in changed_ums:
         um.save(update_fields=["flags"])
+    flush_unread_data_cache(um.user_profile_id for um in changed_ums)
 
 
 def do_update_embedded_data(
@@ -735,6 +738,7 @@ def do_update_message(
             event["message_ids"] = sorted(update_message_cache([target_message]))
             users_to_be_notified = list(map(user_info, ums))
             send_event_on_commit(user_profile.realm, event, users_to_be_notified)
+            flush_message_window_cache(user["id"] for user in users_to_be_notified)
 
             changed_messages_count = 1
             return UpdateMessageResult(
@@ -853,9 +857,7 @@ def do_update_message(
     changed_messages = Message.objects.filter(id=target_message.id)
     changed_message_ids = [target_message.id]
     changed_messages_count = 1
-    save_changes_for_propagation_mode = lambda: Message.objects.filter(
-        id=target_message.id
-    ).select_related(*Message.DEFAULT_SELECT_RELATED)
+    propagate_changes: Callable[[list[int]], None] = lambda message_ids: None
     if message_edit_request.propagate_mode in ["change_later", "change_all"]:
         # Other messages should only get topic/stream fields in their edit history.
         topic_only_edit_history_event: EditHistoryEvent = {
@@ -869,7 +871,7 @@ def do_update_message(
             topic_only_edit_history_event["prev_stream"] = edit_history_event["prev_stream"]
             topic_only_edit_history_event["stream"] = edit_history_event["stream"]
 
-        later_messages, save_changes_for_propagation_mode = update_messages_for_topic_edit(
+        later_messages, propagate_changes = update_messages_for_topic_edit(
             acting_user=user_profile,
             edited_message=target_message,
             message_edit_request=message_edit_request,
@@ -915,6 +917,8 @@ def do_update_message(
         send_event_on_commit(
             user_profile.realm, delete_event, [user.id for user in users_losing_access]
         )
+        flush_unread_data_cache(user.id for user in users_losing_access)
+        flush_message_window_cache(user.id for user in users_losing_access)
 
         # Reset the Attachment.is_*_public caches for all messages
         # moved to another stream with different access permissions.
@@ -937,12 +941,29 @@ def do_update_message(
     # This does message.save(update_fields=[...])
     save_message_for_edit_use_case(message=target_message)
 
-    # This updates any later messages, if any.  It returns the
-    # freshly-fetched-from-the-database changed messages.
-    changed_messages = save_changes_for_propagation_mode()
+    # This updates any later messages, if any.
+    propagate_changes(changed_message_ids)
+
+    if message_edit_request.is_message_moved:
+        assert message_edit_request.orig_stream.recipient_id is not None
+        assert message_edit_request.target_stream.recipient_id is not None
+        update_topic_summaries(
+            [
+                (
+                    target_message.realm_id,
+                    message_edit_request.orig_stream.recipient_id,
+                    message_edit_request.orig_topic_name,
+                ),
+                (
+                    target_message.realm_id,
+                    message_edit_request.target_stream.recipient_id,
+                    message_edit_request.target_topic_name,
+                ),
+            ]
+        )
 
     realm_id = target_message.realm_id
-    event["message_ids"] = sorted(update_message_cache(changed_messages, realm_id))
+    event["message_ids"] = sorted(update_message_cache_for_ids(changed_message_ids, realm_id))
 
     # The following blocks arranges that users who are subscribed to a
     # stream and can see history from before they subscribed get
@@ -1239,6 +1260,14 @@ def do_update_message(
             apply_automatic_unmute_follow_topics_policy(sender, target_stream, target_topic)
 
     send_event_on_commit(user_profile.realm, event, users_to_be_notified)
+    if message_edit_request.is_message_moved:
+        flush_unread_data_cache(user["id"] for user in users_to_be_notified)
+    assert stream_being_edited.recipient_id is not None
+    assert message_edit_request.target_stream.recipient_id is not None
+    flush_message_window_cache(
+        (user["id"] for user in users_to_be_notified),
+        {stream_being_edited.recipient_id, message_edit_request.target_stream.recipient_id},
+    )
 
     resolved_topic_message_id = None
     # We calculate the users for which the resolved-topic notification
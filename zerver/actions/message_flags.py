@@ -9,7 +9,13 @@ from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
 
 from analytics.lib.counts import COUNT_STATS, do_increment_logging_stat
+from zerver.lib.cache import flush_message_window_cache, flush_unread_data_cache
 from zerver.lib.exceptions import JsonableError
+from zerver.lib.lazy_user_messages import (
+    advance_lazy_read_watermarks,
+    get_lazy_user_message_flags,
+    mark_lazy_unread_messages_as_read,
+)
 from zerver.lib.message import (
     bulk_access_messages,
     format_unread_message_details,
@@ -18,7 +24,12 @@ from zerver.lib.message import (
 from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.stream_subscription import get_subscribed_stream_recipient_ids_for_user
 from zerver.lib.topic import filter_by_topic_name_via_message
-from zerver.lib.user_message import DEFAULT_HISTORICAL_FLAGS, create_historical_user_messages
+from zerver.lib.user_message import (
+    DEFAULT_HISTORICAL_FLAGS,
+    UserMessageLite,
+    bulk_insert_ums,
+    create_historical_user_messages,
+)
 from zerver.models import Message, Recipient, UserMessage, UserProfile
 from zerver.tornado.django_api import send_event_on_commit, send_event_rollback_unsafe
 
@@ -33,6 +44,37 @@ class ReadMessagesEvent:
     flag: str = field(default="read", init=False)
 
 
+# Marking many messages as read is done in batches, each in its own
+# transaction, so that we never hold row locks on a large part of a
+# user's zerver_usermessage rows at once.  Every batch sends its own
+# update_message_flags event, so clients' unread counts stay
+# consistent while a large operation is in progress.
+MARK_AS_READ_BATCH_SIZE = 2000
+
+
+@dataclass
+class MarkAsReadProgress:
+    count: int
+    # Messages up to this ID have been processed; pass this as
+    # after_message_id to resume an incomplete operation.
+    last_message_id: int
+    complete: bool
+
+
+def increment_messages_read_stats(user_profile: UserProfile, count: int) -> None:
+    event_time = timezone_now()
+    do_increment_logging_stat(
+        user_profile, COUNT_STATS["messages_read::hour"], None, event_time, increment=count
+    )
+    do_increment_logging_stat(
+        user_profile,
+        COUNT_STATS["messages_read_interactions::hour"],
+        None,
+        event_time,
+        increment=min(1, count),
+    )
+
+
 def do_mark_all_as_read(user_profile: UserProfile, *, timeout: float | None = None) -> int | None:
     start_time = time.monotonic()
 
@@ -49,46 +91,54 @@ def do_mark_all_as_read(user_profile: UserProfile, *, timeout: float | None = No
     )
     do_clear_mobile_push_notifications_for_ids([user_profile.id], all_push_message_ids)
 
-    batch_size = 2000
     count = 0
     while True:
         if timeout is not None and time.monotonic() >= start_time + timeout:
             return None
 
         with transaction.atomic(durable=True):
-            query = (
+            # Rows leave the unread index once they're marked as read,
+            # so each batch just takes the oldest remaining ones; this
+            # means an interrupted run resumes naturally.
+            message_ids = list(
                 UserMessage.select_for_update_query()
                 .filter(user_profile=user_profile)
-                .extra(where=[UserMessage.where_unread()])[:batch_size]  # noqa: S610
-            )
-            # This updated_count is the same as the number of UserMessage
-            # rows selected, because due to the FOR UPDATE lock, we're guaranteed
-            # that all the selected rows will indeed be updated.
-            # UPDATE queries don't support LIMIT, so we have to use a subquery
-            # to do batching.
-            updated_count = UserMessage.objects.filter(id__in=query).update(
-                flags=F("flags").bitor(UserMessage.flags.read),
+                .extra(where=[UserMessage.where_unread()])  # noqa: S610
+                .values_list("message_id", flat=True)[:MARK_AS_READ_BATCH_SIZE]
             )
-
-            event_time = timezone_now()
-            do_increment_logging_stat(
-                user_profile,
-                COUNT_STATS["messages_read::hour"],
-                None,
-                event_time,
-                increment=updated_count,
-            )
-            do_increment_logging_stat(
-                user_profile,
-                COUNT_STATS["messages_read_interactions::hour"],
-                None,
-                event_time,
-                increment=min(1, updated_count),
-            )
-
-            count += updated_count
-            if updated_count < batch_size:
-                break
+            if message_ids:
+                # Due to the FOR UPDATE lock, we're guaranteed that
+                # all the selected rows are still unread.
+                UserMessage.objects.filter(
+                    user_profile=user_profile, message_id__in=message_ids
+                ).update(
+                    flags=F("flags").bitor(UserMessage.flags.read),
+                )
+                flush_unread_data_cache([user_profile.id])
+                flush_message_window_cache([user_profile.id])
+                increment_messages_read_stats(user_profile, len(message_ids))
+
+                event = asdict(ReadMessagesEvent(messages=message_ids, all=False))
+                send_event_on_commit(user_profile.realm, event, [user_profile.id])
+
+        count += len(message_ids)
+        if len(message_ids) < MARK_AS_READ_BATCH_SIZE:
+            break
+
+    # Messages in streams with lazy_user_messages enabled only need
+    # their subscription's read watermark to be advanced.
+    lazy_count = advance_lazy_read_watermarks(user_profile)
+    if lazy_count > 0:
+        flush_unread_data_cache([user_profile.id])
+        flush_message_window_cache([user_profile.id])
+        do_increment_logging_stat(
+            user_profile,
+            COUNT_STATS["messages_read::hour"],
+            None,
+            timezone_now(),
+            increment=lazy_count,
+        )
+        count += lazy_count
 
     event = asdict(
         ReadMessagesEvent(
@@ -101,15 +151,67 @@ def do_mark_all_as_read(user_profile: UserProfile, *, timeout: float | None = No
     return count
 
 
-@transaction.atomic(durable=True)
 def do_mark_stream_messages_as_read(
     user_profile: UserProfile, stream_recipient_id: int, topic_name: str | None = None
 ) -> int:
+    progress = do_mark_stream_messages_as_read_in_batches(
+        user_profile, stream_recipient_id, topic_name
+    )
+    assert progress.complete
+    return progress.count
+
+
+def do_mark_stream_messages_as_read_in_batches(
+    user_profile: UserProfile,
+    stream_recipient_id: int,
+    topic_name: str | None = None,
+    *,
+    after_message_id: int = 0,
+    timeout: float | None = None,
+) -> MarkAsReadProgress:
+    """Marks the user's unread messages in a stream, or in one of its
+    topics, as read, in batches of MARK_AS_READ_BATCH_SIZE messages in
+    increasing ID order.
+
+    If the timeout is reached, returns an incomplete
+    MarkAsReadProgress, which can be resumed (e.g. by the deferred_work
+    queue worker) by passing its last_message_id as after_message_id.
+    """
+    start_time = time.monotonic()
+    count = 0
+    while True:
+        if timeout is not None and time.monotonic() >= start_time + timeout:
+            return MarkAsReadProgress(count=count, last_message_id=after_message_id, complete=False)
+
+        with transaction.atomic(durable=True):
+            message_ids, batch_count = mark_stream_messages_batch_as_read(
+                user_profile, stream_recipient_id, topic_name, after_message_id
+            )
+        count += batch_count
+        if len(message_ids) < MARK_AS_READ_BATCH_SIZE:
+            break
+        after_message_id = message_ids[-1]
+
+    # The last batch also marked any lazily represented messages as
+    # read, which we don't track with after_message_id.
+    return MarkAsReadProgress(count=count, last_message_id=after_message_id, complete=True)
+
+
+def mark_stream_messages_batch_as_read(
+    user_profile: UserProfile,
+    stream_recipient_id: int,
+    topic_name: str | None,
+    after_message_id: int,
+) -> tuple[list[int], int]:
+    """Marks one batch for do_mark_stream_messages_as_read_in_batches.
+    Returns the IDs of the messages whose UserMessage rows were
+    updated, and the total number of messages marked as read."""
     query = (
         UserMessage.select_for_update_query()
         .filter(
             user_profile=user_profile,
             message__recipient_id=stream_recipient_id,
+            message_id__gt=after_message_id,
         )
         .extra(  # noqa: S610
             where=[UserMessage.where_unread()],
@@ -122,37 +224,34 @@ def do_mark_stream_messages_as_read(
             topic_name=topic_name,
         )
 
-    message_ids = list(query.values_list("message_id", flat=True))
+    message_ids = list(query.values_list("message_id", flat=True)[:MARK_AS_READ_BATCH_SIZE])
+    lazy_message_ids = []
+    if len(message_ids) < MARK_AS_READ_BATCH_SIZE:
+        lazy_message_ids = mark_lazy_unread_messages_as_read(
+            user_profile, recipient_id=stream_recipient_id, topic_name=topic_name or None
+        )
 
-    if len(message_ids) == 0:
-        return 0
+    if len(message_ids) == 0 and len(lazy_message_ids) == 0:
+        return message_ids, 0
 
-    count = query.update(
+    UserMessage.objects.filter(user_profile=user_profile, message_id__in=message_ids).update(
         flags=F("flags").bitor(UserMessage.flags.read),
     )
+    flush_unread_data_cache([user_profile.id])
+    flush_message_window_cache([user_profile.id])
 
     event = asdict(
         ReadMessagesEvent(
-            messages=message_ids,
+            messages=sorted(message_ids + lazy_message_ids),
             all=False,
         )
     )
-    event_time = timezone_now()
-
     send_event_on_commit(user_profile.realm, event, [user_profile.id])
     do_clear_mobile_push_notifications_for_ids([user_profile.id], message_ids)
 
-    do_increment_logging_stat(
-        user_profile, COUNT_STATS["messages_read::hour"], None, event_time, increment=count
-    )
-    do_increment_logging_stat(
-        user_profile,
-        COUNT_STATS["messages_read_interactions::hour"],
-        None,
-        event_time,
-        increment=min(1, count),
-    )
-    return count
+    count = len(message_ids) + len(lazy_message_ids)
+    increment_messages_read_stats(user_profile, count)
+    return message_ids, count
 
 
 @transaction.atomic(savepoint=False)
@@ -166,35 +265,28 @@ def do_mark_muted_user_messages_as_read(
         .extra(where=[UserMessage.where_unread()])  # noqa: S610
     )
     message_ids = list(query.values_list("message_id", flat=True))
+    lazy_message_ids = mark_lazy_unread_messages_as_read(user_profile, sender_id=muted_user.id)
 
-    if len(message_ids) == 0:
+    if len(message_ids) == 0 and len(lazy_message_ids) == 0:
         return 0
 
     count = query.update(
         flags=F("flags").bitor(UserMessage.flags.read),
     )
+    count += len(lazy_message_ids)
+    flush_unread_data_cache([user_profile.id])
+    flush_message_window_cache([user_profile.id])
 
     event = asdict(
         ReadMessagesEvent(
-            messages=message_ids,
+            messages=sorted(message_ids + lazy_message_ids),
             all=False,
         )
     )
-    event_time = timezone_now()
-
     send_event_on_commit(user_profile.realm, event, [user_profile.id])
     do_clear_mobile_push_notifications_for_ids([user_profile.id], message_ids)
 
-    do_increment_logging_stat(
-        user_profile, COUNT_STATS["messages_read::hour"], None, event_time, increment=count
-    )
-    do_increment_logging_stat(
-        user_profile,
-        COUNT_STATS["messages_read_interactions::hour"],
-        None,
-        event_time,
-        increment=min(1, count),
-    )
+    increment_messages_read_stats(user_profile, count)
     return count
 
 
@@ -313,6 +405,17 @@ def do_update_message_flags(
             )
         }
 
+        # Messages in streams with lazy_user_messages enabled may not
+        # have a UserMessage row despite having been received.
+        lazy_flags = get_lazy_user_message_flags(
+            user_profile, [message_id for message_id in messages if message_id not in ums]
+        )
+
+        def current_flags(message_id: int) -> int:
+            if message_id in ums:
+                return int(ums[message_id].flags)
+            return lazy_flags.get(message_id, DEFAULT_HISTORICAL_FLAGS)
+
         # Filter out rows that already have the desired flag.  We do
         # this here, rather than in the original database query,
         # because not all flags have database indexes and we want to
@@ -320,12 +423,26 @@ def do_update_message_flags(
         messages = [
             message_id
             for message_id in messages
-            if (int(ums[message_id].flags) if message_id in ums else DEFAULT_HISTORICAL_FLAGS)
-            & flagattr
-            != flag_target
+            if current_flags(message_id) & flagattr != flag_target
         ]
         count = len(messages)
 
+        # The changed flags of lazily represented messages can only be
+        # recorded by creating their UserMessage rows.  Note that this
+        # includes marking such a message as unread, which is the one
+        # case where we create a row with no flags set.
+        lazy_message_ids = set(messages) & lazy_flags.keys()
+        bulk_insert_ums(
+            [
+                UserMessageLite(
+                    user_profile_id=user_profile.id,
+                    message_id=message_id,
+                    flags=(lazy_flags[message_id] & ~flagattr) | flag_target,
+                )
+                for message_id in sorted(lazy_message_ids)
+            ]
+        )
+
         if DEFAULT_HISTORICAL_FLAGS & flagattr != flag_target:
             # When marking messages as read, creating "historical"
             # UserMessage rows would be a waste of storage, because
@@ -340,7 +457,7 @@ def do_update_message_flags(
             #
             # See create_historical_user_messages for a more detailed
             # explanation.
-            historical_message_ids = set(messages) - set(ums.keys())
+            historical_message_ids = set(messages) - set(ums.keys()) - lazy_message_ids
             historical_messages = bulk_access_messages(
                 user_profile,
                 list(
@@ -389,6 +506,10 @@ def do_update_message_flags(
             )
 
         send_event_on_commit(user_profile.realm, event, [user_profile.id])
+        flush_message_window_cache([user_profile.id])
+
+        if flag == "read":
+            flush_unread_data_cache([user_profile.id])
 
         if flag == "read" and is_adding:
             event_time = timezone_now()
@@ -1,8 +1,9 @@
+import copy
 import logging
 from collections import defaultdict
 from collections.abc import Callable, Collection, Sequence
 from collections.abc import Set as AbstractSet
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import timedelta
 from email.headerregistry import Address
 from typing import Any, TypedDict, cast
@@ -25,7 +26,12 @@ from zerver.actions.user_topics import (
 )
 from zerver.lib.addressee import Addressee
 from zerver.lib.alert_words import get_alert_word_automaton
-from zerver.lib.cache import cache_with_key, user_profile_delivery_email_cache_key
+from zerver.lib.cache import (
+    cache_with_key,
+    flush_accessible_user_ids_cache,
+    flush_newest_message_window_cache,
+    user_profile_delivery_email_cache_key,
+)
 from zerver.lib.create_user import create_user
 from zerver.lib.exceptions import (
     DirectMessageInitiationError,
@@ -79,6 +85,7 @@ from zerver.lib.thumbnail import get_user_upload_previews, rewrite_thumbnailed_i
 from zerver.lib.timestamp import timestamp_to_datetime
 from zerver.lib.topic import get_topic_display_name, participants_for_topic
 from zerver.lib.topic_link_util import get_stream_link_syntax
+from zerver.lib.topic_summaries import increment_topic_summaries
 from zerver.lib.url_preview.types import UrlEmbedData
 from zerver.lib.user_groups import (
     check_any_user_has_permission_by_role,
@@ -206,6 +213,7 @@ class RecipientInfoResult:
     muted_sender_user_ids: set[int]
     um_eligible_user_ids: set[int]
     long_term_idle_user_ids: set[int]
+    lazy_user_message_user_ids: set[int]
     default_bot_user_ids: set[int]
     service_bot_tuples: list[tuple[int, int]]
     all_bot_user_ids: set[int]
@@ -235,6 +243,26 @@ class SentMessageResult:
     automatic_new_visibility_policy: int | None = None
 
 
+RecipientInfoCacheKey = tuple[int, str | None, frozenset[int], bool, bool]
+
+
+@dataclass
+class MessageSendBatchCaches:
+    """Lookups shared between the messages of a single batch sent by
+    one sender via check_send_message_batch.
+
+    Like MentionBackend, this is only safe to reuse for the lifetime
+    of one request by one sender: it caches the results of
+    permission checks that depend on who the sender is.
+    """
+
+    mention_backend: MentionBackend
+    streams_by_name: dict[str, Stream] = field(default_factory=dict)
+    streams_by_id: dict[int, Stream] = field(default_factory=dict)
+    accessible_stream_ids: set[int] = field(default_factory=set)
+    recipient_info: dict[RecipientInfoCacheKey, RecipientInfoResult] = field(default_factory=dict)
+
+
 def get_recipient_info(
     *,
     realm_id: int,
@@ -255,6 +283,7 @@ def get_recipient_info(
     stream_wildcard_mention_in_followed_topic_user_ids: set[int] = set()
     muted_sender_user_ids: set[int] = get_muting_users(sender_id)
     topic_participant_user_ids: set[int] = set()
+    lazy_user_message_user_ids: set[int] = set()
     sender_muted_stream: bool | None = None
 
     if recipient.type == Recipient.PERSONAL:
@@ -320,6 +349,7 @@ def get_recipient_info(
                 "user_profile_push_notifications",
                 "user_profile_wildcard_mentions_notify",
                 "is_muted",
+                "lazy_start_message_id",
             )
             .order_by("user_profile_id")
         )
@@ -327,6 +357,8 @@ def get_recipient_info(
         message_to_user_id_set = set()
         for row in subscription_rows:
             message_to_user_id_set.add(row["user_profile_id"])
+            if settings.LAZY_USER_MESSAGE_STREAMS and row["lazy_start_message_id"] is not None:
+                lazy_user_message_user_ids.add(row["user_profile_id"])
             # We store the 'sender_muted_stream' information here to avoid db query at
             # a later stage when we perform automatically unmute topic in muted stream operation.
             if row["user_profile_id"] == sender_id:
@@ -539,6 +571,7 @@ def get_recipient_info(
         muted_sender_user_ids=muted_sender_user_ids,
         um_eligible_user_ids=um_eligible_user_ids,
         long_term_idle_user_ids=long_term_idle_user_ids,
+        lazy_user_message_user_ids=lazy_user_message_user_ids,
         default_bot_user_ids=default_bot_user_ids,
         service_bot_tuples=service_bot_tuples,
         all_bot_user_ids=all_bot_user_ids,
@@ -628,6 +661,7 @@ def build_message_send_dict(
     recipients_for_user_creation_events: dict[UserProfile, set[int]] | None = None,
     acting_user: UserProfile | None = None,
     no_previews: bool = False,
+    batch_caches: MessageSendBatchCaches | None = None,
 ) -> SendMessageRequest:
     """Returns a dictionary that can be passed into do_send_messages.  In
     production, this is always called by check_message, but some
@@ -635,7 +669,9 @@ def build_message_send_dict(
     """
     realm = message.realm
 
-    if mention_backend is None:
+    if batch_caches is not None:
+        mention_backend = batch_caches.mention_backend
+    elif mention_backend is None:
         mention_backend = MentionBackend(realm.id)
 
     mention_data = MentionData(
@@ -653,15 +689,32 @@ def build_message_send_dict(
     else:
         stream_topic = None
 
-    info = get_recipient_info(
-        realm_id=realm.id,
-        recipient=message.recipient,
-        sender_id=message.sender_id,
-        stream_topic=stream_topic,
-        possibly_mentioned_user_ids=mention_data.get_user_ids(),
-        possible_topic_wildcard_mention=mention_data.message_has_topic_wildcards(),
-        possible_stream_wildcard_mention=mention_data.message_has_stream_wildcards(),
+    possibly_mentioned_user_ids = mention_data.get_user_ids()
+    possible_topic_wildcard_mention = mention_data.message_has_topic_wildcards()
+    possible_stream_wildcard_mention = mention_data.message_has_stream_wildcards()
+    info_cache_key: RecipientInfoCacheKey = (
+        message.recipient.id,
+        stream_topic.topic_name if stream_topic is not None else None,
+        frozenset(possibly_mentioned_user_ids),
+        possible_topic_wildcard_mention,
+        possible_stream_wildcard_mention,
     )
+    if batch_caches is not None and info_cache_key in batch_caches.recipient_info:
+        # The sets in RecipientInfoResult are mutated later in the
+        # send path, so every message needs its own copy.
+        info = copy.deepcopy(batch_caches.recipient_info[info_cache_key])
+    else:
+        info = get_recipient_info(
+            realm_id=realm.id,
+            recipient=message.recipient,
+            sender_id=message.sender_id,
+            stream_topic=stream_topic,
+            possibly_mentioned_user_ids=possibly_mentioned_user_ids,
+            possible_topic_wildcard_mention=possible_topic_wildcard_mention,
+            possible_stream_wildcard_mention=possible_stream_wildcard_mention,
+        )
+        if batch_caches is not None:
+            batch_caches.recipient_info[info_cache_key] = copy.deepcopy(info)
 
     # Render our message_dicts.
     assert message.rendered_content is None
@@ -746,6 +799,7 @@ def build_message_send_dict(
         muted_sender_user_ids=info.muted_sender_user_ids,
         um_eligible_user_ids=info.um_eligible_user_ids,
         long_term_idle_user_ids=info.long_term_idle_user_ids,
+        lazy_user_message_user_ids=info.lazy_user_message_user_ids,
         default_bot_user_ids=info.default_bot_user_ids,
         service_bot_tuples=info.service_bot_tuples,
         all_bot_user_ids=info.all_bot_user_ids,
@@ -770,6 +824,7 @@ def create_user_messages(
     rendering_result: MessageRenderingResult,
     um_eligible_user_ids: AbstractSet[int],
     long_term_idle_user_ids: AbstractSet[int],
+    lazy_user_message_user_ids: AbstractSet[int],
     stream_push_user_ids: AbstractSet[int],
     stream_email_user_ids: AbstractSet[int],
     mentioned_user_ids: AbstractSet[int],
@@ -809,6 +864,11 @@ def create_user_messages(
     #
     # See https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html#soft-deactivation
     # for details on this system.
+    #
+    # Subscribers to streams with lazy_user_messages enabled get the
+    # same treatment; their read watermark on the Subscription tracks
+    # the state of messages without UserMessage rows.  See
+    # zerver/lib/lazy_user_messages.py.
     user_messages = []
     for user_profile_id in um_eligible_user_ids:
         flags = base_flags
@@ -827,7 +887,10 @@ def create_user_messages(
             flags |= UserMessage.flags.topic_wildcard_mentioned
 
         if (
-            user_profile_id in long_term_idle_user_ids
+            (
+                user_profile_id in long_term_idle_user_ids
+                or user_profile_id in lazy_user_message_user_ids
+            )
             and user_profile_id not in stream_push_user_ids
             and user_profile_id not in stream_email_user_ids
             and user_profile_id not in followed_topic_push_user_ids
@@ -966,6 +1029,7 @@ def do_send_messages(
             rendering_result=send_request.rendering_result,
             um_eligible_user_ids=send_request.um_eligible_user_ids,
             long_term_idle_user_ids=send_request.long_term_idle_user_ids,
+            lazy_user_message_user_ids=send_request.lazy_user_message_user_ids,
             stream_push_user_ids=send_request.stream_push_user_ids,
             stream_email_user_ids=send_request.stream_email_user_ids,
             mentioned_user_ids=mentioned_user_ids,
@@ -991,6 +1055,10 @@ def do_send_messages(
 
     bulk_insert_ums(ums)
 
+    # This is done late in the transaction, since it locks the
+    # summary rows of the topics until the transaction commits.
+    increment_topic_summaries(send_request.message for send_request in send_message_requests)
+
     for send_request in send_message_requests:
         do_widget_post_save_actions(send_request)
 
@@ -1117,6 +1185,13 @@ def do_send_messages(
         else:
             user_list = list(user_ids)
 
+        flush_newest_message_window_cache(
+            user_ids,
+            [send_request.message.recipient_id] if send_request.message.is_channel_message else [],
+        )
+        if send_request.message.recipient.type == Recipient.PERSONAL:
+            flush_accessible_user_ids_cache([sender_id, send_request.message.recipient.type_id])
+
         class UserData(TypedDict):
             id: int
             flags: list[str]
@@ -1467,6 +1542,66 @@ def check_send_message(
     return do_send_messages([message], mark_as_read=[sender.id] if read_by_sender else [])[0]
 
 
+@dataclass
+class BatchMessageSpec:
+    recipient_type_name: str
+    message_to: Sequence[int] | Sequence[str]
+    topic_name: str | None
+    message_content: str
+    local_id: str | None = None
+    sender_queue_id: str | None = None
+
+
+def check_send_message_batch(
+    sender: UserProfile,
+    client: Client,
+    message_specs: Sequence[BatchMessageSpec],
+    *,
+    read_by_sender: bool = False,
+) -> list[SentMessageResult | JsonableError]:
+    """Validates and renders every message in the batch, sharing
+    stream, permission, mention, and recipient lookups between them,
+    and then sends all of the valid messages in a single
+    do_send_messages transaction.
+
+    A message that fails validation does not prevent the rest of the
+    batch from being sent; the returned list is aligned with
+    message_specs, with the JsonableError explaining the failure in
+    place of each rejected message.
+    """
+    batch_caches = MessageSendBatchCaches(mention_backend=MentionBackend(sender.realm_id))
+
+    checked: list[SendMessageRequest | JsonableError] = []
+    for spec in message_specs:
+        try:
+            addressee = Addressee.legacy_build(
+                sender, spec.recipient_type_name, spec.message_to, spec.topic_name
+            )
+            send_request = check_message(
+                sender,
+                client,
+                addressee,
+                spec.message_content,
+                local_id=spec.local_id,
+                sender_queue_id=spec.sender_queue_id,
+                batch_caches=batch_caches,
+            )
+        except JsonableError as e:
+            checked.append(e)
+        else:
+            checked.append(send_request)
+
+    send_requests = [item for item in checked if isinstance(item, SendMessageRequest)]
+    sent_results = iter(
+        do_send_messages(send_requests, mark_as_read=[sender.id] if read_by_sender else [])
+        if send_requests
+        else []
+    )
+    return [
+        next(sent_results) if isinstance(item, SendMessageRequest) else item for item in checked
+    ]
+
+
 def send_rate_limited_pm_notification_to_bot_owner(
     sender: UserProfile, realm: Realm, content: str
 ) -> None:
@@ -1738,6 +1873,7 @@ def check_message(
     archived_channel_notice: bool = False,
     no_previews: bool = False,
     acting_user: UserProfile | None = None,
+    batch_caches: MessageSendBatchCaches | None = None,
 ) -> SendMessageRequest:
     """See
     https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html
@@ -1759,9 +1895,19 @@ def check_message(
         stream_id = addressee.stream_id()
 
         if stream_name is not None:
-            stream = validate_stream_name_with_pm_notification(stream_name, realm, sender)
+            if batch_caches is not None and stream_name in batch_caches.streams_by_name:
+                stream = batch_caches.streams_by_name[stream_name]
+            else:
+                stream = validate_stream_name_with_pm_notification(stream_name, realm, sender)
+                if batch_caches is not None:
+                    batch_caches.streams_by_name[stream_name] = stream
         elif stream_id is not None:
-            stream = validate_stream_id_with_pm_notification(stream_id, realm, sender)
+            if batch_caches is not None and stream_id in batch_caches.streams_by_id:
+                stream = batch_caches.streams_by_id[stream_id]
+            else:
+                stream = validate_stream_id_with_pm_notification(stream_id, realm, sender)
+                if batch_caches is not None:
+                    batch_caches.streams_by_id[stream_id] = stream
         else:
             stream = addressee.stream()
         assert stream is not None
@@ -1782,12 +1928,15 @@ def check_message(
         )
 
         if not skip_stream_access_check:
-            access_stream_for_send_message(
-                sender=sender,
-                stream=stream,
-                forwarder_user_profile=forwarder_user_profile,
-                archived_channel_notice=archived_channel_notice,
-            )
+            if batch_caches is None or stream.id not in batch_caches.accessible_stream_ids:
+                access_stream_for_send_message(
+                    sender=sender,
+                    stream=stream,
+                    forwarder_user_profile=forwarder_user_profile,
+                    archived_channel_notice=archived_channel_notice,
+                )
+                if batch_caches is not None:
+                    batch_caches.accessible_stream_ids.add(stream.id)
         else:
             # Defensive assertion - the only currently supported use case
             # for this option is for outgoing webhook bots and since this
@@ -1886,6 +2035,7 @@ def check_message(
         recipients_for_user_creation_events=recipients_for_user_creation_events,
         acting_user=acting_user,
         no_previews=no_previews,
+        batch_caches=batch_caches,
     )
 
     if (
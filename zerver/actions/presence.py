@@ -7,12 +7,15 @@ from django.db import connection, transaction
 from psycopg2 import sql
 
 from zerver.actions.user_activity import update_user_activity_interval
+from zerver.lib.cache import cache_get, cache_set, presence_write_cache_key
 from zerver.lib.presence import (
     format_legacy_presence_dict,
     get_modern_user_presence_info,
     user_presence_datetime_with_date_joined_default,
 )
+from zerver.lib.presence_store import update_presence_store
 from zerver.lib.users import get_user_ids_who_can_access_user
+from zerver.lib.write_coalescing import record_coalesced_writes
 from zerver.models import Client, UserPresence, UserProfile
 from zerver.models.clients import get_client
 from zerver.models.users import active_user_ids
@@ -230,6 +233,7 @@ def do_update_user_presence(
                 INSERT INTO zerver_userpresence (user_profile_id, last_active_time, last_connected_time, realm_id, last_update_id)
                 VALUES ({user_profile_id}, {last_active_time}, {last_connected_time}, {realm_id}, (SELECT last_update_id FROM new_last_update_id))
                 ON CONFLICT (user_profile_id) DO NOTHING
+                RETURNING last_update_id
                 """).format(
                 user_profile_id=sql.Literal(user_profile.id),
                 last_active_time=sql.Literal(presence.last_active_time),
@@ -248,6 +252,7 @@ def do_update_user_presence(
                 UPDATE zerver_userpresence
                 SET {update_fields_segment}, last_update_id = (SELECT last_update_id FROM new_last_update_id)
                 WHERE id = {presence_id}
+                RETURNING last_update_id
             """).format(
                 update_fields_segment=update_fields_segment, presence_id=sql.Literal(presence.id)
             )
@@ -258,6 +263,21 @@ def do_update_user_presence(
                 # Check if the row was actually created or if we
                 # hit the ON CONFLICT DO NOTHING case.
                 actually_created = cursor.rowcount > 0
+            row = cursor.fetchone()
+
+        if settings.PRESENCE_REDIS_STORE and row is not None:
+            [new_last_update_id] = row
+            transaction.on_commit(
+                lambda: update_presence_store(
+                    user_profile.realm_id,
+                    user_profile.id,
+                    new_last_update_id,
+                    presence.last_active_time,
+                    presence.last_connected_time,
+                    user_profile.date_joined,
+                    user_profile.is_bot,
+                )
+            )
 
     if creating and not actually_created:
         # If we ended up doing nothing due to something else creating the row
@@ -265,6 +285,18 @@ def do_update_user_presence(
         logger.info("UserPresence row already created for %s, returning.", user_profile.id)
         return
 
+    if settings.PRESENCE_WRITE_COALESCING:
+        # Remember what's now in the database, so that
+        # update_user_presence can skip heartbeats which wouldn't
+        # change it.
+        transaction.on_commit(
+            lambda: cache_set(
+                presence_write_cache_key(user_profile.id),
+                (presence.last_active_time, presence.last_connected_time),
+                timeout=settings.PRESENCE_UPDATE_MIN_FREQ_SECONDS,
+            )
+        )
+
     if force_send_update or (
         not user_profile.realm.presence_disabled and (creating or became_online)
     ):
@@ -279,6 +311,26 @@ def do_update_user_presence(
         )
 
 
+def is_presence_update_redundant(
+    user_profile: UserProfile, log_time: datetime, status: int
+) -> bool:
+    """Whether do_update_user_presence would leave the user's presence
+    unchanged, based on what it last wrote for them, which lets us skip
+    its transaction entirely for most heartbeats."""
+    cached = cache_get(presence_write_cache_key(user_profile.id))
+    if cached is None:
+        return False
+    last_active_time, last_connected_time = cached[0]
+    window = timedelta(seconds=settings.PRESENCE_UPDATE_MIN_FREQ_SECONDS)
+    if last_connected_time is None or log_time - last_connected_time > window:
+        return False
+    if status == UserPresence.LEGACY_STATUS_ACTIVE_INT and (
+        last_active_time is None or log_time - last_active_time > window
+    ):
+        return False
+    return True
+
+
 def update_user_presence(
     user_profile: UserProfile,
     client: Client,
@@ -293,6 +345,11 @@ def update_user_presence(
         status,
     )
     if user_profile.presence_enabled:
-        do_update_user_presence(user_profile, client, log_time, status)
+        if settings.PRESENCE_WRITE_COALESCING and is_presence_update_redundant(
+            user_profile, log_time, status
+        ):
+            record_coalesced_writes("presence", 1)
+        else:
+            do_update_user_presence(user_profile, client, log_time, status)
     if new_user_input:
         update_user_activity_interval(user_profile, log_time)
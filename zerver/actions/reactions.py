@@ -3,6 +3,7 @@ from typing import Any
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
 from zerver.lib.emoji import check_emoji_request, get_emoji_data
 from zerver.lib.exceptions import ReactionExistsError
+from zerver.lib.lazy_user_messages import materialize_lazy_user_messages
 from zerver.lib.message import (
     access_message_and_usermessage,
     event_recipient_ids_for_action_on_messages,
@@ -160,7 +161,7 @@ def check_add_reaction(
         # realm emoji).
         check_emoji_request(user_profile.realm, emoji_name, emoji_code, reaction_type)
 
-    if user_message is None:
+    if user_message is None and not materialize_lazy_user_messages(user_profile, [message.id]):
         # See called function for more context.
         create_historical_user_messages(user_id=user_profile.id, message_ids=[message.id])
 
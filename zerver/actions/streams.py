@@ -1,5 +1,5 @@
-from collections import defaultdict
-from collections.abc import Collection, Iterable, Mapping
+from collections import Counter, defaultdict
+from collections.abc import Callable, Collection, Iterable, Mapping
 from typing import Any, TypeAlias
 
 from django.conf import settings
@@ -18,9 +18,14 @@ from zerver.lib.cache import (
     cache_delete_many,
     cache_set,
     display_recipient_cache_key,
+    flush_accessible_user_ids_cache,
+    flush_message_window_cache,
+    flush_realm_message_window_cache,
+    flush_unread_data_cache,
     to_dict_cache_key_id,
 )
 from zerver.lib.exceptions import JsonableError
+from zerver.lib.lazy_user_messages import materialize_lazy_subscriptions
 from zerver.lib.mention import silent_mention_syntax_for_user, silent_mention_syntax_for_user_group
 from zerver.lib.message import get_last_message_id
 from zerver.lib.queue import queue_event_on_commit
@@ -52,7 +57,7 @@ from zerver.lib.streams import (
 )
 from zerver.lib.subscription_info import bulk_get_subscriber_peer_info, get_subscribers_query
 from zerver.lib.topic import get_topic_display_name
-from zerver.lib.types import APISubscriptionDict, UserGroupMembersData
+from zerver.lib.types import APIStreamDict, APISubscriptionDict, UserGroupMembersData
 from zerver.lib.user_groups import (
     convert_to_user_group_members_dict,
     get_group_setting_value_for_api,
@@ -131,6 +136,7 @@ def do_deactivate_stream(stream: Stream, *, acting_user: UserProfile | None) ->
     was_web_public = stream.is_web_public
     stream.deactivated = True
     stream.save(update_fields=["deactivated"])
+    flush_realm_message_window_cache(stream.realm_id)
 
     ChannelEmailAddress.objects.filter(realm=stream.realm, channel=stream).update(deactivated=True)
 
@@ -257,6 +263,7 @@ def do_unarchive_stream(stream: Stream, new_name: str, *, acting_user: UserProfi
             "is_web_public",
         ]
     )
+    flush_realm_message_window_cache(realm.id)
 
     ChannelEmailAddress.objects.filter(realm=realm, channel=stream).update(deactivated=False)
 
@@ -416,17 +423,19 @@ def send_subscription_add_events(
     stream_ids = {sub_info.stream.id for sub_info in sub_info_list}
     recent_traffic = get_streams_traffic(stream_ids=stream_ids, realm=realm)
 
-    # We generally only have a few streams, so we compute subscriber
-    # data in its own loop.
-    stream_subscribers_dict: dict[int, list[int]] = {}
-    for sub_info in sub_info_list:
-        stream = sub_info.stream
-        if stream.id not in stream_subscribers_dict:
-            subscribers = list(subscriber_dict[stream.id])
-            stream_subscribers_dict[stream.id] = subscribers
+    streams_by_id = {sub_info.stream.id: sub_info.stream for sub_info in sub_info_list}
+    anonymous_group_membership = get_anonymous_group_membership_dict_for_streams(
+        list(streams_by_id.values())
+    )
 
-    streams = [sub_info.stream for sub_info in sub_info_list]
-    anonymous_group_membership = get_anonymous_group_membership_dict_for_streams(streams)
+    # We generally only have a few streams, shared by many users, so
+    # we compute the stream data, including its subscribers, in its
+    # own loop.
+    stream_subscribers_dict: dict[int, list[int]] = {}
+    stream_dicts: dict[int, APIStreamDict] = {}
+    for stream_id, stream in streams_by_id.items():
+        stream_subscribers_dict[stream_id] = list(subscriber_dict[stream_id])
+        stream_dicts[stream_id] = stream_to_dict(stream, recent_traffic, anonymous_group_membership)
 
     for user_id, sub_infos in info_by_user.items():
         sub_dicts: list[APISubscriptionDict] = []
@@ -434,7 +443,7 @@ def send_subscription_add_events(
             stream = sub_info.stream
             stream_subscribers = stream_subscribers_dict[stream.id]
             subscription = sub_info.sub
-            stream_dict = stream_to_dict(stream, recent_traffic, anonymous_group_membership)
+            stream_dict = stream_dicts[stream.id]
             # This is verbose as we cannot unpack existing TypedDict
             # to initialize another TypedDict while making mypy happy.
             # https://github.com/python/mypy/issues/5382
@@ -495,6 +504,23 @@ def send_subscription_add_events(
         send_event_on_commit(realm, event, [user_id])
 
 
+def flush_subscribers_accessible_user_ids_cache(sub_infos: list[SubInfo]) -> None:
+    """Flushes the cached accessible users of the users whose
+    subscriptions changed, and of everyone else subscribed to those
+    channels, who now do or don't share a channel with them."""
+    if not settings.CACHE_ACCESSIBLE_USER_IDS or not sub_infos:
+        return
+    user_ids = {sub_info.user.id for sub_info in sub_infos}
+    user_ids.update(
+        Subscription.objects.filter(
+            recipient_id__in={sub_info.sub.recipient_id for sub_info in sub_infos},
+            active=True,
+            is_user_active=True,
+        ).values_list("user_profile_id", flat=True)
+    )
+    flush_accessible_user_ids_cache(user_ids)
+
+
 # This function contains all the database changes as part of
 # subscribing users to streams; the transaction ensures that the
 # RealmAuditLog entries are created atomically with the Subscription
@@ -506,13 +532,32 @@ def bulk_add_subs_to_db_with_logging(
     subs_to_add: list[SubInfo],
     subs_to_activate: list[SubInfo],
 ) -> None:
+    event_last_message_id = get_last_message_id()
+
+    # Subscribers to streams with lazy_user_messages enabled start out
+    # with every existing message outside their lazy window, and read.
+    for sub_info in subs_to_add:
+        if sub_info.stream.lazy_user_messages:
+            sub_info.sub.lazy_start_message_id = event_last_message_id
+            sub_info.sub.lazy_read_message_id = event_last_message_id
+
     Subscription.objects.bulk_create(info.sub for info in subs_to_add)
     sub_ids = [info.sub.id for info in subs_to_activate]
     Subscription.objects.filter(id__in=sub_ids).update(active=True)
+    # Unread messages in reactivated subscriptions are visible again.
+    flush_unread_data_cache({info.user.id for info in subs_to_activate})
+    flush_message_window_cache({info.user.id for info in [*subs_to_add, *subs_to_activate]})
+    flush_subscribers_accessible_user_ids_cache([*subs_to_add, *subs_to_activate])
+
+    lazy_sub_ids = [info.sub.id for info in subs_to_activate if info.stream.lazy_user_messages]
+    if lazy_sub_ids:
+        Subscription.objects.filter(id__in=lazy_sub_ids).update(
+            lazy_start_message_id=event_last_message_id,
+            lazy_read_message_id=event_last_message_id,
+        )
 
     # Log subscription activities in RealmAuditLog
     event_time = timezone_now()
-    event_last_message_id = get_last_message_id()
 
     all_subscription_logs = [
         RealmAuditLog(
@@ -922,6 +967,56 @@ def bulk_add_subscriptions(
     )
 
 
+# bulk_add_subscriptions_in_chunks subscribes this many users per
+# transaction.
+BULK_SUBSCRIPTION_CHUNK_SIZE = 1000
+
+
+def bulk_add_subscriptions_in_chunks(
+    realm: Realm,
+    streams: Collection[Stream],
+    users: Iterable[UserProfile],
+    color_map: Mapping[str, str] = {},
+    *,
+    acting_user: UserProfile | None,
+    chunk_size: int = BULK_SUBSCRIPTION_CHUNK_SIZE,
+    progress_callback: Callable[[int, int], None] | None = None,
+) -> tuple[Counter[int], Counter[int]]:
+    """Variant of bulk_add_subscriptions for subscribing many thousands
+    of users at once, like when adding everyone in an organization to
+    its default channels.
+
+    A single bulk_add_subscriptions call would hold a transaction open
+    while it creates every subscription and RealmAuditLog row, and
+    queue every event until it commits.  Instead, this subscribes
+    users in chunks of chunk_size, each committed in its own
+    transaction, with one subscriber count update and one set of
+    peer_add events per chunk.  After each chunk, progress_callback is
+    called with the number of users processed so far, and the total.
+
+    Rather than every SubInfo, returns the number of users newly
+    subscribed, and already subscribed, to each channel, by channel ID.
+
+    This must not be called inside a transaction; if it fails, users
+    in the chunks which were already committed remain subscribed."""
+    users = list(users)
+    subscribed_counts: Counter[int] = Counter()
+    already_subscribed_counts: Counter[int] = Counter()
+    for start in range(0, len(users), chunk_size):
+        chunk = users[start : start + chunk_size]
+        with transaction.atomic(durable=True):
+            chunk_subscribed, chunk_already_subscribed = bulk_add_subscriptions(
+                realm, streams, chunk, color_map, acting_user=acting_user
+            )
+        subscribed_counts.update(sub_info.stream.id for sub_info in chunk_subscribed)
+        already_subscribed_counts.update(
+            sub_info.stream.id for sub_info in chunk_already_subscribed
+        )
+        if progress_callback is not None:
+            progress_callback(start + len(chunk), len(users))
+    return (subscribed_counts, already_subscribed_counts)
+
+
 def send_peer_remove_events(
     realm: Realm,
     streams: list[Stream],
@@ -1119,9 +1214,19 @@ def bulk_remove_subscriptions(
     # We do all the database changes in a transaction to ensure
     # RealmAuditLog entries are atomically created when making changes.
     with transaction.atomic(savepoint=False):
+        materialize_lazy_subscriptions(
+            [
+                sub_info.sub.id
+                for sub_info in subs_to_deactivate
+                if sub_info.stream.lazy_user_messages
+            ]
+        )
         Subscription.objects.filter(
             id__in=sub_ids_to_deactivate,
         ).update(active=False)
+        flush_unread_data_cache({sub_info.user.id for sub_info in subs_to_deactivate})
+        flush_message_window_cache({sub_info.user.id for sub_info in subs_to_deactivate})
+        flush_subscribers_accessible_user_ids_cache(subs_to_deactivate)
         bulk_update_subscriber_counts(direction=-1, streams=subscriber_count_changes)
 
         # Log subscription activities in RealmAuditLog
@@ -1200,6 +1305,8 @@ def do_change_subscription_property(
     # once clients are migrated to handle the subscription update event
     # with is_muted as the property name.
     if database_property_name == "is_muted":
+        flush_unread_data_cache([user_profile.id])
+        flush_message_window_cache([user_profile.id])
         event_value = not database_value
         in_home_view_event = dict(
             type="subscription",
@@ -1268,6 +1375,14 @@ def do_change_stream_permission(
     stream.invite_only = invite_only
     stream.history_public_to_subscribers = history_public_to_subscribers
     stream.save(update_fields=["invite_only", "history_public_to_subscribers", "is_web_public"])
+    flush_realm_message_window_cache(stream.realm_id)
+
+    if stream.lazy_user_messages and (
+        stream.invite_only or not stream.history_public_to_subscribers
+    ):
+        # Without shared history, access to messages depends on
+        # having a UserMessage row, so they can't be stored lazily.
+        do_change_stream_lazy_user_messages(stream, False)
 
     realm = stream.realm
 
@@ -1485,6 +1600,39 @@ def send_stream_posting_permission_update_notification(
         )
 
 
+@transaction.atomic(savepoint=False)
+def do_change_stream_lazy_user_messages(stream: Stream, lazy_user_messages: bool) -> None:
+    """Switches whether subscribers to the stream only get UserMessage
+    rows for messages with nonzero flags; see
+    zerver/lib/lazy_user_messages.py.  This is not visible in the API."""
+    if lazy_user_messages and (stream.invite_only or not stream.history_public_to_subscribers):
+        raise JsonableError(
+            _("Only public channels with shared history can use lazy message storage.")
+        )
+    if stream.lazy_user_messages == lazy_user_messages:
+        return
+
+    stream.lazy_user_messages = lazy_user_messages
+    stream.save(update_fields=["lazy_user_messages"])
+    flush_realm_message_window_cache(stream.realm_id)
+
+    if lazy_user_messages:
+        # Existing messages keep their UserMessage rows; only messages
+        # sent from now on are stored lazily.
+        last_message_id = get_last_message_id()
+        Subscription.objects.filter(recipient_id=stream.recipient_id, active=True).update(
+            lazy_start_message_id=last_message_id, lazy_read_message_id=last_message_id
+        )
+    else:
+        materialize_lazy_subscriptions(
+            list(
+                Subscription.objects.filter(
+                    recipient_id=stream.recipient_id, lazy_start_message_id__isnull=False
+                ).values_list("id", flat=True)
+            )
+        )
+
+
 @transaction.atomic(durable=True)
 def do_rename_stream(stream: Stream, new_name: str, user_profile: UserProfile) -> None:
     old_name = stream.name
@@ -1811,6 +1959,7 @@ def do_change_stream_group_based_setting(
 
     setattr(stream, setting_name, user_group)
     stream.save(update_fields=[setting_name, "name"])
+    flush_realm_message_window_cache(stream.realm_id)
 
     new_setting_api_value = get_group_setting_value_for_api(user_group)
     RealmAuditLog.objects.create(
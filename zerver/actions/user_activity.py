@@ -1,32 +1,78 @@
+from collections import defaultdict
+from collections.abc import Iterable
 from datetime import datetime
 
+from django.db import connection
+from psycopg2.sql import SQL, Literal
+
 from zerver.lib.queue import queue_json_publish_rollback_unsafe
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.models import UserActivityInterval, UserProfile
 
 
 def do_update_user_activity_interval(user_profile: UserProfile, log_time: datetime) -> None:
-    effective_end = log_time + UserActivityInterval.MIN_INTERVAL_LENGTH
-    # This code isn't perfect, because with various races we might end
-    # up creating two overlapping intervals, but that shouldn't happen
-    # often, and can be corrected for in post-processing
-    try:
-        last = UserActivityInterval.objects.filter(user_profile=user_profile).order_by("-end")[0]
-        # Two intervals overlap iff each interval ends after the other
-        # begins.  In this case, we just extend the old interval to
-        # include the new interval.
-        if log_time <= last.end and effective_end >= last.start:
-            last.end = max(last.end, effective_end)
-            last.start = min(last.start, log_time)
-            last.save(update_fields=["start", "end"])
-            return
-    except IndexError:
-        pass
-
-    # Otherwise, the intervals don't overlap, so we should make a new one
-    UserActivityInterval.objects.create(
-        user_profile=user_profile, start=log_time, end=effective_end
-    )
+    do_update_user_activity_intervals([(user_profile.id, log_time)])
+
+
+def do_update_user_activity_intervals(activity: Iterable[tuple[int, datetime]]) -> int:
+    """A batch version of do_update_user_activity_interval, for
+    (user_profile_id, log_time) pairs.  Each user's overlapping
+    intervals are merged before being written, and all of the writes
+    are done in a single query; returns the number of intervals
+    written."""
+    intervals: dict[int, list[list[datetime]]] = defaultdict(list)
+    for user_profile_id, log_time in sorted(activity):
+        effective_end = log_time + UserActivityInterval.MIN_INTERVAL_LENGTH
+        user_intervals = intervals[user_profile_id]
+        if user_intervals and log_time <= user_intervals[-1][1]:
+            user_intervals[-1][1] = max(user_intervals[-1][1], effective_end)
+        else:
+            user_intervals.append([log_time, effective_end])
+
+    rows = [
+        SQL("({}, {}, {})").format(Literal(user_profile_id), Literal(start), Literal(end))
+        for user_profile_id, user_intervals in intervals.items()
+        for start, end in user_intervals
+    ]
+    if not rows:
+        return 0
+
+    # Two intervals overlap iff each interval ends after the other
+    # begins.  We extend each user's latest interval to include a new
+    # interval which overlaps it, and insert the others.  This isn't
+    # perfect: if several new intervals overlap the latest one, or
+    # with races between batches, we might end up creating overlapping
+    # intervals, but that shouldn't happen often, and can be corrected
+    # for in post-processing.
+    query = SQL(
+        """
+        WITH new_interval (user_profile_id, start, "end") AS (VALUES {rows}),
+        last_interval AS (
+            SELECT DISTINCT ON (user_profile_id) id, user_profile_id, start, "end"
+            FROM zerver_useractivityinterval
+            WHERE user_profile_id IN (SELECT user_profile_id FROM new_interval)
+            ORDER BY user_profile_id, "end" DESC
+        ),
+        extended AS (
+            UPDATE zerver_useractivityinterval
+            SET start = LEAST(zerver_useractivityinterval.start, new_interval.start),
+                "end" = GREATEST(zerver_useractivityinterval."end", new_interval."end")
+            FROM last_interval, new_interval
+            WHERE zerver_useractivityinterval.id = last_interval.id
+            AND new_interval.user_profile_id = last_interval.user_profile_id
+            AND new_interval.start <= last_interval."end"
+            AND new_interval."end" >= last_interval.start
+            RETURNING new_interval.user_profile_id, new_interval.start
+        )
+        INSERT INTO zerver_useractivityinterval (user_profile_id, start, "end")
+        SELECT user_profile_id, start, "end" FROM new_interval
+        WHERE (user_profile_id, start) NOT IN (SELECT user_profile_id, start FROM extended)
+        """
+    ).format(rows=SQL(", ").join(rows))
+    # Uses index: zerver_useractivityinterval_user_profile_id_end_bb3bfc37_idx
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+    return len(rows)
 
 
 def update_user_activity_interval(user_profile: UserProfile, log_time: datetime) -> None:
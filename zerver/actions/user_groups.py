@@ -7,6 +7,7 @@ from django.db import transaction
 from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
 
+from zerver.lib.cache import flush_message_window_cache, flush_realm_message_window_cache
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.stream_subscription import get_user_ids_for_streams
 from zerver.lib.stream_traffic import get_streams_traffic
@@ -21,6 +22,7 @@ from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.types import UserGroupMembersData, UserGroupMembersDict
 from zerver.lib.user_groups import (
     convert_to_user_group_members_dict,
+    flush_recursive_membership_group_ids,
     get_group_setting_value_for_api,
     get_group_setting_value_for_audit_log_data,
     get_recursive_supergroups_union_for_groups,
@@ -80,6 +82,7 @@ def create_user_group_in_database(
     UserGroupMembership.objects.bulk_create(
         UserGroupMembership(user_profile=member, user_group=user_group) for member in members
     )
+    flush_recursive_membership_group_ids()
 
     creation_time = timezone_now()
     audit_log_entries = [
@@ -320,6 +323,8 @@ def bulk_add_members_to_user_groups(
         return
 
     realm = user_groups[0].realm
+    # Group membership can grant access to channels' messages.
+    flush_message_window_cache(user_profile_ids)
     supergroups = get_recursive_supergroups_union_for_groups(
         [user_group.id for user_group in user_groups]
     )
@@ -333,6 +338,7 @@ def bulk_add_members_to_user_groups(
         for user_group in user_groups
     ]
     UserGroupMembership.objects.bulk_create(memberships)
+    flush_recursive_membership_group_ids()
     now = timezone_now()
     RealmAuditLog.objects.bulk_create(
         RealmAuditLog(
@@ -395,6 +401,8 @@ def bulk_remove_members_from_user_groups(
         return
 
     realm = user_groups[0].realm
+    # Group membership can grant access to channels' messages.
+    flush_message_window_cache(user_profile_ids)
     supergroups = get_recursive_supergroups_union_for_groups(
         [user_group.id for user_group in user_groups]
     )
@@ -406,6 +414,7 @@ def bulk_remove_members_from_user_groups(
     UserGroupMembership.objects.filter(
         user_group__in=user_groups, user_profile_id__in=user_profile_ids
     ).delete()
+    flush_recursive_membership_group_ids()
     now = timezone_now()
     RealmAuditLog.objects.bulk_create(
         RealmAuditLog(
@@ -455,6 +464,7 @@ def add_subgroups_to_user_group(
         return
 
     realm = user_group.realm
+    flush_realm_message_window_cache(realm.id)
     supergroups = get_recursive_supergroups_union_for_groups([user_group.id])
     streams = list(
         get_metadata_access_streams_via_group_ids([group.id for group in supergroups], realm)
@@ -465,6 +475,7 @@ def add_subgroups_to_user_group(
         GroupGroupMembership(supergroup=user_group, subgroup=subgroup) for subgroup in subgroups
     ]
     GroupGroupMembership.objects.bulk_create(group_memberships)
+    flush_recursive_membership_group_ids()
 
     subgroup_ids = [subgroup.id for subgroup in subgroups]
     now = timezone_now()
@@ -533,6 +544,7 @@ def remove_subgroups_from_user_group(
         return
 
     realm = user_group.realm
+    flush_realm_message_window_cache(realm.id)
     supergroups = get_recursive_supergroups_union_for_groups([user_group.id])
     streams = list(
         get_metadata_access_streams_via_group_ids([group.id for group in supergroups], realm)
@@ -540,6 +552,7 @@ def remove_subgroups_from_user_group(
     old_stream_metadata_user_ids = bulk_can_access_stream_metadata_user_ids(streams)
 
     GroupGroupMembership.objects.filter(supergroup=user_group, subgroup__in=subgroups).delete()
+    flush_recursive_membership_group_ids()
 
     subgroup_ids = [subgroup.id for subgroup in subgroups]
     now = timezone_now()
@@ -20,7 +20,7 @@ from zerver.actions.user_groups import (
 )
 from zerver.lib.avatar import get_avatar_field
 from zerver.lib.bot_config import ConfigError, get_bot_config, get_bot_configs, set_bot_config
-from zerver.lib.cache import bot_dict_fields
+from zerver.lib.cache import bot_dict_fields, flush_message_window_cache
 from zerver.lib.create_user import create_user
 from zerver.lib.event_types import BotServicesOutgoing
 from zerver.lib.invites import revoke_invites_generated_by_user
@@ -46,6 +46,7 @@ from zerver.lib.types import UserGroupMembersData
 from zerver.lib.user_counts import realm_user_count_by_role
 from zerver.lib.user_groups import (
     convert_to_user_group_members_dict,
+    flush_recursive_membership_group_ids,
     get_system_user_group_for_user,
 )
 from zerver.lib.users import (
@@ -634,6 +635,7 @@ def do_change_user_role(
 
     user_profile.role = value
     user_profile.save(update_fields=["role"])
+    flush_message_window_cache([user_profile.id])
     RealmAuditLog.objects.create(
         realm=user_profile.realm,
         modified_user=user_profile,
@@ -665,6 +667,7 @@ def do_change_user_role(
     system_group = get_system_user_group_for_user(user_profile)
     now = timezone_now()
     UserGroupMembership.objects.create(user_profile=user_profile, user_group=system_group)
+    flush_recursive_membership_group_ids()
     RealmAuditLog.objects.bulk_create(
         [
             RealmAuditLog(
@@ -10,6 +10,7 @@ from zerver.lib.streams import (
     get_default_values_for_stream_permission_group_settings,
     render_stream_description,
 )
+from zerver.lib.user_directory import flush_user_directory_entries
 from zerver.models import (
     NamedUserGroup,
     Realm,
@@ -96,6 +97,9 @@ def bulk_create_users(
         UserProfile.objects.bulk_update(profiles_to_create, ["email"])
 
     user_ids = {user.id for user in profiles_to_create}
+    # Bulk creation skips the post_save handler which patches the
+    # directory for other new users.
+    flush_user_directory_entries(realm.id, list(user_ids))
 
     RealmAuditLog.objects.bulk_create(
         RealmAuditLog(
@@ -16,6 +16,7 @@ from bmemcached.exceptions import MemcachedException
 from django.conf import settings
 from django.core.cache import caches
 from django.core.cache.backends.base import BaseCache
+from django.db import transaction
 from django.db.models import Q, QuerySet
 from typing_extensions import ParamSpec
 
@@ -554,6 +555,10 @@ def get_realm_seat_count_cache_key(realm_id: int) -> str:
     return f"realm_seat_count:{realm_id}"
 
 
+def presence_write_cache_key(user_profile_id: int) -> str:
+    return f"presence_write:{user_profile_id}"
+
+
 def active_user_ids_cache_key(realm_id: int) -> str:
     return f"active_user_ids:{realm_id}"
 
@@ -587,6 +592,146 @@ def bot_dicts_in_realm_cache_key(realm_id: int) -> str:
     return f"bot_dicts_in_realm:{realm_id}"
 
 
+def unread_data_cache_key(user_profile_id: int, generation: str) -> str:
+    return f"unread_data:{user_profile_id}:{generation}"
+
+
+def unread_data_generation_cache_key(user_profile_id: int) -> str:
+    return f"unread_data_generation:{user_profile_id}"
+
+
+def realm_unread_data_generation_cache_key(realm_id: int) -> str:
+    return f"realm_unread_data_generation:{realm_id}"
+
+
+def flush_unread_data_cache(user_profile_ids: Iterable[int]) -> None:
+    """Invalidates the cached unread message data of the given users,
+    once the current transaction commits.  Deleting the generation
+    key, rather than the data itself, ensures that a concurrent
+    request which computed its data before the commit cannot write
+    stale data where later requests will find it."""
+    if not settings.CACHE_UNREAD_MESSAGE_DATA:
+        return
+    keys = [unread_data_generation_cache_key(user_id) for user_id in user_profile_ids]
+    if keys:
+        transaction.on_commit(lambda: cache_delete_many(keys))
+
+
+def flush_realm_unread_data_cache(realm_id: int) -> None:
+    """Like flush_unread_data_cache, for every user in the realm."""
+    if not settings.CACHE_UNREAD_MESSAGE_DATA:
+        return
+    transaction.on_commit(lambda: cache_delete(realm_unread_data_generation_cache_key(realm_id)))
+
+
+def realm_snapshot_cache_key(realm_id: int, section: str, variant: str, generation: str) -> str:
+    return f"realm_snapshot:{realm_id}:{section}:{variant}:{generation}"
+
+
+def realm_snapshot_generation_cache_key(realm_id: int, section: str) -> str:
+    return f"realm_snapshot_generation:{realm_id}:{section}"
+
+
+def message_window_cache_key(user_profile_id: int, query_hash: str) -> str:
+    return f"message_window:{user_profile_id}:{query_hash}"
+
+
+def message_window_generation_cache_key(user_profile_id: int) -> str:
+    return f"message_window_generation:{user_profile_id}"
+
+
+def newest_message_window_generation_cache_key(user_profile_id: int) -> str:
+    return f"newest_message_window_generation:{user_profile_id}"
+
+
+def channel_message_window_generation_cache_key(recipient_id: int) -> str:
+    return f"channel_message_window_generation:{recipient_id}"
+
+
+def newest_channel_message_window_generation_cache_key(recipient_id: int) -> str:
+    return f"newest_channel_message_window_generation:{recipient_id}"
+
+
+def realm_message_window_generation_cache_key(realm_id: int) -> str:
+    return f"realm_message_window_generation:{realm_id}"
+
+
+def flush_message_window_cache(
+    user_profile_ids: Iterable[int], recipient_ids: Iterable[int] = ()
+) -> None:
+    """Invalidates the cached message windows of the given users, and
+    of queries including the history of the given channels (by
+    recipient ID), once the current transaction commits; used when
+    their messages or flags change.  Like flush_unread_data_cache."""
+    if not settings.CACHE_MESSAGE_WINDOWS:
+        return
+    keys = [message_window_generation_cache_key(user_id) for user_id in user_profile_ids]
+    keys += [
+        channel_message_window_generation_cache_key(recipient_id) for recipient_id in recipient_ids
+    ]
+    if keys:
+        transaction.on_commit(lambda: cache_delete_many(keys))
+
+
+def flush_newest_message_window_cache(
+    user_profile_ids: Iterable[int], recipient_ids: Iterable[int] = ()
+) -> None:
+    """Variant of flush_message_window_cache for new messages, which
+    only invalidates the windows which extend to the newest messages."""
+    if not settings.CACHE_MESSAGE_WINDOWS:
+        return
+    keys = [newest_message_window_generation_cache_key(user_id) for user_id in user_profile_ids]
+    keys += [
+        newest_channel_message_window_generation_cache_key(recipient_id)
+        for recipient_id in recipient_ids
+    ]
+    if keys:
+        transaction.on_commit(lambda: cache_delete_many(keys))
+
+
+def flush_realm_message_window_cache(realm_id: int) -> None:
+    """Like flush_message_window_cache, for every user in the realm;
+    used for changes to which messages users can access."""
+    if not settings.CACHE_MESSAGE_WINDOWS:
+        return
+    transaction.on_commit(lambda: cache_delete(realm_message_window_generation_cache_key(realm_id)))
+
+
+def accessible_user_ids_cache_key(user_profile_id: int, generation: str) -> str:
+    return f"accessible_user_ids:{user_profile_id}:{generation}"
+
+
+def accessible_user_ids_generation_cache_key(user_profile_id: int) -> str:
+    return f"accessible_user_ids_generation:{user_profile_id}"
+
+
+def realm_accessible_user_ids_generation_cache_key(realm_id: int) -> str:
+    return f"realm_accessible_user_ids_generation:{realm_id}"
+
+
+def flush_accessible_user_ids_cache(user_profile_ids: Iterable[int]) -> None:
+    """Invalidates the cached data on which users the given users share
+    subscriptions or direct messages with, once the current
+    transaction commits; used when direct messages between them are
+    sent, and for the subscribers of channels whose subscribers
+    change.  Like flush_unread_data_cache."""
+    if not settings.CACHE_ACCESSIBLE_USER_IDS:
+        return
+    keys = [accessible_user_ids_generation_cache_key(user_id) for user_id in user_profile_ids]
+    if keys:
+        transaction.on_commit(lambda: cache_delete_many(keys))
+
+
+def flush_realm_accessible_user_ids_cache(realm_id: int) -> None:
+    """Like flush_accessible_user_ids_cache, for every user in the
+    realm; used for changes to which users are active."""
+    if not settings.CACHE_ACCESSIBLE_USER_IDS:
+        return
+    transaction.on_commit(
+        lambda: cache_delete(realm_accessible_user_ids_generation_cache_key(realm_id))
+    )
+
+
 def delete_user_profile_caches(user_profiles: Iterable["UserProfile"], realm_id: int) -> None:
     # Imported here to avoid cyclic dependency.
     from zerver.models.users import is_cross_realm_bot_email
@@ -641,10 +786,15 @@ def flush_user_profile(
     # the fields in the dict or become (in)active
     if changed(update_fields, realm_user_dict_fields):
         cache_delete(realm_user_dicts_cache_key(user_profile.realm_id))
+        if settings.REALM_USER_DIRECTORY:
+            from zerver.lib.user_directory import flush_user_directory_entries
+
+            flush_user_directory_entries(user_profile.realm_id, [user_profile.id])
 
     if changed(update_fields, ["is_active"]):
         cache_delete(active_user_ids_cache_key(user_profile.realm_id))
         cache_delete(active_non_guest_user_ids_cache_key(user_profile.realm_id))
+        flush_realm_accessible_user_ids_cache(user_profile.realm_id)
 
     if changed(update_fields, ["role"]):
         cache_delete(active_non_guest_user_ids_cache_key(user_profile.realm_id))
@@ -683,6 +833,10 @@ def flush_realm(
         or (update_fields is not None and "string_id" in update_fields)
     ):
         cache_delete(realm_user_dicts_cache_key(realm.id))
+        if settings.REALM_USER_DIRECTORY:
+            from zerver.lib.user_directory import flush_user_directory
+
+            flush_user_directory(realm.id)
         cache_delete(active_user_ids_cache_key(realm.id))
         cache_delete(bot_dicts_in_realm_cache_key(realm.id))
         cache_delete(realm_alert_words_cache_key(realm.id))
@@ -1,6 +1,7 @@
 # See https://zulip.readthedocs.io/en/latest/subsystems/events-system.html for
 # high-level documentation on how this system works.
 import copy
+import itertools
 import logging
 import time
 from collections.abc import Callable, Collection, Iterable, Sequence
@@ -52,6 +53,8 @@ from zerver.lib.presence import get_presence_for_user, get_presences_for_realm
 from zerver.lib.push_notifications import get_push_devices
 from zerver.lib.realm_icon import realm_icon_url
 from zerver.lib.realm_logo import get_realm_logo_source, get_realm_logo_url
+from zerver.lib.realm_snapshot import get_realm_snapshot
+from zerver.lib.register_sections import RegisterSectionFetcher
 from zerver.lib.scheduled_messages import (
     get_undelivered_reminders,
     get_undelivered_scheduled_messages,
@@ -62,7 +65,11 @@ from zerver.lib.stream_subscription import handle_stream_notifications_compatibi
 from zerver.lib.streams import do_get_streams, get_web_public_streams
 from zerver.lib.subscription_info import (
     build_unsubscribed_sub_from_stream_dict,
+    delta_encode_user_ids,
     gather_subscriptions_helper,
+    get_changed_subscription_stream_ids,
+    get_removed_subscription_stream_ids,
+    get_subscription_state_version,
     get_web_public_subs,
 )
 from zerver.lib.thumbnail import THUMBNAIL_OUTPUT_FORMATS
@@ -158,6 +165,24 @@ def has_pending_sponsorship_request(
     return sponsorship_pending
 
 
+def get_realm_user_settings_defaults(realm: Realm) -> dict[str, Any]:
+    realm_user_default = RealmUserDefault.objects.get(realm=realm)
+    realm_user_settings_defaults = {}
+    for property_name in RealmUserDefault.property_types:
+        realm_user_settings_defaults[property_name] = getattr(realm_user_default, property_name)
+
+    realm_user_settings_defaults["emojiset_choices"] = RealmUserDefault.emojiset_choices()
+    realm_user_settings_defaults["available_notification_sounds"] = (
+        get_available_notification_sounds()
+    )
+    realm_user_settings_defaults["resolved_topic_notice_auto_read_policy"] = (
+        ResolvedTopicNoticeAutoReadPolicyEnum(
+            realm_user_default.resolved_topic_notice_auto_read_policy
+        ).name
+    )
+    return realm_user_settings_defaults
+
+
 def fetch_initial_state_data(
     user_profile: UserProfile | None,
     *,
@@ -179,6 +204,8 @@ def fetch_initial_state_data(
     include_deactivated_groups: bool = False,
     archived_channels: bool = False,
     simplified_presence_events: bool = False,
+    subscription_state_version: int | None = None,
+    section_timings: dict[str, float] | None = None,
 ) -> dict[str, Any]:
     """When `event_types` is None, fetches the core data powering the
     web app's `page_params` and `/api/v1/register` (for mobile/terminal
@@ -190,8 +217,17 @@ def fetch_initial_state_data(
     Whenever you add new code to this function, you should also add
     corresponding events for changes in the data structures and new
     code to apply_events (and add a test in test_events.py).
+
+    If subscription_state_version is passed, the subscription data
+    only includes the channels which changed since that version, when
+    possible; see get_changed_subscription_stream_ids.
+
+    Independent sections are fetched with a RegisterSectionFetcher,
+    possibly concurrently; if section_timings is passed, it's filled
+    with how long the sections took.
     """
     state: dict[str, Any] = {"queue_id": queue_id}
+    fetcher = RegisterSectionFetcher(state)
 
     if event_types is None:
         # return True always
@@ -252,10 +288,15 @@ def fetch_initial_state_data(
         # anonymous groups in realm_setting_group_ids and the
         # IDs of the NamedUserGroup objects used there, but
         # don't need the other NamedUserGroup fields.
-        realm_groups_data = user_groups_in_realm_serialized(
-            realm,
-            include_deactivated_groups=include_deactivated_groups,
-            fetch_anonymous_group_membership=True,
+        realm_groups_data = get_realm_snapshot(
+            realm.id,
+            "realm_user_groups",
+            lambda: user_groups_in_realm_serialized(
+                realm,
+                include_deactivated_groups=include_deactivated_groups,
+                fetch_anonymous_group_membership=True,
+            ),
+            variant=str(include_deactivated_groups),
         )
         anonymous_group_membership_data_dict: dict[int, UserGroupMembersData] = {}
         for key, value in realm_groups_data.anonymous_group_membership.items():
@@ -265,7 +306,10 @@ def fetch_initial_state_data(
             )
 
     if want("alert_words"):
-        state["alert_words"] = [] if user_profile is None else user_alert_words(user_profile)
+        if user_profile is None:
+            state["alert_words"] = []
+        else:
+            fetcher.submit("alert_words", lambda: user_alert_words(user_profile))
 
     if want("custom_profile_fields"):
         if user_profile is None:
@@ -273,8 +317,11 @@ def fetch_initial_state_data(
             # personal settings, so we send an empty list.
             state["custom_profile_fields"] = []
         else:
-            fields = custom_profile_fields_for_realm(realm.id)
-            state["custom_profile_fields"] = [f.as_dict() for f in fields]
+            state["custom_profile_fields"] = get_realm_snapshot(
+                realm.id,
+                "custom_profile_fields",
+                lambda: [f.as_dict() for f in custom_profile_fields_for_realm(realm.id)],
+            )
         state["custom_profile_field_types"] = {
             item[4]: {"id": item[0], "name": str(item[1])}
             for item in CustomProfileField.ALL_FIELD_TYPES
@@ -307,13 +354,13 @@ def fetch_initial_state_data(
         if user_profile is None:
             state["saved_snippets"] = []
         else:
-            state["saved_snippets"] = do_get_saved_snippets(user_profile)
+            fetcher.submit("saved_snippets", lambda: do_get_saved_snippets(user_profile))
 
     if want("navigation_views"):
         if user_profile is None:
             state["navigation_views"] = []
         else:
-            state["navigation_views"] = get_navigation_views_for_user(user_profile)
+            fetcher.submit("navigation_views", lambda: get_navigation_views_for_user(user_profile))
 
     if want("drafts"):
         if user_profile is None:
@@ -323,19 +370,29 @@ def fetch_initial_state_data(
             # their old drafts stored on the server will be deleted and
             # simply retained in local storage. In which case user_drafts
             # would just be an empty queryset.
-            user_draft_objects = Draft.objects.filter(user_profile=user_profile).order_by(
-                "-last_edit_time"
-            )[: settings.MAX_DRAFTS_IN_REGISTER_RESPONSE]
-            user_draft_dicts = [draft.to_dict() for draft in user_draft_objects]
-            state["drafts"] = user_draft_dicts
+            fetcher.submit(
+                "drafts",
+                lambda: [
+                    draft.to_dict()
+                    for draft in Draft.objects.filter(user_profile=user_profile).order_by(
+                        "-last_edit_time"
+                    )[: settings.MAX_DRAFTS_IN_REGISTER_RESPONSE]
+                ],
+            )
 
     if want("scheduled_messages"):
-        state["scheduled_messages"] = (
-            [] if user_profile is None else get_undelivered_scheduled_messages(user_profile)
-        )
+        if user_profile is None:
+            state["scheduled_messages"] = []
+        else:
+            fetcher.submit(
+                "scheduled_messages", lambda: get_undelivered_scheduled_messages(user_profile)
+            )
 
     if want("reminders"):
-        state["reminders"] = [] if user_profile is None else get_undelivered_reminders(user_profile)
+        if user_profile is None:
+            state["reminders"] = []
+        else:
+            fetcher.submit("reminders", lambda: get_undelivered_reminders(user_profile))
 
     if want("muted_topics") and (
         # Suppress muted_topics data for clients that explicitly
@@ -357,15 +414,21 @@ def fetch_initial_state_data(
             slim_presence = True
 
         if user_profile is not None:
-            presences, presence_last_update_id_fetched_by_server = get_presences_for_realm(
-                realm,
-                slim_presence,
-                last_update_id_fetched_by_client=presence_last_update_id_fetched_by_client,
-                history_limit_days=presence_history_limit_days,
-                requesting_user_profile=user_profile,
+
+            def store_presences(result: tuple[dict[str, Any], int]) -> None:
+                state["presences"], state["presence_last_update_id"] = result
+
+            fetcher.submit_with_store(
+                "presences",
+                lambda: get_presences_for_realm(
+                    realm,
+                    slim_presence,
+                    last_update_id_fetched_by_client=presence_last_update_id_fetched_by_client,
+                    history_limit_days=presence_history_limit_days,
+                    requesting_user_profile=user_profile,
+                ),
+                store_presences,
             )
-            state["presences"] = presences
-            state["presence_last_update_id"] = presence_last_update_id_fetched_by_server
         else:
             state["presences"] = {}
 
@@ -613,27 +676,16 @@ def fetch_initial_state_data(
         )
 
     if want("realm_user_settings_defaults"):
-        realm_user_default = RealmUserDefault.objects.get(realm=realm)
-        state["realm_user_settings_defaults"] = {}
-        for property_name in RealmUserDefault.property_types:
-            state["realm_user_settings_defaults"][property_name] = getattr(
-                realm_user_default, property_name
-            )
-
-        state["realm_user_settings_defaults"]["emojiset_choices"] = (
-            RealmUserDefault.emojiset_choices()
-        )
-        state["realm_user_settings_defaults"]["available_notification_sounds"] = (
-            get_available_notification_sounds()
-        )
-        state["realm_user_settings_defaults"]["resolved_topic_notice_auto_read_policy"] = (
-            ResolvedTopicNoticeAutoReadPolicyEnum(
-                realm_user_default.resolved_topic_notice_auto_read_policy
-            ).name
+        state["realm_user_settings_defaults"] = get_realm_snapshot(
+            realm.id,
+            "realm_user_settings_defaults",
+            lambda: get_realm_user_settings_defaults(realm),
         )
 
     if want("realm_domains"):
-        state["realm_domains"] = get_realm_domains(realm)
+        state["realm_domains"] = get_realm_snapshot(
+            realm.id, "realm_domains", lambda: get_realm_domains(realm)
+        )
 
     if want("realm_emoji"):
         state["realm_emoji"] = get_all_custom_emoji_for_realm(realm.id)
@@ -655,7 +707,9 @@ def fetch_initial_state_data(
         state["realm_filters"] = []
 
     if want("realm_playgrounds"):
-        state["realm_playgrounds"] = get_realm_playgrounds(realm)
+        state["realm_playgrounds"] = get_realm_snapshot(
+            realm.id, "realm_playgrounds", lambda: get_realm_playgrounds(realm)
+        )
 
     if want("realm_billing"):
         state["realm_billing"] = {}
@@ -667,15 +721,16 @@ def fetch_initial_state_data(
         )
 
     if want("realm_user"):
-        state["raw_users"] = get_users_for_api(
-            realm,
-            user_profile,
-            client_gravatar=client_gravatar,
-            user_avatar_url_field_optional=user_avatar_url_field_optional,
-            # Don't send custom profile field values to spectators.
-            include_custom_profile_fields=user_profile is not None,
-            user_list_incomplete=user_list_incomplete,
-        )
+        with fetcher.timed("realm_user"):
+            state["raw_users"] = get_users_for_api(
+                realm,
+                user_profile,
+                client_gravatar=client_gravatar,
+                user_avatar_url_field_optional=user_avatar_url_field_optional,
+                # Don't send custom profile field values to spectators.
+                include_custom_profile_fields=user_profile is not None,
+                user_list_incomplete=user_list_incomplete,
+            )
         state["cross_realm_bots"] = list(get_cross_realm_dicts())
 
         # For the user's own avatar URL, we force
@@ -785,24 +840,61 @@ def fetch_initial_state_data(
         # intermediate form as a dictionary keyed by recipient_id,
         # which is more efficient to update, and is rewritten to the
         # final format in post_process_state.
-        state["raw_recent_private_conversations"] = (
-            {} if user_profile is None else get_recent_private_conversations(user_profile)
-        )
-
-    if want("subscription"):
-        if user_profile is not None:
-            sub_info = gather_subscriptions_helper(
-                user_profile,
-                include_subscribers=include_subscribers,
-                include_archived_channels=archived_channels,
-                anonymous_group_membership=anonymous_group_membership_data_dict,
-            )
+        if user_profile is None:
+            state["raw_recent_private_conversations"] = {}
         else:
-            sub_info = get_web_public_subs(realm, anonymous_group_membership_data_dict)
+            fetcher.submit(
+                "raw_recent_private_conversations",
+                lambda: get_recent_private_conversations(user_profile),
+            )
 
-        state["subscriptions"] = sub_info.subscriptions
-        state["unsubscribed"] = sub_info.unsubscribed
-        state["never_subscribed"] = sub_info.never_subscribed
+    if want("subscription"):
+        with fetcher.timed("subscription"):
+            changed_stream_ids = None
+            if user_profile is not None:
+                # We read the version before the data, so that changes
+                # made while we fetch it are sent again next time.
+                state["subscription_state_version"] = get_subscription_state_version(realm)
+                if subscription_state_version is not None:
+                    changed_stream_ids = get_changed_subscription_stream_ids(
+                        realm, subscription_state_version
+                    )
+                sub_info = gather_subscriptions_helper(
+                    user_profile,
+                    include_subscribers=include_subscribers,
+                    include_archived_channels=archived_channels,
+                    anonymous_group_membership=anonymous_group_membership_data_dict,
+                    stream_ids=changed_stream_ids,
+                )
+            else:
+                sub_info = get_web_public_subs(realm, anonymous_group_membership_data_dict)
+
+            state["subscriptions"] = sub_info.subscriptions
+            state["unsubscribed"] = sub_info.unsubscribed
+            state["never_subscribed"] = sub_info.never_subscribed
+
+            if user_profile is not None:
+                state["subscription_state_delta"] = changed_stream_ids is not None
+                # Channels which changed, but are no longer visible to
+                # the user at all.
+                state["subscription_state_removed_channel_ids"] = []
+                if changed_stream_ids is not None:
+                    assert subscription_state_version is not None
+                    state["subscription_state_removed_channel_ids"] = (
+                        get_removed_subscription_stream_ids(
+                            user_profile,
+                            subscription_state_version,
+                            changed_stream_ids
+                            - {
+                                stream_dict["stream_id"]
+                                for stream_dict in itertools.chain(
+                                    sub_info.subscriptions,
+                                    sub_info.unsubscribed,
+                                    sub_info.never_subscribed,
+                                )
+                            },
+                        )
+                    )
 
     if want("channel_folders"):
         if user_profile is None:
@@ -817,7 +909,7 @@ def fetch_initial_state_data(
         # message event.
 
         if user_profile is not None:
-            state["raw_unread_msgs"] = get_raw_unread_data(user_profile)
+            fetcher.submit("raw_unread_msgs", lambda: get_raw_unread_data(user_profile))
         else:
             # For logged-out visitors, we treat all messages as read;
             # calling this helper lets us return empty objects in the
@@ -825,9 +917,10 @@ def fetch_initial_state_data(
             state["raw_unread_msgs"] = extract_unread_data_from_um_rows([], user_profile)
 
     if want("starred_messages"):
-        state["starred_messages"] = (
-            [] if user_profile is None else get_starred_message_ids(user_profile)
-        )
+        if user_profile is None:
+            state["starred_messages"] = []
+        else:
+            fetcher.submit("starred_messages", lambda: get_starred_message_ids(user_profile))
 
     if want("stream") and include_streams:
         # The web app doesn't use the data from here; instead,
@@ -862,8 +955,10 @@ def fetch_initial_state_data(
         if settings_user.is_guest:
             state["realm_default_stream_groups"] = []
         else:
-            state["realm_default_stream_groups"] = default_stream_groups_to_dicts_sorted(
-                get_default_stream_groups(realm)
+            state["realm_default_stream_groups"] = get_realm_snapshot(
+                realm.id,
+                "default_stream_groups",
+                lambda: default_stream_groups_to_dicts_sorted(get_default_stream_groups(realm)),
             )
 
     if want("stop_words"):
@@ -926,6 +1021,10 @@ def fetch_initial_state_data(
     if want("push_device"):
         state["push_devices"] = {} if user_profile is None else get_push_devices(user_profile)
 
+    fetcher.wait()
+    if section_timings is not None:
+        section_timings.update(fetcher.timings)
+
     if user_profile is None:
         # To ensure we have the correct user state set.
         assert state["is_admin"] is False
@@ -2014,6 +2113,7 @@ class ClientCapabilities(TypedDict):
     archived_channels: NotRequired[bool]
     empty_topic_name: NotRequired[bool]
     simplified_presence_events: NotRequired[bool]
+    delta_encoded_subscribers: NotRequired[bool]
 
 
 DEFAULT_CLIENT_CAPABILITIES = ClientCapabilities(notification_settings_null=False)
@@ -2038,6 +2138,8 @@ def do_events_register(
     fetch_event_types: Collection[str] | None = None,
     spectator_requested_language: str | None = None,
     pronouns_field_type_supported: bool = True,
+    subscription_state_version: int | None = None,
+    section_timings: dict[str, float] | None = None,
 ) -> dict[str, Any]:
     # Technically we don't need to check this here because
     # build_narrow_predicate will check it, but it's nicer from an error
@@ -2057,6 +2159,7 @@ def do_events_register(
     archived_channels = client_capabilities.get("archived_channels", False)
     empty_topic_name = client_capabilities.get("empty_topic_name", False)
     simplified_presence_events = client_capabilities.get("simplified_presence_events", False)
+    delta_encoded_subscribers = client_capabilities.get("delta_encoded_subscribers", False)
 
     if fetch_event_types is not None:
         event_types_set: set[str] | None = set(fetch_event_types)
@@ -2093,6 +2196,7 @@ def do_events_register(
             spectator_requested_language=spectator_requested_language,
             include_deactivated_groups=include_deactivated_groups,
             simplified_presence_events=simplified_presence_events,
+            section_timings=section_timings,
         )
 
         post_process_state(
@@ -2154,6 +2258,8 @@ def do_events_register(
         include_deactivated_groups=include_deactivated_groups,
         archived_channels=archived_channels,
         simplified_presence_events=simplified_presence_events,
+        subscription_state_version=subscription_state_version,
+        section_timings=section_timings,
     )
 
     # Apply events that came in while we were fetching initial data
@@ -2173,7 +2279,11 @@ def do_events_register(
     )
 
     post_process_state(
-        user_profile, ret, notification_settings_null, allow_empty_topic_name=empty_topic_name
+        user_profile,
+        ret,
+        notification_settings_null,
+        allow_empty_topic_name=empty_topic_name,
+        delta_encoded_subscribers=delta_encoded_subscribers,
     )
 
     if len(events) > 0:
@@ -2188,6 +2298,7 @@ def post_process_state(
     ret: dict[str, Any],
     notification_settings_null: bool,
     allow_empty_topic_name: bool,
+    delta_encoded_subscribers: bool = False,
 ) -> None:
     """
     NOTE:
@@ -2247,6 +2358,19 @@ def post_process_state(
                 user_profile, stream_dict, notification_settings_null
             )
 
+    """
+    Subscriber lists are similarly only delta-encoded at the end, since
+    peer_add and peer_remove events are applied to the plain lists.
+    """
+    if delta_encoded_subscribers:
+        for key in ["subscriptions", "unsubscribed", "never_subscribed"]:
+            for stream_dict in ret.get(key, []):
+                for subscribers_key in ["subscribers", "partial_subscribers"]:
+                    if subscribers_key in stream_dict:
+                        stream_dict[subscribers_key] = delta_encode_user_ids(
+                            stream_dict[subscribers_key]
+                        )
+
     if not allow_empty_topic_name and "user_topics" in ret:
         for user_topic in ret["user_topics"]:
             if user_topic["topic_name"] == "":
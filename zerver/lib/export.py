@@ -191,6 +191,7 @@ ALL_ZULIP_TABLES = {
     "zerver_realmreactivationstatus",
     "zerver_realmuserdefault",
     "zerver_recipient",
+    "zerver_recursivegroupgroupmembership",
     "zerver_savedsnippet",
     "zerver_scheduledemail",
     "zerver_scheduledemail_users",
@@ -200,6 +201,7 @@ ALL_ZULIP_TABLES = {
     "zerver_stream",
     "zerver_submessage",
     "zerver_subscription",
+    "zerver_topicsummary",
     "zerver_useractivity",
     "zerver_useractivityinterval",
     "zerver_usergroup",
@@ -292,6 +294,12 @@ NON_EXPORTED_TABLES = {
     # ChannelEmailAddress entries are low value to export since
     # channel email addresses include the server's hostname.
     "zerver_channelemailaddress",
+    # Topic summaries are computed from the messages, and are rebuilt
+    # after importing them.
+    "zerver_topicsummary",
+    # The recursive subgroup closure is maintained by database triggers
+    # as GroupGroupMembership rows are imported.
+    "zerver_recursivegroupgroupmembership",
     # For any tables listed below here, it's a bug that they are not present in the export.
 }
 
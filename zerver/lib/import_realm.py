@@ -60,6 +60,7 @@ from zerver.lib.thumbnail import (
     maybe_thumbnail,
 )
 from zerver.lib.timestamp import datetime_to_timestamp
+from zerver.lib.topic_summaries import rebuild_topic_summaries
 from zerver.lib.upload import ensure_avatar_image, sanitize_name, upload_backend, upload_emoji_image
 from zerver.lib.upload.s3 import get_bucket
 from zerver.lib.user_counts import realm_user_count_by_role
@@ -1840,6 +1841,10 @@ def do_import_realm(import_dir: Path, subdomain: str, processes: int = 1) -> Rea
     with connection.cursor() as cursor:
         cursor.execute(update_first_message_id_query, {"realm_id": realm.id})
 
+    # Messages are imported in bulk, bypassing the send path which
+    # maintains the topic summaries.
+    rebuild_topic_summaries(realm.id)
+
     if "zerver_userstatus" in data:
         fix_datetime_fields(data, "zerver_userstatus")
         re_map_foreign_keys(data, "zerver_userstatus", "user_profile", related_table="user_profile")
@@ -0,0 +1,334 @@
+# Lazy UserMessage storage for very large public streams.
+#
+# Normally, every subscriber to a stream gets a UserMessage row for
+# every message sent to it, which is the bulk of the storage and write
+# load for announcement-style streams with thousands of subscribers.
+# For streams with Stream.lazy_user_messages enabled, we instead only
+# create UserMessage rows for messages where a subscriber has nonzero
+# flags (e.g. they were mentioned, or starred or read the message
+# individually), similar to what we do for soft-deactivated users.
+#
+# The remaining messages are represented implicitly by two fields on
+# the Subscription: messages above lazy_start_message_id without a
+# UserMessage row were received by the user, and are read if and only
+# if they are at or below the lazy_read_message_id watermark.
+# Marking a whole stream (or everything) as read just advances the
+# watermark.
+#
+# Because the implicit rows only exist while the subscription is
+# active, unsubscribing or disabling the mode on a stream materializes
+# them via materialize_lazy_subscriptions.
+import operator
+from collections.abc import Collection
+from dataclasses import dataclass
+from functools import reduce
+from typing import Any
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Exists, F, IntegerField, Max, OuterRef, Q, QuerySet, Value
+from django.db.models.functions import Greatest
+from psycopg2.sql import SQL
+from sqlalchemy.sql import and_, case, column, literal, literal_column, select, table, union_all
+from sqlalchemy.sql.selectable import FromClause
+from sqlalchemy.types import Integer
+
+from zerver.lib.topic import DB_TOPIC_NAME
+from zerver.lib.user_message import UserMessageLite, bulk_insert_ums
+from zerver.models import Message, Recipient, Subscription, UserMessage, UserProfile
+
+
+@dataclass(frozen=True)
+class LazySubscription:
+    recipient_id: int
+    start_message_id: int
+    read_message_id: int
+
+    def flags_for_message(self, message_id: int) -> int:
+        """The flags for a message in this stream that has no UserMessage
+        row; only meaningful for message_id > start_message_id."""
+        if message_id <= self.read_message_id:
+            return UserMessage.flags.read.mask
+        return 0
+
+
+def get_lazy_subscriptions(user_profile: UserProfile) -> list[LazySubscription]:
+    if not settings.LAZY_USER_MESSAGE_STREAMS:
+        return []
+
+    rows = Subscription.objects.filter(
+        user_profile=user_profile,
+        active=True,
+        recipient__type=Recipient.STREAM,
+        lazy_start_message_id__isnull=False,
+        lazy_read_message_id__isnull=False,
+    ).values_list("recipient_id", "lazy_start_message_id", "lazy_read_message_id")
+    return [
+        LazySubscription(
+            recipient_id=recipient_id,
+            start_message_id=start_message_id,
+            read_message_id=read_message_id,
+        )
+        for recipient_id, start_message_id, read_message_id in rows
+    ]
+
+
+def lazy_messages_without_user_message(
+    user_profile: UserProfile, lazy_subs: list[LazySubscription], *, unread_only: bool
+) -> QuerySet[Message]:
+    assert lazy_subs
+    conditions = [
+        Q(
+            recipient_id=sub.recipient_id,
+            id__gt=(
+                max(sub.start_message_id, sub.read_message_id)
+                if unread_only
+                else sub.start_message_id
+            ),
+        )
+        for sub in lazy_subs
+    ]
+    return (
+        Message.objects.alias(
+            has_user_message=Exists(
+                UserMessage.objects.filter(
+                    user_profile_id=user_profile.id,
+                    message_id=OuterRef("id"),
+                )
+            )
+        )
+        .filter(reduce(operator.or_, conditions))
+        # Uses index: zerver_message_realm_recipient_id
+        .filter(realm_id=user_profile.realm_id, has_user_message=False)
+    )
+
+
+def get_lazy_user_message_flags(
+    user_profile: UserProfile, message_ids: Collection[int]
+) -> dict[int, int]:
+    """Given IDs of messages for which the user has no UserMessage row,
+    returns the implicit flags of those which are represented lazily."""
+    lazy_subs = get_lazy_subscriptions(user_profile)
+    if not lazy_subs or not message_ids:
+        return {}
+
+    subs_by_recipient_id = {sub.recipient_id: sub for sub in lazy_subs}
+    rows = Message.objects.filter(
+        id__in=message_ids,
+        realm_id=user_profile.realm_id,
+        recipient_id__in=subs_by_recipient_id.keys(),
+    ).values_list("id", "recipient_id")
+
+    lazy_flags = {}
+    for message_id, recipient_id in rows:
+        sub = subs_by_recipient_id[recipient_id]
+        if message_id > sub.start_message_id:
+            lazy_flags[message_id] = sub.flags_for_message(message_id)
+    return lazy_flags
+
+
+def materialize_lazy_user_messages(
+    user_profile: UserProfile, message_ids: Collection[int]
+) -> set[int]:
+    """Creates UserMessage rows, with their implicit flags, for those of
+    the given messages without a UserMessage row that are represented
+    lazily; returns the IDs of the messages for which it did so.
+
+    Used in place of create_historical_user_messages where the caller
+    needs a row to exist, so that these messages don't incorrectly get
+    the historical flag."""
+    lazy_flags = get_lazy_user_message_flags(user_profile, message_ids)
+    bulk_insert_ums(
+        [
+            UserMessageLite(user_profile_id=user_profile.id, message_id=message_id, flags=flags)
+            for message_id, flags in lazy_flags.items()
+        ]
+    )
+    return set(lazy_flags)
+
+
+def get_lazy_unread_message_rows(
+    user_profile: UserProfile, first_visible_message_id: int, limit: int
+) -> list[dict[str, Any]]:
+    """Returns the user's most recent lazily represented unread messages,
+    in the format used by get_raw_unread_data."""
+    lazy_subs = get_lazy_subscriptions(user_profile)
+    if not lazy_subs:
+        return []
+
+    return list(
+        lazy_messages_without_user_message(user_profile, lazy_subs, unread_only=True)
+        .filter(id__gte=first_visible_message_id)
+        .annotate(
+            message_id=F("id"),
+            topic=F(DB_TOPIC_NAME),
+            flags=Value(0, output_field=IntegerField()),
+        )
+        .values(
+            "message_id",
+            "sender_id",
+            "topic",
+            "flags",
+            "recipient_id",
+            "recipient__type",
+            "recipient__type_id",
+        )
+        .order_by("-id")[:limit]
+    )
+
+
+def get_user_message_table_for_search(
+    user_profile: UserProfile, lazy_subs: list[LazySubscription]
+) -> FromClause:
+    """A drop-in replacement for the zerver_usermessage table in
+    SQLAlchemy search queries, which adds rows with the implicit flags
+    for the user's lazily represented messages."""
+    user_message_rows = (
+        select(
+            column("user_profile_id", Integer),
+            column("message_id", Integer),
+            column("flags", Integer),
+        )
+        .select_from(table("zerver_usermessage"))
+        .where(column("user_profile_id", Integer) == literal(user_profile.id))
+    )
+
+    message_id_col = literal_column("lazy_message.id", Integer)
+    lazy_rows = [
+        select(
+            literal(user_profile.id, Integer).label("user_profile_id"),
+            message_id_col.label("message_id"),
+            case(
+                (
+                    message_id_col <= literal(sub.read_message_id),
+                    literal(UserMessage.flags.read.mask, Integer),
+                ),
+                else_=literal(0, Integer),
+            ).label("flags"),
+        )
+        .select_from(table("zerver_message").alias("lazy_message"))
+        .where(
+            and_(
+                literal_column("lazy_message.realm_id", Integer) == literal(user_profile.realm_id),
+                literal_column("lazy_message.recipient_id", Integer) == literal(sub.recipient_id),
+                message_id_col > literal(sub.start_message_id),
+                ~select(1)
+                .select_from(table("zerver_usermessage").alias("lazy_user_message"))
+                .where(
+                    literal_column("lazy_user_message.user_profile_id", Integer)
+                    == literal(user_profile.id),
+                    literal_column("lazy_user_message.message_id", Integer) == message_id_col,
+                )
+                .exists(),
+            )
+        )
+        for sub in lazy_subs
+    ]
+    return union_all(user_message_rows, *lazy_rows).subquery("zerver_usermessage")
+
+
+def mark_lazy_unread_messages_as_read(
+    user_profile: UserProfile,
+    *,
+    recipient_id: int | None = None,
+    topic_name: str | None = None,
+    sender_id: int | None = None,
+) -> list[int]:
+    """Marks as read the user's lazily represented unread messages
+    matching the given filters, returning their IDs.
+
+    When a whole stream is being marked as read, we just advance the
+    read watermark; otherwise, we need UserMessage rows to record
+    that only some of the stream's messages were read."""
+    lazy_subs = get_lazy_subscriptions(user_profile)
+    if recipient_id is not None:
+        lazy_subs = [sub for sub in lazy_subs if sub.recipient_id == recipient_id]
+    if not lazy_subs:
+        return []
+
+    query = lazy_messages_without_user_message(user_profile, lazy_subs, unread_only=True)
+    if topic_name is not None:
+        query = query.filter(is_channel_message=True, subject__iexact=topic_name)
+    if sender_id is not None:
+        query = query.filter(sender_id=sender_id)
+    message_ids = list(query.order_by("id").values_list("id", flat=True))
+    if not message_ids:
+        return []
+
+    if recipient_id is not None and topic_name is None and sender_id is None:
+        Subscription.objects.filter(
+            user_profile=user_profile, recipient_id=recipient_id, active=True
+        ).update(lazy_read_message_id=Greatest(F("lazy_read_message_id"), Value(message_ids[-1])))
+    else:
+        bulk_insert_ums(
+            [
+                UserMessageLite(
+                    user_profile_id=user_profile.id,
+                    message_id=message_id,
+                    flags=UserMessage.flags.read.mask,
+                )
+                for message_id in message_ids
+            ]
+        )
+    return message_ids
+
+
+def advance_lazy_read_watermarks(user_profile: UserProfile) -> int:
+    """Marks all of the user's lazily represented messages as read, by
+    advancing each read watermark past the stream's latest unread
+    message.  Returns the number of messages newly marked as read."""
+    lazy_subs = get_lazy_subscriptions(user_profile)
+    if not lazy_subs:
+        return 0
+
+    rows = (
+        lazy_messages_without_user_message(user_profile, lazy_subs, unread_only=True)
+        .values("recipient_id")
+        .annotate(unread_count=Count("id"), max_unread_id=Max("id"))
+        .order_by()
+    )
+    count = 0
+    for row in rows:
+        Subscription.objects.filter(
+            user_profile=user_profile, recipient_id=row["recipient_id"], active=True
+        ).update(
+            lazy_read_message_id=Greatest(F("lazy_read_message_id"), Value(row["max_unread_id"]))
+        )
+        count += row["unread_count"]
+    return count
+
+
+def materialize_lazy_subscriptions(subscription_ids: list[int]) -> None:
+    """Converts the given subscriptions back to the regular
+    representation, creating UserMessage rows for all of their lazily
+    represented messages.  Called when a user unsubscribes from a stream,
+    or when the lazy mode is disabled for a stream."""
+    if not subscription_ids:
+        return
+
+    query = SQL(
+        """
+        INSERT INTO zerver_usermessage (user_profile_id, message_id, flags)
+        SELECT zerver_subscription.user_profile_id, zerver_message.id,
+               CASE WHEN zerver_message.id <= zerver_subscription.lazy_read_message_id
+                    THEN %(read_flag)s ELSE 0 END
+          FROM zerver_subscription
+          JOIN zerver_userprofile
+            ON zerver_userprofile.id = zerver_subscription.user_profile_id
+          JOIN zerver_message
+            ON zerver_message.realm_id = zerver_userprofile.realm_id
+           AND zerver_message.recipient_id = zerver_subscription.recipient_id
+           AND zerver_message.id > zerver_subscription.lazy_start_message_id
+         WHERE zerver_subscription.id = ANY(%(subscription_ids)s)
+        ON CONFLICT DO NOTHING
+        """
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            query,
+            {"read_flag": UserMessage.flags.read.mask, "subscription_ids": subscription_ids},
+        )
+
+    Subscription.objects.filter(id__in=subscription_ids).update(
+        lazy_start_message_id=None, lazy_read_message_id=None
+    )
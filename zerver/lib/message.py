@@ -1,12 +1,16 @@
 import re
-from collections.abc import Callable, Collection, Mapping, Sequence
+import secrets
+from bisect import bisect_right
+from collections.abc import Callable, Collection, Iterator, Mapping, Sequence
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from operator import itemgetter
 from typing import Any, TypedDict
 
+import orjson
 from django.conf import settings
 from django.db import connection
-from django.db.models import Exists, F, Max, OuterRef, QuerySet, Sum
+from django.db.models import Exists, F, Max, Min, OuterRef, QuerySet, Sum
 from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
 from django_cte import CTE, with_cte
@@ -14,9 +18,20 @@ from psycopg2.sql import SQL
 
 from analytics.lib.counts import COUNT_STATS
 from analytics.models import RealmCount
-from zerver.lib.cache import generic_bulk_cached_fetch, to_dict_cache_key_id
+from zerver.lib.cache import (
+    cache_get,
+    cache_get_many,
+    cache_set,
+    cache_set_many,
+    generic_bulk_cached_fetch,
+    realm_unread_data_generation_cache_key,
+    to_dict_cache_key_id,
+    unread_data_cache_key,
+    unread_data_generation_cache_key,
+)
 from zerver.lib.display_recipient import get_display_recipient, get_display_recipient_by_id
 from zerver.lib.exceptions import JsonableError, MissingAuthenticationError
+from zerver.lib.lazy_user_messages import get_lazy_unread_message_rows
 from zerver.lib.markdown import MessageRenderingResult
 from zerver.lib.mention import MentionData, sender_can_mention_group
 from zerver.lib.message_cache import MessageDict, extract_message_dict, stringify_message_dict
@@ -146,6 +161,7 @@ class SendMessageRequest:
     muted_sender_user_ids: set[int]
     um_eligible_user_ids: set[int]
     long_term_idle_user_ids: set[int]
+    lazy_user_message_user_ids: set[int]
     default_bot_user_ids: set[int]
     service_bot_tuples: list[tuple[int, int]]
     all_bot_user_ids: set[int]
@@ -192,6 +208,8 @@ class SendMessageRequest:
 # client-side code mostly doesn't need to think about the case that a
 # user has more older unread messages that were cut off.
 MAX_UNREAD_MESSAGES = 50000
+UNREAD_DATA_CACHE_SETTLE_TIME = timedelta(minutes=5)
+UNREAD_DATA_CACHE_TIMEOUT = 3600 * 24
 
 
 def truncate_content(content: str, max_length: int, truncation_message: str) -> str:
@@ -366,6 +384,43 @@ def messages_for_ids(
     return message_list
 
 
+def serialized_messages_for_ids_in_chunks(
+    message_ids: list[int],
+    chunk_size: int,
+    user_message_flags: dict[int, list[str]],
+    search_fields: dict[int, dict[str, str]],
+    apply_markdown: bool,
+    client_gravatar: bool,
+    allow_empty_topic_name: bool,
+    message_edit_history_visibility_policy: int,
+    user_profile: UserProfile | None,
+    realm: Realm,
+) -> Iterator[list[bytes]]:
+    """Generates the JSON serialization of the messages_for_ids dicts
+    for the messages, a chunk at a time, so that only one chunk of
+    message dicts, rather than all of them, is in memory at once; see
+    StreamingJsonResponse.
+
+    Like messages_for_ids, this expects all of the messages to exist,
+    so it should be consumed in the transaction which found them."""
+    for i in range(0, len(message_ids), chunk_size):
+        message_list = messages_for_ids(
+            message_ids=message_ids[i : i + chunk_size],
+            user_message_flags=user_message_flags,
+            search_fields=search_fields,
+            apply_markdown=apply_markdown,
+            client_gravatar=client_gravatar,
+            allow_empty_topic_name=allow_empty_topic_name,
+            message_edit_history_visibility_policy=message_edit_history_visibility_policy,
+            user_profile=user_profile,
+            realm=realm,
+        )
+        yield [
+            orjson.dumps(msg_dict, option=orjson.OPT_PASSTHROUGH_DATETIME)
+            for msg_dict in message_list
+        ]
+
+
 def access_message(
     user_profile: UserProfile,
     message_id: int,
@@ -832,8 +887,28 @@ def get_starred_message_ids(user_profile: UserProfile) -> list[int]:
 def get_raw_unread_data(
     user_profile: UserProfile, message_ids: list[int] | None = None
 ) -> RawUnreadMessagesResult:
-    excluded_recipient_ids = get_inactive_recipient_ids(user_profile)
+    if message_ids is None and settings.CACHE_UNREAD_MESSAGE_DATA:
+        return get_cached_raw_unread_data(user_profile)
+
     first_visible_message_id = get_first_visible_message_id(user_profile.realm)
+    rows = get_raw_unread_rows(user_profile, first_visible_message_id, message_ids)
+    return extract_unread_data_from_um_rows(rows, user_profile)
+
+
+def get_raw_unread_rows(
+    user_profile: UserProfile,
+    first_visible_message_id: int,
+    message_ids: list[int] | None = None,
+    *,
+    after_message_id: int | None = None,
+) -> list[dict[str, Any]]:
+    """Fetches the rows for the user's unread messages (or, if
+    message_ids is passed, for those messages), in ascending order, for
+    use with extract_unread_data_from_um_rows."""
+    if after_message_id is not None:
+        first_visible_message_id = max(first_visible_message_id, after_message_id + 1)
+
+    excluded_recipient_ids = get_inactive_recipient_ids(user_profile)
     user_msgs = (
         UserMessage.objects.filter(
             user_profile=user_profile,
@@ -915,7 +990,141 @@ def get_raw_unread_data(
             rows = list(user_msgs)
         finally:
             cursor.execute("SET enable_bitmapscan TO on")
-        return extract_unread_data_from_um_rows(rows, user_profile)
+
+    if message_ids is None:
+        # Unread messages in streams with lazy_user_messages enabled
+        # may not have UserMessage rows at all.
+        lazy_rows = get_lazy_unread_message_rows(
+            user_profile, first_visible_message_id, MAX_UNREAD_MESSAGES
+        )
+        if lazy_rows:
+            rows = sorted(rows + lazy_rows, key=itemgetter("message_id"))[-MAX_UNREAD_MESSAGES:]
+
+    return rows
+
+
+class UnreadDataCacheEntry(TypedDict):
+    max_message_id: int
+    first_visible_message_id: int
+    raw_unread_data: RawUnreadMessagesResult
+
+
+def get_unread_data_cache_generation(user_profile: UserProfile) -> str:
+    keys = [
+        unread_data_generation_cache_key(user_profile.id),
+        realm_unread_data_generation_cache_key(user_profile.realm_id),
+    ]
+    generations = cache_get_many(keys)
+    new_generations = {key: secrets.token_hex(8) for key in keys if key not in generations}
+    if new_generations:
+        cache_set_many(new_generations)
+        generations.update(new_generations)
+    return "-".join(generations[key] for key in keys)
+
+
+def get_unread_data_cache_boundary(realm_id: int) -> int:
+    """Returns a message ID such that every message with an ID at or
+    below it was sent at least UNREAD_DATA_CACHE_SETTLE_TIME ago.
+
+    Message IDs are allocated before the sending transaction commits,
+    so a message with a lower ID than the latest one we can see may
+    still appear later.  Only unread data for messages at or below
+    this boundary is stored in the cache; newer ones are always
+    queried directly."""
+    recent_message_id = (
+        # Uses index: zerver_message_realm_date_sent
+        Message.objects.filter(
+            realm_id=realm_id, date_sent__gte=timezone_now() - UNREAD_DATA_CACHE_SETTLE_TIME
+        ).aggregate(Min("id"))["id__min"]
+    )
+    if recent_message_id is not None:
+        return recent_message_id - 1
+    return Message.objects.filter(realm_id=realm_id).aggregate(Max("id"))["id__max"] or 0
+
+
+def merge_raw_unread_data(
+    base: RawUnreadMessagesResult, newer: RawUnreadMessagesResult
+) -> RawUnreadMessagesResult:
+    return RawUnreadMessagesResult(
+        pm_dict={**base["pm_dict"], **newer["pm_dict"]},
+        stream_dict={**base["stream_dict"], **newer["stream_dict"]},
+        huddle_dict={**base["huddle_dict"], **newer["huddle_dict"]},
+        mentions=base["mentions"] | newer["mentions"],
+        muted_stream_ids=newer["muted_stream_ids"],
+        unmuted_stream_msgs=base["unmuted_stream_msgs"] | newer["unmuted_stream_msgs"],
+        old_unreads_missing=base["old_unreads_missing"] or newer["old_unreads_missing"],
+    )
+
+
+def get_cached_raw_unread_data(user_profile: UserProfile) -> RawUnreadMessagesResult:
+    """Variant of get_raw_unread_data for /register, which stores the
+    aggregated unread data for messages up to a settled boundary (see
+    get_unread_data_cache_boundary) in the cache, so that only newer
+    unread messages need to be fetched and aggregated.
+
+    Changes to older unread data, like marking messages as read,
+    moving them, or changing muting settings, invalidate the cache via
+    flush_unread_data_cache or flush_realm_unread_data_cache."""
+    first_visible_message_id = get_first_visible_message_id(user_profile.realm)
+    cache_key = unread_data_cache_key(
+        user_profile.id, get_unread_data_cache_generation(user_profile)
+    )
+    cached = cache_get(cache_key)
+    entry: UnreadDataCacheEntry | None = cached[0] if cached is not None else None
+    if entry is not None and entry["first_visible_message_id"] != first_visible_message_id:
+        entry = None
+
+    boundary = get_unread_data_cache_boundary(user_profile.realm_id)
+    if entry is None:
+        rows = get_raw_unread_rows(user_profile, first_visible_message_id)
+        if len(rows) == MAX_UNREAD_MESSAGES:
+            # Users with this many unreads will keep having their
+            # oldest ones truncated; there's no settled state to cache.
+            return extract_unread_data_from_um_rows(rows, user_profile)
+    else:
+        rows = get_raw_unread_rows(
+            user_profile, first_visible_message_id, after_message_id=entry["max_message_id"]
+        )
+        cached_data = entry["raw_unread_data"]
+        cached_count = (
+            len(cached_data["pm_dict"])
+            + len(cached_data["stream_dict"])
+            + len(cached_data["huddle_dict"])
+        )
+        if cached_count + len(rows) >= MAX_UNREAD_MESSAGES:
+            rows = get_raw_unread_rows(user_profile, first_visible_message_id)
+            return extract_unread_data_from_um_rows(rows, user_profile)
+
+    # The rows are in ascending order, so this splits them into those
+    # which can be added to the cache entry, and those which cannot.
+    settled_count = bisect_right(rows, boundary, key=itemgetter("message_id"))
+    if entry is None:
+        settled = extract_unread_data_from_um_rows(rows[:settled_count], user_profile)
+        max_message_id = boundary
+    else:
+        settled = entry["raw_unread_data"]
+        if settled_count > 0:
+            settled = merge_raw_unread_data(
+                settled, extract_unread_data_from_um_rows(rows[:settled_count], user_profile)
+            )
+        max_message_id = max(boundary, entry["max_message_id"])
+
+    if entry is None or max_message_id != entry["max_message_id"]:
+        cache_set(
+            cache_key,
+            UnreadDataCacheEntry(
+                max_message_id=max_message_id,
+                first_visible_message_id=first_visible_message_id,
+                raw_unread_data=settled,
+            ),
+            timeout=UNREAD_DATA_CACHE_TIMEOUT,
+        )
+
+    if settled_count == len(rows):
+        return settled
+    return merge_raw_unread_data(
+        settled, extract_unread_data_from_um_rows(rows[settled_count:], user_profile)
+    )
 
 
 def extract_unread_data_from_um_rows(
@@ -89,6 +89,22 @@ def update_message_cache(
     return list(changed_messages_to_dict.keys())
 
 
+def update_message_cache_for_ids(
+    message_ids: list[int], realm_id: int | None = None, *, batch_size: int = 1000
+) -> list[int]:
+    """Variant of update_message_cache which fetches the messages
+    itself, in batches, so that changes to a very large number of
+    messages (e.g. moving a large topic) don't need to hold all of
+    them in memory at once."""
+    updated_message_ids: list[int] = []
+    for i in range(0, len(message_ids), batch_size):
+        batch = Message.objects.filter(id__in=message_ids[i : i + batch_size]).select_related(
+            *Message.DEFAULT_SELECT_RELATED
+        )
+        updated_message_ids += update_message_cache(batch, realm_id)
+    return updated_message_ids
+
+
 def save_message_rendered_content(message: Message, content: str) -> str:
     rendering_result = render_message_markdown(message, content, realm=message.get_realm())
     rendered_content = None
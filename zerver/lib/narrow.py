@@ -1,12 +1,19 @@
+import base64
+import hashlib
 import re
+import secrets
+import time
 from collections.abc import Callable, Iterable, Sequence
 from dataclasses import dataclass
-from typing import Any, Generic, TypeAlias, TypeVar
+from datetime import timedelta
+from typing import Any, Generic, Literal, TypeAlias, TypedDict, TypeVar
 
+import orjson
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import ValidationError
 from django.db import connection
+from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
 from pydantic import BaseModel, model_validator
 from sqlalchemy.dialects import postgresql
@@ -16,6 +23,7 @@ from sqlalchemy.sql import (
     ColumnElement,
     Select,
     and_,
+    any_,
     column,
     false,
     func,
@@ -28,18 +36,31 @@ from sqlalchemy.sql import (
     true,
     union_all,
 )
-from sqlalchemy.sql.selectable import SelectBase
-from sqlalchemy.types import ARRAY, Boolean, Integer, Text
+from sqlalchemy.sql.selectable import FromClause, SelectBase
+from sqlalchemy.types import Boolean, Integer, Text
+from sqlalchemy.util import LRUCache
 from typing_extensions import override
 
 from zerver.lib.addressee import get_user_profiles, get_user_profiles_by_ids
+from zerver.lib.cache import (
+    cache_get_many,
+    cache_set_many,
+    channel_message_window_generation_cache_key,
+    message_window_cache_key,
+    message_window_generation_cache_key,
+    newest_channel_message_window_generation_cache_key,
+    newest_message_window_generation_cache_key,
+    realm_message_window_generation_cache_key,
+)
 from zerver.lib.exceptions import ErrorCode, JsonableError, MissingAuthenticationError
+from zerver.lib.lazy_user_messages import get_lazy_subscriptions, get_user_message_table_for_search
 from zerver.lib.message import (
     access_message,
     access_web_public_message,
     get_first_visible_message_id,
 )
 from zerver.lib.narrow_predicate import channel_operators, channels_operators
+from zerver.lib.narrow_query_plans import record_narrow_query_plan
 from zerver.lib.recipient_users import recipient_for_user_profiles
 from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
 from zerver.lib.streams import (
@@ -216,29 +237,6 @@ class InvalidOperatorCombinationError(JsonableError):
 
 ConditionTransform: TypeAlias = Callable[[ClauseElement], ClauseElement]
 
-# These delimiters will not appear in rendered messages or HTML-escaped topics.
-TS_START = "<ts-match>"
-TS_STOP = "</ts-match>"
-
-
-def ts_locs_array(
-    config: ColumnElement[Text],
-    text: ColumnElement[Text],
-    tsquery: ColumnElement[Any],
-) -> ColumnElement[ARRAY[Integer]]:
-    options = f"HighlightAll = TRUE, StartSel = {TS_START}, StopSel = {TS_STOP}"
-    delimited = func.ts_headline(config, text, tsquery, options, type_=Text)
-    part = func.unnest(
-        func.string_to_array(delimited, TS_START, type_=ARRAY(Text)), type_=Text
-    ).column_valued()
-    part_len = func.length(part, type_=Integer) - len(TS_STOP)
-    match_pos = func.sum(part_len, type_=Integer).over(rows=(None, -1)) + len(TS_STOP)
-    match_len = func.strpos(part, TS_STOP, type_=Integer) - 1
-    return func.array(
-        select(postgresql.array([match_pos, match_len])).offset(1).scalar_subquery(),
-        type_=ARRAY(Integer),
-    )
-
 
 class NarrowBuilder:
     """
@@ -710,36 +708,23 @@ class NarrowBuilder:
     def _by_search_pgroonga(
         self, query: Select, operand: str, maybe_negate: ConditionTransform
     ) -> Select:
-        match_positions_character = func.pgroonga_match_positions_character
-        query_extract_keywords = func.pgroonga_query_extract_keywords
+        # The positions of the matches, for highlighting, are computed
+        # in zerver.lib.search_highlight for just the returned messages.
         operand_escaped = func.escape_html(operand, type_=Text)
-        keywords = query_extract_keywords(operand_escaped)
-        query = query.add_columns(
-            match_positions_character(column("rendered_content", Text), keywords).label(
-                "content_matches"
-            ),
-            match_positions_character(
-                func.escape_html(topic_column_sa(), type_=Text), keywords
-            ).label("topic_matches"),
-        )
         condition = column("search_pgroonga", Text).op("&@~")(operand_escaped)
+        unindexed_condition = (
+            func.escape_html(topic_column_sa(), type_=Text)
+            .op("||")(literal(" "))
+            .op("||")(column("rendered_content", Text))
+            .op("&@~")(operand_escaped)
+        )
+        condition = self._or_unindexed_own_messages(condition, unindexed_condition)
         return query.where(maybe_negate(condition))
 
     def _by_search_tsearch(
         self, query: Select, operand: str, maybe_negate: ConditionTransform
     ) -> Select:
         tsquery = func.plainto_tsquery(literal("zulip.english_us_search"), literal(operand))
-        query = query.add_columns(
-            ts_locs_array(
-                literal("zulip.english_us_search", Text), column("rendered_content", Text), tsquery
-            ).label("content_matches"),
-            # We HTML-escape the topic in PostgreSQL to avoid doing a server round-trip
-            ts_locs_array(
-                literal("zulip.english_us_search", Text),
-                func.escape_html(topic_column_sa(), type_=Text),
-                tsquery,
-            ).label("topic_matches"),
-        )
 
         # Do quoted string matching.  We really want phrase
         # search here so we can ignore punctuation and do
@@ -759,8 +744,60 @@ class NarrowBuilder:
                 query = query.where(maybe_negate(cond))
 
         cond = column("search_tsvector", postgresql.TSVECTOR).op("@@")(tsquery)
+        unindexed_cond = func.to_tsvector(
+            literal("zulip.english_us_search"),
+            topic_column_sa().op("||")(literal(" ")).op("||")(column("rendered_content", Text)),
+            type_=postgresql.TSVECTOR,
+        ).op("@@")(tsquery)
+        cond = self._or_unindexed_own_messages(cond, unindexed_cond)
         return query.where(maybe_negate(cond))
 
+    def _or_unindexed_own_messages(
+        self, indexed_cond: ClauseElement, unindexed_cond: ClauseElement
+    ) -> ClauseElement:
+        # The search columns are updated asynchronously by
+        # process_fts_updates, from the IDs of sent or edited messages
+        # that a database trigger logs to fts_update_log.  So that users
+        # can find messages they just sent, we can also match their own
+        # messages still waiting in that log directly against their
+        # content; normally, there are very few of those.
+        #
+        # We match them by ID against an array of their IDs, computed
+        # by an uncorrelated subquery, rather than with IN (subquery),
+        # so that both sides of the OR can use an index: PostgreSQL
+        # computes the array once, and can then combine a scan of the
+        # search index with a primary key lookup of those few
+        # messages, rather than filtering every message the user can
+        # see by the search condition.  The query doesn't depend on
+        # which messages are unindexed, so it's cached like any other.
+        if not settings.SEARCH_UNINDEXED_OWN_MESSAGES or self.user_profile is None:
+            return indexed_cond
+        unindexed_message_ids = (
+            select(
+                func.coalesce(
+                    func.array_agg(literal_column("fts_update_log.message_id", Integer)),
+                    literal_column("'{}'::bigint[]"),
+                )
+            )
+            .select_from(table("fts_update_log"))
+            .join(
+                table("zerver_message"),
+                literal_column("fts_update_log.message_id", Integer)
+                == literal_column("zerver_message.id", Integer),
+            )
+            .where(
+                literal_column("zerver_message.sender_id", Integer) == literal(self.user_profile.id)
+            )
+            # This must not be correlated with the outer query's
+            # zerver_message.
+            .correlate(None)
+            .scalar_subquery()
+        )
+        return or_(
+            indexed_cond,
+            and_(self.msg_id_column == any_(unindexed_message_ids), unindexed_cond),
+        )
+
 
 def ok_to_include_history(
     narrow: list[NarrowParameter] | None,
@@ -1003,6 +1040,16 @@ def get_base_query_for_search(
             get_recursive_membership_groups(user_profile).values_list("id", flat=True)
         )
 
+    # Messages in streams with lazy_user_messages enabled may not have
+    # UserMessage rows; if the user has any such subscriptions, we
+    # query a union which also contains the implicit rows.
+    lazy_subs = get_lazy_subscriptions(user_profile)
+    user_message_table: FromClause
+    if lazy_subs:
+        user_message_table = get_user_message_table_for_search(user_profile, lazy_subs)
+    else:
+        user_message_table = table("zerver_usermessage")
+
     query = (
         select(column("message_id", Integer))
         # We don't limit by realm_id despite the join to
@@ -1010,7 +1057,7 @@ def get_base_query_for_search(
         # usermessage is more selective, and the query planner
         # can't know about that cross-table correlation.
         .where(column("user_profile_id", Integer) == literal(user_profile.id))
-        .select_from(table("zerver_usermessage"))
+        .select_from(user_message_table)
         .join(
             table("zerver_message"),
             literal_column("zerver_usermessage.message_id", Integer)
@@ -1072,6 +1119,16 @@ def get_base_query_for_search(
     return (query, inner_msg_id_col)
 
 
+def get_search_operand(narrow: list[NarrowParameter] | None) -> str | None:
+    """The search terms of a narrow are combined into a single search."""
+    if narrow is None:
+        return None
+    search_operands = [term.operand for term in narrow if term.operator == "search"]
+    if not search_operands:
+        return None
+    return " ".join(search_operands)
+
+
 def add_narrow_conditions(
     user_profile: UserProfile | None,
     inner_msg_id_col: ColumnElement[Integer],
@@ -1087,18 +1144,15 @@ def add_narrow_conditions(
 
     # Build the query for the narrow
     builder = NarrowBuilder(user_profile, inner_msg_id_col, realm, is_web_public_query)
-    search_operands = []
 
     # As we loop through terms, builder does most of the work to extend
-    # our query, but we need to collect the search operands and handle
-    # them after the loop.
+    # our query, but we need to handle the search operands after the loop.
     for term in narrow:
-        if term.operator == "search":
-            search_operands.append(term.operand)
-        else:
+        if term.operator != "search":
             query = builder.add_term(query, term)
 
-    if search_operands:
+    search_operand = get_search_operand(narrow)
+    if search_operand is not None:
         # This topic escaping logic ensures consistent escaping of topic names throughout
         # the system, ensuring accuracy in string highlighting and avoiding any discrepancies.
         #
@@ -1121,15 +1175,59 @@ def add_narrow_conditions(
             func.escape_html(topic_column_sa(), type_=Text).label("escaped_topic_name"),
             column("rendered_content", Text),
         )
-        search_term = NarrowParameter(
-            operator="search",
-            operand=" ".join(search_operands),
-        )
+        search_term = NarrowParameter(operator="search", operand=search_operand)
         query = builder.add_term(query, search_term)
 
     return (query, is_search, builder.is_dm_narrow)
 
 
+# SQLAlchemy caches the compiled form of each statement, keyed by the
+# statement's structure rather than the values of its bound parameters.
+# Since NarrowBuilder binds operands as parameters, queries for
+# narrows with the same shape (e.g. any channel+topic narrow) share a
+# compiled statement.  Narrow queries get their own cache, sized for
+# the number of distinct shapes a server sees, so that they are not
+# evicted by other statements.
+narrow_compiled_cache = LRUCache(settings.NARROW_QUERY_CACHE_SIZE)
+
+NARROW_OPERATOR_ALIASES = {
+    "stream": "channel",
+    "streams": "channels",
+    "pm-with": "dm",
+    "pm_with": "dm",
+    "group_pm_with": "group-pm-with",
+}
+
+# Operators whose operand selects which conditions are added to the
+# query, rather than just being a bound parameter.
+NARROW_OPERATORS_WITH_KEYWORD_OPERANDS = {"channels", "has", "in", "is"}
+
+
+def narrow_query_shape(narrow: list[NarrowParameter] | None) -> str:
+    """A description of the structure of a narrow, with operands
+    omitted, for grouping queries by shape in instrumentation; e.g.
+    "channel topic" or "-is:muted is:unread"."""
+    if not narrow:
+        return "(all messages)"
+
+    terms = []
+    for term in narrow:
+        operator = NARROW_OPERATOR_ALIASES.get(term.operator, term.operator)
+        if operator in NARROW_OPERATORS_WITH_KEYWORD_OPERANDS and isinstance(term.operand, str):
+            operator = f"{operator}:{term.operand}"
+        terms.append(f"-{operator}" if term.negated else operator)
+    return " ".join(sorted(terms))
+
+
+def execute_narrow_query(sa_conn: Connection, query: SelectBase, shape: str) -> list[Row]:
+    start = time.perf_counter()
+    rows = list(
+        sa_conn.execution_options(compiled_cache=narrow_compiled_cache).execute(query).fetchall()
+    )
+    record_narrow_query_plan(sa_conn, query, shape, time.perf_counter() - start)
+    return rows
+
+
 def find_first_unread_anchor(
     sa_conn: Connection,
     user_profile: UserProfile | None,
@@ -1175,7 +1273,9 @@ def find_first_unread_anchor(
 
     first_unread_query = query.where(condition)
     first_unread_query = first_unread_query.order_by(inner_msg_id_col.asc()).limit(1)
-    first_unread_result = list(sa_conn.execute(first_unread_query).fetchall())
+    first_unread_result = execute_narrow_query(
+        sa_conn, first_unread_query, f"first_unread: {narrow_query_shape(narrow)}"
+    )
     if len(first_unread_result) > 0:
         anchor = first_unread_result[0][0]
     else:
@@ -1222,6 +1322,45 @@ def parse_anchor_value(anchor_val: str | None, use_first_unread_anchor: bool) ->
         raise JsonableError(_("Invalid anchor"))
 
 
+MessageCursorDirection: TypeAlias = Literal["older", "newer"]
+
+
+def narrow_cursor_hash(narrow: list[NarrowParameter] | None) -> str:
+    narrow_key = orjson.dumps(
+        [term.model_dump() for term in narrow] if narrow is not None else None
+    )
+    return hashlib.sha256(narrow_key).hexdigest()[:16]
+
+
+def encode_message_cursor(
+    narrow: list[NarrowParameter] | None, last_message_id: int, direction: MessageCursorDirection
+) -> str:
+    """Cursors let clients page through a narrow without computing
+    anchors: the next page is just the messages past the last one
+    returned, in the cursor's direction.  The cursor is opaque to
+    clients; it records a hash of the narrow, so that it is not used
+    with a different one."""
+    payload = orjson.dumps([narrow_cursor_hash(narrow), last_message_id, direction])
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_message_cursor(
+    cursor: str, narrow: list[NarrowParameter] | None
+) -> tuple[int, MessageCursorDirection]:
+    try:
+        payload = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        narrow_hash, last_message_id, direction = payload
+    except (ValueError, TypeError):
+        raise JsonableError(_("Invalid cursor"))
+    if (
+        narrow_hash != narrow_cursor_hash(narrow)
+        or not isinstance(last_message_id, int)
+        or direction not in ("older", "newer")
+    ):
+        raise JsonableError(_("Invalid cursor"))
+    return last_message_id, direction
+
+
 def limit_query_to_range(
     query: Select,
     num_before: int,
@@ -1304,6 +1443,69 @@ def limit_query_to_range(
         return query.where(id_col == anchor)
 
 
+# Ranked searches only rank this many of the newest matching messages
+# (or num_before, if larger); see limit_query_to_ranked_search.
+RANKED_SEARCH_CANDIDATES = 1000
+# The relevance of a message is divided by 1 + its age / this many days.
+RANKED_SEARCH_DECAY_DAYS = 30
+
+
+def limit_query_to_ranked_search(
+    query: Select,
+    search_operand: str,
+    num_before: int,
+    anchor: int,
+    include_anchor: bool,
+    anchored_to_right: bool,
+    id_col: ColumnElement[Integer],
+) -> SelectBase:
+    """Orders the messages matching a search by relevance, rather than by
+    ID, returning the num_before most relevant ones.
+
+    To keep this cheap regardless of how many messages match, we only
+    rank a bounded set of candidates: the newest matching messages
+    (before the anchor), which the search index finds without ranking
+    anything.  The relevance is computed from the stored search vector
+    (or the PGroonga score), without re-parsing any content, and
+    decays with the age of the message, so that recent matches win
+    over equally good older ones."""
+    candidates = query.add_columns(
+        literal_column("zerver_message.date_sent").label("search_date_sent")
+    )
+    if settings.USING_PGROONGA:
+        candidates = candidates.add_columns(
+            func.pgroonga_score(
+                literal_column("zerver_message.tableoid"), literal_column("zerver_message.ctid")
+            ).label("search_score")
+        )
+    else:
+        candidates = candidates.add_columns(
+            literal_column("zerver_message.search_tsvector").label("search_tsvector")
+        )
+    if not anchored_to_right:
+        candidates = candidates.where(id_col <= anchor - (not include_anchor))
+    candidates_subquery = (
+        candidates.order_by(id_col.desc())
+        .limit(max(RANKED_SEARCH_CANDIDATES, num_before))
+        .subquery()
+    )
+
+    if settings.USING_PGROONGA:
+        score = candidates_subquery.c.search_score
+    else:
+        tsquery = func.plainto_tsquery(literal("zulip.english_us_search"), literal(search_operand))
+        score = func.ts_rank_cd(candidates_subquery.c.search_tsvector, tsquery)
+    age_days = func.date_part("epoch", func.now() - candidates_subquery.c.search_date_sent) / 86400
+    relevance = score / (1 + age_days / RANKED_SEARCH_DECAY_DAYS)
+
+    return (
+        select(*(candidates_subquery.c[col.name] for col in query.selected_columns))
+        .select_from(candidates_subquery)
+        .order_by(relevance.desc(), candidates_subquery.c.message_id.desc())
+        .limit(num_before)
+    )
+
+
 MessageRowT = TypeVar("MessageRowT", bound=Sequence[Any])
 
 
@@ -1400,6 +1602,170 @@ class FetchedMessages(LimitedMessages[Row]):
     is_search: bool
 
 
+MESSAGE_WINDOW_CACHE_TIMEOUT = 3600 * 24
+# Messages are assigned IDs before their sending transaction commits,
+# so a window ending in recent messages may still gain a message with
+# a lower ID than its last one; see get_unread_data_cache_boundary.
+MESSAGE_WINDOW_SETTLE_TIME = timedelta(minutes=1)
+
+
+class MessageWindowCacheEntry(TypedDict):
+    # The generations of the cache keys this entry depends on, at the
+    # time it was computed.
+    generations: dict[str, str]
+    rows: list[Row]
+    found_anchor: bool
+    found_newest: bool
+    found_oldest: bool
+    history_limited: bool
+    include_history: bool
+
+
+@dataclass
+class MessageWindowCache:
+    """The cache of the rows fetched for a given (user, narrow, anchor,
+    window) combination; see get_message_window_cache."""
+
+    key: str
+    generations: dict[str, str]
+    generation_keys: list[str]
+    newest_generation_keys: list[str]
+    entry: MessageWindowCacheEntry | None
+
+
+def get_message_window_cache(
+    *,
+    narrow: list[NarrowParameter] | None,
+    user_profile: UserProfile | None,
+    is_web_public_query: bool,
+    anchor: int | None,
+    include_anchor: bool,
+    num_before: int,
+    num_after: int,
+) -> MessageWindowCache | None:
+    """Clients repeatedly fetch the same windows of the same narrows, so
+    when CACHE_MESSAGE_WINDOWS is enabled, we cache the rows we found for
+    each window.  Entries are invalidated by deleting the generation
+    keys they depend on: the user's, for changes to their messages or
+    flags (see flush_message_window_cache); the realm's, for permission
+    changes; and, for queries including history, the channel's.
+
+    New messages are handled separately, since they can only change
+    windows which extend to the newest message (or very recent ones),
+    so only such entries depend on the "newest" generation keys which
+    flush_newest_message_window_cache deletes when a message is sent.
+
+    Searches are not cached, since their results also depend on the
+    content of the messages, and nor are has:reaction narrows, since
+    reactions are too frequent to invalidate windows for.
+
+    This must be called before the transaction in which the messages
+    are fetched; otherwise, we could store rows fetched from a
+    snapshot from before a change under generations from after it."""
+    if not settings.CACHE_MESSAGE_WINDOWS or user_profile is None or anchor is None:
+        return None
+    if narrow is not None and any(
+        term.operator == "search" or (term.operator == "has" and term.operand == "reaction")
+        for term in narrow
+    ):
+        return None
+
+    include_history = ok_to_include_history(narrow, user_profile, is_web_public_query)
+
+    generation_keys = [
+        message_window_generation_cache_key(user_profile.id),
+        realm_message_window_generation_cache_key(user_profile.realm_id),
+    ]
+    newest_generation_keys = [newest_message_window_generation_cache_key(user_profile.id)]
+    if include_history:
+        # Messages sent to a channel aren't changes to the user's
+        # messages if they're not subscribed, so the window also
+        # depends on the channel.
+        assert narrow is not None
+        if any(term.operator in channels_operators for term in narrow):
+            return None
+        try:
+            recipient_ids = {
+                get_stream_by_narrow_operand_access_unchecked(
+                    term.operand, user_profile.realm
+                ).recipient_id
+                for term in narrow
+                if term.operator in channel_operators
+            }
+        except Stream.DoesNotExist:
+            return None
+        for recipient_id in sorted(
+            recipient_id for recipient_id in recipient_ids if recipient_id is not None
+        ):
+            generation_keys.append(channel_message_window_generation_cache_key(recipient_id))
+            newest_generation_keys.append(
+                newest_channel_message_window_generation_cache_key(recipient_id)
+            )
+
+    query_key = orjson.dumps(
+        [
+            [term.model_dump() for term in narrow] if narrow is not None else None,
+            include_history,
+            anchor,
+            include_anchor,
+            num_before,
+            num_after,
+            get_first_visible_message_id(user_profile.realm),
+        ]
+    )
+    key = message_window_cache_key(user_profile.id, hashlib.sha256(query_key).hexdigest())
+
+    cached = cache_get_many([key, *generation_keys, *newest_generation_keys])
+    entry: MessageWindowCacheEntry | None = cached.pop(key, None)
+    new_generations = {
+        generation_key: secrets.token_hex(8)
+        for generation_key in [*generation_keys, *newest_generation_keys]
+        if generation_key not in cached
+    }
+    if new_generations:
+        cache_set_many(new_generations)
+        cached.update(new_generations)
+
+    if entry is not None and any(
+        cached.get(generation_key) != generation
+        for generation_key, generation in entry["generations"].items()
+    ):
+        entry = None
+
+    return MessageWindowCache(
+        key=key,
+        generations=cached,
+        generation_keys=generation_keys,
+        newest_generation_keys=newest_generation_keys,
+        entry=entry,
+    )
+
+
+def cache_message_window(window_cache: MessageWindowCache, fetched: FetchedMessages) -> None:
+    depends_on_newest = fetched.found_newest or len(fetched.rows) == 0
+    if not depends_on_newest:
+        last_date_sent = Message.objects.get(id=fetched.rows[-1][0]).date_sent
+        depends_on_newest = last_date_sent > timezone_now() - MESSAGE_WINDOW_SETTLE_TIME
+
+    generation_keys = window_cache.generation_keys
+    if depends_on_newest:
+        generation_keys = [*generation_keys, *window_cache.newest_generation_keys]
+    cache_set_many(
+        {
+            window_cache.key: MessageWindowCacheEntry(
+                generations={key: window_cache.generations[key] for key in generation_keys},
+                rows=fetched.rows,
+                found_anchor=fetched.found_anchor,
+                found_newest=fetched.found_newest,
+                found_oldest=fetched.found_oldest,
+                history_limited=fetched.history_limited,
+                include_history=fetched.include_history,
+            )
+        },
+        timeout=MESSAGE_WINDOW_CACHE_TIMEOUT,
+    )
+
+
 def fetch_messages(
     *,
     narrow: list[NarrowParameter] | None,
@@ -1411,7 +1777,22 @@ def fetch_messages(
     num_before: int,
     num_after: int,
     client_requested_message_ids: list[int] | None = None,
+    window_cache: MessageWindowCache | None = None,
+    ranked_search: bool = False,
 ) -> FetchedMessages:
+    if window_cache is not None and window_cache.entry is not None:
+        entry = window_cache.entry
+        return FetchedMessages(
+            rows=entry["rows"],
+            found_anchor=entry["found_anchor"],
+            found_newest=entry["found_newest"],
+            found_oldest=entry["found_oldest"],
+            history_limited=entry["history_limited"],
+            anchor=anchor,
+            include_history=entry["include_history"],
+            is_search=False,
+        )
+
     include_history = ok_to_include_history(narrow, user_profile, is_web_public_query)
     if include_history:
         # The initial query in this case doesn't use `zerver_usermessage`,
@@ -1470,28 +1851,41 @@ def fetch_messages(
             if anchored_to_right:
                 num_after = 0
 
-            query = limit_query_to_range(
-                query=query,
-                num_before=num_before,
-                num_after=num_after,
-                anchor=anchor,
-                include_anchor=include_anchor,
-                anchored_to_left=anchored_to_left,
-                anchored_to_right=anchored_to_right,
-                id_col=inner_msg_id_col,
-                first_visible_message_id=first_visible_message_id,
-            )
+            if ranked_search:
+                search_operand = get_search_operand(narrow)
+                assert search_operand is not None
+                query = limit_query_to_ranked_search(
+                    query=query,
+                    search_operand=search_operand,
+                    num_before=num_before,
+                    anchor=anchor,
+                    include_anchor=include_anchor,
+                    anchored_to_right=anchored_to_right,
+                    id_col=inner_msg_id_col,
+                )
+            else:
+                query = limit_query_to_range(
+                    query=query,
+                    num_before=num_before,
+                    num_after=num_after,
+                    anchor=anchor,
+                    include_anchor=include_anchor,
+                    anchored_to_left=anchored_to_left,
+                    anchored_to_right=anchored_to_right,
+                    id_col=inner_msg_id_col,
+                    first_visible_message_id=first_visible_message_id,
+                )
 
-            main_query = query.subquery()
-            query = (
-                select(*main_query.c)
-                .select_from(main_query)
-                .order_by(column("message_id", Integer).asc())
-            )
+                main_query = query.subquery()
+                query = (
+                    select(*main_query.c)
+                    .select_from(main_query)
+                    .order_by(column("message_id", Integer).asc())
+                )
 
         # This is a hack to tag the query we use for testing
         query = query.prefix_with("/* get_messages */")
-        rows = list(sa_conn.execute(query).fetchall())
+        rows = execute_narrow_query(sa_conn, query, narrow_query_shape(narrow))
 
     if client_requested_message_ids is not None:
         # We don't need to do any post-processing in this case.
@@ -1511,6 +1905,27 @@ def fetch_messages(
         )
 
     assert anchor is not None
+    if ranked_search:
+        # The rows are in order of relevance, so the usual
+        # post-processing, which assumes ID order, doesn't apply.
+        if first_visible_message_id > 0:
+            visible_rows = [r for r in rows if r[0] >= first_visible_message_id]
+        else:
+            visible_rows = rows
+        # If there were fewer candidates than requested, we've ranked
+        # every matching message.
+        found_oldest = len(rows) < num_before
+        return FetchedMessages(
+            rows=visible_rows,
+            found_anchor=False,
+            found_newest=anchored_to_right,
+            found_oldest=found_oldest,
+            history_limited=found_oldest and len(visible_rows) != len(rows),
+            anchor=anchor,
+            include_history=include_history,
+            is_search=is_search,
+        )
+
     query_info = post_process_limited_query(
         rows=rows,
         num_before=num_before,
@@ -1521,7 +1936,7 @@ def fetch_messages(
         first_visible_message_id=first_visible_message_id,
     )
 
-    return FetchedMessages(
+    fetched = FetchedMessages(
         rows=query_info.rows,
         found_anchor=query_info.found_anchor,
         found_newest=query_info.found_newest,
@@ -1531,3 +1946,6 @@ def fetch_messages(
         include_history=include_history,
         is_search=is_search,
     )
+    if window_cache is not None:
+        cache_message_window(window_cache, fetched)
+    return fetched
@@ -0,0 +1,123 @@
+# Opt-in instrumentation for the query plans of slow narrow queries.
+#
+# When NARROW_EXPLAIN_SAMPLE_RATE is nonzero, a random sample of the
+# GET /messages queries which took longer than
+# NARROW_EXPLAIN_SLOW_QUERY_TIME are run again under EXPLAIN (ANALYZE,
+# BUFFERS), and a summary of the plan is aggregated per narrow shape
+# (see narrow_query_shape), so that one can tell which combinations of
+# operators are slow, and which tables they end up scanning without an
+# index.  Since EXPLAIN ANALYZE executes the query a second time, this
+# should only be enabled with a small sample rate, while investigating.
+#
+# The aggregates are stored under a single memcached key, and are
+# updated without locking; losing the occasional sample to a race
+# between processes is fine for this purpose.
+import logging
+import random
+from typing import Any, TypedDict
+
+import orjson
+from django.conf import settings
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.selectable import SelectBase
+
+from zerver.lib.cache import cache_delete, cache_get, cache_set
+
+logger = logging.getLogger("zulip.narrow_query_plans")
+
+# Bounds the size of the aggregates, so they always fit in memcached.
+MAX_NARROW_QUERY_SHAPES = 200
+NARROW_QUERY_PLANS_CACHE_TIMEOUT = 3600 * 24 * 7
+
+
+class NarrowQueryPlanStats(TypedDict):
+    count: int
+    total_time: float
+    max_time: float
+    # Counts of the scan nodes in the sampled plans, e.g.
+    # "Seq Scan on zerver_message".
+    scans: dict[str, int]
+    shared_hit_blocks: int
+    shared_read_blocks: int
+
+
+def narrow_query_plans_cache_key() -> str:
+    return "narrow_query_plans"
+
+
+def get_narrow_query_plan_stats() -> dict[str, NarrowQueryPlanStats]:
+    stats = cache_get(narrow_query_plans_cache_key())
+    if stats is None:
+        return {}
+    return stats[0]
+
+
+def reset_narrow_query_plan_stats() -> None:
+    cache_delete(narrow_query_plans_cache_key())
+
+
+def should_sample_narrow_query_plan(elapsed: float) -> bool:
+    if settings.NARROW_EXPLAIN_SAMPLE_RATE <= 0:
+        return False
+    if elapsed < settings.NARROW_EXPLAIN_SLOW_QUERY_TIME:
+        return False
+    return random.random() < settings.NARROW_EXPLAIN_SAMPLE_RATE
+
+
+def get_plan_scans(plan: dict[str, Any]) -> list[str]:
+    scans = []
+    node_type = plan["Node Type"]
+    if "Relation Name" in plan:
+        if "Index Name" in plan:
+            scans.append(f"{node_type} using {plan['Index Name']} on {plan['Relation Name']}")
+        else:
+            scans.append(f"{node_type} on {plan['Relation Name']}")
+    for subplan in plan.get("Plans", []):
+        scans.extend(get_plan_scans(subplan))
+    return scans
+
+
+def explain_narrow_query(sa_conn: Connection, query: SelectBase) -> dict[str, Any]:
+    compiled = query.compile(dialect=sa_conn.dialect, compile_kwargs={"render_postcompile": True})
+    result = sa_conn.exec_driver_sql(
+        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled.string}", compiled.params
+    ).scalar()
+    if isinstance(result, str | bytes):
+        result = orjson.loads(result)
+    return result[0]
+
+
+def record_narrow_query_plan(
+    sa_conn: Connection, query: SelectBase, shape: str, elapsed: float
+) -> None:
+    """Called after executing a narrow query; if the query was slow and
+    is selected for sampling, records its plan under its shape."""
+    if not should_sample_narrow_query_plan(elapsed):
+        return
+
+    explain = explain_narrow_query(sa_conn, query)
+    plan = explain["Plan"]
+    scans = get_plan_scans(plan)
+    logger.info("Slow narrow query (%.3fs) for %s: %s", elapsed, shape, ", ".join(scans))
+
+    all_stats = get_narrow_query_plan_stats()
+    if shape not in all_stats:
+        if len(all_stats) >= MAX_NARROW_QUERY_SHAPES:
+            return
+        all_stats[shape] = NarrowQueryPlanStats(
+            count=0,
+            total_time=0,
+            max_time=0,
+            scans={},
+            shared_hit_blocks=0,
+            shared_read_blocks=0,
+        )
+    stats = all_stats[shape]
+    stats["count"] += 1
+    stats["total_time"] += elapsed
+    stats["max_time"] = max(stats["max_time"], elapsed)
+    for scan in scans:
+        stats["scans"][scan] = stats["scans"].get(scan, 0) + 1
+    stats["shared_hit_blocks"] += plan.get("Shared Hit Blocks", 0)
+    stats["shared_read_blocks"] += plan.get("Shared Read Blocks", 0)
+    cache_set(narrow_query_plans_cache_key(), all_stats, timeout=NARROW_QUERY_PLANS_CACHE_TIMEOUT)
@@ -5,15 +5,21 @@ ReturnT = TypeVar("ReturnT")
 
 FUNCTION_NAME_TO_PER_REQUEST_RESULT: dict[str, dict[int, Any]] = {}
 
+# The number of calls answered from each cache, which is never reset,
+# so that callers can report how many were saved over some period.
+FUNCTION_NAME_TO_PER_REQUEST_HITS: dict[str, int] = {}
+
 
 def return_same_value_during_entire_request(f: Callable[..., ReturnT]) -> Callable[..., ReturnT]:
     cache_key = f.__name__
 
     assert cache_key not in FUNCTION_NAME_TO_PER_REQUEST_RESULT
     FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key] = {}
+    FUNCTION_NAME_TO_PER_REQUEST_HITS[cache_key] = 0
 
     def wrapper(key: int, *args: Any) -> ReturnT:
         if key in FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key]:
+            FUNCTION_NAME_TO_PER_REQUEST_HITS[cache_key] += 1
             return FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key][key]
 
         result = f(key, *args)
@@ -31,3 +37,7 @@ def flush_per_request_cache(cache_key: str) -> None:
 def flush_per_request_caches() -> None:
     for cache_key in FUNCTION_NAME_TO_PER_REQUEST_RESULT:
         FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key] = {}
+
+
+def get_per_request_cache_hits(cache_key: str) -> int:
+    return FUNCTION_NAME_TO_PER_REQUEST_HITS.get(cache_key, 0)
@@ -1,15 +1,21 @@
+import logging
 import time
 from collections import defaultdict
 from collections.abc import Mapping, Sequence
 from datetime import datetime, timedelta
 from typing import Any
 
+import redis
 from django.conf import settings
 from django.utils.timezone import now as timezone_now
 
+from zerver.lib.presence_store import get_presence_store_rows
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.users import check_user_can_access_all_users, get_accessible_user_ids
 from zerver.models import Realm, UserPresence, UserProfile
+from zerver.models.users import active_user_ids
+
+logger = logging.getLogger(__name__)
 
 
 def get_presence_dicts_for_rows(
@@ -163,6 +169,19 @@ def get_presence_dict_by_realm(
         # param is not provided.
         fetch_since_datetime = now - timedelta(days=14)
 
+    if settings.PRESENCE_REDIS_STORE and slim_presence and history_limit_days != 0:
+        try:
+            presence_from_store = get_presence_dict_from_store(
+                realm,
+                last_update_id_fetched_by_client,
+                fetch_since_datetime,
+                requesting_user_profile,
+            )
+            if presence_from_store is not None:
+                return presence_from_store
+        except redis.RedisError:
+            logger.exception("Failed to read presence store for realm %s", realm.id)
+
     kwargs: dict[str, object] = dict()
     if last_update_id_fetched_by_client is not None:
         kwargs["last_update_id__gt"] = last_update_id_fetched_by_client
@@ -227,6 +246,73 @@ def get_presence_dict_by_realm(
     ), last_update_id_fetched_by_server
 
 
+def get_presence_dict_from_store(
+    realm: Realm,
+    last_update_id_fetched_by_client: int | None,
+    fetch_since_datetime: datetime,
+    requesting_user_profile: UserProfile | None,
+) -> tuple[dict[str, dict[str, Any]], int] | None:
+    """The equivalent of get_presence_dict_by_realm with slim_presence,
+    served from the realm's presence store, which avoids querying the
+    database except when the store needs to be loaded; or None if the
+    store couldn't be read."""
+    rows = get_presence_store_rows(
+        realm.id,
+        last_update_id_fetched_by_client if last_update_id_fetched_by_client is not None else -1,
+    )
+    if rows is None:
+        return None
+
+    # Unlike the database query, the store can't filter by whether
+    # users are active, so we do that using the cached list of active
+    # users.
+    user_ids = set(active_user_ids(realm.id))
+    if settings.CAN_ACCESS_ALL_USERS_GROUP_LIMITS_PRESENCE and not check_user_can_access_all_users(
+        requesting_user_profile
+    ):
+        assert requesting_user_profile is not None
+        user_ids &= set(get_accessible_user_ids(realm, requesting_user_profile))
+
+    fetch_since_timestamp = None
+    if last_update_id_fetched_by_client is None or last_update_id_fetched_by_client <= 0:
+        fetch_since_timestamp = datetime_to_timestamp(fetch_since_datetime)
+
+    user_statuses: dict[str, dict[str, Any]] = {}
+    last_update_id_fetched_by_server = last_update_id_fetched_by_client
+    for (
+        user_profile_id,
+        last_update_id,
+        last_active_timestamp,
+        last_connected_timestamp,
+        date_joined_timestamp,
+        is_bot,
+    ) in rows:
+        if is_bot or user_profile_id not in user_ids:
+            continue
+        if fetch_since_timestamp is not None and (
+            last_connected_timestamp is None or last_connected_timestamp < fetch_since_timestamp
+        ):
+            continue
+        # Like user_presence_datetime_with_date_joined_default.
+        if last_active_timestamp is None:
+            last_active_timestamp = date_joined_timestamp
+        if last_connected_timestamp is None:  # nocoverage
+            last_connected_timestamp = date_joined_timestamp
+        user_statuses[str(user_profile_id)] = dict(
+            active_timestamp=last_active_timestamp,
+            idle_timestamp=last_connected_timestamp,
+        )
+        if (
+            last_update_id_fetched_by_server is None
+            or last_update_id > last_update_id_fetched_by_server
+        ):
+            last_update_id_fetched_by_server = last_update_id
+
+    if last_update_id_fetched_by_server is None:
+        last_update_id_fetched_by_server = -1
+    return user_statuses, last_update_id_fetched_by_server
+
+
 def get_presences_for_realm(
     realm: Realm,
     slim_presence: bool,
@@ -0,0 +1,139 @@
+# A Redis-backed copy of each realm's UserPresence data, which serves
+# presence polls (including deltas by last_update_id) without querying
+# PostgreSQL.  UserPresence remains the source of truth; the store is
+# only enabled with PRESENCE_REDIS_STORE.
+#
+# The store is a RedisSnapshot (see zerver.lib.redis_snapshot) of
+# each realm's users' presence data, versioned by last_update_id, so
+# that deltas can be read by last_update_id directly.
+#
+# Updates from do_update_user_presence are written after their
+# transaction commits; a cold store is populated from the database on
+# the first read.
+#
+# Unlike the database, the store can apply two updates in a different
+# order from their last_update_id, since they are written after their
+# transactions commit.  So that a client polling in between doesn't
+# miss the earlier one, deltas also include the last
+# PRESENCE_STORE_DELTA_LAG updates the client already has; only
+# updates committed concurrently can be reordered, so that covers them.
+import logging
+from datetime import datetime
+from typing import Any
+
+import orjson
+import redis
+
+from zerver.lib.redis_snapshot import RedisSnapshot
+from zerver.lib.timestamp import datetime_to_timestamp
+from zerver.models import UserPresence
+
+logger = logging.getLogger(__name__)
+
+# Realms which see no presence updates for this long are evicted, and
+# will be loaded again from the database.
+PRESENCE_STORE_EXPIRY_SECONDS = 7 * 24 * 3600
+
+# How many updates before the client's last_update_id we include in
+# deltas; see above.
+PRESENCE_STORE_DELTA_LAG = 20
+
+presence_store = RedisSnapshot("presence_store", PRESENCE_STORE_EXPIRY_SECONDS)
+
+
+def optional_timestamp(dt: datetime | None) -> int | None:
+    if dt is None:
+        return None
+    return datetime_to_timestamp(dt)
+
+
+def encode_presence_entry(
+    user_profile_id: int,
+    last_update_id: int,
+    last_active_time: datetime | None,
+    last_connected_time: datetime | None,
+    date_joined: datetime,
+    is_bot: bool,
+) -> tuple[int, int, bytes]:
+    return (
+        user_profile_id,
+        last_update_id,
+        orjson.dumps(
+            [
+                user_profile_id,
+                last_update_id,
+                optional_timestamp(last_active_time),
+                optional_timestamp(last_connected_time),
+                datetime_to_timestamp(date_joined),
+                is_bot,
+            ]
+        ),
+    )
+
+
+def update_presence_store(
+    realm_id: int,
+    user_profile_id: int,
+    last_update_id: int,
+    last_active_time: datetime | None,
+    last_connected_time: datetime | None,
+    date_joined: datetime,
+    is_bot: bool,
+) -> None:
+    entry = encode_presence_entry(
+        user_profile_id,
+        last_update_id,
+        last_active_time,
+        last_connected_time,
+        date_joined,
+        is_bot,
+    )
+    try:
+        presence_store.write(realm_id, [entry])
+    except redis.RedisError:
+        # The store may now be missing this update, so make the next
+        # read reload it from the database.
+        logger.exception("Failed to update presence store for realm %s", realm_id)
+        clear_presence_store(realm_id)
+
+
+def load_presence_store(realm_id: int) -> None:
+    # Marks the store as loading first, so that any updates committed
+    # after the database read below are written to it.
+    presence_store.write(realm_id, [], state="loading")
+    rows = UserPresence.objects.filter(realm_id=realm_id).values_list(
+        "user_profile_id",
+        "last_update_id",
+        "last_active_time",
+        "last_connected_time",
+        "user_profile__date_joined",
+        "user_profile__is_bot",
+    )
+    presence_store.write(
+        realm_id, (encode_presence_entry(*row) for row in rows.iterator()), state="loaded"
+    )
+
+
+def clear_presence_store(realm_id: int) -> None:
+    try:
+        presence_store.clear(realm_id)
+    except redis.RedisError:  # nocoverage
+        logger.exception("Failed to clear presence store for realm %s", realm_id)
+
+
+def get_presence_store_rows(realm_id: int, last_update_id: int) -> list[list[Any]] | None:
+    """Returns the presence data of the users in the realm whose
+    last_update_id is larger than the given one, less
+    PRESENCE_STORE_DELTA_LAG, as lists of user ID, last_update_id, last
+    active and last connected timestamps, the timestamp the user
+    joined, and whether the user is a bot.
+
+    Loads the realm's store from the database if necessary; returns
+    None if it was cleared again before we could read it, in which
+    case the caller should query the database instead."""
+    result = presence_store.read_or_load(
+        realm_id, load_presence_store, newer_than=last_update_id - PRESENCE_STORE_DELTA_LAG
+    )
+    if result is None:
+        return None
+    return [orjson.loads(data) for data in result]
@@ -0,0 +1,90 @@
+# Caches the sections of the /register response which are the same for
+# every user in a realm, so that when many clients register at once
+# (e.g. after a server restart), the sections are computed once per
+# realm rather than once per client.
+#
+# Each section is cached under a generation token, like the unread
+# message data cache; the generation is deleted whenever an event
+# which could change the section is sent (see
+# REALM_SNAPSHOT_INVALIDATING_EVENTS), which is after the change's
+# transaction commits.  So a snapshot can only predate a change if the
+# event for that change is sent after it was read, in which case
+# apply_events applies it to the register response as usual.
+import secrets
+from collections.abc import Callable
+from typing import TypeVar
+
+from django.conf import settings
+
+from zerver.lib.cache import (
+    cache_delete_many,
+    cache_get,
+    cache_set,
+    realm_snapshot_cache_key,
+    realm_snapshot_generation_cache_key,
+)
+
+T = TypeVar("T")
+
+REALM_SNAPSHOT_CACHE_TIMEOUT = 3600 * 24
+
+# Maps each section to the types of events which invalidate it.
+REALM_SNAPSHOT_INVALIDATING_EVENTS: dict[str, set[str]] = {
+    # Group memberships exclude deactivated users, and the anonymous
+    # groups include those used by realm and channel settings.
+    "realm_user_groups": {"user_group", "realm_user", "realm", "stream"},
+    "custom_profile_fields": {"custom_profile_fields"},
+    "realm_domains": {"realm_domains"},
+    "realm_playgrounds": {"realm_playgrounds"},
+    "realm_user_settings_defaults": {"realm_user_settings_defaults"},
+    "default_stream_groups": {"default_stream_groups", "stream"},
+}
+
+REALM_SNAPSHOT_SECTIONS_BY_EVENT: dict[str, list[str]] = {}
+for section, event_types in REALM_SNAPSHOT_INVALIDATING_EVENTS.items():
+    for event_type in event_types:
+        REALM_SNAPSHOT_SECTIONS_BY_EVENT.setdefault(event_type, []).append(section)
+
+
+def get_realm_snapshot_generation(realm_id: int, section: str) -> str:
+    key = realm_snapshot_generation_cache_key(realm_id, section)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached[0]
+    generation = secrets.token_hex(8)
+    cache_set(key, generation)
+    return generation
+
+
+def get_realm_snapshot(
+    realm_id: int, section: str, compute: Callable[[], T], *, variant: str = ""
+) -> T:
+    """Returns the realm's cached value of a section of the /register
+    response, computing it if necessary.  Sections which depend on
+    parameters of the request must use a different variant for each
+    combination of them."""
+    if not settings.CACHE_REGISTER_REALM_SNAPSHOT:
+        return compute()
+
+    assert section in REALM_SNAPSHOT_INVALIDATING_EVENTS
+    generation = get_realm_snapshot_generation(realm_id, section)
+    key = realm_snapshot_cache_key(realm_id, section, variant, generation)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached[0]
+
+    value = compute()
+    cache_set(key, value, timeout=REALM_SNAPSHOT_CACHE_TIMEOUT)
+    return value
+
+
+def flush_realm_snapshot_for_event(realm_id: int, event_type: str) -> None:
+    """Called when sending an event, after the change it describes has
+    been committed."""
+    if not settings.CACHE_REGISTER_REALM_SNAPSHOT:
+        return
+    sections = REALM_SNAPSHOT_SECTIONS_BY_EVENT.get(event_type)
+    if sections:
+        cache_delete_many(
+            [realm_snapshot_generation_cache_key(realm_id, section) for section in sections]
+        )
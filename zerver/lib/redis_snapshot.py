@@ -0,0 +1,133 @@
+# A Redis-backed snapshot of some per-realm data from the database,
+# which remains the source of truth; used by the presence store and the
+# realm user directory.
+#
+# For each realm, a snapshot has:
+# * A sorted set of entry IDs (e.g. user IDs), scored by the version of
+#   each entry.
+# * A hash from entry ID to the entry's data.
+# * A state key, which is "loading" while the snapshot is being
+#   populated from the database, and "loaded" once it can serve reads.
+#
+# Writes of changed entries are discarded if the realm's snapshot
+# isn't being loaded or loaded; a cold snapshot is populated from the
+# database on the first read.  Since the state key is set before the
+# database is read, every change committed after that read is written
+# to the snapshot itself.  Writes only ever replace an entry with one
+# with a larger version, so the order in which they reach Redis
+# doesn't matter, as long as versions are assigned in the order the
+# database was read.
+#
+# Snapshots which aren't written to for their expiry time are evicted,
+# and will be loaded again from the database.
+from collections.abc import Callable, Iterable
+
+from zerver.lib import redis_utils
+from zerver.lib.redis_utils import get_redis_client
+
+client = get_redis_client()
+
+# Lua can't unpack arbitrarily many arguments at once.
+REDIS_SNAPSHOT_BATCH_SIZE = 1000
+
+# KEYS: ids, data, state.  ARGV: expiry, a new state (or ""), then
+# (entry ID, version, data) triples.
+WRITE_SCRIPT = client.register_script(
+    """
+local state = redis.call("GET", KEYS[3])
+if not state and ARGV[2] == "" then
+    return 0
+end
+for i = 3, #ARGV, 3 do
+    local version = redis.call("ZSCORE", KEYS[1], ARGV[i])
+    if not version or tonumber(version) < tonumber(ARGV[i + 1]) then
+        redis.call("ZADD", KEYS[1], ARGV[i + 1], ARGV[i])
+        redis.call("HSET", KEYS[2], ARGV[i], ARGV[i + 2])
+    end
+end
+if ARGV[2] ~= "" and state ~= "loaded" then
+    redis.call("SET", KEYS[3], ARGV[2])
+end
+for i = 1, 3 do
+    redis.call("EXPIRE", KEYS[i], ARGV[1])
+end
+return 1
+"""
+)
+
+# KEYS: ids, data, state.  ARGV: the minimum version to return, as a
+# ZRANGEBYSCORE bound.  Returns nil if the snapshot isn't loaded.
+READ_SCRIPT = client.register_script(
+    f"""
+if redis.call("GET", KEYS[3]) ~= "loaded" then
+    return false
+end
+local ids = redis.call("ZRANGEBYSCORE", KEYS[1], ARGV[1], "+inf")
+local result = {{}}
+for i = 1, #ids, {REDIS_SNAPSHOT_BATCH_SIZE} do
+    local batch = redis.call(
+        "HMGET", KEYS[2], unpack(ids, i, math.min(i + {REDIS_SNAPSHOT_BATCH_SIZE - 1}, #ids))
+    )
+    for _, data in ipairs(batch) do
+        if data then
+            table.insert(result, data)
+        end
+    end
+end
+return result
+"""
+)
+
+
+class RedisSnapshot:
+    def __init__(self, name: str, expiry_seconds: int) -> None:
+        self.name = name
+        self.expiry_seconds = expiry_seconds
+
+    def keys(self, realm_id: int) -> list[str]:
+        prefix = f"{redis_utils.REDIS_KEY_PREFIX}{self.name}:{realm_id}"
+        return [f"{prefix}:ids", f"{prefix}:data", f"{prefix}:state"]
+
+    def write(
+        self, realm_id: int, entries: Iterable[tuple[int, int, bytes]], state: str = ""
+    ) -> None:
+        """Writes the (entry ID, version, data) entries to the realm's
+        snapshot, if it's being loaded or loaded, and then sets its
+        state, if one is given."""
+        args: list[object] = []
+        for entry in entries:
+            args.extend(entry)
+        batch_size = 3 * REDIS_SNAPSHOT_BATCH_SIZE
+        for start in range(0, max(len(args), 1), batch_size):
+            last_batch = start + batch_size >= len(args)
+            WRITE_SCRIPT(
+                keys=self.keys(realm_id),
+                args=[
+                    self.expiry_seconds,
+                    state if last_batch else "",
+                    *args[start : start + batch_size],
+                ],
+            )
+
+    def read(self, realm_id: int, newer_than: int | None = None) -> list[bytes] | None:
+        """Returns the data of the entries in the realm's snapshot, or
+        just those with a version larger than newer_than; or None if
+        the snapshot isn't loaded."""
+        min_version = "-inf" if newer_than is None else f"({newer_than}"
+        return READ_SCRIPT(keys=self.keys(realm_id), args=[min_version])
+
+    def read_or_load(
+        self, realm_id: int, load: Callable[[int], None], newer_than: int | None = None
+    ) -> list[bytes] | None:
+        """Like read, but loads the realm's snapshot using load if it
+        isn't loaded.  Returns None if the snapshot was cleared again
+        before we could read it; callers should then query the
+        database instead."""
+        result = self.read(realm_id, newer_than)
+        if result is None:
+            load(realm_id)
+            result = self.read(realm_id, newer_than)
+        return result
+
+    def clear(self, realm_id: int) -> None:
+        client.delete(*self.keys(realm_id))
@@ -0,0 +1,157 @@
+# Admission control for POST /register, which is by far our most
+# expensive endpoint, so that a herd of clients reconnecting at once
+# (e.g. after a deploy, or after event queues are lost) is spread out
+# over time, rather than overloading Django and PostgreSQL.
+#
+# With REGISTER_MAX_CONCURRENT set, at most that many /register
+# requests are processed at a time across the server; others are
+# rejected with a 429 whose Retry-After is jittered over a window that
+# grows with the load and the size of the realm, since a large realm's
+# clients all arrive at once.  In-flight requests are tracked in a
+# Redis sorted set, so that the limit is shared by all processes.
+#
+# Tornado also holds back web_reload_client events (see
+# scripts/reload-clients) while /register is saturated.
+import logging
+import random
+import secrets
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+
+from zerver.lib import redis_utils
+from zerver.lib.exceptions import RateLimitedError
+from zerver.lib.redis_utils import get_redis_client
+from zerver.models import Realm
+from zerver.models.users import active_user_ids
+
+logger = logging.getLogger(__name__)
+
+client = get_redis_client()
+
+# A request which was admitted this long ago is assumed to have died
+# without releasing its slot.
+REGISTER_ADMISSION_TIMEOUT_SECONDS = 60
+
+REGISTER_RETRY_MIN_SECONDS = 1
+REGISTER_RETRY_MAX_SECONDS = 60
+
+# KEYS: in-flight set, stats.  ARGV: now, timeout, limit, token.
+# Returns the number of requests in flight, negated if this one was
+# rejected.
+ACQUIRE_SCRIPT = client.register_script(
+    """
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1] - ARGV[2])
+local in_flight = redis.call("ZCARD", KEYS[1])
+if in_flight >= tonumber(ARGV[3]) then
+    redis.call("HINCRBY", KEYS[2], "rejected", 1)
+    return -in_flight
+end
+redis.call("ZADD", KEYS[1], ARGV[1], ARGV[4])
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+redis.call("HINCRBY", KEYS[2], "admitted", 1)
+return in_flight + 1
+"""
+)
+
+
+def register_in_flight_key() -> str:
+    return redis_utils.REDIS_KEY_PREFIX + "register_admission:in_flight"
+
+
+def register_stats_key() -> str:
+    return redis_utils.REDIS_KEY_PREFIX + "register_admission:stats"
+
+
+def get_register_retry_delay(in_flight: int, realm_size: int) -> float:
+    """A jittered delay before a rejected client should retry.
+
+    We assume each admitted request takes about a second; the window
+    is then roughly how long it takes to work through the current load
+    plus all of the realm's clients, so that retries are spread out
+    rather than arriving together again."""
+    window = (in_flight + realm_size) / settings.REGISTER_MAX_CONCURRENT
+    window = min(max(window, REGISTER_RETRY_MIN_SECONDS), REGISTER_RETRY_MAX_SECONDS)
+    return round(random.uniform(REGISTER_RETRY_MIN_SECONDS, window), 3)
+
+
+@contextmanager
+def register_admission(realm: Realm) -> Iterator[None]:
+    """Holds one of the REGISTER_MAX_CONCURRENT slots for /register
+    requests, or raises RateLimitedError if they're all taken.
+
+    If Redis is unavailable, requests are admitted."""
+    if settings.REGISTER_MAX_CONCURRENT <= 0:
+        yield
+        return
+
+    token = secrets.token_hex(8)
+    try:
+        in_flight = ACQUIRE_SCRIPT(
+            keys=[register_in_flight_key(), register_stats_key()],
+            args=[
+                time.time(),
+                REGISTER_ADMISSION_TIMEOUT_SECONDS,
+                settings.REGISTER_MAX_CONCURRENT,
+                token,
+            ],
+        )
+    except redis.RedisError:
+        logger.exception("Failed to check /register admission")
+        yield
+        return
+
+    if in_flight < 0:
+        raise RateLimitedError(get_register_retry_delay(-in_flight, len(active_user_ids(realm.id))))
+
+    try:
+        yield
+    finally:
+        try:
+            client.zrem(register_in_flight_key(), token)
+        except redis.RedisError:  # nocoverage
+            logger.exception("Failed to release /register admission")
+
+
+def get_register_in_flight() -> int:
+    return client.zcount(
+        register_in_flight_key(), time.time() - REGISTER_ADMISSION_TIMEOUT_SECONDS, "+inf"
+    )
+
+
+def is_register_saturated() -> bool:
+    if settings.REGISTER_MAX_CONCURRENT <= 0:
+        return False
+    try:
+        return get_register_in_flight() >= settings.REGISTER_MAX_CONCURRENT
+    except redis.RedisError:  # nocoverage
+        logger.exception("Failed to check /register load")
+        return False
+
+
+def get_register_backlog() -> dict[str, int]:
+    """The number of /register requests in flight, and how many have
+    been admitted and rejected since the counts were last reset; a
+    growing number of rejections is the backlog of clients waiting to
+    reconnect."""
+    stats = {
+        key.decode(): int(count) for key, count in client.hgetall(register_stats_key()).items()
+    }
+    return {
+        "in_flight": get_register_in_flight(),
+        "admitted": stats.get("admitted", 0),
+        "rejected": stats.get("rejected", 0),
+        "deferred_reloads": stats.get("deferred_reloads", 0),
+    }
+
+
+def record_deferred_reloads(count: int) -> None:
+    if count > 0:
+        client.hincrby(register_stats_key(), "deferred_reloads", count)
+
+
+def reset_register_backlog() -> None:
+    client.delete(register_stats_key())
@@ -0,0 +1,119 @@
+# Fetches independent sections of the /register response concurrently.
+#
+# Many sections of the response, like a user's drafts, unread messages
+# or presence data, are independent queries; with
+# REGISTER_SECTION_THREADS set, they're run on a shared, bounded pool
+# of threads, while the rest of fetch_initial_state_data runs in the
+# request's thread, so that the latency of /register tracks its
+# slowest section rather than the sum of them all.  Without it,
+# sections are computed inline.
+#
+# Each thread keeps its own persistent database connection, so the
+# pool holds at most REGISTER_SECTION_THREADS connections open;
+# close_old_connections runs around every section, as it does around
+# every request, so that CONN_MAX_AGE and health checks still apply.
+# The connections are closed when the pool is shut down.
+#
+# Since sections are fetched outside of any transaction on separate
+# connections, they may see slightly different snapshots of the
+# database; that's fine for the same reason as it is for sections
+# computed in sequence: the event queue is registered first, and
+# apply_events applies any events for changes made in the meantime.
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+executor: ThreadPoolExecutor | None = None
+# The database connections opened by the pool's threads.
+thread_connections: set[BaseDatabaseWrapper] = set()
+thread_connections_lock = threading.Lock()
+
+
+def get_register_section_executor() -> ThreadPoolExecutor:
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.REGISTER_SECTION_THREADS, thread_name_prefix="register_section"
+        )
+    return executor
+
+
+def shutdown_register_section_executor() -> None:
+    global executor
+    if executor is None:
+        return
+    executor.shutdown()
+    executor = None
+    with thread_connections_lock:
+        for thread_connection in thread_connections:
+            # The thread which owned the connection has exited.
+            thread_connection.inc_thread_sharing()
+            thread_connection.close()
+        thread_connections.clear()
+
+
+def run_in_section_thread(fetch: Callable[[], Any]) -> tuple[Any, float]:
+    with thread_connections_lock:
+        thread_connections.add(connections[DEFAULT_DB_ALIAS])
+    close_old_connections()
+    start = time.perf_counter()
+    try:
+        return fetch(), time.perf_counter() - start
+    finally:
+        close_old_connections()
+
+
+class RegisterSectionFetcher:
+    def __init__(self, state: dict[str, Any]) -> None:
+        self.state = state
+        self.pending: dict[str, tuple[Future[tuple[Any, float]], Callable[[Any], None]]] = {}
+        # Seconds spent computing each section, for the Server-Timing
+        # header in development.
+        self.timings: dict[str, float] = {}
+
+    def submit(self, key: str, fetch: Callable[[], Any]) -> None:
+        """Sets state[key] to the result of fetch() before wait()
+        returns.  fetch must not depend on the rest of the state."""
+
+        def store(value: Any) -> None:
+            self.state[key] = value
+
+        self.submit_with_store(key, fetch, store)
+
+    def submit_with_store(
+        self, name: str, fetch: Callable[[], Any], store: Callable[[Any], None]
+    ) -> None:
+        """Like submit, for sections which set several keys of the
+        state; store is called with the result of fetch(), in the
+        request's thread."""
+        if settings.REGISTER_SECTION_THREADS <= 0:
+            with self.timed(name):
+                store(fetch())
+            return
+        future = get_register_section_executor().submit(run_in_section_thread, fetch)
+        self.pending[name] = (future, store)
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def wait(self) -> None:
+        for name, (future, store) in self.pending.items():
+            value, self.timings[name] = future.result()
+            store(value)
+        self.pending = {}
+
+
+def format_server_timing(timings: dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
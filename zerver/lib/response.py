@@ -1,8 +1,9 @@
-from collections.abc import Iterator, Mapping
+import secrets
+from collections.abc import Iterable, Iterator, Mapping
 from typing import Any
 
 import orjson
-from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed
+from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
 from typing_extensions import override
 
 from zerver.lib.exceptions import JsonableError, UnauthorizedError
@@ -78,6 +79,62 @@ class MutableJsonResponse(HttpResponse):
         return iter([self.content])
 
 
+class StreamingJsonResponse(StreamingHttpResponse):
+    """A JSON response where the value of one key is a long list, whose
+    items are passed already serialized, in chunks.  The body is
+    written a chunk at a time, rather than as one large bytestring
+    containing the whole list, and is byte-identical to that of the
+    equivalent MutableJsonResponse.
+
+    Like MutableJsonResponse, the rest of the data can be modified
+    via get_data() until the response starts being written.
+
+    The chunks are only read once the status line has been sent, so
+    an exception while producing them could only truncate the body;
+    callers should pass chunks which were fully computed before the
+    view returned."""
+
+    def __init__(
+        self,
+        data: dict[str, Any],
+        *,
+        streamed_key: str,
+        streamed_chunks: Iterable[list[bytes]],
+        content_type: str,
+        status: int,
+    ) -> None:
+        # The value for streamed_key in data is only a placeholder,
+        # which determines where the list appears in the output.
+        assert streamed_key in data
+        self._data = data
+        self.streamed_key = streamed_key
+        self.streamed_chunks = streamed_chunks
+        super().__init__(self.generate_content(), content_type=content_type, status=status)
+
+    def get_data(self) -> dict[str, Any]:
+        return self._data
+
+    def generate_content(self) -> Iterator[bytes]:
+        # Serialize everything but the streamed list, with a unique
+        # placeholder for it, which we then split the output on.
+        placeholder = secrets.token_hex(16)
+        data = dict(self._data)
+        data[self.streamed_key] = placeholder
+        content = orjson.dumps(
+            data, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+        prefix, suffix = content.split(b'"' + placeholder.encode() + b'"')
+
+        yield prefix + b"["
+        first = True
+        for chunk in self.streamed_chunks:
+            if not chunk:
+                continue
+            yield (b"" if first else b",") + b",".join(chunk)
+            first = False
+        yield b"]" + suffix
+
+
 def json_unauthorized(
     message: str | None = None, www_authenticate: str | None = None
 ) -> HttpResponse:
@@ -116,6 +173,27 @@ def json_success(request: HttpRequest, data: Mapping[str, Any] = {}) -> MutableJ
     return json_response(data=data)
 
 
+def json_success_streaming(
+    request: HttpRequest,
+    data: Mapping[str, Any],
+    *,
+    streamed_key: str,
+    streamed_chunks: Iterable[list[bytes]],
+) -> StreamingJsonResponse:
+    """Like json_success, but with the list for streamed_key written
+    out from its serialized chunks; see StreamingJsonResponse."""
+    content = {"result": "success", "msg": ""}
+    content.update(data)
+
+    return StreamingJsonResponse(
+        data=content,
+        streamed_key=streamed_key,
+        streamed_chunks=streamed_chunks,
+        content_type="application/json",
+        status=200,
+    )
+
+
 def json_response_from_error(exception: JsonableError) -> MutableJsonResponse:
     """
     This should only be needed in middleware; in app code, just raise.
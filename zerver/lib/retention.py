@@ -38,8 +38,14 @@ from django.db.models import Model
 from django.utils.timezone import now as timezone_now
 from psycopg2.sql import SQL, Composable, Identifier, Literal
 
+from zerver.lib.cache import (
+    flush_accessible_user_ids_cache,
+    flush_message_window_cache,
+    flush_unread_data_cache,
+)
 from zerver.lib.logging_util import log_to_file
 from zerver.lib.request import RequestVariableConversionError
+from zerver.lib.topic_summaries import get_topics_for_message_ids, update_topic_summaries
 from zerver.models import (
     ArchivedAttachment,
     ArchivedReaction,
@@ -53,6 +59,7 @@ from zerver.models import (
     Recipient,
     Stream,
     SubMessage,
+    Subscription,
     UserMessage,
 )
 
@@ -120,6 +127,51 @@ def move_rows(
             return []
 
 
+def flush_accessible_user_ids_for_messages(msg_ids: list[int]) -> None:
+    # Which users have exchanged direct messages determines which
+    # users guests can access.
+    participants = (
+        Message.objects.filter(id__in=msg_ids, recipient__type=Recipient.PERSONAL)
+        .values_list("sender_id", "recipient__type_id")
+        .distinct()
+    )
+    flush_accessible_user_ids_cache(
+        {
+            user_id
+            for sender_id, recipient_user_id in participants
+            for user_id in (sender_id, recipient_user_id)
+        }
+    )
+
+
+def flush_caches_for_messages(msg_ids: list[int]) -> None:
+    # The messages are in the cached unread data and message windows
+    # of the users who received them, including subscribers to
+    # channels with lazy_user_messages, who may have no UserMessage
+    # rows for them, and of queries including the channels' history.
+    if settings.CACHE_UNREAD_MESSAGE_DATA or settings.CACHE_MESSAGE_WINDOWS:
+        recipient_ids = set(
+            Message.objects.filter(id__in=msg_ids).values_list("recipient_id", flat=True).distinct()
+        )
+        user_ids = set(
+            UserMessage.objects.filter(message_id__in=msg_ids)
+            .values_list("user_profile_id", flat=True)
+            .distinct()
+        )
+        user_ids.update(
+            Subscription.objects.filter(
+                recipient_id__in=Stream.objects.filter(
+                    recipient_id__in=recipient_ids, lazy_user_messages=True
+                ).values("recipient_id"),
+                active=True,
+            ).values_list("user_profile_id", flat=True)
+        )
+        flush_unread_data_cache(user_ids)
+        flush_message_window_cache(user_ids, recipient_ids)
+    if settings.CACHE_ACCESSIBLE_USER_IDS:
+        flush_accessible_user_ids_for_messages(msg_ids)
+
+
 def run_archiving(
     query: SQL,
     type: int,
@@ -152,6 +204,7 @@ def run_archiving(
                 **kwargs,
             )
             if new_chunk:
+                flush_caches_for_messages(new_chunk)
                 move_related_objects_to_archive(new_chunk)
                 delete_messages(new_chunk)
                 message_count += len(new_chunk)
@@ -323,8 +376,10 @@ def delete_messages(msg_ids: list[int]) -> None:
     # configuration), so we need to be sure we've taken care of
     # archiving the messages before doing this step.
     #
+    topics = get_topics_for_message_ids(msg_ids)
     # Uses index: zerver_message_pkey
     Message.objects.filter(id__in=msg_ids).delete()
+    update_topic_summaries(topics)
 
 
 def delete_expired_attachments(realm: Realm) -> None:
@@ -597,7 +652,9 @@ def restore_data_from_archive(archive_transaction: ArchiveTransaction) -> int:
         restore_models_with_message_key_from_archive(archive_transaction.id)
         restore_attachments_from_archive(archive_transaction.id)
         restore_attachment_messages_from_archive(archive_transaction.id)
+        update_topic_summaries(get_topics_for_message_ids(msg_ids))
 
+        flush_caches_for_messages(msg_ids)
         archive_transaction.restored = True
         archive_transaction.restored_timestamp = timezone_now()
         archive_transaction.save()
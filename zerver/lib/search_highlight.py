@@ -0,0 +1,140 @@
+# Computes the positions of search matches in messages, for
+# highlighting them in search results.
+#
+# The database only filters messages by the full-text search; rather
+# than having PostgreSQL re-parse the full content of every matching
+# row (ts_headline, or pgroonga_match_positions_character) to find the
+# matches, we find them here, for only the messages being returned.
+#
+# For PGroonga, matches are case-insensitive substring matches of the
+# keywords of the query.  For PostgreSQL's full-text search, we split
+# the text into tokens the way PostgreSQL's default parser does, and
+# match them against the lexemes of the query; the lexemes of tokens
+# are looked up in the database in a single batch, and cached.
+import re
+from collections.abc import Iterable, Sequence
+
+from django.conf import settings
+from django.db import connection
+from sqlalchemy.util import LRUCache
+
+TSEARCH_CONFIG = "zulip.english_us_search"
+SEARCH_LEXEME_CACHE_SIZE = 10000
+
+# Maps tokens to the set of lexemes PostgreSQL indexes them as (empty
+# for stop words).  Lexemes only depend on the text search
+# configuration, so this is safe to share between requests.
+search_lexeme_cache = LRUCache(SEARCH_LEXEME_CACHE_SIZE)
+
+# An approximation of the token types of PostgreSQL's default text
+# search parser which end up as lexemes with the zulip.english_us_search
+# configuration.  HTML tags and entities are skipped, as are URL
+# protocols, which aren't indexed.
+TSEARCH_TOKEN_RE = re.compile(
+    r"""
+    (?P<tag><[^>]*>)
+    | (?P<entity>&(?:\#[0-9]+|\#x[0-9a-f]+|[a-z]+);)
+    | (?P<protocol>[a-z]+://)
+    | (?P<email>[^\W_][\w.+-]*@(?:[^\W_][\w-]*\.)+[^\W\d_]+)
+    | (?P<host>(?:[^\W_][\w-]*\.)+[^\W\d_]+)
+    | (?P<number>[0-9]+(?:\.[0-9]+)+)
+    | (?P<word>[^\W_]+)
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+
+
+def escape_html(text: str) -> str:
+    """Equivalent to the escape_html function in the database, which
+    is used for escaping topic names for search."""
+    return (
+        text.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+        .replace("'", "&#39;")
+    )
+
+
+def get_pgroonga_keywords(operand: str) -> list[str]:
+    """The keywords of a PGroonga query, like pgroonga_query_extract_keywords:
+    the terms of the query, excluding the OR operator and negated terms.
+
+    Like the query itself, the operand is HTML-escaped first, so that it
+    matches the escaped content; this means that double quotes are
+    never treated as delimiting phrases."""
+    keywords = []
+    for term in escape_html(operand).split():
+        if term == "OR" or term.startswith("-"):
+            continue
+        keyword = term.lstrip("(+").rstrip(")")
+        if keyword:
+            keywords.append(keyword)
+    return keywords
+
+
+def get_pgroonga_match_positions(text: str, keywords: Sequence[str]) -> list[tuple[int, int]]:
+    if not keywords:
+        return []
+    # Prefer the longest keyword matching at a given position.
+    pattern = "|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True))
+    return [
+        (match.start(), match.end() - match.start())
+        for match in re.finditer(pattern, text, re.IGNORECASE)
+    ]
+
+
+def get_tsearch_tokens(text: str) -> list[tuple[int, int, str]]:
+    tokens = []
+    for match in TSEARCH_TOKEN_RE.finditer(text):
+        if match.lastgroup in ("tag", "entity", "protocol"):
+            continue
+        tokens.append((match.start(), match.end() - match.start(), match.group()))
+    return tokens
+
+
+def get_tsearch_lexemes(tokens: Iterable[str]) -> dict[str, frozenset[str]]:
+    lexemes: dict[str, frozenset[str]] = {}
+    missing = []
+    for token in set(tokens):
+        cached = search_lexeme_cache.get(token)
+        if cached is None:
+            missing.append(token)
+        else:
+            lexemes[token] = cached
+
+    if missing:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT token, tsvector_to_array(to_tsvector(%s, token))
+                FROM unnest(%s::text[]) AS token
+                """,
+                [TSEARCH_CONFIG, missing],
+            )
+            for token, token_lexemes in cursor.fetchall():
+                lexemes[token] = search_lexeme_cache[token] = frozenset(token_lexemes)
+    return lexemes
+
+
+def get_search_match_positions(operand: str, texts: Sequence[str]) -> list[list[tuple[int, int]]]:
+    """Returns the (offset, length) of the matches of the search operand
+    in each of the texts, which are rendered message content or
+    HTML-escaped topic names."""
+    if settings.USING_PGROONGA:
+        keywords = get_pgroonga_keywords(operand)
+        return [get_pgroonga_match_positions(text, keywords) for text in texts]
+
+    text_tokens = [get_tsearch_tokens(text) for text in texts]
+    lexemes = get_tsearch_lexemes(
+        [operand, *(token for tokens in text_tokens for _offset, _length, token in tokens)]
+    )
+    query_lexemes = lexemes[operand]
+    return [
+        [
+            (offset, length)
+            for offset, length, token in tokens
+            if not lexemes[token].isdisjoint(query_lexemes)
+        ]
+        for tokens in text_tokens
+    ]
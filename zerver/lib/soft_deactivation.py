@@ -11,6 +11,7 @@ from django.db.models import Exists, F, Max, OuterRef, QuerySet
 from django.db.models.functions import Greatest
 from django.utils.timezone import now as timezone_now
 
+from zerver.lib.cache import flush_message_window_cache, flush_unread_data_cache
 from zerver.lib.logging_util import log_to_file
 from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.user_message import bulk_insert_all_ums
@@ -154,7 +155,7 @@ def add_missing_messages(user_profile: UserProfile) -> None:
     all_stream_subs = list(
         Subscription.objects.filter(
             user_profile=user_profile, recipient__type=Recipient.STREAM
-        ).values("recipient_id", "recipient__type_id")
+        ).values("recipient_id", "recipient__type_id", "active", "lazy_start_message_id")
     )
 
     # For stream messages we need to check messages against data from
@@ -224,8 +225,20 @@ def add_missing_messages(user_profile: UserProfile) -> None:
         .values("id", "recipient__type_id")
     )
 
+    # Messages in streams with lazy_user_messages enabled are
+    # represented by the subscription's read watermark, and must not
+    # get UserMessage rows here.
+    lazy_start_message_ids = {
+        sub["recipient__type_id"]: sub["lazy_start_message_id"]
+        for sub in all_stream_subs
+        if sub["active"] and sub["lazy_start_message_id"] is not None
+    }
+
     stream_messages: defaultdict[int, list[MissingMessageDict]] = defaultdict(list)
     for msg in new_stream_msgs:
+        lazy_start_message_id = lazy_start_message_ids.get(msg["recipient__type_id"])
+        if lazy_start_message_id is not None and msg["id"] > lazy_start_message_id:
+            continue
         stream_messages[msg["recipient__type_id"]].append(
             MissingMessageDict(id=msg["id"], recipient__type_id=msg["recipient__type_id"])
         )
@@ -249,6 +262,11 @@ def add_missing_messages(user_profile: UserProfile) -> None:
             last_active_message_id=Greatest(F("last_active_message_id"), message_ids[-1])
         )
 
+    # Besides the rows added here, edits to this user's messages while
+    # they were soft-deactivated didn't invalidate the caches.
+    flush_unread_data_cache([user_profile.id])
+    flush_message_window_cache([user_profile.id])
+
 
 def do_soft_deactivate_user(user_profile: UserProfile) -> None:
     try:
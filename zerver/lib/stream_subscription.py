@@ -10,6 +10,7 @@ from django.db.models import F, Q, QuerySet
 from psycopg2 import sql
 from psycopg2.extras import execute_values
 
+from zerver.lib.cache import flush_realm_accessible_user_ids_cache
 from zerver.models import AlertWord, Recipient, Stream, Subscription, UserProfile, UserTopic
 
 
@@ -398,6 +399,7 @@ def create_stream_subscription(
 
     if user_profile.is_active:
         Stream.objects.filter(id=stream.id).update(subscriber_count=F("subscriber_count") + 1)
+    flush_realm_accessible_user_ids_cache(user_profile.realm_id)
 
 
 @transaction.atomic(savepoint=False)
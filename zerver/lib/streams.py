@@ -31,11 +31,13 @@ from zerver.lib.types import APIStreamDict, UserGroupMembersData
 from zerver.lib.user_groups import (
     UserGroupMembershipDetails,
     access_user_group_for_setting,
+    flush_recursive_membership_group_ids,
     get_group_setting_value_for_register_api,
     get_members_and_subgroups_of_groups,
     get_recursive_membership_groups,
     get_role_based_system_groups_dict,
     get_root_id_annotated_recursive_subgroups_for_groups,
+    get_user_recursive_group_ids,
     parse_group_setting_value,
     user_has_permission_for_group_setting,
 )
@@ -243,6 +245,7 @@ def get_stream_permission_default_group(
             )
             default_group.save()
             UserGroupMembership.objects.create(user_profile=creator, user_group=default_group)
+            flush_recursive_membership_group_ids()
             return default_group
         else:
             return system_groups_name_dict[SystemGroups.NOBODY]
@@ -652,9 +655,7 @@ def access_stream_for_send_message(
         # Bots can send to any stream their owner can.
         return
 
-    user_recursive_group_ids = set(
-        get_recursive_membership_groups(sender).values_list("id", flat=True)
-    )
+    user_recursive_group_ids = get_user_recursive_group_ids(sender)
 
     if (
         stream.history_public_to_subscribers
@@ -703,8 +704,8 @@ def user_has_metadata_access(
         return True
 
     if user_group_membership_details.user_recursive_group_ids is None:
-        user_group_membership_details.user_recursive_group_ids = set(
-            get_recursive_membership_groups(user_profile).values_list("id", flat=True)
+        user_group_membership_details.user_recursive_group_ids = get_user_recursive_group_ids(
+            user_profile
         )
 
     if has_metadata_access_to_channel_via_groups(
@@ -739,8 +740,8 @@ def user_has_content_access(
         return True
 
     if user_group_membership_details.user_recursive_group_ids is None:
-        user_group_membership_details.user_recursive_group_ids = set(
-            get_recursive_membership_groups(user_profile).values_list("id", flat=True)
+        user_group_membership_details.user_recursive_group_ids = get_user_recursive_group_ids(
+            user_profile
         )
 
     # This check must be after the user_profile.is_guest check, since
@@ -1270,9 +1271,7 @@ def bulk_can_remove_subscribers_from_streams(
         # All the permissions in this function have allow_everyone_group=False
         return False  # nocoverage
 
-    user_recursive_group_ids = set(
-        get_recursive_membership_groups(user_profile).values_list("id", flat=True)
-    )
+    user_recursive_group_ids = get_user_recursive_group_ids(user_profile)
 
     # We check this before basic access since for the channels the user
     # cannot access, they can unsubscribe other users if they have
@@ -1328,8 +1327,8 @@ def get_streams_to_which_user_cannot_add_subscribers(
         return []
 
     if user_group_membership_details.user_recursive_group_ids is None:
-        user_group_membership_details.user_recursive_group_ids = set(
-            get_recursive_membership_groups(user_profile).values_list("id", flat=True)
+        user_group_membership_details.user_recursive_group_ids = get_user_recursive_group_ids(
+            user_profile
         )
     if allow_default_streams:
         default_stream_ids = get_default_stream_ids_for_realm(user_profile.realm_id)
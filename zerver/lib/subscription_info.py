@@ -1,5 +1,6 @@
 import itertools
 from collections.abc import Callable, Collection, Iterable, Mapping
+from datetime import timedelta
 from operator import itemgetter
 from typing import Any, Literal
 
@@ -7,6 +8,7 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import connection
 from django.db.models import QuerySet
+from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
 from psycopg2.sql import SQL
 
@@ -42,9 +44,68 @@ from zerver.lib.user_groups import (
     get_members_and_subgroups_of_groups,
     get_recursive_membership_groups,
 )
-from zerver.models import Realm, Stream, Subscription, UserGroup, UserProfile
+from zerver.models import (
+    Realm,
+    RealmAuditLog,
+    Recipient,
+    Stream,
+    Subscription,
+    UserGroup,
+    UserProfile,
+)
+from zerver.models.realm_audit_logs import AuditLogEventType
 from zerver.models.streams import StreamTopicsPolicyEnum, get_all_streams
 
+# Audit log entries of these types change the data of only the channel
+# they were logged for.
+SUBSCRIPTION_STATE_CHANNEL_EVENT_TYPES = [
+    AuditLogEventType.SUBSCRIPTION_CREATED,
+    AuditLogEventType.SUBSCRIPTION_ACTIVATED,
+    AuditLogEventType.SUBSCRIPTION_DEACTIVATED,
+    AuditLogEventType.SUBSCRIPTION_PROPERTY_CHANGED,
+    AuditLogEventType.CHANNEL_CREATED,
+    AuditLogEventType.CHANNEL_DEACTIVATED,
+    AuditLogEventType.CHANNEL_NAME_CHANGED,
+    AuditLogEventType.CHANNEL_REACTIVATED,
+    AuditLogEventType.CHANNEL_MESSAGE_RETENTION_DAYS_CHANGED,
+    AuditLogEventType.CHANNEL_PROPERTY_CHANGED,
+    AuditLogEventType.CHANNEL_GROUP_BASED_SETTING_CHANGED,
+    AuditLogEventType.CHANNEL_FOLDER_CHANGED,
+]
+
+# Audit log entries of these types can change the data of any number
+# of channels, so clients need all of it again.
+SUBSCRIPTION_STATE_REALM_EVENT_TYPES = [
+    AuditLogEventType.USER_ACTIVATED,
+    AuditLogEventType.USER_DEACTIVATED,
+    AuditLogEventType.USER_REACTIVATED,
+    AuditLogEventType.USER_ROLE_CHANGED,
+    AuditLogEventType.USER_DELETED,
+    AuditLogEventType.USER_DELETED_PRESERVING_MESSAGES,
+    AuditLogEventType.REALM_PROPERTY_CHANGED,
+    AuditLogEventType.REALM_SCRUBBED,
+    AuditLogEventType.REALM_IMPORTED,
+    AuditLogEventType.USER_GROUP_DELETED,
+    AuditLogEventType.USER_GROUP_DIRECT_USER_MEMBERSHIP_ADDED,
+    AuditLogEventType.USER_GROUP_DIRECT_USER_MEMBERSHIP_REMOVED,
+    AuditLogEventType.USER_GROUP_DIRECT_SUBGROUP_MEMBERSHIP_ADDED,
+    AuditLogEventType.USER_GROUP_DIRECT_SUBGROUP_MEMBERSHIP_REMOVED,
+    AuditLogEventType.USER_GROUP_DIRECT_SUPERGROUP_MEMBERSHIP_ADDED,
+    AuditLogEventType.USER_GROUP_DIRECT_SUPERGROUP_MEMBERSHIP_REMOVED,
+    AuditLogEventType.USER_GROUP_DEACTIVATED,
+    AuditLogEventType.USER_GROUP_REACTIVATED,
+]
+
+# Some channel data, like its weekly traffic or whether it was recently
+# active, changes without an audit log entry, so we only serve changes
+# relative to recent versions.
+SUBSCRIPTION_STATE_VERSION_MAX_AGE = timedelta(days=1)
+
+# RealmAuditLog IDs are assigned when entries are inserted, not when
+# their transactions commit, so entries can become visible out of ID
+# order; versions therefore trail the latest entry by this long.
+SUBSCRIPTION_STATE_VERSION_SETTLE_TIME = timedelta(minutes=1)
+
 
 def get_web_public_subs(
     realm: Realm, anonymous_group_membership: dict[int, UserGroupMembersData]
@@ -789,11 +850,16 @@ def gather_subscriptions_helper(
     include_subscribers: bool | Literal["partial"] = True,
     include_archived_channels: bool = False,
     anonymous_group_membership: dict[int, UserGroupMembersData] | None = None,
+    stream_ids: Collection[int] | None = None,
 ) -> SubscriptionInfo:
+    """If stream_ids is given, only the data for those channels is
+    gathered; see get_changed_subscription_stream_ids."""
     realm = user_profile.realm
     all_streams = get_all_streams(
         realm, include_archived_channels=include_archived_channels
     ).select_related("can_send_message_group", "can_send_message_group__named_user_group")
+    if stream_ids is not None:
+        all_streams = all_streams.filter(id__in=stream_ids)
 
     all_stream_dicts = all_streams.values(
         *Stream.API_FIELDS,
@@ -827,15 +893,16 @@ def gather_subscriptions_helper(
         ).values_list("id", flat=True)
         anonymous_group_membership = get_members_and_subgroups_of_groups(set(anonymous_group_ids))
 
-    sub_dicts_query: Iterable[RawSubscriptionDict] = (
-        get_stream_subscriptions_for_user(user_profile)
-        .values(
-            *Subscription.API_FIELDS,
-            "recipient_id",
-            "active",
+    subscriptions_query = get_stream_subscriptions_for_user(user_profile)
+    if stream_ids is not None:
+        subscriptions_query = subscriptions_query.filter(
+            recipient_id__in=list(recip_id_to_stream_id)
         )
-        .order_by("recipient_id")
-    )
+    sub_dicts_query: Iterable[RawSubscriptionDict] = subscriptions_query.values(
+        *Subscription.API_FIELDS,
+        "recipient_id",
+        "active",
+    ).order_by("recipient_id")
 
     # We only care about subscriptions for active streams.
     sub_dicts: list[RawSubscriptionDict] = [
@@ -1005,3 +1072,124 @@ def gather_subscriptions(
     subscribed = helper_result.subscriptions
     unsubscribed = helper_result.unsubscribed
     return (subscribed, unsubscribed)
+
+
+def get_subscription_state_version(realm: Realm) -> int:
+    """The version of the realm's channel and subscription data which
+    clients can pass to POST /register as subscription_state_version,
+    to only fetch the channels which changed since.
+
+    This is the latest entry logged over
+    SUBSCRIPTION_STATE_VERSION_SETTLE_TIME ago, rather than the latest
+    entry, since an entry with a smaller ID than the latest one may
+    still be committed after we read it; using the latest ID would
+    skip it forever.  Deltas from the version thus include the last
+    few changes again, and can only miss entries from transactions
+    which take longer than that to commit."""
+    # Uses index: zerver_realmauditlog_realm_id
+    return (
+        RealmAuditLog.objects.filter(
+            realm=realm, event_time__lt=timezone_now() - SUBSCRIPTION_STATE_VERSION_SETTLE_TIME
+        )
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    ) or 0
+
+
+def get_changed_subscription_stream_ids(realm: Realm, version: int) -> set[int] | None:
+    """The IDs of the channels whose data, or the user's subscriptions
+    to which, may have changed since the given version, as tracked by
+    the RealmAuditLog entries logged since.
+
+    Returns None if the version can't be used, and clients need all of
+    the data again: if it's too old, or if there were changes which can
+    affect any number of channels, like users being deactivated (which
+    removes them from subscriber lists) or changes to group membership
+    (which can change which channels a user can access)."""
+    version_time = (
+        RealmAuditLog.objects.filter(realm=realm, id=version)
+        .values_list("event_time", flat=True)
+        .first()
+    )
+    if version_time is None or version_time < timezone_now() - SUBSCRIPTION_STATE_VERSION_MAX_AGE:
+        return None
+
+    changed_stream_ids: set[int] = set()
+    # Uses index: zerver_realmauditlog_realm_id
+    for event_type, stream_id in (
+        RealmAuditLog.objects.filter(
+            realm=realm,
+            id__gt=version,
+            event_type__in=SUBSCRIPTION_STATE_CHANNEL_EVENT_TYPES
+            + SUBSCRIPTION_STATE_REALM_EVENT_TYPES,
+        )
+        .values_list("event_type", "modified_stream_id")
+        .distinct()
+    ):
+        if event_type in SUBSCRIPTION_STATE_REALM_EVENT_TYPES:
+            return None
+        if stream_id is not None:
+            changed_stream_ids.add(stream_id)
+    return changed_stream_ids
+
+
+def get_removed_subscription_stream_ids(
+    user_profile: UserProfile, version: int, stream_ids: set[int]
+) -> list[int]:
+    """Of the given channels, which changed since the version but
+    which the user can no longer see, the ones which the user may have
+    been able to see at that version, so that clients can remove them.
+
+    We don't list the others, which would reveal the IDs of private
+    channels the user never had access to.  Changes to the user's role
+    or groups make the version unusable, so a user may have been able
+    to see a channel if they're an administrator, if they were ever
+    subscribed to it, or, unless they're a guest, if it was public at
+    that version."""
+    if not stream_ids:
+        return []
+    if user_profile.is_realm_admin:
+        return sorted(stream_ids)
+
+    known_stream_ids = set(
+        Subscription.objects.filter(
+            user_profile=user_profile,
+            recipient__type=Recipient.STREAM,
+            recipient__type_id__in=stream_ids,
+        ).values_list("recipient__type_id", flat=True)
+    )
+    if not user_profile.is_guest:
+        was_public = {
+            stream_id: not invite_only
+            for stream_id, invite_only in Stream.objects.filter(id__in=stream_ids).values_list(
+                "id", "invite_only"
+            )
+        }
+        # Going back from the latest change, so that the earliest
+        # change since the version determines its value then.
+        for stream_id, extra_data in (
+            RealmAuditLog.objects.filter(
+                realm_id=user_profile.realm_id,
+                id__gt=version,
+                event_type=AuditLogEventType.CHANNEL_PROPERTY_CHANGED,
+                modified_stream_id__in=stream_ids,
+                extra_data__property="invite_only",
+            )
+            .order_by("-id")
+            .values_list("modified_stream_id", "extra_data")
+        ):
+            was_public[stream_id] = not extra_data[RealmAuditLog.OLD_VALUE]
+        known_stream_ids |= {stream_id for stream_id, public in was_public.items() if public}
+    return sorted(known_stream_ids)
+
+
+def delta_encode_user_ids(user_ids: Iterable[int]) -> list[int]:
+    """Sorts the user IDs, and replaces each one after the first with
+    its difference from the previous one; since subscriber lists are
+    usually dense in the realm's user IDs, this is much smaller in JSON."""
+    sorted_user_ids = sorted(user_ids)
+    return [
+        user_id - previous_user_id
+        for previous_user_id, user_id in itertools.pairwise([0, *sorted_user_ids])
+    ]
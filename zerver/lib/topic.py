@@ -1,3 +1,4 @@
+import logging
 from collections.abc import Callable
 from datetime import datetime
 from typing import Any
@@ -11,7 +12,9 @@ from django.utils.translation import override as override_language
 
 from zerver.lib.types import EditHistoryEvent, StreamMessageEditRequest
 from zerver.lib.utils import assert_is_not_none
-from zerver.models import Message, Reaction, UserMessage, UserProfile
+from zerver.models import Message, Reaction, TopicSummary, UserMessage, UserProfile
+
+logger = logging.getLogger(__name__)
 
 # Only use these constants for events.
 ORIG_TOPIC = "orig_subject"
@@ -22,6 +25,9 @@ MATCH_TOPIC = "match_subject"
 # Prefix use to mark topic as resolved.
 RESOLVED_TOPIC_PREFIX = "✔ "
 
+# The number of messages updated per statement when moving a topic.
+MESSAGE_MOVE_BATCH_SIZE = 1000
+
 # This constant is pretty closely coupled to the
 # database, but it's the JSON field.
 EXPORT_TOPIC_NAME = "subject"
@@ -159,7 +165,7 @@ def update_messages_for_topic_edit(
     message_edit_request: StreamMessageEditRequest,
     edit_history_event: EditHistoryEvent,
     last_edit_time: datetime,
-) -> tuple[QuerySet[Message], Callable[[], QuerySet[Message]]]:
+) -> tuple[QuerySet[Message], Callable[[list[int]], None]]:
     # Uses index: zerver_message_realm_recipient_upper_subject
     old_stream = message_edit_request.orig_stream
     messages = Message.objects.filter(
@@ -224,18 +230,31 @@ def update_messages_for_topic_edit(
     if message_edit_request.is_topic_edited:
         update_fields["subject"] = message_edit_request.target_topic_name
 
-    # The update will cause the 'messages' query to no longer match
-    # any rows; we capture the set of matching ids first, do the
-    # update, and then return a fresh collection -- so we know their
-    # metadata has been updated for the UPDATE command, and the caller
-    # can update the remote cache with that.
-    message_ids = [edited_message.id, *messages.values_list("id", flat=True)]
-
-    def propagate() -> QuerySet[Message]:
-        messages.update(**update_fields)
-        return Message.objects.filter(id__in=message_ids).select_related(
-            *Message.DEFAULT_SELECT_RELATED
-        )
+    def propagate(changed_message_ids: list[int]) -> None:
+        # Moving a large topic can update tens of thousands of
+        # messages.  We do so in batches, in ID order, so that each
+        # UPDATE statement stays small and row locks are always
+        # acquired in a consistent order.
+        #
+        # All of the batches run in the caller's transaction, so the
+        # move remains atomic: the UserMessage, attachment and topic
+        # summary changes, and the update_message event, all describe
+        # the complete move, and committing batches separately would
+        # expose a half-moved topic to other users.
+        #
+        # The caller has already fetched the IDs of the messages to
+        # move (which include the edited message, saved separately).
+        message_ids = sorted(set(changed_message_ids) - {edited_message.id})
+        for i in range(0, len(message_ids), MESSAGE_MOVE_BATCH_SIZE):
+            batch = message_ids[i : i + MESSAGE_MOVE_BATCH_SIZE]
+            Message.objects.filter(id__in=batch).update(**update_fields)
+            if len(message_ids) > MESSAGE_MOVE_BATCH_SIZE:
+                logger.info(
+                    "Moved %s/%s messages from message %s's topic",
+                    i + len(batch),
+                    len(message_ids),
+                    edited_message.id,
+                )
 
     return messages, propagate
 
@@ -270,29 +289,15 @@ def get_topic_history_for_public_stream(
     recipient_id: int,
     allow_empty_topic_name: bool,
 ) -> list[dict[str, Any]]:
-    cursor = connection.cursor()
-    # Uses index: zerver_message_realm_recipient_subject
-    # Note that this is *case-sensitive*, so that we can display the
+    # The summaries are *case-sensitive*, so that we can display the
     # most recently-used case (in generate_topic_history_from_db_rows)
-    query = """
-    SELECT
-        "zerver_message"."subject" as topic,
-        max("zerver_message".id) as max_message_id
-    FROM "zerver_message"
-    WHERE (
-        "zerver_message"."realm_id" = %s AND
-        "zerver_message"."recipient_id" = %s AND
-        "zerver_message"."is_channel_message"
-    )
-    GROUP BY (
-        "zerver_message"."subject"
+    #
+    # Uses index: zerver_topicsummary_recipient_topic_name_uniq
+    rows = list(
+        TopicSummary.objects.filter(realm_id=realm_id, recipient_id=recipient_id).values_list(
+            "topic_name", "max_message_id"
+        )
     )
-    ORDER BY max("zerver_message".id) DESC
-    """
-    cursor.execute(query, [realm_id, recipient_id])
-    rows = cursor.fetchall()
-    cursor.close()
-
     return generate_topic_history_from_db_rows(rows, allow_empty_topic_name)
 
 
@@ -0,0 +1,150 @@
+# Maintains the TopicSummary table, which the topic history of channels
+# with public history is read from.
+#
+# Sending messages only ever adds to a topic, so new messages are
+# counted in with a single upsert.  Moves, deletions and restorations
+# can change the latest message or remove topics entirely, so for
+# those we recompute the affected topics from zerver_message, which is
+# cheap per topic (using the zerver_message_realm_recipient_upper_subject
+# index); since topic moves are case-insensitive, we recompute all of
+# the casings of each affected topic name.
+from collections import defaultdict
+from collections.abc import Iterable
+
+from django.db import connection
+from psycopg2.sql import SQL
+
+from zerver.models import Message
+
+# (realm_id, recipient_id, topic_name)
+TopicKey = tuple[int, int, str]
+
+
+def increment_topic_summaries(messages: Iterable[Message]) -> None:
+    """Counts newly sent messages in the summaries of their topics."""
+    counts: dict[TopicKey, list[int]] = defaultdict(lambda: [0, 0])
+    for message in messages:
+        if not message.is_channel_message:
+            continue
+        summary = counts[(message.realm_id, message.recipient_id, message.topic_name())]
+        summary[0] = max(summary[0], message.id)
+        summary[1] += 1
+    if not counts:
+        return
+
+    # Sorting the rows makes concurrent sends lock the rows they share
+    # in the same order.
+    keys = sorted(counts)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO zerver_topicsummary
+                (realm_id, recipient_id, topic_name, max_message_id, message_count)
+            SELECT * FROM unnest(%s::integer[], %s::integer[], %s::text[], %s::integer[], %s::integer[])
+            ON CONFLICT (recipient_id, topic_name) DO UPDATE SET
+                max_message_id = GREATEST(
+                    zerver_topicsummary.max_message_id, EXCLUDED.max_message_id
+                ),
+                message_count = zerver_topicsummary.message_count + EXCLUDED.message_count
+            """,
+            [
+                [realm_id for realm_id, _recipient_id, _topic_name in keys],
+                [recipient_id for _realm_id, recipient_id, _topic_name in keys],
+                [topic_name for _realm_id, _recipient_id, topic_name in keys],
+                [counts[key][0] for key in keys],
+                [counts[key][1] for key in keys],
+            ],
+        )
+
+
+def get_topics_for_message_ids(message_ids: Iterable[int]) -> set[TopicKey]:
+    return set(
+        # Uses index: zerver_message_pkey
+        Message.objects.filter(id__in=list(message_ids), is_channel_message=True)
+        .values_list("realm_id", "recipient_id", "subject")
+        .distinct()
+    )
+
+
+def update_topic_summaries(topics: Iterable[TopicKey]) -> None:
+    """Recomputes the summaries of the given topics, after their
+    messages were moved, deleted, or restored."""
+    keys = sorted(topics)
+    if not keys:
+        return
+
+    params = [
+        [realm_id for realm_id, _recipient_id, _topic_name in keys],
+        [recipient_id for _realm_id, recipient_id, _topic_name in keys],
+        [topic_name for _realm_id, _recipient_id, topic_name in keys],
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM zerver_topicsummary
+            USING unnest(%s::integer[], %s::integer[], %s::text[])
+                AS affected (realm_id, recipient_id, topic_name)
+            WHERE zerver_topicsummary.recipient_id = affected.recipient_id
+            AND upper(zerver_topicsummary.topic_name) = upper(affected.topic_name)
+            """,
+            params,
+        )
+        # Uses index: zerver_message_realm_recipient_upper_subject
+        cursor.execute(
+            """
+            INSERT INTO zerver_topicsummary
+                (realm_id, recipient_id, topic_name, max_message_id, message_count)
+            SELECT zerver_message.realm_id, zerver_message.recipient_id, zerver_message.subject,
+                max(zerver_message.id), count(*)
+            FROM (
+                SELECT DISTINCT realm_id, recipient_id, upper(topic_name) AS upper_topic_name
+                FROM unnest(%s::integer[], %s::integer[], %s::text[])
+                    AS affected (realm_id, recipient_id, topic_name)
+            ) AS affected
+            INNER JOIN zerver_message ON (
+                zerver_message.realm_id = affected.realm_id
+                AND zerver_message.recipient_id = affected.recipient_id
+                AND upper(zerver_message.subject) = affected.upper_topic_name
+            )
+            WHERE zerver_message.is_channel_message
+            GROUP BY zerver_message.realm_id, zerver_message.recipient_id, zerver_message.subject
+            ON CONFLICT (recipient_id, topic_name) DO UPDATE SET
+                max_message_id = EXCLUDED.max_message_id,
+                message_count = EXCLUDED.message_count
+            """,
+            params,
+        )
+
+
+def rebuild_topic_summaries(realm_id: int, recipient_id: int | None = None) -> None:
+    """Recomputes the summaries of all of the topics in a realm, or in
+    just one of its channels."""
+    recipient_clause = SQL("")
+    params: list[int] = [realm_id]
+    if recipient_id is not None:
+        recipient_clause = SQL("AND recipient_id = %s")
+        params.append(recipient_id)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            SQL("DELETE FROM zerver_topicsummary WHERE realm_id = %s {recipient_clause}").format(
+                recipient_clause=recipient_clause
+            ),
+            params,
+        )
+        cursor.execute(
+            SQL(
+                """
+            INSERT INTO zerver_topicsummary
+                (realm_id, recipient_id, topic_name, max_message_id, message_count)
+            SELECT realm_id, recipient_id, subject, max(id), count(*)
+            FROM zerver_message
+            WHERE realm_id = %s {recipient_clause} AND is_channel_message
+            GROUP BY realm_id, recipient_id, subject
+            ON CONFLICT (recipient_id, topic_name) DO UPDATE SET
+                max_message_id = EXCLUDED.max_message_id,
+                message_count = EXCLUDED.message_count
+            """
+            ).format(recipient_clause=recipient_clause),
+            params,
+        )
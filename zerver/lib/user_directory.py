@@ -0,0 +1,245 @@
+# A Redis-backed directory of each realm's users, pre-formatted for the
+# API, which get_users_for_api serves GET /users and /register from
+# when REALM_USER_DIRECTORY is enabled, so that fetching every user in
+# a realm with 100,000s of users doesn't format all of them each time.
+# UserProfile and CustomProfileFieldValue remain the source of truth.
+#
+# The directory is a RedisSnapshot (see zerver.lib.redis_snapshot) of
+# each realm's users' entries: their API dict, formatted for a
+# logged-in user, along with the data needed to adjust the few fields
+# which depend on who is asking (delivery_email and avatar_url).  An
+# empty entry is a user who was deleted.
+#
+# Changes to users are patched into the directory after their
+# transaction commits, by reformatting just the changed users.  Each
+# write takes a new version from a per-realm counter before reading
+# the database, so a write which read older data than another always
+# loses to it, regardless of the order in which they reach Redis.
+#
+# Changes which affect many users, like removing a custom profile
+# field, clear the realm's directory instead, which is then loaded
+# again on the next read.
+import logging
+from typing import Any
+
+import orjson
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from zerver.lib import redis_utils
+from zerver.lib.avatar import get_avatar_field
+from zerver.lib.cache import realm_user_dict_fields
+from zerver.lib.redis_snapshot import RedisSnapshot
+from zerver.lib.redis_utils import get_redis_client
+from zerver.lib.timezone import canonicalize_timezone
+from zerver.lib.types import RawUserDict
+from zerver.lib.users import (
+    APIUserDict,
+    can_access_delivery_email,
+    check_user_can_access_all_users,
+    format_user_row,
+    get_accessible_user_ids,
+    get_custom_profile_field_values,
+    get_data_for_inaccessible_user,
+)
+from zerver.models import CustomProfileFieldValue, Realm, UserProfile
+
+logger = logging.getLogger(__name__)
+
+client = get_redis_client()
+
+# Realms whose directory isn't changed for this long are evicted, and
+# will be loaded again from the database.
+USER_DIRECTORY_EXPIRY_SECONDS = 7 * 24 * 3600
+
+user_directory = RedisSnapshot("user_directory", USER_DIRECTORY_EXPIRY_SECONDS)
+
+
+def user_directory_version_key(realm_id: int) -> str:
+    return f"{redis_utils.REDIS_KEY_PREFIX}user_directory:{realm_id}:version"
+
+
+def encode_user_directory_entry(
+    realm_id: int, row: RawUserDict, custom_profile_field_data: dict[str, Any] | None
+) -> bytes:
+    # format_user_row formats users for spectators when there's no
+    # acting user; entries are for logged-in users, who also see
+    # users' time zones, and more precise join dates.
+    user = format_user_row(
+        realm_id,
+        acting_user=None,
+        row=row,
+        client_gravatar=False,
+        user_avatar_url_field_optional=True,
+        custom_profile_field_data=None if row["is_bot"] else custom_profile_field_data or {},
+    )
+    user["timezone"] = canonicalize_timezone(row["timezone"])
+    user["date_joined"] = row["date_joined"].isoformat(timespec="minutes")
+    user.pop("avatar_url", None)
+    avatar_urls = [
+        get_avatar_field(
+            user_id=row["id"],
+            realm_id=realm_id,
+            email=row["delivery_email"],
+            avatar_source=row["avatar_source"],
+            avatar_version=row["avatar_version"],
+            medium=False,
+            client_gravatar=client_gravatar,
+        )
+        for client_gravatar in (False, True)
+    ]
+    return orjson.dumps(
+        [
+            user,
+            *avatar_urls,
+            row["delivery_email"],
+            row["email_address_visibility"],
+            row["long_term_idle"],
+        ]
+    )
+
+
+def format_user_directory_entries(realm_id: int, user_ids: list[int] | None) -> dict[int, bytes]:
+    users = UserProfile.objects.filter(realm_id=realm_id)
+    custom_profile_field_values = CustomProfileFieldValue.objects.select_related("field").filter(
+        field__realm_id=realm_id
+    )
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+        custom_profile_field_values = custom_profile_field_values.filter(
+            user_profile_id__in=user_ids
+        )
+    profiles_by_user_id = get_custom_profile_field_values(custom_profile_field_values)
+    return {
+        row["id"]: encode_user_directory_entry(realm_id, row, profiles_by_user_id.get(row["id"]))
+        for row in users.values(*realm_user_dict_fields).iterator()
+    }
+
+
+def next_user_directory_version(realm_id: int) -> int:
+    version_key = user_directory_version_key(realm_id)
+    version = client.incr(version_key)
+    client.expire(version_key, USER_DIRECTORY_EXPIRY_SECONDS)
+    return version
+
+
+def load_user_directory(realm_id: int) -> None:
+    # Marks the directory as loading first, so that any changes
+    # committed after the database read below are written to it.
+    version = next_user_directory_version(realm_id)
+    user_directory.write(realm_id, [], state="loading")
+    entries = format_user_directory_entries(realm_id, None)
+    user_directory.write(
+        realm_id,
+        ((user_id, version, entry) for user_id, entry in entries.items()),
+        state="loaded",
+    )
+
+
+def update_user_directory_entries(realm_id: int, user_ids: list[int]) -> None:
+    try:
+        version = next_user_directory_version(realm_id)
+        entries = format_user_directory_entries(realm_id, user_ids)
+        user_directory.write(
+            realm_id, ((user_id, version, entries.get(user_id, b"")) for user_id in user_ids)
+        )
+    except redis.RedisError:
+        # The directory may now be missing this change, so make the
+        # next read reload it from the database.
+        logger.exception("Failed to update user directory for realm %s", realm_id)
+        clear_user_directory(realm_id)
+
+
+def flush_user_directory_entries(realm_id: int, user_ids: list[int]) -> None:
+    """Patches the given users' entries in the realm's directory, once
+    the current transaction commits."""
+    if settings.REALM_USER_DIRECTORY:
+        transaction.on_commit(lambda: update_user_directory_entries(realm_id, user_ids))
+
+
+def flush_user_directory(realm_id: int) -> None:
+    """Clears the realm's directory, once the current transaction
+    commits; for changes which affect many of its users."""
+    if settings.REALM_USER_DIRECTORY:
+        transaction.on_commit(lambda: clear_user_directory(realm_id))
+
+
+def clear_user_directory(realm_id: int) -> None:
+    try:
+        user_directory.clear(realm_id)
+    except redis.RedisError:  # nocoverage
+        logger.exception("Failed to clear user directory for realm %s", realm_id)
+
+
+def get_user_directory_entries(realm_id: int) -> list[list[Any]] | None:
+    """Returns the entries for all of the users in the realm, loading
+    its directory from the database if necessary; or None if it was
+    cleared again before we could read it."""
+    result = user_directory.read_or_load(realm_id, load_user_directory)
+    if result is None:
+        return None
+    return [orjson.loads(entry) for entry in result if entry]
+
+
+def get_users_from_directory(
+    realm: Realm,
+    acting_user: UserProfile,
+    *,
+    client_gravatar: bool,
+    user_avatar_url_field_optional: bool,
+    include_custom_profile_fields: bool,
+    user_list_incomplete: bool,
+) -> dict[int, APIUserDict] | None:
+    """Equivalent to get_users_for_api for all of the users in the
+    realm, for a logged-in acting user; or None if the directory
+    couldn't be read, in which case the caller should query the
+    database instead."""
+    try:
+        entries = get_user_directory_entries(realm.id)
+    except redis.RedisError:
+        logger.exception("Failed to read user directory for realm %s", realm.id)
+        return None
+    if entries is None:
+        return None
+
+    accessible_user_ids: set[int] | None = None
+    if not check_user_can_access_all_users(acting_user):
+        accessible_user_ids = set(
+            get_accessible_user_ids(realm, acting_user, include_deactivated_users=True)
+        )
+
+    result: dict[int, APIUserDict] = {}
+    for (
+        user,
+        avatar_url,
+        gravatar_avatar_url,
+        delivery_email,
+        email_address_visibility,
+        long_term_idle,
+    ) in entries:
+        user_id = user["user_id"]
+        if (
+            accessible_user_ids is not None
+            and user_id not in accessible_user_ids
+            and not user["is_bot"]
+        ):
+            if not user_list_incomplete:
+                result[user_id] = get_data_for_inaccessible_user(realm, user_id)
+            continue
+
+        if can_access_delivery_email(acting_user, user_id, email_address_visibility):
+            user["delivery_email"] = delivery_email
+        if not user_avatar_url_field_optional or not long_term_idle:
+            if (
+                client_gravatar
+                and email_address_visibility == UserProfile.EMAIL_ADDRESS_VISIBILITY_EVERYONE
+            ):
+                user["avatar_url"] = gravatar_avatar_url
+            else:
+                user["avatar_url"] = avatar_url
+        if not include_custom_profile_fields:
+            user.pop("profile_data", None)
+        result[user_id] = user
+
+    return result
@@ -3,6 +3,7 @@ from contextlib import contextmanager
 from dataclasses import asdict, dataclass
 from typing import Any, TypedDict
 
+from django.conf import settings
 from django.db import connection, transaction
 from django.db.models import F, Q, QuerySet, Value
 from django.utils.timezone import now as timezone_now
@@ -16,6 +17,11 @@ from zerver.lib.exceptions import (
     PreviousSettingValueMismatchedError,
     SystemGroupRequiredError,
 )
+from zerver.lib.per_request_cache import (
+    flush_per_request_cache,
+    get_per_request_cache_hits,
+    return_same_value_during_entire_request,
+)
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.types import (
     GroupPermissionSetting,
@@ -28,6 +34,7 @@ from zerver.models import (
     NamedUserGroup,
     Realm,
     RealmAuditLog,
+    RecursiveGroupGroupMembership,
     Stream,
     UserGroup,
     UserGroupMembership,
@@ -461,6 +468,7 @@ def update_or_create_user_group_for_setting(
             raise JsonableError(_("Insufficient permission"))  # nocoverage
 
     user_group.direct_subgroups.set(group_ids_found)
+    flush_recursive_membership_group_ids()
 
     return user_group
 
@@ -777,31 +785,38 @@ def get_direct_memberships_of_users(user_group: UserGroup, members: list[UserPro
     )
 
 
-# These recursive lookups use standard PostgreSQL common table
-# expression (CTE) queries. These queries use the django-cte library,
-# because upstream Django does not yet support CTE.
+# These recursive lookups read RecursiveGroupGroupMembership, the
+# transitive closure of GroupGroupMembership, which is maintained by
+# database triggers (see migration 0760), so that each of them is a
+# single indexed lookup rather than a recursive query.
 #
-# https://www.postgresql.org/docs/current/queries-with.html
-# https://pypi.org/project/django-cte/
-# https://code.djangoproject.com/ticket/28919
+# The groups themselves aren't in the closure, so they're combined
+# with it using a UNION; PostgreSQL can't use an index for an OR of
+# id IN (...) with a subquery, and would scan all of zerver_usergroup.
 
 
 def get_recursive_subgroups_union_for_groups(user_group_ids: list[int]) -> QuerySet[UserGroup]:
-    cte = CTE.recursive(
-        lambda cte: UserGroup.objects.filter(id__in=user_group_ids)
+    cte = CTE(
+        UserGroup.objects.filter(id__in=user_group_ids)
         .values(group_id=F("id"))
         .union(
-            cte.join(NamedUserGroup, direct_supergroups=cte.col.group_id).values(group_id=F("id"))
+            RecursiveGroupGroupMembership.objects.filter(supergroup_id__in=user_group_ids).values(
+                group_id=F("subgroup_id")
+            )
         )
     )
     return with_cte(cte, select=cte.join(UserGroup, id=cte.col.group_id))
 
 
 def get_recursive_supergroups_union_for_groups(user_group_ids: list[int]) -> QuerySet[UserGroup]:
-    cte = CTE.recursive(
-        lambda cte: UserGroup.objects.filter(id__in=user_group_ids)
+    cte = CTE(
+        UserGroup.objects.filter(id__in=user_group_ids)
         .values(group_id=F("id"))
-        .union(cte.join(UserGroup, direct_subgroups=cte.col.group_id).values(group_id=F("id")))
+        .union(
+            RecursiveGroupGroupMembership.objects.filter(subgroup_id__in=user_group_ids).values(
+                group_id=F("supergroup_id")
+            )
+        )
     )
     return with_cte(cte, select=cte.join(UserGroup, id=cte.col.group_id))
 
@@ -813,15 +828,11 @@ def get_recursive_subgroups(user_group_id: int) -> QuerySet[UserGroup]:
 def get_recursive_strict_subgroups(user_group: UserGroup) -> QuerySet[NamedUserGroup]:
     # Same as get_recursive_subgroups but does not include the
     # user_group passed.
-    direct_subgroup_ids = user_group.direct_subgroups.all().values("id")
-    cte = CTE.recursive(
-        lambda cte: NamedUserGroup.objects.filter(id__in=direct_subgroup_ids)
-        .values(group_id=F("id"))
-        .union(
-            cte.join(NamedUserGroup, direct_supergroups=cte.col.group_id).values(group_id=F("id"))
+    return NamedUserGroup.objects.filter(
+        id__in=RecursiveGroupGroupMembership.objects.filter(supergroup_id=user_group.id).values(
+            "subgroup_id"
         )
     )
-    return with_cte(cte, select=cte.join(NamedUserGroup, id=cte.col.group_id))
 
 
 def get_recursive_group_members(user_group_id: int) -> QuerySet[UserProfile]:
@@ -837,15 +848,48 @@ def get_recursive_group_members_union_for_groups(
     ).distinct()
 
 
-def get_recursive_membership_groups(user_profile: UserProfile) -> QuerySet[UserGroup]:
-    cte = CTE.recursive(
-        lambda cte: user_profile.direct_groups.values(group_id=F("id")).union(
-            cte.join(UserGroup, direct_subgroups=cte.col.group_id).values(group_id=F("id"))
+def get_recursive_membership_group_ids_query(
+    user_id: int,
+) -> QuerySet[UserGroupMembership, dict[str, Any]]:
+    return (
+        UserGroupMembership.objects.filter(user_profile_id=user_id)
+        .values(group_id=F("user_group_id"))
+        .union(
+            RecursiveGroupGroupMembership.objects.filter(subgroup__direct_members=user_id).values(
+                group_id=F("supergroup_id")
+            )
         )
     )
+
+
+def get_recursive_membership_groups(user_profile: UserProfile) -> QuerySet[UserGroup]:
+    cte = CTE(get_recursive_membership_group_ids_query(user_profile.id))
     return with_cte(cte, select=cte.join(UserGroup, id=cte.col.group_id))
 
 
+@return_same_value_during_entire_request
+def get_recursive_membership_group_ids(user_id: int) -> frozenset[int]:
+    return frozenset(row["group_id"] for row in get_recursive_membership_group_ids_query(user_id))
+
+
+def get_user_recursive_group_ids(user_profile: UserProfile) -> set[int]:
+    if settings.PER_REQUEST_GROUP_MEMBERSHIP_CACHE:
+        return set(get_recursive_membership_group_ids(user_profile.id))
+    return set(get_recursive_membership_groups(user_profile).values_list("id", flat=True))
+
+
+def get_group_membership_cache_hits() -> int:
+    """The number of queries saved by get_recursive_membership_group_ids
+    so far in this process."""
+    return get_per_request_cache_hits("get_recursive_membership_group_ids")
+
+
+def flush_recursive_membership_group_ids() -> None:
+    """Must be called whenever group memberships change, so that
+    permission checks later in the same request see the change."""
+    flush_per_request_cache("get_recursive_membership_group_ids")
+
+
 def user_has_permission_for_group_setting(
     user_group_id: int,
     user: UserProfile,
@@ -871,6 +915,13 @@ def is_user_in_group(
     if direct_member_only:
         return is_any_user_direct_member(user_group_id, [user.id])
 
+    if settings.PER_REQUEST_GROUP_MEMBERSHIP_CACHE:
+        # A single request tends to check many group-based settings
+        # for the same user, so we load all of the user's groups once.
+        # The user is the one we were passed, which for the acting
+        # user of a request is always current.
+        return user.is_active and user_group_id in get_recursive_membership_group_ids(user.id)
+
     return get_recursive_group_members(user_group_id=user_group_id).filter(id=user.id).exists()
 
 
@@ -906,15 +957,17 @@ def get_subgroup_ids(user_group: UserGroup, *, direct_subgroup_only: bool = Fals
 def get_recursive_subgroups_for_groups(
     user_group_ids: Iterable[int], realm: Realm
 ) -> QuerySet[NamedUserGroup]:
-    cte = CTE.recursive(
-        lambda cte: NamedUserGroup.objects.filter(id__in=user_group_ids, realm_for_sharding=realm)
+    user_group_ids = list(user_group_ids)
+    cte = CTE(
+        NamedUserGroup.objects.filter(id__in=user_group_ids, realm_for_sharding=realm)
         .values(group_id=F("id"))
         .union(
-            cte.join(NamedUserGroup, direct_supergroups=cte.col.group_id).values(group_id=F("id"))
+            RecursiveGroupGroupMembership.objects.filter(
+                supergroup_id__in=user_group_ids, subgroup__realm_for_sharding=realm
+            ).values(group_id=F("subgroup_id"))
         )
     )
-    recursive_subgroups = with_cte(cte, select=cte.join(NamedUserGroup, id=cte.col.group_id))
-    return recursive_subgroups
+    return with_cte(cte, select=cte.join(NamedUserGroup, id=cte.col.group_id))
 
 
 def get_root_id_annotated_recursive_subgroups_for_groups(
@@ -922,14 +975,14 @@ def get_root_id_annotated_recursive_subgroups_for_groups(
 ) -> QuerySet[UserGroup]:
     # Same as get_recursive_subgroups_for_groups but keeps track of
     # each group root_id and annotates it with that group.
-
-    cte = CTE.recursive(
-        lambda cte: UserGroup.objects.filter(id__in=user_group_ids, realm=realm_id)
+    user_group_ids = list(user_group_ids)
+    cte = CTE(
+        UserGroup.objects.filter(id__in=user_group_ids, realm=realm_id)
         .values(group_id=F("id"), root_id=F("id"))
         .union(
-            cte.join(NamedUserGroup, direct_supergroups=cte.col.group_id).values(
-                group_id=F("id"), root_id=cte.col.root_id
-            )
+            RecursiveGroupGroupMembership.objects.filter(
+                supergroup_id__in=user_group_ids, supergroup__realm=realm_id
+            ).values(group_id=F("subgroup_id"), root_id=F("supergroup_id"))
         )
     )
     recursive_subgroups = with_cte(cte, select=cte.join(UserGroup, id=cte.col.group_id)).annotate(
@@ -973,6 +1026,7 @@ def set_defaults_for_group_settings(
                 UserGroupMembership.objects.create(
                     user_profile=user_group.creator, user_group=default_group
                 )
+                flush_recursive_membership_group_ids()
             else:
                 raise AssertionError("Group creator should not be None.")
         else:
@@ -1138,6 +1192,7 @@ def create_system_user_groups_for_realm(realm: Realm) -> dict[str, NamedUserGrou
 
     GroupGroupMembership.objects.bulk_create(subgroup_objects)
     RealmAuditLog.objects.bulk_create(realmauditlog_objects)
+    flush_recursive_membership_group_ids()
 
     return system_groups_name_dict
 
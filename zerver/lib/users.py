@@ -1,5 +1,6 @@
 import itertools
 import re
+import secrets
 import unicodedata
 from collections import defaultdict
 from collections.abc import Iterable, Mapping, Sequence
@@ -17,7 +18,17 @@ from typing_extensions import NotRequired
 from zulip_bots.custom_exceptions import ConfigValidationError
 
 from zerver.lib.avatar import avatar_url, get_avatar_field, get_avatar_for_inaccessible_user
-from zerver.lib.cache import cache_with_key, get_cross_realm_dicts_key
+from zerver.lib.cache import (
+    accessible_user_ids_cache_key,
+    accessible_user_ids_generation_cache_key,
+    cache_get,
+    cache_get_many,
+    cache_set,
+    cache_set_many,
+    cache_with_key,
+    get_cross_realm_dicts_key,
+    realm_accessible_user_ids_generation_cache_key,
+)
 from zerver.lib.create_user import get_dummy_email_address_for_display_regex
 from zerver.lib.exceptions import JsonableError, OrganizationOwnerRequiredError
 from zerver.lib.string_validation import check_string_is_printable
@@ -767,6 +778,21 @@ def get_inaccessible_user_ids(
 
     assert acting_user is not None
 
+    if settings.CACHE_ACCESSIBLE_USER_IDS:
+        access_data = get_user_access_data(acting_user)
+        accessible_user_ids = (
+            access_data["subscriber_ids"] - access_data["deactivated_user_ids"]
+        ) | access_data["direct_message_user_ids"]
+        possible_inaccessible_user_ids = set(target_user_ids) - accessible_user_ids
+        if not possible_inaccessible_user_ids:
+            return set()
+        # All users can access all the bots, so we just exclude them.
+        return set(
+            UserProfile.objects.filter(
+                id__in=possible_inaccessible_user_ids, is_bot=False
+            ).values_list("id", flat=True)
+        )
+
     # All users can access all the bots, so we just exclude them.
     target_human_user_ids = UserProfile.objects.filter(
         id__in=target_user_ids, is_bot=False
@@ -829,6 +855,17 @@ def get_user_ids_who_can_access_user(target_user: UserProfile) -> list[int]:
 
     active_non_guest_user_ids_in_realm = active_non_guest_user_ids(realm.id)
 
+    if settings.CACHE_ACCESSIBLE_USER_IDS:
+        access_data = get_user_access_data(target_user)
+        return list(
+            {target_user.id}
+            | set(active_non_guest_user_ids_in_realm)
+            | (
+                (access_data["subscriber_ids"] | access_data["direct_message_user_ids"])
+                - access_data["deactivated_user_ids"]
+            )
+        )
+
     users_sharing_any_subscription = get_subscribers_of_target_user_subscriptions([target_user])
     users_involved_in_dms_dict = get_users_involved_in_dms_with_target_users([target_user], realm)
 
@@ -959,6 +996,67 @@ def get_users_involved_in_dms_with_target_users(
     return direct_message_participants_dict
 
 
+class UserAccessData(TypedDict):
+    # Users subscribed to any channel or group DM which the user is
+    # subscribed to; including deactivated users only for group DMs.
+    subscriber_ids: set[int]
+    # Users the user has sent direct messages to or received them
+    # from, including deactivated users.
+    direct_message_user_ids: set[int]
+    # The deactivated users among the above.
+    deactivated_user_ids: set[int]
+
+
+def get_user_access_data_generation(user_profile: UserProfile) -> str:
+    keys = [
+        accessible_user_ids_generation_cache_key(user_profile.id),
+        realm_accessible_user_ids_generation_cache_key(user_profile.realm_id),
+    ]
+    generations = cache_get_many(keys)
+    new_generations = {key: secrets.token_hex(8) for key in keys if key not in generations}
+    if new_generations:
+        cache_set_many(new_generations)
+        generations.update(new_generations)
+    return "-".join(generations[key] for key in keys)
+
+
+def get_user_access_data(user_profile: UserProfile) -> UserAccessData:
+    """The users that user_profile shares a subscription or direct
+    messages with, from which get_accessible_user_ids,
+    get_inaccessible_user_ids and get_user_ids_who_can_access_user
+    are computed when CACHE_ACCESSIBLE_USER_IDS is enabled.
+
+    This is cached, since it requires scanning the user's
+    subscriptions and direct messages; changes to them invalidate it
+    via flush_accessible_user_ids_cache or
+    flush_realm_accessible_user_ids_cache."""
+    cache_key = accessible_user_ids_cache_key(
+        user_profile.id, get_user_access_data_generation(user_profile)
+    )
+    cached = cache_get(cache_key)
+    if cached is not None:
+        return cached[0]
+
+    subscriber_ids = get_subscribers_of_target_user_subscriptions(
+        [user_profile], include_deactivated_users_for_dm_groups=True
+    )[user_profile.id]
+    direct_message_user_ids = get_users_involved_in_dms_with_target_users(
+        [user_profile], user_profile.realm, include_deactivated_users=True
+    )[user_profile.id]
+    deactivated_user_ids = set(
+        UserProfile.objects.filter(
+            id__in=subscriber_ids | direct_message_user_ids, is_active=False
+        ).values_list("id", flat=True)
+    )
+    access_data = UserAccessData(
+        subscriber_ids=subscriber_ids,
+        direct_message_user_ids=direct_message_user_ids,
+        deactivated_user_ids=deactivated_user_ids,
+    )
+    cache_set(cache_key, access_data)
+    return access_data
+
+
 def user_profile_to_user_row(user_profile: UserProfile) -> RawUserDict:
     return RawUserDict(
         id=user_profile.id,
@@ -1036,6 +1134,13 @@ def get_data_for_inaccessible_user(realm: Realm, user_id: int) -> APIUserDict:
 def get_accessible_user_ids(
     realm: Realm, user_profile: UserProfile, include_deactivated_users: bool = False
 ) -> list[int]:
+    if settings.CACHE_ACCESSIBLE_USER_IDS:
+        access_data = get_user_access_data(user_profile)
+        accessible_user_ids = access_data["subscriber_ids"] | access_data["direct_message_user_ids"]
+        if not include_deactivated_users:
+            accessible_user_ids -= access_data["deactivated_user_ids"]
+        return list({user_profile.id} | accessible_user_ids)
+
     subscribers_dict_of_target_user_subscriptions = get_subscribers_of_target_user_subscriptions(
         [user_profile], include_deactivated_users_for_dm_groups=include_deactivated_users
     )
@@ -1115,6 +1220,27 @@ def get_users_for_api(
     acting_user via the standard format for the Zulip API.  If
     target_user is None, we fetch all users in the realm.
     """
+    if (
+        settings.REALM_USER_DIRECTORY
+        and acting_user is not None
+        and target_user is None
+        and user_ids is None
+        and not settings.PARTIAL_USERS
+    ):
+        # Imported here to avoid a circular import.
+        from zerver.lib.user_directory import get_users_from_directory
+
+        users = get_users_from_directory(
+            realm,
+            acting_user,
+            client_gravatar=client_gravatar,
+            user_avatar_url_field_optional=user_avatar_url_field_optional,
+            include_custom_profile_fields=include_custom_profile_fields,
+            user_list_incomplete=user_list_incomplete,
+        )
+        if users is not None:
+            return users
+
     profiles_by_user_id = None
     custom_profile_field_data = None
     # target_user is an optional parameter which is passed when user data of a specific user
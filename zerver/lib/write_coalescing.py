@@ -0,0 +1,27 @@
+# Counts the database writes we avoid by coalescing frequent updates,
+# like presence heartbeats and user activity intervals, so that one
+# can tell how effective the coalescing is.  The counts are kept in
+# Redis, since they're incremented by many processes.
+from zerver.lib import redis_utils
+from zerver.lib.redis_utils import get_redis_client
+
+client = get_redis_client()
+
+
+def coalesced_writes_key() -> str:
+    return redis_utils.REDIS_KEY_PREFIX + "coalesced_writes"
+
+
+def record_coalesced_writes(kind: str, count: int) -> None:
+    if count > 0:
+        client.hincrby(coalesced_writes_key(), kind, count)
+
+
+def get_coalesced_writes() -> dict[str, int]:
+    return {
+        kind.decode(): int(count) for kind, count in client.hgetall(coalesced_writes_key()).items()
+    }
+
+
+def reset_coalesced_writes() -> None:
+    client.delete(coalesced_writes_key())
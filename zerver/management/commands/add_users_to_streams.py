@@ -3,7 +3,7 @@ from typing import Any
 from django.core.management.base import CommandParser
 from typing_extensions import override
 
-from zerver.actions.streams import bulk_add_subscriptions
+from zerver.actions.streams import bulk_add_subscriptions_in_chunks
 from zerver.lib.management import ZulipBaseCommand
 from zerver.lib.streams import ensure_stream
 
@@ -27,18 +27,19 @@ class Command(ZulipBaseCommand):
 
         user_profiles = self.get_users(options, realm)
         stream_names = {stream.strip() for stream in options["streams"].split(",")}
+        streams = [
+            ensure_stream(realm, stream_name, acting_user=None)
+            for stream_name in sorted(stream_names)
+        ]
 
-        for stream_name in stream_names:
-            for user_profile in user_profiles:
-                stream = ensure_stream(realm, stream_name, acting_user=None)
-                _ignore, already_subscribed = bulk_add_subscriptions(
-                    realm, [stream], [user_profile], acting_user=None
-                )
-                was_there_already = user_profile.id in (info.user.id for info in already_subscribed)
-                print(
-                    "{} {} to {}".format(
-                        "Already subscribed" if was_there_already else "Subscribed",
-                        user_profile.delivery_email,
-                        stream_name,
-                    )
-                )
+        def print_progress(processed: int, total: int) -> None:
+            print(f"Processed {processed}/{total} users")
+
+        subscribed_counts, already_subscribed_counts = bulk_add_subscriptions_in_chunks(
+            realm, streams, user_profiles, acting_user=None, progress_callback=print_progress
+        )
+        for stream in streams:
+            print(
+                f"{stream.name}: subscribed {subscribed_counts[stream.id]} users, "
+                f"{already_subscribed_counts[stream.id]} already subscribed"
+            )
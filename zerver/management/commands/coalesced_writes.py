@@ -0,0 +1,33 @@
+from typing import Any
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.write_coalescing import get_coalesced_writes, reset_coalesced_writes
+
+
+class Command(ZulipBaseCommand):
+    help = """Show how many database writes were saved by coalescing frequent updates.
+
+Presence updates are only coalesced when PRESENCE_WRITE_COALESCING is
+enabled; user activity intervals are always coalesced per batch of
+queue events."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--reset", action="store_true", help="Clear the counts after showing them."
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        coalesced_writes = get_coalesced_writes()
+        for kind, count in sorted(coalesced_writes.items()):
+            print(f"{kind}: {count} writes saved")
+
+        if not coalesced_writes:
+            print("No writes have been coalesced.")
+
+        if options["reset"]:
+            reset_coalesced_writes()
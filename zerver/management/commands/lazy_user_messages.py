@@ -0,0 +1,46 @@
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import CommandError, CommandParser
+from typing_extensions import override
+
+from zerver.actions.streams import do_change_stream_lazy_user_messages
+from zerver.lib.exceptions import JsonableError
+from zerver.lib.management import ZulipBaseCommand
+from zerver.models.streams import get_stream
+
+
+class Command(ZulipBaseCommand):
+    help = """Enable or disable lazy UserMessage storage for a channel.
+
+In this mode, subscribers only get UserMessage rows for messages with
+nonzero flags (e.g. mentions), with their other messages tracked by a
+read watermark on their subscription.  This saves a great deal of
+storage for very large, announcement-style public channels.
+
+Disabling the mode creates the UserMessage rows which were skipped.
+The LAZY_USER_MESSAGE_STREAMS setting must be enabled for the mode to
+take effect."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("-s", "--stream", required=True, help="A channel name.")
+        parser.add_argument("operation", choices=["enable", "disable", "show"], help="What to do.")
+        self.add_realm_args(parser, required=True)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None  # Should be ensured by parser
+        stream = get_stream(options["stream"].strip(), realm)
+
+        if options["operation"] != "show":
+            try:
+                do_change_stream_lazy_user_messages(stream, options["operation"] == "enable")
+            except JsonableError as e:
+                raise CommandError(e.msg)
+
+        state = "enabled" if stream.lazy_user_messages else "disabled"
+        print(f"Lazy UserMessage storage is {state} for #{stream.name}.")
+        if stream.lazy_user_messages and not settings.LAZY_USER_MESSAGE_STREAMS:
+            print("Note: LAZY_USER_MESSAGE_STREAMS is not enabled on this server.")
@@ -0,0 +1,49 @@
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.narrow_query_plans import get_narrow_query_plan_stats, reset_narrow_query_plan_stats
+
+
+class Command(ZulipBaseCommand):
+    help = """Show the aggregated query plans of slow narrow queries.
+
+Plans are only sampled when NARROW_EXPLAIN_SAMPLE_RATE is enabled; see
+its documentation in the server settings.  Narrow shapes are sorted by
+their total sampled time, and for each we list the tables scanned by
+the sampled plans; a sequential scan of a large table usually means
+that the combination of operators needs a new index."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--reset", action="store_true", help="Clear the aggregated plans after showing them."
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        if settings.NARROW_EXPLAIN_SAMPLE_RATE <= 0:
+            print("Note: NARROW_EXPLAIN_SAMPLE_RATE is not enabled on this server.")
+
+        all_stats = get_narrow_query_plan_stats()
+        for shape, stats in sorted(
+            all_stats.items(), key=lambda item: item[1]["total_time"], reverse=True
+        ):
+            print(
+                f"{shape}: {stats['count']} samples, "
+                f"{stats['total_time'] / stats['count']:.3f}s average, "
+                f"{stats['max_time']:.3f}s max, "
+                f"{stats['shared_hit_blocks']} buffers hit, "
+                f"{stats['shared_read_blocks']} buffers read"
+            )
+            for scan, count in sorted(stats["scans"].items(), key=lambda item: -item[1]):
+                print(f"    {count:>6} {scan}")
+
+        if not all_stats:
+            print("No slow narrow queries have been sampled.")
+
+        if options["reset"]:
+            reset_narrow_query_plan_stats()
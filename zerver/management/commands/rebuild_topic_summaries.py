@@ -0,0 +1,44 @@
+from collections.abc import Iterable
+from typing import Any
+
+from django.core.management.base import CommandError, CommandParser
+from django.db import transaction
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.topic_summaries import rebuild_topic_summaries
+from zerver.models import Realm
+from zerver.models.streams import get_stream
+
+
+class Command(ZulipBaseCommand):
+    help = """Recompute the topic summaries used for the topic history of channels.
+
+The summaries are maintained as messages are sent, moved and deleted;
+this is only needed if they were lost or became inconsistent, e.g.
+after messages were modified directly in the database.  Rebuilds all
+realms unless a realm is specified."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("-s", "--stream", help="Only rebuild the topics of this channel.")
+        self.add_realm_args(parser)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        if options["stream"] is not None:
+            if realm is None:
+                raise CommandError("Please specify the realm of the channel.")
+            stream = get_stream(options["stream"].strip(), realm)
+            assert stream.recipient_id is not None
+            with transaction.atomic(durable=True):
+                rebuild_topic_summaries(realm.id, stream.recipient_id)
+            print(f"Rebuilt the topic summaries of #{stream.name}.")
+            return
+
+        realms: Iterable[Realm] = [realm] if realm is not None else Realm.objects.order_by("id")
+        for target_realm in realms:
+            with transaction.atomic(durable=True):
+                rebuild_topic_summaries(target_realm.id)
+            print(f"Rebuilt the topic summaries of {target_realm.string_id}.")
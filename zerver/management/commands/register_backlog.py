@@ -0,0 +1,31 @@
+from typing import Any
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.register_admission import get_register_backlog, reset_register_backlog
+
+
+class Command(ZulipBaseCommand):
+    help = """Show the load on /register, and how many clients were asked to retry.
+
+Requests are only rejected, and client reloads deferred, when
+REGISTER_MAX_CONCURRENT is set."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--reset", action="store_true", help="Clear the counts after showing them."
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        backlog = get_register_backlog()
+        print(f"In flight: {backlog['in_flight']}")
+        print(f"Admitted: {backlog['admitted']}")
+        print(f"Rejected: {backlog['rejected']}")
+        print(f"Deferred client reloads: {backlog['deferred_reloads']}")
+
+        if options["reset"]:
+            reset_register_backlog()
@@ -44,6 +44,7 @@ from zerver.lib.response import (
 from zerver.lib.subdomains import get_subdomain
 from zerver.lib.typed_endpoint import INTENTIONALLY_UNDOCUMENTED, ApiParamConfig, typed_endpoint
 from zerver.lib.user_agent import parse_user_agent
+from zerver.lib.user_groups import get_group_membership_cache_hits
 from zerver.models import Realm
 from zerver.models.realms import get_realm
 
@@ -101,6 +102,7 @@ def record_request_start_data(log_data: MutableMapping[str, Any]) -> None:
     log_data["markdown_requests_start"] = get_markdown_requests()
     log_data["ai_time_start"] = get_ai_time()
     log_data["ai_requests_start"] = get_ai_time()
+    log_data["group_membership_cache_hits_start"] = get_group_membership_cache_hits()
 
 
 def timedelta_ms(timedelta: float) -> float:
@@ -196,6 +198,16 @@ def write_log_line(
         if ai_time_delta > 0.005:
             ai_output = f" (ai: {format_timedelta(ai_time_delta)}/{ai_count_delta})"
 
+    # The number of group membership queries that permission checks
+    # answered from the per-request cache instead.
+    group_membership_cache_output = ""
+    if "group_membership_cache_hits_start" in log_data:
+        group_membership_cache_hits = (
+            get_group_membership_cache_hits() - log_data["group_membership_cache_hits_start"]
+        )
+        if group_membership_cache_hits > 0:
+            group_membership_cache_output = f" (groups: {group_membership_cache_hits} saved)"
+
     # Get the amount of time spent doing database queries
     db_time_output = ""
     queries = connection.connection.queries if connection.connection is not None else []
@@ -211,7 +223,7 @@ def write_log_line(
         logger_client = f"({requester_for_logs} via {client_name})"
     else:
         logger_client = f"({requester_for_logs} via {client_name}/{client_version})"
-    logger_timing = f"{format_timedelta(time_delta):>5}{optional_orig_delta}{remote_cache_output}{markdown_output}{ai_output}{db_time_output}{startup_output} {path}"
+    logger_timing = f"{format_timedelta(time_delta):>5}{optional_orig_delta}{remote_cache_output}{markdown_output}{ai_output}{group_membership_cache_output}{db_time_output}{startup_output} {path}"
     logger_line = f"{remote_ip:<15} {method:<7} {status_code:3} {logger_timing}{extra_request_data} {logger_client}"
     if status_code in [200, 304] and method == "GET" and path.startswith("/static"):
         logger.debug(logger_line)
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2025-10-20 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0754_merge_20251014_1855"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stream",
+            name="lazy_user_messages",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="subscription",
+            name="lazy_read_message_id",
+            field=models.IntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="subscription",
+            name="lazy_start_message_id",
+            field=models.IntegerField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0755_stream_lazy_user_messages"),
+    ]
+
+    operations = [
+        # Records when each message was queued for full-text search
+        # indexing, so that process_fts_updates can report how far
+        # behind it is.  Since now() is not volatile, adding the column
+        # does not rewrite the table.
+        migrations.RunSQL(
+            sql="ALTER TABLE fts_update_log ADD COLUMN created_at timestamptz NOT NULL DEFAULT now()",
+            reverse_sql="ALTER TABLE fts_update_log DROP COLUMN created_at",
+        ),
+    ]
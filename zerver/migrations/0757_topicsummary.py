@@ -0,0 +1,55 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:00
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0756_fts_update_log_created_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TopicSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("topic_name", models.CharField(max_length=60)),
+                ("max_message_id", models.IntegerField()),
+                ("message_count", models.IntegerField()),
+                (
+                    "realm",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="zerver.realm"
+                    ),
+                ),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="zerver.recipient"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        models.F("recipient"),
+                        django.db.models.functions.text.Upper("topic_name"),
+                        name="zerver_topicsummary_recipient_upper_topic_name",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("recipient", "topic_name"),
+                        name="zerver_topicsummary_recipient_topic_name_uniq",
+                    )
+                ],
+            },
+        ),
+    ]
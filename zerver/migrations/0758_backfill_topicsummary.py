@@ -0,0 +1,53 @@
+from django.db import connection, migrations, transaction
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.db.migrations.state import StateApps
+
+
+def backfill_topic_summaries(apps: StateApps, schema_editor: BaseDatabaseSchemaEditor) -> None:
+    Stream = apps.get_model("zerver", "Stream")
+
+    # A single GROUP BY over every channel message would hold one
+    # transaction, and a sort of every topic, for the whole backfill.
+    # Instead, we summarize one channel at a time, each in its own
+    # transaction, using the zerver_message_realm_recipient_subject
+    # index.
+    channels = (
+        Stream.objects.exclude(recipient_id=None)
+        .order_by("recipient_id")
+        .values_list("realm_id", "recipient_id")
+    )
+    for realm_id, recipient_id in list(channels):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO zerver_topicsummary
+                    (realm_id, recipient_id, topic_name, max_message_id, message_count)
+                SELECT realm_id, recipient_id, subject, max(id), count(*)
+                FROM zerver_message
+                WHERE realm_id = %s AND recipient_id = %s AND is_channel_message
+                GROUP BY realm_id, recipient_id, subject
+                ON CONFLICT (recipient_id, topic_name) DO NOTHING
+                """,
+                [realm_id, recipient_id],
+            )
+
+
+def clear_topic_summaries(apps: StateApps, schema_editor: BaseDatabaseSchemaEditor) -> None:
+    TopicSummary = apps.get_model("zerver", "TopicSummary")
+    TopicSummary.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("zerver", "0757_topicsummary"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_topic_summaries,
+            reverse_code=clear_topic_summaries,
+            elidable=True,
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+    dependencies = [
+        ("zerver", "0758_backfill_topicsummary"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="realmauditlog",
+            index=models.Index(fields=["realm", "id"], name="zerver_realmauditlog_realm_id"),
+        ),
+    ]
@@ -0,0 +1,145 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0759_realmauditlog_zerver_realmauditlog_realm_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecursiveGroupGroupMembership",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("path_count", models.PositiveIntegerField()),
+                (
+                    "subgroup",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="zerver.namedusergroup",
+                    ),
+                ),
+                (
+                    "supergroup",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="zerver.usergroup",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["subgroup", "supergroup"],
+                        name="zerver_recursivegroupgroupmembership_subgroup_supergroup",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("supergroup", "subgroup"),
+                        name="zerver_recursivegroupgroupmembership_uniq",
+                    )
+                ],
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+            -- Every chain of subgroups through a direct membership goes
+            -- from the supergroup, or one of its ancestors, to the
+            -- subgroup, or one of its descendants; there are no cycles.
+            CREATE FUNCTION zerver_groupgroupmembership_chains(
+                changed_supergroup_id bigint, changed_subgroup_id bigint
+            )
+            RETURNS TABLE (supergroup_id bigint, subgroup_id bigint, path_count integer)
+            LANGUAGE sql STABLE AS $$
+                SELECT ancestors.group_id, descendants.group_id,
+                    ancestors.path_count * descendants.path_count
+                FROM (
+                    SELECT changed_supergroup_id AS group_id, 1 AS path_count
+                    UNION ALL
+                    SELECT closure.supergroup_id, closure.path_count
+                    FROM zerver_recursivegroupgroupmembership AS closure
+                    WHERE closure.subgroup_id = changed_supergroup_id
+                ) AS ancestors
+                CROSS JOIN (
+                    SELECT changed_subgroup_id AS group_id, 1 AS path_count
+                    UNION ALL
+                    SELECT closure.subgroup_id, closure.path_count
+                    FROM zerver_recursivegroupgroupmembership AS closure
+                    WHERE closure.supergroup_id = changed_subgroup_id
+                ) AS descendants
+            $$;
+
+            CREATE FUNCTION zerver_groupgroupmembership_update_closure() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    UPDATE zerver_recursivegroupgroupmembership AS closure
+                    SET path_count = closure.path_count - chains.path_count
+                    FROM zerver_groupgroupmembership_chains(OLD.supergroup_id, OLD.subgroup_id)
+                        AS chains
+                    WHERE closure.supergroup_id = chains.supergroup_id
+                    AND closure.subgroup_id = chains.subgroup_id;
+
+                    DELETE FROM zerver_recursivegroupgroupmembership AS closure
+                    WHERE closure.path_count = 0
+                    AND closure.subgroup_id IN (
+                        SELECT OLD.subgroup_id
+                        UNION ALL
+                        SELECT descendants.subgroup_id
+                        FROM zerver_recursivegroupgroupmembership AS descendants
+                        WHERE descendants.supergroup_id = OLD.subgroup_id
+                    );
+                END IF;
+
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO zerver_recursivegroupgroupmembership AS closure
+                        (supergroup_id, subgroup_id, path_count)
+                    SELECT chains.supergroup_id, chains.subgroup_id, chains.path_count
+                    FROM zerver_groupgroupmembership_chains(NEW.supergroup_id, NEW.subgroup_id)
+                        AS chains
+                    ON CONFLICT (supergroup_id, subgroup_id) DO UPDATE
+                    SET path_count = closure.path_count + EXCLUDED.path_count;
+                END IF;
+
+                RETURN NULL;
+            END
+            $$;
+
+            LOCK TABLE zerver_groupgroupmembership IN SHARE MODE;
+
+            CREATE TRIGGER zerver_groupgroupmembership_update_closure
+            AFTER INSERT OR UPDATE OR DELETE ON zerver_groupgroupmembership
+            FOR EACH ROW EXECUTE FUNCTION zerver_groupgroupmembership_update_closure();
+
+            INSERT INTO zerver_recursivegroupgroupmembership
+                (supergroup_id, subgroup_id, path_count)
+            WITH RECURSIVE chains (supergroup_id, subgroup_id) AS (
+                SELECT supergroup_id, subgroup_id
+                FROM zerver_groupgroupmembership
+                UNION ALL
+                SELECT chains.supergroup_id, membership.subgroup_id
+                FROM chains
+                JOIN zerver_groupgroupmembership AS membership
+                    ON membership.supergroup_id = chains.subgroup_id
+            )
+            SELECT supergroup_id, subgroup_id, count(*)::integer
+            FROM chains
+            GROUP BY supergroup_id, subgroup_id;
+            """,
+            reverse_sql="""
+            DROP TRIGGER zerver_groupgroupmembership_update_closure ON zerver_groupgroupmembership;
+            DROP FUNCTION zerver_groupgroupmembership_update_closure();
+            DROP FUNCTION zerver_groupgroupmembership_chains(bigint, bigint);
+            DELETE FROM zerver_recursivegroupgroupmembership;
+            """,
+        ),
+    ]
@@ -0,0 +1,110 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0760_recursivegroupgroupmembership"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            -- Each change to zerver_groupgroupmembership updates the
+            -- closure rows of all of the ancestors and descendants of
+            -- the changed edge, which it reads from the closure table
+            -- itself.  Two concurrent transactions changing edges in
+            -- the same realm would each read the closure without the
+            -- other's change, and so miss the chains through both
+            -- edges.  So we serialize closure maintenance per realm,
+            -- with a transaction-level advisory lock; in READ COMMITTED,
+            -- the statements after the lock see the closure as updated
+            -- by the transaction which held it before.
+            CREATE OR REPLACE FUNCTION zerver_groupgroupmembership_update_closure() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                changed_supergroup_id bigint;
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    changed_supergroup_id := OLD.supergroup_id;
+                ELSE
+                    changed_supergroup_id := NEW.supergroup_id;
+                END IF;
+                -- The first key identifies this lock; the second is the
+                -- realm.
+                PERFORM pg_advisory_xact_lock(
+                    760,
+                    (SELECT realm_id FROM zerver_usergroup WHERE id = changed_supergroup_id)
+                );
+
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    UPDATE zerver_recursivegroupgroupmembership AS closure
+                    SET path_count = closure.path_count - chains.path_count
+                    FROM zerver_groupgroupmembership_chains(OLD.supergroup_id, OLD.subgroup_id)
+                        AS chains
+                    WHERE closure.supergroup_id = chains.supergroup_id
+                    AND closure.subgroup_id = chains.subgroup_id;
+
+                    DELETE FROM zerver_recursivegroupgroupmembership AS closure
+                    WHERE closure.path_count = 0
+                    AND closure.subgroup_id IN (
+                        SELECT OLD.subgroup_id
+                        UNION ALL
+                        SELECT descendants.subgroup_id
+                        FROM zerver_recursivegroupgroupmembership AS descendants
+                        WHERE descendants.supergroup_id = OLD.subgroup_id
+                    );
+                END IF;
+
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO zerver_recursivegroupgroupmembership AS closure
+                        (supergroup_id, subgroup_id, path_count)
+                    SELECT chains.supergroup_id, chains.subgroup_id, chains.path_count
+                    FROM zerver_groupgroupmembership_chains(NEW.supergroup_id, NEW.subgroup_id)
+                        AS chains
+                    ON CONFLICT (supergroup_id, subgroup_id) DO UPDATE
+                    SET path_count = closure.path_count + EXCLUDED.path_count;
+                END IF;
+
+                RETURN NULL;
+            END
+            $$;
+            """,
+            reverse_sql="""
+            CREATE OR REPLACE FUNCTION zerver_groupgroupmembership_update_closure() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    UPDATE zerver_recursivegroupgroupmembership AS closure
+                    SET path_count = closure.path_count - chains.path_count
+                    FROM zerver_groupgroupmembership_chains(OLD.supergroup_id, OLD.subgroup_id)
+                        AS chains
+                    WHERE closure.supergroup_id = chains.supergroup_id
+                    AND closure.subgroup_id = chains.subgroup_id;
+
+                    DELETE FROM zerver_recursivegroupgroupmembership AS closure
+                    WHERE closure.path_count = 0
+                    AND closure.subgroup_id IN (
+                        SELECT OLD.subgroup_id
+                        UNION ALL
+                        SELECT descendants.subgroup_id
+                        FROM zerver_recursivegroupgroupmembership AS descendants
+                        WHERE descendants.supergroup_id = OLD.subgroup_id
+                    );
+                END IF;
+
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO zerver_recursivegroupgroupmembership AS closure
+                        (supergroup_id, subgroup_id, path_count)
+                    SELECT chains.supergroup_id, chains.subgroup_id, chains.path_count
+                    FROM zerver_groupgroupmembership_chains(NEW.supergroup_id, NEW.subgroup_id)
+                        AS chains
+                    ON CONFLICT (supergroup_id, subgroup_id) DO UPDATE
+                    SET path_count = closure.path_count + EXCLUDED.path_count;
+                END IF;
+
+                RETURN NULL;
+            END
+            $$;
+            """,
+        ),
+    ]
@@ -10,6 +10,7 @@ from zerver.models.custom_profile_fields import CustomProfileFieldValue as Custo
 from zerver.models.drafts import Draft as Draft
 from zerver.models.groups import GroupGroupMembership as GroupGroupMembership
 from zerver.models.groups import NamedUserGroup as NamedUserGroup
+from zerver.models.groups import RecursiveGroupGroupMembership as RecursiveGroupGroupMembership
 from zerver.models.groups import UserGroup as UserGroup
 from zerver.models.groups import UserGroupMembership as UserGroupMembership
 from zerver.models.linkifiers import RealmFilter as RealmFilter
@@ -69,6 +70,7 @@ from zerver.models.streams import DefaultStream as DefaultStream
 from zerver.models.streams import DefaultStreamGroup as DefaultStreamGroup
 from zerver.models.streams import Stream as Stream
 from zerver.models.streams import Subscription as Subscription
+from zerver.models.topic_summaries import TopicSummary as TopicSummary
 from zerver.models.user_activity import UserActivity as UserActivity
 from zerver.models.user_activity import UserActivityInterval as UserActivityInterval
 from zerver.models.user_topics import UserTopic as UserTopic
@@ -1,5 +1,5 @@
 from django.db import models
-from django.db.models import CASCADE
+from django.db.models import CASCADE, DO_NOTHING
 from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext_lazy
 
@@ -175,6 +175,39 @@ class GroupGroupMembership(models.Model):
         ]
 
 
+class RecursiveGroupGroupMembership(models.Model):
+    """The transitive closure of GroupGroupMembership: a row for each
+    pair of a group and one of its direct or indirect subgroups, so
+    that recursive group membership can be queried without recursive
+    queries.
+
+    Rows are maintained by database triggers on
+    zerver_groupgroupmembership (see migrations 0760 and 0761), which catch every
+    way of changing subgroups, including bulk operations; path_count is
+    the number of distinct chains of subgroups from the supergroup to
+    the subgroup, so that removing one of them can tell whether the
+    subgroup is still reachable.  The triggers also delete the rows of
+    deleted groups, which is why the foreign keys don't cascade.
+    """
+
+    supergroup = models.ForeignKey(UserGroup, on_delete=DO_NOTHING, related_name="+")
+    subgroup = models.ForeignKey(NamedUserGroup, on_delete=DO_NOTHING, related_name="+")
+    path_count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["supergroup", "subgroup"], name="zerver_recursivegroupgroupmembership_uniq"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["subgroup", "supergroup"],
+                name="zerver_recursivegroupgroupmembership_subgroup_supergroup",
+            ),
+        ]
+
+
 @cache_with_key(get_realm_system_groups_cache_key, timeout=3600 * 24 * 7)
 def get_realm_system_groups_name_dict(realm_id: int) -> dict[int, str]:
     system_groups = NamedUserGroup.objects.filter(
@@ -264,6 +264,11 @@ class RealmAuditLog(AbstractRealmAuditLog):
                 name="zerver_realmauditlog_realm__event_type__event_time",
                 fields=["realm", "event_type", "event_time"],
             ),
+            models.Index(
+                # Used for incremental subscription state in POST /register
+                name="zerver_realmauditlog_realm_id",
+                fields=["realm", "id"],
+            ),
             models.Index(
                 name="zerver_realmauditlog_user_subscriptions_idx",
                 fields=["modified_user", "modified_stream"],
@@ -6,6 +6,7 @@ from django.db import models, transaction
 from django.db.models import QuerySet
 from typing_extensions import override
 
+from zerver.lib.cache import flush_accessible_user_ids_cache
 from zerver.lib.display_recipient import get_display_recipient
 
 if TYPE_CHECKING:
@@ -187,6 +188,8 @@ def get_or_create_direct_message_group(id_list: list[int]) -> DirectMessageGroup
                 .values_list("id", "is_active")
             ]
             Subscription.objects.bulk_create(subs_to_create)
+            if subs_to_create:
+                flush_accessible_user_ids_cache(sub.user_profile_id for sub in subs_to_create)
         return direct_message_group
 
 
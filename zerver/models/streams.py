@@ -162,6 +162,12 @@ class Stream(models.Model):
 
     topics_policy = models.PositiveSmallIntegerField(default=StreamTopicsPolicyEnum.inherit.value)
 
+    # Whether subscribers' UserMessage rows for this stream are only
+    # created for messages with nonzero flags; see
+    # zerver/lib/lazy_user_messages.py.  Only supported for public
+    # streams with shared history.
+    lazy_user_messages = models.BooleanField(default=False)
+
     stream_permission_group_settings = {
         "can_add_subscribers_group": GroupPermissionSetting(
             allow_nobody_group=True,
@@ -405,6 +411,14 @@ class Subscription(models.Model):
     email_notifications = models.BooleanField(null=True, default=None)
     wildcard_mentions_notify = models.BooleanField(null=True, default=None)
 
+    # For subscriptions to streams with lazy_user_messages enabled:
+    # messages with IDs above lazy_start_message_id were received by
+    # the user even if no UserMessage row exists for them, and those
+    # without a row are read if and only if their ID is at most
+    # lazy_read_message_id.  Both are None for other subscriptions.
+    lazy_start_message_id = models.IntegerField(null=True, default=None)
+    lazy_read_message_id = models.IntegerField(null=True, default=None)
+
     class Meta:
         unique_together = ("user_profile", "recipient")
         indexes = [
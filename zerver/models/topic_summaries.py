@@ -0,0 +1,45 @@
+from django.db import models
+from django.db.models import CASCADE
+from django.db.models.functions import Upper
+
+from zerver.models.constants import MAX_TOPIC_NAME_LENGTH
+from zerver.models.realms import Realm
+from zerver.models.recipients import Recipient
+
+
+class TopicSummary(models.Model):
+    """A summary of the messages in each topic of a channel, so that
+    the topic history of channels with public history does not need to
+    aggregate over all of the channel's messages.
+
+    Like the query it replaces, this is keyed by the exact topic name;
+    topics whose names differ only in case are merged when reading.
+    Whether a topic is resolved is part of its name, as elsewhere.
+
+    The summaries are maintained by zerver.lib.topic_summaries whenever
+    channel messages are sent, moved, deleted, or restored, and can be
+    recomputed with the `rebuild_topic_summaries` management command.
+    """
+
+    realm = models.ForeignKey(Realm, on_delete=CASCADE)
+    recipient = models.ForeignKey(Recipient, on_delete=CASCADE)
+    topic_name = models.CharField(max_length=MAX_TOPIC_NAME_LENGTH)
+    max_message_id = models.IntegerField()
+    message_count = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipient", "topic_name"],
+                name="zerver_topicsummary_recipient_topic_name_uniq",
+            ),
+        ]
+        indexes = [
+            # Used to find all of the casings of a topic name when
+            # recomputing its summary.
+            models.Index(
+                "recipient",
+                Upper("topic_name"),
+                name="zerver_topicsummary_recipient_upper_topic_name",
+            ),
+        ]
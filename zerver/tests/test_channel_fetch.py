@@ -839,7 +839,7 @@ class GetSubscribersTest(ZulipTestCase):
             polonius.id,
         ]
 
-        with self.assert_database_query_count(52):
+        with self.assert_database_query_count(53):
             self.subscribe_via_post(
                 self.user_profile,
                 stream_names,
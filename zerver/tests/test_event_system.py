@@ -1,10 +1,13 @@
+import itertools
 import time
 from collections.abc import Callable
+from datetime import timedelta
 from typing import Any
 from unittest import mock
 from urllib.parse import urlsplit
 
 import orjson
+import time_machine
 from django.conf import settings
 from django.http import HttpRequest, HttpResponse
 from django.test import override_settings
@@ -15,23 +18,48 @@ from zerver.actions.channel_folders import check_add_channel_folder
 from zerver.actions.custom_profile_fields import try_update_realm_custom_profile_field
 from zerver.actions.message_send import check_send_message
 from zerver.actions.presence import do_update_user_presence
-from zerver.actions.streams import do_change_stream_folder
+from zerver.actions.realm_domains import do_add_realm_domain
+from zerver.actions.streams import (
+    do_change_stream_description,
+    do_change_stream_folder,
+    do_change_stream_permission,
+    do_change_subscription_property,
+)
+from zerver.actions.user_groups import check_add_user_group
 from zerver.actions.user_settings import do_change_user_setting
-from zerver.actions.users import do_change_user_role
+from zerver.actions.users import do_change_user_role, do_deactivate_user
 from zerver.lib.event_schema import check_web_reload_client_event
 from zerver.lib.events import fetch_initial_state_data, post_process_state
 from zerver.lib.exceptions import AccessDeniedError
+from zerver.lib.register_admission import (
+    REGISTER_ADMISSION_TIMEOUT_SECONDS,
+    REGISTER_RETRY_MAX_SECONDS,
+    REGISTER_RETRY_MIN_SECONDS,
+    get_register_backlog,
+    is_register_saturated,
+    register_in_flight_key,
+    reset_register_backlog,
+)
+from zerver.lib.register_admission import client as redis_client
 from zerver.lib.request import RequestVariableMissingError
+from zerver.lib.subscription_info import (
+    SUBSCRIPTION_STATE_VERSION_SETTLE_TIME,
+    delta_encode_user_ids,
+    get_changed_subscription_stream_ids,
+    get_subscription_state_version,
+)
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import (
     HostRequestMock,
     dummy_handler,
+    get_subscription,
     reset_email_visibility_to_everyone_in_zulip_realm,
     stub_event_queue_user_events,
 )
 from zerver.lib.users import get_users_for_api
-from zerver.models import CustomProfileField, UserMessage, UserPresence, UserProfile
+from zerver.models import CustomProfileField, RealmAuditLog, UserMessage, UserPresence, UserProfile
 from zerver.models.clients import get_client
+from zerver.models.realm_audit_logs import AuditLogEventType
 from zerver.models.realms import get_realm
 from zerver.models.streams import get_stream
 from zerver.models.users import get_system_bot
@@ -312,6 +340,51 @@ class EventsEndpointTest(ZulipTestCase):
         self.assert_json_success(result)
         self.assertEqual(orjson.loads(result.content)["sent_events"], 0)
 
+    def test_register_admission(self) -> None:
+        hamlet = self.example_user("hamlet")
+        reset_register_backlog()
+        self.addCleanup(reset_register_backlog)
+
+        with self.settings(REGISTER_MAX_CONCURRENT=1):
+            result = self.api_post(hamlet, "/api/v1/register")
+            self.assert_json_success(result)
+            self.assertEqual(get_register_backlog()["in_flight"], 0)
+
+            # Another request holds the only slot.
+            redis_client.zadd(register_in_flight_key(), {"other": time.time()})
+            self.addCleanup(redis_client.delete, register_in_flight_key())
+            self.assertTrue(is_register_saturated())
+            result = self.api_post(hamlet, "/api/v1/register")
+            self.assert_json_error(result, "API usage exceeded rate limit", status_code=429)
+            self.assertGreaterEqual(float(result["Retry-After"]), REGISTER_RETRY_MIN_SECONDS)
+            self.assertLessEqual(float(result["Retry-After"]), REGISTER_RETRY_MAX_SECONDS)
+
+            # Web clients aren't told to reload meanwhile.
+            post_data = {"client_count": "10", "secret": settings.SHARED_SECRET}
+            req = HostRequestMock(post_data, tornado_handler=dummy_handler)
+            req.META["REMOTE_ADDR"] = "127.0.0.1"
+            with mock.patch.dict(
+                "zerver.tornado.event_queue.web_reload_clients", {"queue_id": True}, clear=True
+            ):
+                result = self.client_post_request("/api/internal/web_reload_clients", req)
+            data = self.assert_json_success(result)
+            self.assertEqual(data["sent_events"], 0)
+            self.assertFalse(data["complete"])
+
+            self.assertEqual(
+                get_register_backlog(),
+                {"in_flight": 1, "admitted": 1, "rejected": 1, "deferred_reloads": 1},
+            )
+
+            # Requests which never released their slot eventually expire.
+            with time_machine.travel(
+                timezone_now() + timedelta(seconds=REGISTER_ADMISSION_TIMEOUT_SECONDS + 1),
+                tick=False,
+            ):
+                self.assertFalse(is_register_saturated())
+                result = self.api_post(hamlet, "/api/v1/register")
+            self.assert_json_success(result)
+
 
 class GetEventsTest(ZulipTestCase):
     def tornado_call(
@@ -878,6 +951,236 @@ class FetchInitialStateDataTest(ZulipTestCase):
         self.assertEqual(result["unread_msgs"]["streams"][0]["topic"], "case DOES not MATTER")
         self.assert_length(result["unread_msgs"]["streams"][0]["unread_message_ids"], 2)
 
+    @override_settings(CACHE_REGISTER_REALM_SNAPSHOT=True)
+    def test_realm_snapshot(self) -> None:
+        hamlet = self.example_user("hamlet")
+        realm = hamlet.realm
+        event_types = ["realm_user_groups", "custom_profile_fields", "realm_domains"]
+
+        def fetch() -> dict[str, Any]:
+            return fetch_initial_state_data(hamlet, realm=realm, event_types=event_types)
+
+        with self.settings(CACHE_REGISTER_REALM_SNAPSHOT=False):
+            expected = fetch()
+        self.assertEqual(fetch(), expected)
+
+        # The realm-wide sections are now served from the cache.
+        with (
+            mock.patch("zerver.lib.events.user_groups_in_realm_serialized") as mock_groups,
+            mock.patch("zerver.lib.events.custom_profile_fields_for_realm") as mock_fields,
+            mock.patch("zerver.lib.events.get_realm_domains") as mock_domains,
+        ):
+            self.assertEqual(fetch(), expected)
+        mock_groups.assert_not_called()
+        mock_fields.assert_not_called()
+        mock_domains.assert_not_called()
+
+        # Events for changes to a section invalidate it.
+        with self.captureOnCommitCallbacks(execute=True):
+            check_add_user_group(realm, "snapshot", [hamlet], acting_user=hamlet)
+        result = fetch()
+        self.assertIn("snapshot", [group["name"] for group in result["realm_user_groups"]])
+        self.assertEqual(result["custom_profile_fields"], expected["custom_profile_fields"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            do_add_realm_domain(realm, "snapshot.example.com", False, acting_user=None)
+        self.assertIn(
+            "snapshot.example.com", [domain["domain"] for domain in fetch()["realm_domains"]]
+        )
+
+    # Changes are visible to later versions immediately in tests; see
+    # test_subscription_state_version_settle_time.
+    @mock.patch("zerver.lib.subscription_info.SUBSCRIPTION_STATE_VERSION_SETTLE_TIME", timedelta(0))
+    def test_subscription_state_version(self) -> None:
+        hamlet = self.example_user("hamlet")
+        realm = hamlet.realm
+
+        def fetch(subscription_state_version: int | None) -> dict[str, Any]:
+            return fetch_initial_state_data(
+                hamlet,
+                realm=realm,
+                event_types=["subscription"],
+                subscription_state_version=subscription_state_version,
+            )
+
+        full_state = fetch(None)
+        self.assertFalse(full_state["subscription_state_delta"])
+        self.assertEqual(full_state["subscription_state_removed_channel_ids"], [])
+        version = full_state["subscription_state_version"]
+
+        state = fetch(version)
+        self.assertTrue(state["subscription_state_delta"])
+        self.assertEqual(state["subscriptions"], [])
+        self.assertEqual(state["unsubscribed"], [])
+        self.assertEqual(state["never_subscribed"], [])
+
+        # Only the channels which changed are sent again.
+        denmark = get_stream("Denmark", realm)
+        do_change_stream_description(denmark, "Changed", acting_user=None)
+        verona = get_stream("Verona", realm)
+        do_change_subscription_property(
+            hamlet,
+            get_subscription("Verona", hamlet),
+            verona,
+            "pin_to_top",
+            True,
+            acting_user=None,
+        )
+        state = fetch(version)
+        self.assertTrue(state["subscription_state_delta"])
+        self.assertEqual(
+            sorted(sub["name"] for sub in state["subscriptions"]), ["Denmark", "Verona"]
+        )
+        self.assertEqual(state["never_subscribed"], [])
+        self.assertGreater(state["subscription_state_version"], version)
+
+        # Channels the user can no longer see are listed as removed,
+        # if the user could see them before.
+        private_stream = self.make_stream("private", invite_only=True)
+        self.subscribe(hamlet, "private")
+        made_private_stream = self.make_stream("made private")
+        version = fetch(None)["subscription_state_version"]
+        self.unsubscribe(hamlet, "private")
+        do_change_stream_permission(
+            made_private_stream,
+            invite_only=True,
+            history_public_to_subscribers=True,
+            is_web_public=False,
+            acting_user=self.example_user("iago"),
+        )
+        self.make_stream("secret", invite_only=True)
+        state = fetch(version)
+        self.assertTrue(state["subscription_state_delta"])
+        self.assertEqual(state["subscriptions"], [])
+        self.assertEqual(
+            state["subscription_state_removed_channel_ids"],
+            sorted([private_stream.id, made_private_stream.id]),
+        )
+
+        # Changes which can affect any channel require all of the data.
+        version = fetch(None)["subscription_state_version"]
+        do_deactivate_user(self.example_user("othello"), acting_user=None)
+        state = fetch(version)
+        self.assertFalse(state["subscription_state_delta"])
+        self.assertEqual(len(state["subscriptions"]), len(full_state["subscriptions"]))
+
+        # As do old versions.
+        version = state["subscription_state_version"]
+        with time_machine.travel(timezone_now() + timedelta(days=2), tick=False):
+            self.assertFalse(fetch(version)["subscription_state_delta"])
+
+    def test_subscription_state_version_settle_time(self) -> None:
+        hamlet = self.example_user("hamlet")
+        realm = hamlet.realm
+        denmark = get_stream("Denmark", realm)
+        verona = get_stream("Verona", realm)
+        now = timezone_now()
+        settled = RealmAuditLog.objects.create(
+            realm=realm,
+            modified_stream=denmark,
+            event_type=AuditLogEventType.CHANNEL_PROPERTY_CHANGED,
+            event_time=now - timedelta(minutes=2),
+        )
+
+        # An entry is logged, but its transaction hasn't committed yet;
+        # we simulate that by creating it only after reading the
+        # version, with the ID it would have been assigned.
+        uncommitted = RealmAuditLog.objects.create(
+            realm=realm,
+            modified_stream=verona,
+            event_type=AuditLogEventType.CHANNEL_PROPERTY_CHANGED,
+            event_time=now,
+        )
+        uncommitted_id = uncommitted.id
+        uncommitted.delete()
+        with time_machine.travel(now, tick=False):
+            do_change_stream_description(denmark, "Changed", acting_user=None)
+            version = get_subscription_state_version(realm)
+        self.assertEqual(version, settled.id)
+        RealmAuditLog.objects.create(
+            id=uncommitted_id,
+            realm=realm,
+            modified_stream=verona,
+            event_type=AuditLogEventType.CHANNEL_PROPERTY_CHANGED,
+            event_time=now,
+        )
+
+        # Both changes are included in deltas from the version.
+        with time_machine.travel(now + timedelta(seconds=5), tick=False):
+            self.assertEqual(
+                get_changed_subscription_stream_ids(realm, version), {denmark.id, verona.id}
+            )
+
+        # Once they are older than the settle time, later versions
+        # include them.
+        with time_machine.travel(
+            now + SUBSCRIPTION_STATE_VERSION_SETTLE_TIME + timedelta(seconds=1), tick=False
+        ):
+            later_version = get_subscription_state_version(realm)
+            self.assertGreaterEqual(later_version, uncommitted_id)
+            self.assertEqual(get_changed_subscription_stream_ids(realm, later_version), set())
+
+    def test_delta_encoded_subscribers(self) -> None:
+        self.assertEqual(delta_encode_user_ids([20, 10, 15, 11]), [10, 1, 4, 5])
+        self.assertEqual(delta_encode_user_ids([]), [])
+
+        hamlet = self.example_user("hamlet")
+
+        def register(client_capabilities: dict[str, bool]) -> dict[str, Any]:
+            result = self.api_post(
+                hamlet,
+                "/api/v1/register",
+                {
+                    "event_types": orjson.dumps(["subscription"]).decode(),
+                    "include_subscribers": "true",
+                    "client_capabilities": orjson.dumps(client_capabilities).decode(),
+                },
+            )
+            return self.assert_json_success(result)
+
+        plain = register({"notification_settings_null": True})
+        encoded = register({"notification_settings_null": True, "delta_encoded_subscribers": True})
+        for key in ["subscriptions", "unsubscribed", "never_subscribed"]:
+            self.assertEqual(
+                [sub["stream_id"] for sub in encoded[key]],
+                [sub["stream_id"] for sub in plain[key]],
+            )
+            for plain_sub, encoded_sub in zip(plain[key], encoded[key], strict=True):
+                self.assertEqual(
+                    list(itertools.accumulate(encoded_sub["subscribers"])),
+                    sorted(plain_sub["subscribers"]),
+                )
+
+    def test_section_timings(self) -> None:
+        hamlet = self.example_user("hamlet")
+        section_timings: dict[str, float] = {}
+        state = fetch_initial_state_data(
+            hamlet,
+            realm=hamlet.realm,
+            event_types=["drafts", "presence", "realm_user", "starred_messages"],
+            section_timings=section_timings,
+        )
+        self.assertIn("drafts", state)
+        self.assertIn("presences", state)
+        self.assertEqual(
+            set(section_timings),
+            {"drafts", "presences", "realm_user", "starred_messages"},
+        )
+
+        self.login_user(hamlet)
+        with self.settings(DEBUG=True):
+            result = self.client_post(
+                "/json/register", {"event_types": orjson.dumps(["drafts"]).decode()}
+            )
+        self.assert_json_success(result)
+        self.assertTrue(result["Server-Timing"].startswith("drafts;dur="))
+
+        result = self.client_post(
+            "/json/register", {"event_types": orjson.dumps(["drafts"]).decode()}
+        )
+        self.assert_json_success(result)
+        self.assertNotIn("Server-Timing", result)
+
 
 class ClientDescriptorsTest(ZulipTestCase):
     def test_get_client_info_for_all_public_streams(self) -> None:
@@ -1241,7 +1544,7 @@ class FetchQueriesTest(ZulipTestCase):
         self.login_user(user)
 
         with (
-            self.assert_database_query_count(48),
+            self.assert_database_query_count(49),
             mock.patch("zerver.lib.events.always_want") as want_mock,
         ):
             fetch_initial_state_data(user, realm=user.realm)
@@ -1287,9 +1590,9 @@ class FetchQueriesTest(ZulipTestCase):
             # as mentioned above.
             stream=5,
             stop_words=0,
-            # 3 of the 9 queries here are shared with other event types
+            # 3 of the 10 queries here are shared with other event types
             # as mentioned above.
-            subscription=9,
+            subscription=10,
             update_display_settings=0,
             update_global_notifications=0,
             update_message_flags=7,
@@ -96,6 +96,23 @@ class RateLimitTests(ZulipTestCase):
         newlimit = int(result["X-RateLimit-Remaining"])
         self.assertEqual(limit, newlimit + 1)
 
+    def test_ratelimit_decrease_for_batch_send(self) -> None:
+        user = self.example_user("hamlet")
+        RateLimitedUser(user).clear_history()
+        result = self.send_api_message(user, "some stuff")
+        limit = int(result["X-RateLimit-Remaining"])
+
+        messages = [
+            {"type": "stream", "to": "Verona", "topic": "whatever", "content": f"batch {i}"}
+            for i in range(3)
+        ]
+        result = self.api_post(
+            user, "/api/v1/messages/batch", {"messages": orjson.dumps(messages).decode()}
+        )
+        self.assert_json_success(result)
+        newlimit = int(result["X-RateLimit-Remaining"])
+        self.assertEqual(limit, newlimit + 3)
+
     def do_test_hit_ratelimits(
         self,
         request_func: Callable[[], "TestHttpResponse"],
@@ -255,6 +255,9 @@ class HomeTest(ZulipTestCase):
         "realm_billing",
         "starred_messages",
         "stop_words",
+        "subscription_state_delta",
+        "subscription_state_removed_channel_ids",
+        "subscription_state_version",
         "subscriptions",
         "unread_msgs",
         "unsubscribed",
@@ -290,7 +293,7 @@ class HomeTest(ZulipTestCase):
 
         # Verify succeeds once logged-in
         with (
-            self.assert_database_query_count(58),
+            self.assert_database_query_count(59),
             patch("zerver.lib.cache.cache_set") as cache_mock,
         ):
             result = self._get_home_page(stream="Denmark")
@@ -597,7 +600,7 @@ class HomeTest(ZulipTestCase):
         # Verify number of queries for Realm admin isn't much higher than for normal users.
         self.login("iago")
         with (
-            self.assert_database_query_count(57),
+            self.assert_database_query_count(58),
             patch("zerver.lib.cache.cache_set") as cache_mock,
         ):
             result = self._get_home_page()
@@ -629,7 +632,7 @@ class HomeTest(ZulipTestCase):
         self._get_home_page()
 
         # Then for the second page load, measure the number of queries.
-        with self.assert_database_query_count(53):
+        with self.assert_database_query_count(54):
             result = self._get_home_page()
 
         # Do a sanity check that our new streams were in the payload.
@@ -0,0 +1,209 @@
+import orjson
+from django.test import override_settings
+
+from zerver.actions.streams import do_change_stream_lazy_user_messages
+from zerver.lib.exceptions import JsonableError
+from zerver.lib.message import get_raw_unread_data
+from zerver.lib.test_classes import ZulipTestCase
+from zerver.lib.test_helpers import get_subscription
+from zerver.models import Stream, UserMessage, UserProfile
+
+
+@override_settings(LAZY_USER_MESSAGE_STREAMS=True)
+class LazyUserMessagesTest(ZulipTestCase):
+    def setup_lazy_stream(self) -> Stream:
+        stream = self.make_stream("announce")
+        for name in ["hamlet", "cordelia", "othello"]:
+            self.subscribe(self.example_user(name), "announce")
+        do_change_stream_lazy_user_messages(stream, True)
+        return stream
+
+    def get_flags(self, user: UserProfile, message_id: int) -> list[str]:
+        self.login_user(user)
+        result = self.client_get(
+            "/json/messages",
+            {
+                "anchor": message_id,
+                "num_before": 0,
+                "num_after": 0,
+                "narrow": orjson.dumps([{"operator": "channel", "operand": "announce"}]).decode(),
+            },
+        )
+        [message] = self.assert_json_success(result)["messages"]
+        return message["flags"]
+
+    def get_unread_message_ids(self, user: UserProfile) -> set[int]:
+        self.login_user(user)
+        result = self.client_get(
+            "/json/messages",
+            {
+                "anchor": "newest",
+                "num_before": 100,
+                "num_after": 0,
+                "narrow": orjson.dumps([{"operator": "is", "operand": "unread"}]).decode(),
+            },
+        )
+        return {message["id"] for message in self.assert_json_success(result)["messages"]}
+
+    def test_send_skips_plain_user_messages(self) -> None:
+        self.setup_lazy_stream()
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+
+        message_id = self.send_stream_message(
+            hamlet, "announce", "@**Othello, the Moor of Venice**"
+        )
+        self.assertEqual(
+            set(
+                UserMessage.objects.filter(message_id=message_id).values_list(
+                    "user_profile_id", flat=True
+                )
+            ),
+            {hamlet.id, othello.id},
+        )
+
+        # Cordelia still received the message, as unread.
+        self.assertIn(message_id, get_raw_unread_data(cordelia)["stream_dict"])
+        self.assertIn(message_id, self.get_unread_message_ids(cordelia))
+        self.assertEqual(self.get_flags(cordelia, message_id), [])
+        self.assertNotIn(message_id, self.get_unread_message_ids(hamlet))
+
+        with override_settings(LAZY_USER_MESSAGE_STREAMS=False):
+            message_id = self.send_stream_message(hamlet, "announce")
+        self.assertTrue(
+            UserMessage.objects.filter(user_profile=cordelia, message_id=message_id).exists()
+        )
+
+    def test_existing_messages_unaffected(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        stream = self.make_stream("announce")
+        self.subscribe(hamlet, "announce")
+        self.subscribe(cordelia, "announce")
+        old_message_id = self.send_stream_message(hamlet, "announce")
+        do_change_stream_lazy_user_messages(stream, True)
+
+        sub = get_subscription("announce", cordelia)
+        self.assertEqual(sub.lazy_start_message_id, old_message_id)
+        self.assertEqual(sub.lazy_read_message_id, old_message_id)
+        self.assertEqual(self.get_flags(cordelia, old_message_id), [])
+        self.assertIn(old_message_id, self.get_unread_message_ids(cordelia))
+
+        # Users who subscribe later don't receive old messages.
+        iago = self.example_user("iago")
+        self.subscribe(iago, "announce")
+        self.assertEqual(self.get_flags(iago, old_message_id), ["read", "historical"])
+
+    def test_mark_stream_as_read(self) -> None:
+        stream = self.setup_lazy_stream()
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        message_ids = [self.send_stream_message(hamlet, "announce") for _ in range(3)]
+
+        self.login_user(cordelia)
+        result = self.client_post("/json/mark_stream_as_read", {"stream_id": stream.id})
+        self.assert_json_success(result)
+
+        self.assertEqual(
+            get_subscription("announce", cordelia).lazy_read_message_id, message_ids[-1]
+        )
+        self.assertFalse(
+            UserMessage.objects.filter(user_profile=cordelia, message_id__in=message_ids).exists()
+        )
+        self.assertEqual(get_raw_unread_data(cordelia)["stream_dict"], {})
+        self.assertEqual(self.get_flags(cordelia, message_ids[0]), ["read"])
+
+        # Newer messages are unread again.
+        message_id = self.send_stream_message(hamlet, "announce")
+        self.assertEqual(list(get_raw_unread_data(cordelia)["stream_dict"]), [message_id])
+
+    def test_mark_all_as_read(self) -> None:
+        self.setup_lazy_stream()
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        message_id = self.send_stream_message(hamlet, "announce")
+
+        self.login_user(cordelia)
+        result = self.client_post("/json/mark_all_as_read", {})
+        self.assert_json_success(result)
+        self.assertEqual(get_subscription("announce", cordelia).lazy_read_message_id, message_id)
+        self.assertNotIn(message_id, self.get_unread_message_ids(cordelia))
+
+    def test_update_message_flags(self) -> None:
+        self.setup_lazy_stream()
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        message_ids = [self.send_stream_message(hamlet, "announce") for _ in range(2)]
+
+        self.login_user(cordelia)
+        result = self.client_post(
+            "/json/messages/flags",
+            {"messages": orjson.dumps(message_ids[:1]).decode(), "op": "add", "flag": "starred"},
+        )
+        self.assert_json_success(result)
+        self.assertEqual(self.get_flags(cordelia, message_ids[0]), ["starred"])
+        self.assertIn(message_ids[0], self.get_unread_message_ids(cordelia))
+
+        result = self.client_post(
+            "/json/messages/flags",
+            {"messages": orjson.dumps(message_ids).decode(), "op": "add", "flag": "read"},
+        )
+        self.assert_json_success(result)
+        self.assertEqual(result.json()["messages"], message_ids)
+        self.assertEqual(self.get_flags(cordelia, message_ids[0]), ["read", "starred"])
+        self.assertEqual(self.get_flags(cordelia, message_ids[1]), ["read"])
+
+        # Marking a message below the watermark as unread needs a row.
+        self.client_post("/json/mark_all_as_read", {})
+        message_id = self.send_stream_message(hamlet, "announce")
+        self.client_post("/json/mark_all_as_read", {})
+        self.assertEqual(self.get_flags(cordelia, message_id), ["read"])
+        result = self.client_post(
+            "/json/messages/flags",
+            {"messages": orjson.dumps([message_id]).decode(), "op": "remove", "flag": "read"},
+        )
+        self.assert_json_success(result)
+        um = UserMessage.objects.get(user_profile=cordelia, message_id=message_id)
+        self.assertEqual(int(um.flags), 0)
+        self.assertIn(message_id, get_raw_unread_data(cordelia)["stream_dict"])
+
+    def test_unsubscribe_materializes_user_messages(self) -> None:
+        self.setup_lazy_stream()
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        read_message_id = self.send_stream_message(hamlet, "announce")
+        self.login_user(cordelia)
+        self.client_post("/json/mark_all_as_read", {})
+        unread_message_id = self.send_stream_message(hamlet, "announce")
+
+        self.unsubscribe(cordelia, "announce")
+        sub = get_subscription("announce", cordelia)
+        self.assertIsNone(sub.lazy_start_message_id)
+        self.assertIsNone(sub.lazy_read_message_id)
+        flags = dict(
+            UserMessage.objects.filter(
+                user_profile=cordelia, message_id__in=[read_message_id, unread_message_id]
+            ).values_list("message_id", "flags")
+        )
+        self.assertEqual(
+            flags, {read_message_id: UserMessage.flags.read.mask, unread_message_id: 0}
+        )
+
+    def test_disable_and_permission_changes(self) -> None:
+        stream = self.setup_lazy_stream()
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        message_id = self.send_stream_message(hamlet, "announce")
+
+        do_change_stream_lazy_user_messages(stream, False)
+        self.assertTrue(
+            UserMessage.objects.filter(user_profile=cordelia, message_id=message_id).exists()
+        )
+        self.assertIsNone(get_subscription("announce", cordelia).lazy_start_message_id)
+
+        private_stream = self.make_stream("private", invite_only=True)
+        with self.assertRaisesRegex(
+            JsonableError, "Only public channels with shared history can use lazy message storage."
+        ):
+            do_change_stream_lazy_user_messages(private_stream, True)
@@ -5,7 +5,9 @@ from typing import TYPE_CHECKING, Any
 from unittest import mock
 
 import orjson
+from django.core.management import call_command
 from django.db import connection
+from django.http import HttpResponse
 from django.test import override_settings
 from django.utils.timezone import now as timezone_now
 from sqlalchemy.sql import ClauseElement, Select, and_, column, select, table
@@ -14,6 +16,7 @@ from typing_extensions import override
 
 from analytics.lib.counts import COUNT_STATS
 from analytics.models import RealmCount
+from zerver.actions.message_delete import do_delete_messages
 from zerver.actions.message_edit import build_message_edit_request, do_update_message
 from zerver.actions.reactions import check_add_reaction
 from zerver.actions.realm_settings import do_set_realm_property
@@ -39,11 +42,23 @@ from zerver.lib.narrow import (
     exclude_muting_conditions,
     find_first_unread_anchor,
     is_spectator_compatible,
+    narrow_compiled_cache,
+    narrow_query_shape,
     ok_to_include_history,
     post_process_limited_query,
 )
 from zerver.lib.narrow_helpers import NeverNegatedNarrowTerm
 from zerver.lib.narrow_predicate import build_narrow_predicate
+from zerver.lib.narrow_query_plans import (
+    explain_narrow_query,
+    get_narrow_query_plan_stats,
+    reset_narrow_query_plan_stats,
+)
+from zerver.lib.search_highlight import (
+    get_pgroonga_keywords,
+    get_pgroonga_match_positions,
+    get_search_match_positions,
+)
 from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
 from zerver.lib.streams import StreamDict, create_streams_if_needed, get_public_streams_queryset
 from zerver.lib.test_classes import ZulipTestCase
@@ -562,7 +577,7 @@ class NarrowBuilderTest(ZulipTestCase):
         term = NarrowParameter(operator="search", operand='"french fries"')
         self._do_add_term_test(
             term,
-            "WHERE (content ILIKE %(content_1)s OR subject ILIKE %(subject_1)s AND is_channel_message) AND (search_tsvector @@ plainto_tsquery(%(param_4)s, %(param_5)s))",
+            "WHERE (content ILIKE %(content_1)s OR subject ILIKE %(subject_1)s AND is_channel_message) AND (search_tsvector @@ plainto_tsquery(%(param_1)s, %(param_2)s))",
         )
 
     @override_settings(USING_PGROONGA=False)
@@ -570,7 +585,7 @@ class NarrowBuilderTest(ZulipTestCase):
         term = NarrowParameter(operator="search", operand='"french fries"', negated=True)
         self._do_add_term_test(
             term,
-            "WHERE NOT (content ILIKE %(content_1)s OR subject ILIKE %(subject_1)s AND is_channel_message) AND NOT (search_tsvector @@ plainto_tsquery(%(param_4)s, %(param_5)s))",
+            "WHERE NOT (content ILIKE %(content_1)s OR subject ILIKE %(subject_1)s AND is_channel_message) AND NOT (search_tsvector @@ plainto_tsquery(%(param_1)s, %(param_2)s))",
         )
 
     @override_settings(USING_PGROONGA=True)
@@ -3260,6 +3275,198 @@ class GetOldMessagesTest(ZulipTestCase):
             '<p>James\' <span class="highlight">burger</span></p>',
         )
 
+    @override_settings(USING_PGROONGA=False)
+    def test_get_messages_with_search_unindexed_own_messages(self) -> None:
+        cordelia = self.example_user("cordelia")
+        hamlet = self.example_user("hamlet")
+        own_message_id = self.send_stream_message(
+            cordelia, "Verona", content="the zanzibar plans", topic_name="travel"
+        )
+        other_message_id = self.send_stream_message(
+            hamlet, "Verona", content="more zanzibar plans", topic_name="travel"
+        )
+        # Both messages are waiting for process_fts_updates.
+        self.assertEqual(
+            set(
+                Message.objects.filter(
+                    id__in=[own_message_id, other_message_id], search_tsvector__isnull=True
+                ).values_list("id", flat=True)
+            ),
+            {own_message_id, other_message_id},
+        )
+
+        self.login_user(cordelia)
+
+        def search_message_ids(operand: str) -> list[int]:
+            result = self.get_and_check_messages(
+                dict(
+                    narrow=orjson.dumps([dict(operator="search", operand=operand)]).decode(),
+                    anchor="newest",
+                    num_before=10,
+                    num_after=0,
+                )
+            )
+            return [message["id"] for message in result["messages"]]
+
+        self.assertEqual(search_message_ids("zanzibar"), [])
+
+        with override_settings(SEARCH_UNINDEXED_OWN_MESSAGES=True):
+            self.assertEqual(search_message_ids("zanzibar"), [own_message_id])
+            self.assertEqual(search_message_ids("travel"), [own_message_id])
+            self.assertEqual(search_message_ids("lunch"), [])
+
+            self._update_tsvector_index()
+            self.assertEqual(search_message_ids("zanzibar"), [own_message_id, other_message_id])
+
+    @override_settings(USING_PGROONGA=False, SEARCH_UNINDEXED_OWN_MESSAGES=True)
+    def test_search_unindexed_own_messages_query_plan(self) -> None:
+        cordelia = self.example_user("cordelia")
+
+        def build_query() -> Select:
+            builder = NarrowBuilder(cordelia, column("id", Integer), cordelia.realm)
+            return builder.add_term(
+                select(column("id", Integer)).select_from(table("zerver_message")),
+                NarrowParameter(operator="search", operand="zanzibar"),
+            )
+
+        # Building the query doesn't query the database, and its SQL
+        # doesn't depend on which messages are unindexed.
+        with self.assert_database_query_count(0):
+            empty_log_sql = str(build_query())
+        self.send_stream_message(cordelia, "Verona", content="the zanzibar plans")
+        query = build_query()
+        self.assertEqual(str(query), empty_log_sql)
+
+        def get_index_names(plan: dict[str, Any]) -> set[str]:
+            index_names = {plan["Index Name"]} if "Index Name" in plan else set()
+            for subplan in plan.get("Plans", []):
+                index_names |= get_index_names(subplan)
+            return index_names
+
+        # Matching the unindexed messages must not stop PostgreSQL from
+        # using the search index for everything else.
+        with get_sqlalchemy_connection() as sa_conn:
+            sa_conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            index_names = get_index_names(explain_narrow_query(sa_conn, query)["Plan"])
+        self.assertIn("zerver_message_search_tsvector", index_names)
+        self.assertIn("zerver_message_pkey", index_names)
+
+    @override_settings(USING_PGROONGA=False)
+    def test_get_messages_with_ranked_search(self) -> None:
+        self.login("cordelia")
+        cordelia = self.example_user("cordelia")
+        best_id = self.send_stream_message(
+            cordelia, "Verona", content="lunch lunch, and then more lunch", topic_name="lunch"
+        )
+        other_ids = [
+            self.send_stream_message(cordelia, "Verona", content=content, topic_name="plans")
+            for content in ["is lunch ready?", "nothing to see here", "lunch at noon"]
+        ]
+        self._update_tsvector_index()
+
+        narrow = [
+            dict(operator="sender", operand=cordelia.email),
+            dict(operator="search", operand="lunch"),
+        ]
+        params: dict[str, str | int] = dict(
+            narrow=orjson.dumps(narrow).decode(),
+            anchor="newest",
+            num_before=10,
+            num_after=0,
+            search_mode="ranked",
+        )
+        result = self.get_and_check_messages(params)
+        message_ids = [message["id"] for message in result["messages"]]
+        # The message with the most matches comes first, despite being
+        # the oldest, and the others follow newest first.
+        self.assertEqual(message_ids, [best_id, other_ids[2], other_ids[0]])
+        self.assertTrue(result["found_newest"])
+        self.assertTrue(result["found_oldest"])
+        self.assertEqual(
+            result["messages"][0]["match_content"],
+            '<p><span class="highlight">lunch</span> <span class="highlight">lunch</span>,'
+            ' and then more <span class="highlight">lunch</span></p>',
+        )
+
+        # The anchor bounds the candidates.
+        result = self.get_and_check_messages({**params, "anchor": other_ids[0], "num_before": 1})
+        self.assertEqual([message["id"] for message in result["messages"]], [best_id])
+        self.assertFalse(result["found_newest"])
+        self.assertFalse(result["found_oldest"])
+
+        result = self.client_get("/json/messages", {**params, "narrow": "[]"})
+        self.assert_json_error(result, "Ranked search requires a search term.")
+        result = self.client_get("/json/messages", {**params, "num_after": 1})
+        self.assert_json_error(result, "Unsupported parameter combination: num_after, search_mode")
+        result = self.client_get("/json/messages", {**params, "anchor": "first_unread"})
+        self.assert_json_error(result, "Unsupported parameter combination: anchor, search_mode")
+
+    def test_get_messages_with_cursor(self) -> None:
+        hamlet = self.example_user("hamlet")
+        self.login_user(hamlet)
+        self.make_stream("paginated")
+        self.subscribe(hamlet, "paginated")
+        message_ids = [self.send_stream_message(hamlet, "paginated") for _ in range(5)]
+        narrow = orjson.dumps([dict(operator="channel", operand="paginated")]).decode()
+
+        def fetch(params: dict[str, str | int]) -> dict[str, Any]:
+            result = self.client_get("/json/messages", {"narrow": narrow, **params})
+            return self.assert_json_success(result)
+
+        result = fetch(dict(anchor="newest", num_before=2, include_cursor="true"))
+        self.assertEqual([message["id"] for message in result["messages"]], message_ids[3:])
+        pages = [message_ids[1:3], message_ids[:1]]
+        for page in pages:
+            result = fetch(dict(cursor=result["next_cursor"], num_before=2))
+            self.assertEqual([message["id"] for message in result["messages"]], page)
+        self.assertTrue(result["found_oldest"])
+        self.assertIsNone(result["next_cursor"])
+
+        result = fetch(dict(anchor=message_ids[0], num_after=2, include_cursor="true"))
+        self.assertEqual([message["id"] for message in result["messages"]], message_ids[:3])
+        result = fetch(dict(cursor=result["next_cursor"], num_after=3))
+        self.assertEqual([message["id"] for message in result["messages"]], message_ids[2:])
+        self.assertTrue(result["found_newest"])
+        self.assertIsNone(result["next_cursor"])
+
+        # Responses only include a cursor when requested.
+        result = fetch(dict(anchor="newest", num_before=2))
+        self.assertNotIn("next_cursor", result)
+
+        older_cursor = fetch(dict(anchor="newest", num_before=2, include_cursor="true"))[
+            "next_cursor"
+        ]
+        result = self.client_get(
+            "/json/messages", {"narrow": "[]", "cursor": older_cursor, "num_before": 2}
+        )
+        self.assert_json_error(result, "Invalid cursor")
+        result = self.client_get(
+            "/json/messages", {"narrow": narrow, "cursor": "not a cursor", "num_before": 2}
+        )
+        self.assert_json_error(result, "Invalid cursor")
+        result = self.client_get(
+            "/json/messages", {"narrow": narrow, "cursor": older_cursor, "num_after": 2}
+        )
+        self.assert_json_error(result, "Unsupported parameter combination: cursor, num_after")
+        result = self.client_get(
+            "/json/messages",
+            {"narrow": narrow, "cursor": older_cursor, "anchor": "newest", "num_before": 2},
+        )
+        self.assert_json_error(result, "Unsupported parameter combination: anchor, cursor")
+        result = self.client_get(
+            "/json/messages",
+            {
+                "narrow": narrow,
+                "anchor": "newest",
+                "num_before": 2,
+                "num_after": 2,
+                "include_cursor": "true",
+            },
+        )
+        self.assert_json_error(
+            result, "Fetching with a cursor requires exactly one of num_before and num_after."
+        )
+
     @override_settings(USING_PGROONGA=False)
     def test_get_visible_messages_with_search(self) -> None:
         self.login("hamlet")
@@ -4249,6 +4456,7 @@ class GetOldMessagesTest(ZulipTestCase):
             num_before=10,
             num_after=10,
         )
+        assert isinstance(payload, HttpResponse)
         result = orjson.loads(payload.content)
         self.assertEqual(result["anchor"], first_message_id)
         self.assertEqual(result["found_newest"], True)
@@ -4291,6 +4499,7 @@ class GetOldMessagesTest(ZulipTestCase):
             num_before=10,
             num_after=10,
         )
+        assert isinstance(payload, HttpResponse)
         result = orjson.loads(payload.content)
         self.assertEqual(result["anchor"], first_message_id)
 
@@ -4309,6 +4518,7 @@ class GetOldMessagesTest(ZulipTestCase):
             num_before=10,
             num_after=10,
         )
+        assert isinstance(payload, HttpResponse)
         result = orjson.loads(payload.content)
         self.assertEqual(result["anchor"], 0)
 
@@ -4328,6 +4538,7 @@ class GetOldMessagesTest(ZulipTestCase):
             num_before=10,
             num_after=10,
         )
+        assert isinstance(payload, HttpResponse)
         result = orjson.loads(payload.content)
         self.assertEqual(result["anchor"], LARGER_THAN_MAX_MESSAGE_ID)
 
@@ -4347,6 +4558,7 @@ class GetOldMessagesTest(ZulipTestCase):
             num_before=10,
             num_after=10,
         )
+        assert isinstance(payload, HttpResponse)
         result = orjson.loads(payload.content)
         self.assertEqual(result["anchor"], 0)
 
@@ -4366,6 +4578,7 @@ class GetOldMessagesTest(ZulipTestCase):
             num_before=10,
             num_after=10,
         )
+        assert isinstance(payload, HttpResponse)
         result = orjson.loads(payload.content)
         self.assertEqual(result["anchor"], LARGER_THAN_MAX_MESSAGE_ID)
 
@@ -4779,6 +4992,37 @@ WHERE zerver_subscription.user_profile_id = {hamlet_id} AND zerver_subscription.
             {"anchor": 100, "num_before": 10, "num_after": 10}, sql
         )
 
+    def test_get_messages_streamed(self) -> None:
+        hamlet = self.login("hamlet")
+        params = dict(
+            anchor="newest",
+            num_before=10,
+            num_after=0,
+            narrow=orjson.dumps([dict(operator="channel", operand="Denmark")]).decode(),
+        )
+        for i in range(10):
+            self.send_stream_message(hamlet, "Denmark", f"message {i}")
+        result = self.client_get("/json/messages", params)
+        self.assert_json_success(result)
+        self.assertFalse(result.streaming)
+
+        # With more messages than fit in a chunk, the response is
+        # streamed, with exactly the same content.
+        with mock.patch("zerver.views.message_fetch.MESSAGES_STREAMING_CHUNK_SIZE", 3):
+            streamed_result = self.client_get("/json/messages", params)
+        self.assertTrue(streamed_result.streaming)
+        self.assertEqual(streamed_result["Content-Type"], "application/json")
+        self.assertEqual(b"".join(streamed_result.streaming_content), result.content)
+
+        # The streamed messages are generated in the view's
+        # transaction, so deleting a message before the body is
+        # written doesn't change it.
+        with mock.patch("zerver.views.message_fetch.MESSAGES_STREAMING_CHUNK_SIZE", 3):
+            streamed_result = self.client_get("/json/messages", params)
+        last_message = Message.objects.filter(sender=hamlet).latest("id")
+        do_delete_messages(hamlet.realm, [last_message], acting_user=None)
+        self.assertEqual(b"".join(streamed_result.streaming_content), result.content)
+
     def test_get_messages_with_narrow_queries(self) -> None:
         query_ids = self.get_query_ids()
         hamlet_email = self.example_user("hamlet").email
@@ -5018,12 +5262,8 @@ WHERE zerver_subscription.user_profile_id = {hamlet_id} AND zerver_subscription.
         query_ids = self.get_query_ids()
 
         sql_template = """\
-SELECT anon_1.message_id, anon_1.flags, anon_1.escaped_topic_name, anon_1.rendered_content, anon_1.content_matches, anon_1.topic_matches \n\
-FROM (SELECT message_id, flags, escape_html(subject) AS escaped_topic_name, rendered_content, array((SELECT ARRAY[sum(length(anon_3) - 11) OVER (ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) + 11, strpos(anon_3, '</ts-match>') - 1] AS anon_2 \n\
-FROM unnest(string_to_array(ts_headline('zulip.english_us_search', rendered_content, plainto_tsquery('zulip.english_us_search', 'jumping'), 'HighlightAll = TRUE, StartSel = <ts-match>, StopSel = </ts-match>'), '<ts-match>')) AS anon_3\n\
- LIMIT ALL OFFSET 1)) AS content_matches, array((SELECT ARRAY[sum(length(anon_5) - 11) OVER (ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) + 11, strpos(anon_5, '</ts-match>') - 1] AS anon_4 \n\
-FROM unnest(string_to_array(ts_headline('zulip.english_us_search', escape_html(subject), plainto_tsquery('zulip.english_us_search', 'jumping'), 'HighlightAll = TRUE, StartSel = <ts-match>, StopSel = </ts-match>'), '<ts-match>')) AS anon_5\n\
- LIMIT ALL OFFSET 1)) AS topic_matches \n\
+SELECT anon_1.message_id, anon_1.flags, anon_1.escaped_topic_name, anon_1.rendered_content \n\
+FROM (SELECT message_id, flags, escape_html(subject) AS escaped_topic_name, rendered_content \n\
 FROM zerver_usermessage JOIN zerver_message ON zerver_usermessage.message_id = zerver_message.id JOIN zerver_recipient ON zerver_message.recipient_id = zerver_recipient.id \n\
 WHERE user_profile_id = {hamlet_id} AND (zerver_recipient.type != 2 OR (EXISTS (SELECT  \n\
 FROM zerver_stream \n\
@@ -5038,12 +5278,8 @@ WHERE zerver_subscription.user_profile_id = {hamlet_id} AND zerver_subscription.
         )
 
         sql_template = """\
-SELECT anon_1.message_id, anon_1.escaped_topic_name, anon_1.rendered_content, anon_1.content_matches, anon_1.topic_matches \n\
-FROM (SELECT id AS message_id, escape_html(subject) AS escaped_topic_name, rendered_content, array((SELECT ARRAY[sum(length(anon_3) - 11) OVER (ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) + 11, strpos(anon_3, '</ts-match>') - 1] AS anon_2 \n\
-FROM unnest(string_to_array(ts_headline('zulip.english_us_search', rendered_content, plainto_tsquery('zulip.english_us_search', 'jumping'), 'HighlightAll = TRUE, StartSel = <ts-match>, StopSel = </ts-match>'), '<ts-match>')) AS anon_3\n\
- LIMIT ALL OFFSET 1)) AS content_matches, array((SELECT ARRAY[sum(length(anon_5) - 11) OVER (ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) + 11, strpos(anon_5, '</ts-match>') - 1] AS anon_4 \n\
-FROM unnest(string_to_array(ts_headline('zulip.english_us_search', escape_html(subject), plainto_tsquery('zulip.english_us_search', 'jumping'), 'HighlightAll = TRUE, StartSel = <ts-match>, StopSel = </ts-match>'), '<ts-match>')) AS anon_5\n\
- LIMIT ALL OFFSET 1)) AS topic_matches \n\
+SELECT anon_1.message_id, anon_1.escaped_topic_name, anon_1.rendered_content \n\
+FROM (SELECT id AS message_id, escape_html(subject) AS escaped_topic_name, rendered_content \n\
 FROM zerver_message \n\
 WHERE realm_id = 2 AND recipient_id = {scotland_recipient} AND (search_tsvector @@ plainto_tsquery('zulip.english_us_search', 'jumping')) ORDER BY zerver_message.id ASC \n\
  LIMIT 10) AS anon_1 ORDER BY message_id ASC\
@@ -5060,12 +5296,8 @@ WHERE realm_id = 2 AND recipient_id = {scotland_recipient} AND (search_tsvector
         )
 
         sql_template = """\
-SELECT anon_1.message_id, anon_1.flags, anon_1.escaped_topic_name, anon_1.rendered_content, anon_1.content_matches, anon_1.topic_matches \n\
-FROM (SELECT message_id, flags, escape_html(subject) AS escaped_topic_name, rendered_content, array((SELECT ARRAY[sum(length(anon_3) - 11) OVER (ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) + 11, strpos(anon_3, '</ts-match>') - 1] AS anon_2 \n\
-FROM unnest(string_to_array(ts_headline('zulip.english_us_search', rendered_content, plainto_tsquery('zulip.english_us_search', '"jumping" quickly'), 'HighlightAll = TRUE, StartSel = <ts-match>, StopSel = </ts-match>'), '<ts-match>')) AS anon_3\n\
- LIMIT ALL OFFSET 1)) AS content_matches, array((SELECT ARRAY[sum(length(anon_5) - 11) OVER (ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) + 11, strpos(anon_5, '</ts-match>') - 1] AS anon_4 \n\
-FROM unnest(string_to_array(ts_headline('zulip.english_us_search', escape_html(subject), plainto_tsquery('zulip.english_us_search', '"jumping" quickly'), 'HighlightAll = TRUE, StartSel = <ts-match>, StopSel = </ts-match>'), '<ts-match>')) AS anon_5\n\
- LIMIT ALL OFFSET 1)) AS topic_matches \n\
+SELECT anon_1.message_id, anon_1.flags, anon_1.escaped_topic_name, anon_1.rendered_content \n\
+FROM (SELECT message_id, flags, escape_html(subject) AS escaped_topic_name, rendered_content \n\
 FROM zerver_usermessage JOIN zerver_message ON zerver_usermessage.message_id = zerver_message.id JOIN zerver_recipient ON zerver_message.recipient_id = zerver_recipient.id \n\
 WHERE user_profile_id = {hamlet_id} AND (zerver_recipient.type != 2 OR (EXISTS (SELECT  \n\
 FROM zerver_stream \n\
@@ -5598,3 +5830,246 @@ class PersonalMessagesTest(ZulipTestCase):
             conversation_link=True,
         )
         self.assertEqual(url, "http://zulip.testserver/#narrow/dm/77,80/with/555")
+
+
+class NarrowQueryPlanTest(ZulipTestCase):
+    def get_channel_topic_messages(self, topic_name: str) -> None:
+        narrow = [
+            dict(operator="channel", operand="Denmark"),
+            dict(operator="topic", operand=topic_name),
+        ]
+        result = self.client_get(
+            "/json/messages",
+            dict(narrow=orjson.dumps(narrow).decode(), anchor="newest", num_before=10, num_after=0),
+        )
+        self.assert_json_success(result)
+
+    def test_narrow_query_shape(self) -> None:
+        self.assertEqual(narrow_query_shape(None), "(all messages)")
+        self.assertEqual(
+            narrow_query_shape(
+                [
+                    NarrowParameter(operator="topic", operand="lunch"),
+                    NarrowParameter(operator="stream", operand="Denmark"),
+                ]
+            ),
+            "channel topic",
+        )
+        self.assertEqual(
+            narrow_query_shape(
+                [
+                    NarrowParameter(operator="is", operand="unread"),
+                    NarrowParameter(operator="is", operand="muted", negated=True),
+                    NarrowParameter(operator="pm-with", operand="hamlet@zulip.com"),
+                ]
+            ),
+            "-is:muted dm is:unread",
+        )
+
+    def test_compiled_queries_shared_by_shape(self) -> None:
+        self.login("hamlet")
+        narrow_compiled_cache.clear()
+        self.get_channel_topic_messages("lunch")
+        cache_size = len(narrow_compiled_cache)
+        self.assertGreater(cache_size, 0)
+
+        self.get_channel_topic_messages("dinner")
+        self.assertEqual(len(narrow_compiled_cache), cache_size)
+
+    @override_settings(NARROW_EXPLAIN_SAMPLE_RATE=1.0, NARROW_EXPLAIN_SLOW_QUERY_TIME=0)
+    def test_record_slow_query_plans(self) -> None:
+        self.login("hamlet")
+        reset_narrow_query_plan_stats()
+        with self.assertLogs("zulip.narrow_query_plans", level="INFO") as logs:
+            self.get_channel_topic_messages("lunch")
+            self.get_channel_topic_messages("dinner")
+        self.assert_length(logs.output, 2)
+        self.assertIn("Slow narrow query", logs.output[0])
+
+        stats = get_narrow_query_plan_stats()
+        self.assertEqual(list(stats), ["channel topic"])
+        self.assertEqual(stats["channel topic"]["count"], 2)
+        self.assertTrue(any("zerver_message" in scan for scan in stats["channel topic"]["scans"]))
+
+        with mock.patch("builtins.print") as mock_print:
+            call_command("narrow_query_plans", "--reset")
+        self.assertTrue(mock_print.call_args_list[0][0][0].startswith("channel topic: 2 samples"))
+        self.assertEqual(get_narrow_query_plan_stats(), {})
+
+        # Fast queries aren't sampled.
+        with self.settings(NARROW_EXPLAIN_SLOW_QUERY_TIME=60):
+            self.get_channel_topic_messages("lunch")
+        self.assertEqual(get_narrow_query_plan_stats(), {})
+
+
+@override_settings(CACHE_MESSAGE_WINDOWS=True)
+class MessageWindowCacheTest(ZulipTestCase):
+    def get_message_ids(
+        self, narrow: list[dict[str, Any]], anchor: int | str = "newest", num_after: int = 0
+    ) -> tuple[list[int], bool]:
+        """Returns the IDs of the messages in the window, and whether the
+        database was queried for them."""
+        with queries_captured() as queries:
+            result = self.client_get(
+                "/json/messages",
+                dict(
+                    narrow=orjson.dumps(narrow).decode(),
+                    anchor=anchor,
+                    num_before=5,
+                    num_after=num_after,
+                ),
+            )
+        messages = self.assert_json_success(result)["messages"]
+        queried = any("/* get_messages */" in query.sql for query in queries)
+        return [message["id"] for message in messages], queried
+
+    def test_newest_window(self) -> None:
+        hamlet = self.login("hamlet")
+        narrow = [dict(operator="channel", operand="Denmark")]
+        message_ids, queried = self.get_message_ids(narrow)
+        self.assertTrue(queried)
+        self.assertEqual(self.get_message_ids(narrow), (message_ids, False))
+
+        # New messages invalidate windows which extend to the newest message.
+        message_id = self.send_stream_message(self.example_user("othello"), "Denmark")
+        new_message_ids, queried = self.get_message_ids(narrow)
+        self.assertTrue(queried)
+        self.assertEqual(new_message_ids, [*message_ids[1:], message_id])
+
+        # So do changes to the user's flags, for narrows on them.
+        starred_narrow = [dict(operator="is", operand="starred")]
+        starred_ids, queried = self.get_message_ids(starred_narrow)
+        self.assertNotIn(message_id, starred_ids)
+        self.assertEqual(self.get_message_ids(starred_narrow)[1], False)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.client_post(
+                "/json/messages/flags",
+                {"messages": orjson.dumps([message_id]).decode(), "op": "add", "flag": "starred"},
+            )
+        self.assert_json_success(result)
+        starred_ids, queried = self.get_message_ids(starred_narrow)
+        self.assertTrue(queried)
+        self.assertIn(message_id, starred_ids)
+
+        # And deleting messages.
+        self.get_message_ids(narrow)
+        self.login("iago")
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.client_delete(f"/json/messages/{message_id}")
+        self.assert_json_success(result)
+        self.login_user(hamlet)
+        self.assertEqual(self.get_message_ids(narrow), (message_ids, True))
+
+    def test_settled_window(self) -> None:
+        self.login("hamlet")
+        narrow = [dict(operator="channel", operand="Denmark")]
+        message_ids = [
+            self.send_stream_message(self.example_user("othello"), "Denmark") for i in range(3)
+        ]
+        Message.objects.filter(id__in=message_ids).update(
+            date_sent=timezone_now() - timedelta(minutes=10)
+        )
+
+        window, queried = self.get_message_ids(narrow, anchor=message_ids[0], num_after=1)
+        self.assertTrue(queried)
+        self.assertEqual(window[-2:], message_ids[:2])
+
+        # A new message doesn't change older windows.
+        self.send_stream_message(self.example_user("othello"), "Denmark")
+        self.assertEqual(
+            self.get_message_ids(narrow, anchor=message_ids[0], num_after=1), (window, False)
+        )
+
+        # But moving messages does.
+        self.login("iago")
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.client_patch(
+                f"/json/messages/{message_ids[1]}",
+                {"topic": "moved", "propagate_mode": "change_one"},
+            )
+        self.assert_json_success(result)
+        self.login("hamlet")
+        topic_narrow = [*narrow, dict(operator="topic", operand="moved")]
+        self.assertEqual(self.get_message_ids(topic_narrow)[0], [message_ids[1]])
+        self.assertTrue(self.get_message_ids(narrow, anchor=message_ids[0], num_after=1)[1])
+
+    def test_uncached_narrows(self) -> None:
+        self.login("hamlet")
+        narrow = [dict(operator="has", operand="reaction")]
+        self.assertTrue(self.get_message_ids(narrow)[1])
+        self.assertTrue(self.get_message_ids(narrow)[1])
+
+        with self.settings(CACHE_MESSAGE_WINDOWS=False):
+            narrow = [dict(operator="channel", operand="Denmark")]
+            self.assertTrue(self.get_message_ids(narrow)[1])
+            self.assertTrue(self.get_message_ids(narrow)[1])
+
+
+class SearchHighlightTest(ZulipTestCase):
+    def test_pgroonga_keywords(self) -> None:
+        self.assertEqual(get_pgroonga_keywords("can speak wiki"), ["can", "speak", "wiki"])
+        self.assertEqual(get_pgroonga_keywords("lunch OR dinner -breakfast"), ["lunch", "dinner"])
+        self.assertEqual(get_pgroonga_keywords("(bread & butter)"), ["bread", "&amp;", "butter"])
+        self.assertEqual(get_pgroonga_keywords('"french fries"'), ["&quot;french", "fries&quot;"])
+
+    def test_pgroonga_match_positions(self) -> None:
+        text = '<p><a href="https://en.wikipedia.org/wiki">Wikipedia wiki</a></p>'
+        self.assertEqual(
+            get_pgroonga_match_positions(text, ["wiki", "wikipedia"]),
+            [(23, 9), (37, 4), (43, 9), (53, 4)],
+        )
+        self.assertEqual(get_pgroonga_match_positions(text, []), [])
+
+    @override_settings(USING_PGROONGA=False)
+    def test_tsearch_matches_ts_headline(self) -> None:
+        def ts_headline_match_positions(text: str, operand: str) -> list[tuple[int, int]]:
+            # How the positions of matches were computed in the
+            # database, before highlighting moved to Python.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT array(
+                        SELECT ARRAY[
+                            sum(length(part) - 11) OVER (ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) + 11,
+                            strpos(part, '</ts-match>') - 1
+                        ]
+                        FROM unnest(string_to_array(ts_headline(
+                            'zulip.english_us_search', %s,
+                            plainto_tsquery('zulip.english_us_search', %s),
+                            'HighlightAll = TRUE, StartSel = <ts-match>, StopSel = </ts-match>'
+                        ), '<ts-match>')) AS part
+                        OFFSET 1
+                    )
+                    """,
+                    [text, operand],
+                )
+                [(locs,)] = cursor.fetchall()
+            return [(offset, length) for offset, length in locs]
+
+        texts = [
+            "<p>discuss lunch after lunch</p>",
+            "<p>The quick brown fox is Jumping over the lazy dogs</p>",
+            '<p><a href="https://google.com">https://google.com</a></p>',
+            "James&#39; burger",
+            "<p>James' <strong>burger</strong> &amp; fries</p>",
+            "<p>昨日、日本 のお菓子を送りました。</p>",
+            "<p>こんに ちは 。 今日は いい 天気ですね。</p>",
+            "<p>Mail othello@zulip.com about it</p>",
+        ]
+        operands = [
+            "lunch",
+            "discuss after",
+            "jump dog",
+            "https://google.com",
+            "burger",
+            "日本",
+            "ちは 今日は",
+            "othello@zulip.com",
+            "the",
+        ]
+        for operand in operands:
+            self.assertEqual(
+                get_search_match_positions(operand, texts),
+                [ts_headline_match_positions(text, operand) for text in texts],
+                operand,
+            )
@@ -1,19 +1,30 @@
+import itertools
+from datetime import timedelta
 from typing import TYPE_CHECKING, Any
 from unittest import mock
 
 import orjson
 from django.db import connection
+from django.test import override_settings
 from typing_extensions import override
 
-from zerver.actions.message_flags import do_update_message_flags
+from zerver.actions.message_flags import (
+    MarkAsReadProgress,
+    do_mark_all_as_read,
+    do_mark_stream_messages_as_read,
+    do_mark_stream_messages_as_read_in_batches,
+    do_update_message_flags,
+)
 from zerver.actions.streams import do_change_stream_group_based_setting, do_change_stream_permission
 from zerver.actions.user_groups import check_add_user_group
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
+from zerver.lib.cache import cache_get, unread_data_cache_key
 from zerver.lib.fix_unreads import fix, fix_unsubscribed
 from zerver.lib.message import (
     MessageDetailsDict,
     RawUnreadDirectMessageDict,
     RawUnreadMessagesResult,
+    UnreadDataCacheEntry,
     UnreadMessagesResult,
     add_message_to_unread_msgs,
     aggregate_unread_data,
@@ -22,8 +33,10 @@ from zerver.lib.message import (
     bulk_access_stream_messages_query,
     format_unread_message_details,
     get_raw_unread_data,
+    get_unread_data_cache_generation,
 )
 from zerver.lib.message_cache import MessageDict
+from zerver.lib.retention import move_messages_to_archive
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import get_subscription
 from zerver.lib.user_message import DEFAULT_HISTORICAL_FLAGS, create_historical_user_messages
@@ -982,10 +995,98 @@ class MarkAllAsReadEndpointTest(ZulipTestCase):
 
     def test_mark_all_as_read_timeout_response(self) -> None:
         self.login("hamlet")
-        with mock.patch("time.monotonic", side_effect=[10000, 10051]):
+        hamlet = self.example_user("hamlet")
+        self.send_personal_message(self.example_user("othello"), hamlet)
+        # The request times out immediately, and the deferred_work
+        # queue worker (which runs synchronously in tests) finishes up.
+        with (
+            mock.patch(
+                "time.monotonic",
+                side_effect=itertools.chain([10000, 10051], itertools.repeat(20000)),
+            ),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
             result = self.client_post("/json/mark_all_as_read", {})
             result_dict = self.assert_json_success(result)
             self.assertFalse(result_dict["complete"])
+        self.assertFalse(
+            UserMessage.objects.filter(user_profile=hamlet)
+            .extra(where=[UserMessage.where_unread()])  # noqa: S610
+            .exists()
+        )
+
+    @mock.patch("zerver.actions.message_flags.MARK_AS_READ_BATCH_SIZE", 2)
+    def test_mark_all_as_read_batches(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        do_mark_all_as_read(hamlet)
+        message_ids = [self.send_personal_message(othello, hamlet) for i in range(3)]
+
+        with self.capture_send_event_calls(expected_num_events=3) as events:
+            self.assertEqual(do_mark_all_as_read(hamlet), 3)
+        self.assertEqual(
+            [(event["event"]["messages"], event["event"]["all"]) for event in events],
+            [(message_ids[:2], False), (message_ids[2:], False), ([], True)],
+        )
+
+
+class MarkStreamAsReadInBatchesTest(ZulipTestCase):
+    @mock.patch("zerver.actions.message_flags.MARK_AS_READ_BATCH_SIZE", 2)
+    def test_batches_and_resume(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        stream = get_stream("Denmark", hamlet.realm)
+        assert stream.recipient_id is not None
+        do_mark_stream_messages_as_read(hamlet, stream.recipient_id)
+        message_ids = [self.send_stream_message(othello, "Denmark") for i in range(5)]
+
+        # Time out after the first batch.
+        with mock.patch("time.monotonic", side_effect=[10000, 10000, 10051]):
+            progress = do_mark_stream_messages_as_read_in_batches(
+                hamlet, stream.recipient_id, timeout=50
+            )
+        self.assertEqual(
+            progress, MarkAsReadProgress(count=2, last_message_id=message_ids[1], complete=False)
+        )
+
+        with self.capture_send_event_calls(expected_num_events=2) as events:
+            progress = do_mark_stream_messages_as_read_in_batches(
+                hamlet, stream.recipient_id, after_message_id=progress.last_message_id
+            )
+        self.assertTrue(progress.complete)
+        self.assertEqual(progress.count, 3)
+        self.assertEqual(
+            [event["event"]["messages"] for event in events], [message_ids[2:4], message_ids[4:]]
+        )
+        self.assertFalse(
+            UserMessage.objects.filter(user_profile=hamlet, message_id__in=message_ids)
+            .extra(where=[UserMessage.where_unread()])  # noqa: S610
+            .exists()
+        )
+
+    def test_deferred_resume(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        stream = get_stream("Denmark", hamlet.realm)
+        message_ids = [self.send_stream_message(othello, "Denmark") for i in range(3)]
+
+        self.login_user(hamlet)
+        # The request processes nothing before timing out; the
+        # deferred_work queue worker (synchronous in tests) resumes.
+        with (
+            mock.patch(
+                "time.monotonic",
+                side_effect=itertools.chain([10000, 10051], itertools.repeat(20000)),
+            ),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            result = self.client_post("/json/mark_stream_as_read", {"stream_id": stream.id})
+        self.assert_json_success(result)
+        self.assertFalse(
+            UserMessage.objects.filter(user_profile=hamlet, message_id__in=message_ids)
+            .extra(where=[UserMessage.where_unread()])  # noqa: S610
+            .exists()
+        )
 
 
 class GetUnreadMsgsTest(ZulipTestCase):
@@ -1533,7 +1634,104 @@ class GetUnreadMsgsTest(ZulipTestCase):
         self.assertEqual(result["mentions"], [])
 
 
-class MessageAccessTests(ZulipTestCase):
+@override_settings(CACHE_UNREAD_MESSAGE_DATA=True)
+class UnreadDataCacheTest(ZulipTestCase):
+    def get_cache_entry(self, user_profile: UserProfile) -> UnreadDataCacheEntry | None:
+        cache_key = unread_data_cache_key(
+            user_profile.id, get_unread_data_cache_generation(user_profile)
+        )
+        cached = cache_get(cache_key)
+        return cached[0] if cached is not None else None
+
+    def assert_matches_uncached(self, user_profile: UserProfile) -> RawUnreadMessagesResult:
+        raw_unread_data = get_raw_unread_data(user_profile)
+        with self.settings(CACHE_UNREAD_MESSAGE_DATA=False):
+            self.assertEqual(raw_unread_data, get_raw_unread_data(user_profile))
+        return raw_unread_data
+
+    def test_recent_messages_not_cached(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        message_id = self.send_stream_message(othello, "Denmark", "hello")
+
+        raw_unread_data = self.assert_matches_uncached(hamlet)
+        self.assertIn(message_id, raw_unread_data["stream_dict"])
+
+        entry = self.get_cache_entry(hamlet)
+        assert entry is not None
+        self.assertLess(entry["max_message_id"], message_id)
+        self.assertNotIn(message_id, entry["raw_unread_data"]["stream_dict"])
+
+    @mock.patch("zerver.lib.message.UNREAD_DATA_CACHE_SETTLE_TIME", timedelta(0))
+    def test_cache_updates_and_invalidation(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        message_ids = [
+            self.send_stream_message(othello, "Denmark", "hello", topic_name="cached"),
+            self.send_personal_message(othello, hamlet),
+        ]
+
+        self.assert_matches_uncached(hamlet)
+        entry = self.get_cache_entry(hamlet)
+        assert entry is not None
+        self.assertEqual(entry["max_message_id"], message_ids[-1])
+        self.assertIn(message_ids[0], entry["raw_unread_data"]["stream_dict"])
+
+        # Newer messages are added to the existing entry.
+        message_ids.append(self.send_stream_message(othello, "Denmark", "again"))
+        self.assertIn(message_ids[-1], self.assert_matches_uncached(hamlet)["stream_dict"])
+        entry = self.get_cache_entry(hamlet)
+        assert entry is not None
+        self.assertEqual(entry["max_message_id"], message_ids[-1])
+
+        # Marking messages as read invalidates the entry.
+        with self.captureOnCommitCallbacks(execute=True):
+            do_update_message_flags(hamlet, "add", "read", message_ids[1:2])
+        self.assertIsNone(self.get_cache_entry(hamlet))
+        raw_unread_data = self.assert_matches_uncached(hamlet)
+        self.assertNotIn(message_ids[1], raw_unread_data["pm_dict"])
+
+        # As does muting the topic.
+        self.assertIn(message_ids[0], raw_unread_data["unmuted_stream_msgs"])
+        with self.captureOnCommitCallbacks(execute=True):
+            do_set_user_topic_visibility_policy(
+                hamlet,
+                get_stream("Denmark", hamlet.realm),
+                "cached",
+                visibility_policy=UserTopic.VisibilityPolicy.MUTED,
+            )
+        raw_unread_data = self.assert_matches_uncached(hamlet)
+        self.assertNotIn(message_ids[0], raw_unread_data["unmuted_stream_msgs"])
+
+        # Moving messages invalidates the entry for their recipients.
+        self.assertIsNotNone(self.get_cache_entry(hamlet))
+        self.login("iago")
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.client_patch(
+                f"/json/messages/{message_ids[0]}",
+                {"topic": "moved", "propagate_mode": "change_one"},
+            )
+        self.assert_json_success(result)
+        self.assertIsNone(self.get_cache_entry(hamlet))
+        raw_unread_data = self.assert_matches_uncached(hamlet)
+        self.assertEqual(raw_unread_data["stream_dict"][message_ids[0]]["topic"], "moved")
+
+    @mock.patch("zerver.lib.message.UNREAD_DATA_CACHE_SETTLE_TIME", timedelta(0))
+    def test_archiving_invalidates_recipients_only(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        cordelia = self.example_user("cordelia")
+        message_id = self.send_personal_message(othello, hamlet)
+        self.assert_matches_uncached(hamlet)
+        self.assert_matches_uncached(cordelia)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            move_messages_to_archive([message_id])
+        self.assertIsNone(self.get_cache_entry(hamlet))
+        self.assertNotIn(message_id, self.assert_matches_uncached(hamlet)["pm_dict"])
+        # Users who didn't receive the message keep their cached data.
+        self.assertIsNotNone(self.get_cache_entry(cordelia))
+
     def test_update_invalid_flags(self) -> None:
         message = self.send_personal_message(
             self.example_user("cordelia"),
@@ -1346,6 +1346,39 @@ class MessageMoveTopicTest(ZulipTestCase):
         self.check_topic(id5, topic_name="edited")
         self.check_topic(id6, topic_name="topic3")
 
+    @mock.patch("zerver.lib.topic.MESSAGE_MOVE_BATCH_SIZE", 2)
+    def test_propagate_all_topics_in_batches(self) -> None:
+        self.login("hamlet")
+        hamlet = self.example_user("hamlet")
+        message_ids = [
+            self.send_stream_message(hamlet, "Denmark", topic_name="topic1") for i in range(6)
+        ]
+        other_id = self.send_stream_message(hamlet, "Denmark", topic_name="topic2")
+
+        with self.assertLogs("zerver.lib.topic", "INFO") as logs:
+            result = self.client_patch(
+                f"/json/messages/{message_ids[1]}",
+                {
+                    "topic": "edited",
+                    "propagate_mode": "change_all",
+                },
+            )
+        self.assert_json_success(result)
+        self.assertEqual(
+            logs.output,
+            [
+                f"INFO:zerver.lib.topic:Moved {count}/5 messages from message {message_ids[1]}'s topic"
+                for count in [2, 4, 5]
+            ],
+        )
+
+        for message_id in message_ids:
+            self.check_topic(message_id, topic_name="edited")
+            message = Message.objects.get(id=message_id)
+            edit_history = orjson.loads(assert_is_not_none(message.edit_history))
+            self.assertEqual(edit_history[0]["prev_topic"], "topic1")
+        self.check_topic(other_id, topic_name="topic2")
+
     def test_propagate_all_topics_with_different_uppercase_letters(self) -> None:
         self.login("hamlet")
         id1 = self.send_stream_message(self.example_user("hamlet"), "Denmark", topic_name="topic1")
@@ -59,6 +59,7 @@ from zerver.lib.test_helpers import (
     message_stream_count,
     most_recent_message,
     most_recent_usermessage,
+    queries_captured,
     reset_email_visibility_to_everyone_in_zulip_realm,
 )
 from zerver.lib.timestamp import datetime_to_timestamp
@@ -1437,6 +1438,128 @@ class MessagePOSTTest(ZulipTestCase):
         self.assert_json_success(result)
 
 
+class MessageBatchPOSTTest(ZulipTestCase):
+    def send_batch(self, user: UserProfile, messages: list[dict[str, Any]]) -> dict[str, Any]:
+        result = self.api_post(
+            user, "/api/v1/messages/batch", {"messages": orjson.dumps(messages).decode()}
+        )
+        return self.assert_json_success(result)
+
+    def test_send_batch(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        stream = get_stream("Verona", hamlet.realm)
+
+        messages = [
+            {"type": "channel", "to": "Verona", "topic": "batch", "content": "First"},
+            {"type": "stream", "to": stream.id, "topic": "batch", "content": "Second"},
+            {"type": "channel", "to": ["Verona"], "topic": "batch", "content": "Third"},
+            {"type": "channel", "to": [stream.id], "topic": "batch", "content": "Fourth"},
+            {"type": "direct", "to": [othello.id], "content": "Fifth"},
+            {"type": "private", "to": othello.email, "content": "Sixth"},
+        ]
+        results = self.send_batch(hamlet, messages)["messages"]
+        self.assert_length(results, 6)
+
+        for message, message_result in zip(messages, results, strict=True):
+            self.assertEqual(message_result["result"], "success")
+            sent_message = Message.objects.get(id=message_result["id"])
+            self.assertEqual(sent_message.sender_id, hamlet.id)
+            self.assertEqual(sent_message.content, message["content"])
+
+        ids = [message_result["id"] for message_result in results]
+        self.assertEqual(ids, sorted(ids))
+        for message_id in ids[1:4]:
+            self.assertEqual(Message.objects.get(id=message_id).recipient_id, stream.recipient_id)
+
+    def test_send_batch_with_errors(self) -> None:
+        hamlet = self.example_user("hamlet")
+        messages = [
+            {"type": "channel", "to": "Verona", "topic": "batch", "content": "First"},
+            {"type": "channel", "to": "nonexistent", "topic": "batch", "content": "Second"},
+            {"type": "channel", "to": "Verona", "content": "Third"},
+            {"type": "channel", "to": ["Verona", "Denmark"], "topic": "t", "content": "Fourth"},
+            {"type": "channel", "to": "Verona", "topic": "batch", "content": "Fifth"},
+        ]
+        results = self.send_batch(hamlet, messages)["messages"]
+        self.assertEqual([r["result"] for r in results], ["success", *["error"] * 3, "success"])
+        self.assertEqual(results[1]["code"], "STREAM_DOES_NOT_EXIST")
+        self.assertEqual(results[1]["msg"], "Channel 'nonexistent' does not exist")
+        self.assertEqual(results[2]["msg"], "Missing topic")
+        self.assertEqual(results[3]["msg"], "Expected exactly one channel")
+        self.assertEqual(Message.objects.get(id=results[4]["id"]).content, "Fifth")
+
+        # A batch in which every message fails sends nothing.
+        last_message_id = self.get_last_message().id
+        results = self.send_batch(hamlet, messages[1:4])["messages"]
+        self.assertEqual([r["result"] for r in results], ["error"] * 3)
+        self.assertEqual(self.get_last_message().id, last_message_id)
+
+    def test_send_batch_permissions_checked_per_stream(self) -> None:
+        polonius = self.example_user("polonius")
+        self.make_stream("public stream", invite_only=False)
+        self.subscribe(polonius, "Verona")
+
+        messages = [
+            {"type": "channel", "to": "Verona", "topic": "batch", "content": "First"},
+            {"type": "channel", "to": "public stream", "topic": "batch", "content": "Second"},
+            {"type": "channel", "to": "Verona", "topic": "batch", "content": "Third"},
+            {"type": "channel", "to": "public stream", "topic": "batch", "content": "Fourth"},
+        ]
+        results = self.send_batch(polonius, messages)["messages"]
+        self.assertEqual([r["result"] for r in results], ["success", "error", "success", "error"])
+        self.assertEqual(results[3]["msg"], "Not authorized to send to channel 'public stream'")
+
+    def test_send_batch_shares_lookups(self) -> None:
+        hamlet = self.example_user("hamlet")
+        self.subscribe(hamlet, "Verona")
+
+        def send(count: int) -> int:
+            messages = [
+                {"type": "channel", "to": "Verona", "topic": "batch", "content": f"Message {i}"}
+                for i in range(count)
+            ]
+            flush_per_request_caches()
+            with queries_captured() as queries:
+                self.send_batch(hamlet, messages)
+            return len(queries)
+
+        # Rendering and recipient lookups are shared, so the batch
+        # costs far fewer queries than sending each message alone.
+        one_message_queries = send(1)
+        ten_message_queries = send(10)
+        self.assertLess(ten_message_queries, 4 * one_message_queries)
+
+    def test_send_batch_read_by_sender(self) -> None:
+        hamlet = self.example_user("hamlet")
+        messages = [
+            {"type": "channel", "to": "Verona", "topic": "batch", "content": f"Message {i}"}
+            for i in range(2)
+        ]
+        result = self.api_post(
+            hamlet,
+            "/api/v1/messages/batch",
+            {"messages": orjson.dumps(messages).decode(), "read_by_sender": "true"},
+        )
+        for message_result in self.assert_json_success(result)["messages"]:
+            um = UserMessage.objects.get(user_profile=hamlet, message_id=message_result["id"])
+            self.assertTrue(um.flags.read)
+
+    def test_send_batch_invalid(self) -> None:
+        hamlet = self.example_user("hamlet")
+        result = self.api_post(hamlet, "/api/v1/messages/batch", {"messages": "[]"})
+        self.assert_json_error(result, "No messages to send.")
+
+        messages = [
+            {"type": "channel", "to": "Verona", "topic": "batch", "content": f"Message {i}"}
+            for i in range(101)
+        ]
+        result = self.api_post(
+            hamlet, "/api/v1/messages/batch", {"messages": orjson.dumps(messages).decode()}
+        )
+        self.assert_json_error(result, "Too many messages in batch; the maximum is 100.")
+
+
 class StreamMessagesTest(ZulipTestCase):
     def assert_stream_message(
         self, stream_name: str, topic_name: str = "test topic", content: str = "test content"
@@ -1565,7 +1688,7 @@ class StreamMessagesTest(ZulipTestCase):
             setting_value=UserProfile.AUTOMATICALLY_CHANGE_VISIBILITY_POLICY_NEVER,
             acting_user=None,
         )
-        with self.assert_database_query_count(14):
+        with self.assert_database_query_count(15):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1585,7 +1708,7 @@ class StreamMessagesTest(ZulipTestCase):
         # 5 queries: 1 to check if it is the first message in the topic +
         # 1 to check if the topic is already followed + 3 to follow the topic.
         flush_per_request_caches()
-        with self.assert_database_query_count(19):
+        with self.assert_database_query_count(20):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1605,7 +1728,7 @@ class StreamMessagesTest(ZulipTestCase):
         # a message to a topic with visibility policy other than FOLLOWED.
         # 1 to check if the topic is already followed + 3 queries to follow the topic.
         flush_per_request_caches()
-        with self.assert_database_query_count(18):
+        with self.assert_database_query_count(19):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1616,7 +1739,7 @@ class StreamMessagesTest(ZulipTestCase):
         # If the topic is already FOLLOWED, there will be an increase in the query
         # count of 1 to check if the topic is already followed.
         flush_per_request_caches()
-        with self.assert_database_query_count(15):
+        with self.assert_database_query_count(16):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1641,7 +1764,7 @@ class StreamMessagesTest(ZulipTestCase):
         # 1 to get the user_id of the mentioned user + 1 to check if the topic
         # is already followed + 3 queries to follow the topic.
         flush_per_request_caches()
-        with self.assert_database_query_count(23):
+        with self.assert_database_query_count(24):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1654,7 +1777,7 @@ class StreamMessagesTest(ZulipTestCase):
         # 1 to get the user_id of the mentioned user + 1 to check if the topic is
         # already followed.
         flush_per_request_caches()
-        with self.assert_database_query_count(20):
+        with self.assert_database_query_count(21):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1664,7 +1787,7 @@ class StreamMessagesTest(ZulipTestCase):
             )
 
         flush_per_request_caches()
-        with self.assert_database_query_count(17):
+        with self.assert_database_query_count(18):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1687,7 +1810,7 @@ class StreamMessagesTest(ZulipTestCase):
         )
         flush_per_request_caches()
 
-        with self.assert_database_query_count(18):
+        with self.assert_database_query_count(19):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
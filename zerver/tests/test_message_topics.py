@@ -2,14 +2,18 @@ import time
 from unittest import mock
 
 import orjson
+from django.core.management import call_command
 from django.utils.timezone import now as timezone_now
 
+from zerver.actions.message_delete import do_delete_messages
 from zerver.actions.streams import do_change_stream_permission
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
 from zerver.lib.events import ClientCapabilities, do_events_register
+from zerver.lib.retention import restore_all_data_from_archive
 from zerver.lib.test_classes import ZulipTestCase
+from zerver.lib.topic_summaries import rebuild_topic_summaries
 from zerver.lib.user_topics import set_topic_visibility_policy, topic_has_visibility_policy
-from zerver.models import Message, UserMessage, UserTopic
+from zerver.models import Message, Stream, TopicSummary, UserMessage, UserTopic
 from zerver.models.clients import get_client
 from zerver.models.realms import get_realm
 from zerver.models.streams import get_stream
@@ -66,6 +70,10 @@ class TopicHistoryTest(ZulipTestCase):
         topic1_msg_id = create_test_message("topic1")
         topic0_msg_id = create_test_message("topic0")
 
+        # These messages were created without going through the send
+        # path, which maintains the topic summaries.
+        rebuild_topic_summaries(stream.realm_id, stream.recipient_id)
+
         endpoint = f"/json/users/me/{stream.id}/topics"
         result = self.client_get(endpoint, {})
         history = self.assert_json_success(result)["topics"]
@@ -201,6 +209,93 @@ class TopicHistoryTest(ZulipTestCase):
         self.assert_json_error(result, "Invalid channel ID", 400)
 
 
+class TopicSummaryTest(ZulipTestCase):
+    def get_summaries(self, stream: Stream) -> dict[str, tuple[int, int]]:
+        return {
+            summary.topic_name: (summary.max_message_id, summary.message_count)
+            for summary in TopicSummary.objects.filter(recipient_id=stream.recipient_id)
+        }
+
+    def test_send_move_and_delete(self) -> None:
+        hamlet = self.example_user("hamlet")
+        iago = self.example_user("iago")
+        stream = self.make_stream("summaries")
+        other_stream = self.make_stream("other summaries")
+        self.subscribe(hamlet, stream.name)
+        self.subscribe(hamlet, other_stream.name)
+        self.subscribe(iago, stream.name)
+        self.subscribe(iago, other_stream.name)
+
+        first_id = self.send_stream_message(hamlet, stream.name, topic_name="lunch")
+        second_id = self.send_stream_message(hamlet, stream.name, topic_name="Lunch")
+        third_id = self.send_stream_message(hamlet, stream.name, topic_name="lunch")
+        dinner_id = self.send_stream_message(hamlet, stream.name, topic_name="dinner")
+        self.send_personal_message(hamlet, iago)
+        self.assertEqual(
+            self.get_summaries(stream),
+            {"lunch": (third_id, 2), "Lunch": (second_id, 1), "dinner": (dinner_id, 1)},
+        )
+
+        # Moving a topic moves all of its casings.
+        self.login_user(iago)
+        result = self.client_patch(
+            f"/json/messages/{first_id}",
+            {
+                "topic": "brunch",
+                "propagate_mode": "change_all",
+                "send_notification_to_old_thread": "false",
+                "send_notification_to_new_thread": "false",
+            },
+        )
+        self.assert_json_success(result)
+        self.assertEqual(
+            self.get_summaries(stream),
+            {"brunch": (third_id, 3), "dinner": (dinner_id, 1)},
+        )
+
+        result = self.client_patch(
+            f"/json/messages/{dinner_id}",
+            {
+                "stream_id": other_stream.id,
+                "propagate_mode": "change_one",
+                "send_notification_to_old_thread": "false",
+                "send_notification_to_new_thread": "false",
+            },
+        )
+        self.assert_json_success(result)
+        self.assertEqual(self.get_summaries(stream), {"brunch": (third_id, 3)})
+        self.assertEqual(self.get_summaries(other_stream), {"dinner": (dinner_id, 1)})
+
+        # Deleting the latest message in a topic updates its max ID.
+        do_delete_messages(iago.realm, [Message.objects.get(id=third_id)], acting_user=None)
+        self.assertEqual(self.get_summaries(stream), {"brunch": (second_id, 2)})
+
+        result = self.client_get(f"/json/users/me/{stream.id}/topics")
+        self.assertEqual(
+            self.assert_json_success(result)["topics"], [dict(name="brunch", max_id=second_id)]
+        )
+
+        # Restoring the message restores the summary.
+        restore_all_data_from_archive()
+        self.assertEqual(self.get_summaries(stream), {"brunch": (third_id, 3)})
+
+    def test_rebuild_topic_summaries(self) -> None:
+        hamlet = self.example_user("hamlet")
+        stream = get_stream("Verona", hamlet.realm)
+        message_id = self.send_stream_message(hamlet, stream.name, topic_name="rebuilt")
+        self.assertEqual(self.get_summaries(stream)["rebuilt"], (message_id, 1))
+
+        Message.objects.filter(id=message_id).update(subject="edited in the database")
+        self.assertNotIn("edited in the database", self.get_summaries(stream))
+
+        with mock.patch("builtins.print") as mock_print:
+            call_command("rebuild_topic_summaries", "--realm", "zulip", "--stream", "Verona")
+        mock_print.assert_called_once_with("Rebuilt the topic summaries of #Verona.")
+        summaries = self.get_summaries(stream)
+        self.assertNotIn("rebuilt", summaries)
+        self.assertEqual(summaries["edited in the database"], (message_id, 1))
+
+
 class TopicDeleteTest(ZulipTestCase):
     def test_topic_delete(self) -> None:
         initial_last_msg_id = self.get_last_message().id
@@ -2,18 +2,22 @@ from datetime import datetime, timedelta
 from typing import Any
 from unittest import mock
 
+import redis
 import time_machine
 from django.conf import settings
 from django.db import connection
+from django.test import override_settings
 from django.utils.timezone import now as timezone_now
 from typing_extensions import override
 
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.users import do_deactivate_user
 from zerver.lib.presence import format_legacy_presence_dict, get_presence_dict_by_realm
+from zerver.lib.presence_store import clear_presence_store, presence_store
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import make_client, reset_email_visibility_to_everyone_in_zulip_realm
 from zerver.lib.timestamp import datetime_to_timestamp
+from zerver.lib.write_coalescing import get_coalesced_writes, reset_coalesced_writes
 from zerver.models import PushDeviceToken, UserActivityInterval, UserPresence, UserProfile
 from zerver.models.realms import get_realm
 
@@ -659,6 +663,127 @@ class UserPresenceTests(ZulipTestCase):
                 self.client_post("/json/users/me/presence", {"status": "idle"})
             )
 
+    @override_settings(PRESENCE_WRITE_COALESCING=True)
+    def test_presence_write_coalescing(self) -> None:
+        hamlet = self.example_user("hamlet")
+        self.login_user(hamlet)
+        UserPresence.objects.filter(user_profile=hamlet).delete()
+        reset_coalesced_writes()
+
+        time_zero = timezone_now().replace(microsecond=0)
+        with time_machine.travel(time_zero, tick=False):
+            self.assert_json_success(
+                self.client_post(
+                    "/json/users/me/presence", {"status": "active", "ping_only": "true"}
+                )
+            )
+
+        # Heartbeats within PRESENCE_UPDATE_MIN_FREQ_SECONDS wouldn't
+        # change anything, so they skip its transaction entirely.
+        with (
+            time_machine.travel(time_zero + timedelta(seconds=30), tick=False),
+            mock.patch("zerver.actions.presence.do_update_user_presence") as mock_update,
+        ):
+            self.assert_json_success(
+                self.client_post(
+                    "/json/users/me/presence", {"status": "active", "ping_only": "true"}
+                )
+            )
+        mock_update.assert_not_called()
+        self.assertEqual(get_coalesced_writes(), {"presence": 1})
+
+        # After the window, the update is written.
+        later = time_zero + timedelta(seconds=settings.PRESENCE_UPDATE_MIN_FREQ_SECONDS + 5)
+        with time_machine.travel(later, tick=False):
+            self.assert_json_success(
+                self.client_post("/json/users/me/presence", {"status": "idle", "ping_only": "true"})
+            )
+        presence = UserPresence.objects.get(user_profile=hamlet)
+        self.assertEqual(presence.last_active_time, time_zero)
+        self.assertEqual(presence.last_connected_time, later)
+
+        # Becoming active again is never coalesced with idle heartbeats.
+        with time_machine.travel(later + timedelta(seconds=5), tick=False):
+            self.assert_json_success(
+                self.client_post(
+                    "/json/users/me/presence", {"status": "active", "ping_only": "true"}
+                )
+            )
+        presence = UserPresence.objects.get(user_profile=hamlet)
+        self.assertEqual(presence.last_active_time, later + timedelta(seconds=5))
+        self.assertEqual(get_coalesced_writes(), {"presence": 1})
+
+    @override_settings(PRESENCE_REDIS_STORE=True)
+    def test_presence_store(self) -> None:
+        realm = get_realm("zulip")
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        UserPresence.objects.filter(realm=realm).delete()
+        clear_presence_store(realm.id)
+
+        # Updates aren't written to a store which hasn't been loaded.
+        self.login_user(hamlet)
+        self.assert_json_success(self.client_post("/json/users/me/presence", {"status": "active"}))
+        self.assertIsNone(presence_store.read(realm.id))
+
+        # The first read loads the store from the database.
+        presence_dct, last_update_id = get_presence_dict_by_realm(realm, slim_presence=True)
+        self.assertEqual(presence_dct.keys(), {str(hamlet.id)})
+        hamlet_last_update_id = UserPresence.objects.get(user_profile=hamlet).last_update_id
+        self.assertEqual(last_update_id, hamlet_last_update_id)
+
+        # Updates are now written to the store, and deltas are served
+        # from it without querying the database.  They also include
+        # the last few updates the client already has, in case an
+        # earlier update reached the store late.
+        self.login_user(othello)
+        self.assert_json_success(self.client_post("/json/users/me/presence", {"status": "idle"}))
+        othello_presence = UserPresence.objects.get(user_profile=othello)
+        with self.assert_database_query_count(0, keep_cache_warm=True):
+            presence_dct, last_update_id = get_presence_dict_by_realm(
+                realm, slim_presence=True, last_update_id_fetched_by_client=hamlet_last_update_id
+            )
+        self.assertEqual(presence_dct.keys(), {str(hamlet.id), str(othello.id)})
+        self.assertEqual(
+            presence_dct[str(othello.id)],
+            dict(
+                active_timestamp=datetime_to_timestamp(othello.date_joined),
+                idle_timestamp=datetime_to_timestamp(othello_presence.last_connected_time),
+            ),
+        )
+        self.assertEqual(last_update_id, othello_presence.last_update_id)
+        with mock.patch("zerver.lib.presence_store.PRESENCE_STORE_DELTA_LAG", 0):
+            presence_dct, last_update_id = get_presence_dict_by_realm(
+                realm, slim_presence=True, last_update_id_fetched_by_client=hamlet_last_update_id
+            )
+        self.assertEqual(presence_dct.keys(), {str(othello.id)})
+
+        # The results match the database query's.
+        with self.settings(PRESENCE_REDIS_STORE=False):
+            expected = get_presence_dict_by_realm(realm, slim_presence=True)
+        self.assertEqual(get_presence_dict_by_realm(realm, slim_presence=True), expected)
+
+        # Deactivated users are excluded.
+        do_deactivate_user(othello, acting_user=None)
+        presence_dct, last_update_id = get_presence_dict_by_realm(realm, slim_presence=True)
+        self.assertEqual(presence_dct.keys(), {str(hamlet.id)})
+
+        # If Redis is unavailable, we fall back to the database.
+        with (
+            mock.patch("zerver.lib.redis_snapshot.READ_SCRIPT", side_effect=redis.ConnectionError),
+            self.assertLogs("zerver.lib.presence", level="ERROR"),
+        ):
+            presence_dct, last_update_id = get_presence_dict_by_realm(realm, slim_presence=True)
+        self.assertEqual(presence_dct.keys(), {str(hamlet.id)})
+
+        # So we do if the store is cleared again while we load it.
+        clear_presence_store(realm.id)
+        with mock.patch(
+            "zerver.lib.presence_store.load_presence_store", side_effect=clear_presence_store
+        ):
+            presence_dct, last_update_id = get_presence_dict_by_realm(realm, slim_presence=True)
+        self.assertEqual(presence_dct.keys(), {str(hamlet.id)})
+
 
 class SingleUserPresenceTests(ZulipTestCase):
     def test_email_access(self) -> None:
@@ -21,7 +21,13 @@ from zerver.lib.remote_server import PushNotificationBouncerRetryLaterError
 from zerver.lib.send_email import EmailNotDeliveredError, FromAddress
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import mock_queue_publish
-from zerver.models import ScheduledMessageNotificationEmail, UserActivity, UserProfile
+from zerver.lib.write_coalescing import get_coalesced_writes, reset_coalesced_writes
+from zerver.models import (
+    ScheduledMessageNotificationEmail,
+    UserActivity,
+    UserActivityInterval,
+    UserProfile,
+)
 from zerver.models.clients import get_client
 from zerver.models.realms import get_realm
 from zerver.models.scheduled_jobs import NotificationTriggers
@@ -34,6 +40,7 @@ from zerver.worker.embed_links import FetchLinksEmbedData
 from zerver.worker.missedmessage_emails import MissedMessageWorker
 from zerver.worker.missedmessage_mobile_notifications import PushNotificationsWorker
 from zerver.worker.user_activity import UserActivityWorker
+from zerver.worker.user_activity_interval import UserActivityIntervalWorker
 
 Event: TypeAlias = dict[str, Any]
 
@@ -209,6 +216,68 @@ class WorkerTest(ZulipTestCase):
             activity_records[4].last_visit, datetime.fromtimestamp(now + 45, tz=timezone.utc)
         )
 
+    def test_useractivityinterval_worker(self) -> None:
+        fake_client = FakeClient()
+
+        user = self.example_user("hamlet")
+        other_user = self.example_user("iago")
+        UserActivityInterval.objects.filter(user_profile__in=[user.id, other_user.id]).delete()
+        reset_coalesced_writes()
+
+        start = datetime(year=2024, month=1, day=1, tzinfo=timezone.utc)
+        UserActivityInterval.objects.create(
+            user_profile=user, start=start, end=start + UserActivityInterval.MIN_INTERVAL_LENGTH
+        )
+
+        # Three heartbeats extending the existing interval, and one
+        # after a break; out of order, as they might be after retries.
+        for event_time in [start + timedelta(minutes=2), start, start + timedelta(minutes=1)]:
+            fake_client.enqueue(
+                "user_activity_interval",
+                dict(user_profile_id=user.id, time=event_time.timestamp()),
+            )
+        fake_client.enqueue(
+            "user_activity_interval",
+            dict(user_profile_id=user.id, time=(start + timedelta(hours=2)).timestamp()),
+        )
+        # And two for a different user, without any intervals.
+        for event_time in [start, start + timedelta(minutes=1)]:
+            fake_client.enqueue(
+                "user_activity_interval",
+                dict(user_profile_id=other_user.id, time=event_time.timestamp()),
+            )
+
+        with simulated_queue_client(fake_client):
+            worker = UserActivityIntervalWorker()
+            worker.setup()
+            with self.assert_database_query_count(1):
+                worker.start()
+
+        self.assertEqual(
+            list(
+                UserActivityInterval.objects.filter(user_profile=user)
+                .order_by("start")
+                .values_list("start", "end")
+            ),
+            [
+                (start, start + timedelta(minutes=2) + UserActivityInterval.MIN_INTERVAL_LENGTH),
+                (
+                    start + timedelta(hours=2),
+                    start + timedelta(hours=2) + UserActivityInterval.MIN_INTERVAL_LENGTH,
+                ),
+            ],
+        )
+        self.assertEqual(
+            list(
+                UserActivityInterval.objects.filter(user_profile=other_user).values_list(
+                    "start", "end"
+                )
+            ),
+            [(start, start + timedelta(minutes=1) + UserActivityInterval.MIN_INTERVAL_LENGTH)],
+        )
+        # 6 events were written as 3 intervals.
+        self.assertEqual(get_coalesced_writes(), {"user_activity_interval": 3})
+
     def test_missed_message_worker(self) -> None:
         cordelia = self.example_user("cordelia")
         hamlet = self.example_user("hamlet")
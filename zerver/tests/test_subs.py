@@ -26,6 +26,7 @@ from zerver.actions.realm_settings import (
 )
 from zerver.actions.streams import (
     bulk_add_subscriptions,
+    bulk_add_subscriptions_in_chunks,
     bulk_remove_subscriptions,
     deactivated_streams_by_old_name,
     do_change_stream_group_based_setting,
@@ -3787,7 +3788,7 @@ class SubscriptionAPITest(ZulipTestCase):
         streams_to_sub = ["multi_user_stream"]
         with (
             self.capture_send_event_calls(expected_num_events=5) as events,
-            self.assert_database_query_count(44),
+            self.assert_database_query_count(45),
         ):
             self.subscribe_via_post(
                 self.test_user,
@@ -3929,6 +3930,60 @@ class SubscriptionAPITest(ZulipTestCase):
         self.assertEqual(add_peer_event["event"]["op"], "peer_add")
         self.assertEqual(add_peer_event["event"]["user_ids"], [self.example_user("iago").id])
 
+    def test_bulk_add_subscriptions_in_chunks(self) -> None:
+        realm = get_realm("zulip")
+        streams = [self.make_stream("chunked1"), self.make_stream("chunked2")]
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+        iago = self.example_user("iago")
+        prospero = self.example_user("prospero")
+        bulk_add_subscriptions(realm, [streams[0]], [hamlet], acting_user=None)
+
+        progress: list[tuple[int, int]] = []
+        # Each user gets a subscription/add event; each chunk sends
+        # peer_add events for each distinct set of users added to the
+        # channels: two for the first chunk, since Hamlet was already
+        # subscribed to one of them, and one for each of the others.
+        with self.capture_send_event_calls(expected_num_events=9) as events:
+            subscribed_counts, already_subscribed_counts = bulk_add_subscriptions_in_chunks(
+                realm,
+                streams,
+                [hamlet, cordelia, othello, iago, prospero],
+                acting_user=None,
+                chunk_size=2,
+                progress_callback=lambda processed, total: progress.append((processed, total)),
+            )
+
+        self.assertEqual(progress, [(2, 5), (4, 5), (5, 5)])
+        self.assertEqual(subscribed_counts, {streams[0].id: 4, streams[1].id: 5})
+        self.assertEqual(already_subscribed_counts, {streams[0].id: 1})
+        peer_add_user_ids = [
+            sorted(event["event"]["user_ids"])
+            for event in events
+            if event["event"]["op"] == "peer_add"
+        ]
+        self.assertCountEqual(
+            peer_add_user_ids,
+            [
+                [cordelia.id],
+                sorted([hamlet.id, cordelia.id]),
+                sorted([othello.id, iago.id]),
+                [prospero.id],
+            ],
+        )
+
+        for stream in streams:
+            stream.refresh_from_db()
+            self.assertEqual(stream.subscriber_count, 5)
+            self.assertEqual(num_subscribers_for_stream_id(stream.id), 5)
+        self.assertEqual(
+            RealmAuditLog.objects.filter(
+                event_type=AuditLogEventType.SUBSCRIPTION_CREATED, modified_stream__in=streams
+            ).count(),
+            10,
+        )
+
     def test_subscribing_to_stream_without_permission_to_post(self) -> None:
         stream = self.make_stream("stream_name1")
         realm = get_realm("zulip")
@@ -4696,7 +4751,7 @@ class SubscriptionAPITest(ZulipTestCase):
         ]
 
         # Test creating a public stream when realm does not have a notification stream.
-        with self.assert_database_query_count(44):
+        with self.assert_database_query_count(45):
             self.subscribe_via_post(
                 self.test_user,
                 [new_streams[0]],
@@ -4704,7 +4759,7 @@ class SubscriptionAPITest(ZulipTestCase):
             )
 
         # Test creating private stream.
-        with self.assert_database_query_count(52):
+        with self.assert_database_query_count(53):
             self.subscribe_via_post(
                 self.test_user,
                 [new_streams[1]],
@@ -4716,7 +4771,7 @@ class SubscriptionAPITest(ZulipTestCase):
         new_stream_announcements_stream = get_stream(self.streams[0], self.test_realm)
         self.test_realm.new_stream_announcements_stream_id = new_stream_announcements_stream.id
         self.test_realm.save()
-        with self.assert_database_query_count(56):
+        with self.assert_database_query_count(57):
             self.subscribe_via_post(
                 self.test_user,
                 [new_streams[2]],
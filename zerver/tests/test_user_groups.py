@@ -4,6 +4,7 @@ from unittest import mock
 
 import orjson
 import time_machine
+from django.test import override_settings
 from django.utils.timezone import now as timezone_now
 
 from zerver.actions.create_realm import do_create_realm
@@ -33,7 +34,10 @@ from zerver.actions.users import do_deactivate_user
 from zerver.lib.create_user import create_user
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.mention import silent_mention_syntax_for_user
-from zerver.lib.streams import ensure_stream
+from zerver.lib.streams import (
+    ensure_stream,
+    get_default_values_for_stream_permission_group_settings,
+)
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import most_recent_usermessage
 from zerver.lib.timestamp import datetime_to_timestamp
@@ -41,6 +45,7 @@ from zerver.lib.types import UserGroupMembersData, UserGroupMembersDict
 from zerver.lib.user_groups import (
     check_user_has_permission_by_role,
     get_direct_user_groups,
+    get_group_membership_cache_hits,
     get_recursive_group_members,
     get_recursive_group_members_union_for_groups,
     get_recursive_membership_groups,
@@ -52,6 +57,7 @@ from zerver.lib.user_groups import (
     get_subgroup_ids,
     get_system_user_group_by_name,
     get_user_group_member_ids,
+    get_user_recursive_group_ids,
     has_user_group_access_for_subgroup,
     is_any_user_in_group,
     is_user_in_group,
@@ -61,6 +67,7 @@ from zerver.models import (
     GroupGroupMembership,
     NamedUserGroup,
     Realm,
+    RecursiveGroupGroupMembership,
     Stream,
     UserGroup,
     UserGroupMembership,
@@ -436,6 +443,114 @@ class UserGroupTestCase(ZulipTestCase):
             sorted(get_user_group_member_ids(supergroup)), sorted([hamlet.id, cordelia.id])
         )
 
+    def test_recursive_group_group_membership_closure(self) -> None:
+        realm = get_realm("zulip")
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        iago = self.example_user("iago")
+
+        def get_closure(*groups: NamedUserGroup) -> dict[tuple[int, int], int]:
+            group_ids = [group.id for group in groups]
+            return {
+                (supergroup_id, subgroup_id): path_count
+                for supergroup_id, subgroup_id, path_count in RecursiveGroupGroupMembership.objects.filter(
+                    supergroup_id__in=group_ids
+                ).values_list("supergroup_id", "subgroup_id", "path_count")
+            }
+
+        # A diamond: top has bottom as a subgroup through both left and right.
+        top = check_add_user_group(realm, "Top", [iago], acting_user=iago)
+        left = check_add_user_group(realm, "Left", [], acting_user=iago)
+        right = check_add_user_group(realm, "Right", [cordelia], acting_user=iago)
+        bottom = check_add_user_group(realm, "Bottom", [hamlet], acting_user=iago)
+
+        add_subgroups_to_user_group(left, [bottom], acting_user=None)
+        add_subgroups_to_user_group(top, [left, right], acting_user=None)
+        # Subgroups are added below a group which already has supergroups.
+        add_subgroups_to_user_group(right, [bottom], acting_user=None)
+        self.assertEqual(
+            get_closure(top, left, right, bottom),
+            {
+                (top.id, left.id): 1,
+                (top.id, right.id): 1,
+                (top.id, bottom.id): 2,
+                (left.id, bottom.id): 1,
+                (right.id, bottom.id): 1,
+            },
+        )
+        self.assertCountEqual(list(get_recursive_group_members(top.id)), [iago, cordelia, hamlet])
+        self.assertCountEqual(list(get_recursive_strict_subgroups(top)), [left, right, bottom])
+
+        # Removing one of the paths keeps bottom a subgroup of top.
+        remove_subgroups_from_user_group(left, [bottom], acting_user=None)
+        self.assertEqual(
+            get_closure(top, left, right, bottom),
+            {
+                (top.id, left.id): 1,
+                (top.id, right.id): 1,
+                (top.id, bottom.id): 1,
+                (right.id, bottom.id): 1,
+            },
+        )
+        self.assertTrue(is_user_in_group(top.id, hamlet))
+
+        remove_subgroups_from_user_group(top, [right], acting_user=None)
+        self.assertEqual(
+            get_closure(top, left, right, bottom),
+            {
+                (top.id, left.id): 1,
+                (right.id, bottom.id): 1,
+            },
+        )
+        self.assertFalse(is_user_in_group(top.id, hamlet))
+        self.assertCountEqual(list(get_recursive_group_members(top.id)), [iago])
+        self.assertNotIn(top.usergroup_ptr, get_recursive_membership_groups(hamlet))
+
+        # Bulk deletions are reflected too.
+        GroupGroupMembership.objects.filter(supergroup=right).delete()
+        self.assertEqual(get_closure(top, left, right, bottom), {(top.id, left.id): 1})
+
+    @override_settings(PER_REQUEST_GROUP_MEMBERSHIP_CACHE=True)
+    def test_per_request_group_membership_cache(self) -> None:
+        realm = get_realm("zulip")
+        hamlet = self.example_user("hamlet")
+        iago = self.example_user("iago")
+        members_group = NamedUserGroup.objects.get(
+            name=SystemGroups.MEMBERS, realm_for_sharding=realm, is_system_group=True
+        )
+        leadership_group = check_add_user_group(realm, "Leadership", [iago], acting_user=iago)
+        staff_group = check_add_user_group(realm, "Staff", [], acting_user=iago)
+        add_subgroups_to_user_group(staff_group, [leadership_group], acting_user=None)
+
+        hits = get_group_membership_cache_hits()
+        # One query for each user.
+        with self.assert_database_query_count(2):
+            self.assertTrue(is_user_in_group(members_group.id, hamlet))
+            self.assertFalse(is_user_in_group(staff_group.id, hamlet))
+            self.assertFalse(is_user_in_group(leadership_group.id, hamlet))
+            self.assertTrue(is_user_in_group(staff_group.id, iago))
+        self.assertEqual(get_group_membership_cache_hits() - hits, 2)
+        self.assertEqual(
+            get_user_recursive_group_ids(hamlet),
+            set(get_recursive_membership_groups(hamlet).values_list("id", flat=True)),
+        )
+
+        # Changes to memberships are seen later in the same request.
+        bulk_add_members_to_user_groups([leadership_group], [hamlet.id], acting_user=None)
+        self.assertTrue(is_user_in_group(staff_group.id, hamlet))
+        remove_subgroups_from_user_group(staff_group, [leadership_group], acting_user=None)
+        self.assertFalse(is_user_in_group(staff_group.id, hamlet))
+        self.assertTrue(is_user_in_group(leadership_group.id, hamlet))
+
+        # Including the membership of a new channel's creator.
+        channel_creator_group = get_default_values_for_stream_permission_group_settings(
+            realm, hamlet
+        )["can_administer_channel_group"]
+        self.assertTrue(is_user_in_group(channel_creator_group.id, hamlet))
+
+        do_deactivate_user(hamlet, acting_user=None)
+        self.assertFalse(is_user_in_group(members_group.id, hamlet))
+
     def test_subgroups_of_role_based_system_groups(self) -> None:
         realm = get_realm("zulip")
         owners_group = NamedUserGroup.objects.get(
@@ -1,3 +1,4 @@
+import itertools
 from collections.abc import Iterable
 from datetime import timedelta
 from email.headerregistry import Address
@@ -5,6 +6,7 @@ from typing import Any, TypeVar
 from unittest import mock
 
 import orjson
+import redis
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sessions.models import Session
@@ -15,11 +17,20 @@ from django.utils.timezone import now as timezone_now
 from confirmation.models import Confirmation
 from corporate.lib.stripe import get_latest_seat_count
 from zerver.actions.create_user import do_create_user, do_reactivate_user
+from zerver.actions.custom_profile_fields import (
+    do_remove_realm_custom_profile_field,
+    do_update_user_custom_profile_data_if_changed,
+)
 from zerver.actions.invites import do_create_multiuse_invite_link, do_invite_users
+from zerver.actions.message_delete import do_delete_messages
 from zerver.actions.message_send import RecipientInfoResult, get_recipient_info
 from zerver.actions.muted_users import do_mute_user
 from zerver.actions.realm_settings import do_set_realm_property
-from zerver.actions.user_settings import bulk_regenerate_api_keys, do_change_user_setting
+from zerver.actions.user_settings import (
+    bulk_regenerate_api_keys,
+    do_change_full_name,
+    do_change_user_setting,
+)
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
 from zerver.actions.users import (
     change_user_is_active,
@@ -47,14 +58,19 @@ from zerver.lib.test_helpers import (
     simulated_empty_cache,
 )
 from zerver.lib.upload import upload_avatar_image
+from zerver.lib.user_directory import clear_user_directory, user_directory
 from zerver.lib.user_groups import get_system_user_group_for_user
 from zerver.lib.users import (
     Account,
     access_user_by_id,
     access_user_by_id_including_cross_realm,
+    get_accessible_user_ids,
     get_accounts_for_email,
     get_cross_realm_dicts,
     get_inaccessible_user_ids,
+    get_user_access_data,
+    get_user_ids_who_can_access_user,
+    get_users_for_api,
     user_ids_to_users,
 )
 from zerver.lib.utils import assert_is_not_none
@@ -2343,6 +2359,7 @@ class RecipientInfoTest(ZulipTestCase):
             muted_sender_user_ids=set(),
             um_eligible_user_ids=all_user_ids,
             long_term_idle_user_ids=set(),
+            lazy_user_message_user_ids=set(),
             default_bot_user_ids=set(),
             service_bot_tuples=[],
             all_bot_user_ids=set(),
@@ -2729,6 +2746,108 @@ class GetProfileTest(ZulipTestCase):
         self.assert_length(cache_queries, 1)
         self.assertEqual(user_profile.email, email)
 
+    @override_settings(REALM_USER_DIRECTORY=True)
+    def test_realm_user_directory(self) -> None:
+        realm = get_realm("zulip")
+        hamlet = self.example_user("hamlet")
+        iago = self.example_user("iago")
+        polonius = self.example_user("polonius")
+        clear_user_directory(realm.id)
+        hamlet.long_term_idle = True
+        hamlet.save(update_fields=["long_term_idle"])
+
+        def assert_matches_database(acting_user: UserProfile) -> None:
+            for (
+                client_gravatar,
+                user_avatar_url_field_optional,
+                include_custom_profile_fields,
+            ) in itertools.product([False, True], repeat=3):
+                with self.settings(REALM_USER_DIRECTORY=False):
+                    expected = get_users_for_api(
+                        realm,
+                        acting_user,
+                        client_gravatar=client_gravatar,
+                        user_avatar_url_field_optional=user_avatar_url_field_optional,
+                        include_custom_profile_fields=include_custom_profile_fields,
+                    )
+                with mock.patch("zerver.lib.user_directory.format_user_row") as m:
+                    users = get_users_for_api(
+                        realm,
+                        acting_user,
+                        client_gravatar=client_gravatar,
+                        user_avatar_url_field_optional=user_avatar_url_field_optional,
+                        include_custom_profile_fields=include_custom_profile_fields,
+                    )
+                m.assert_not_called()
+                self.assertEqual(users, expected)
+
+        # Changes aren't written to a directory which hasn't been loaded.
+        with self.captureOnCommitCallbacks(execute=True):
+            do_change_full_name(hamlet, "Prince Hamlet", acting_user=None)
+        self.assertIsNone(user_directory.read(realm.id))
+
+        # The first read loads the directory from the database; later
+        # ones are served from it without formatting any users.
+        get_users_for_api(
+            realm, hamlet, client_gravatar=False, user_avatar_url_field_optional=False
+        )
+        assert_matches_database(hamlet)
+        assert_matches_database(iago)
+
+        # Changes to users are patched into the directory.
+        with self.captureOnCommitCallbacks(execute=True):
+            do_change_full_name(hamlet, "King Hamlet", acting_user=None)
+        biography_field = CustomProfileField.objects.get(name="Biography", realm=realm)
+        with self.captureOnCommitCallbacks(execute=True):
+            do_update_user_custom_profile_data_if_changed(
+                hamlet, [{"id": biography_field.id, "value": "To be, or not to be"}]
+            )
+        assert_matches_database(hamlet)
+        users = get_users_for_api(
+            realm, iago, client_gravatar=False, user_avatar_url_field_optional=False
+        )
+        self.assertEqual(users[hamlet.id]["full_name"], "King Hamlet")
+        profile_data = users[hamlet.id].get("profile_data")
+        assert profile_data is not None
+        self.assertEqual(profile_data[str(biography_field.id)]["value"], "To be, or not to be")
+
+        # New users are added, and inaccessible users are filtered
+        # per viewer.
+        with self.captureOnCommitCallbacks(execute=True):
+            do_create_user("newuser@zulip.com", "password", realm, "New User", acting_user=None)
+        self.set_up_db_for_testing_user_access()
+        assert_matches_database(polonius)
+        assert_matches_database(iago)
+
+        # Changes affecting many users clear the directory.
+        with self.captureOnCommitCallbacks(execute=True):
+            do_remove_realm_custom_profile_field(realm, biography_field)
+        self.assertIsNone(user_directory.read(realm.id))
+        get_users_for_api(
+            realm, hamlet, client_gravatar=False, user_avatar_url_field_optional=False
+        )
+        assert_matches_database(hamlet)
+
+        # If Redis is unavailable, we fall back to the database.
+        with (
+            mock.patch("zerver.lib.redis_snapshot.READ_SCRIPT", side_effect=redis.ConnectionError),
+            self.assertLogs("zerver.lib.user_directory", level="ERROR"),
+        ):
+            users = get_users_for_api(
+                realm, hamlet, client_gravatar=False, user_avatar_url_field_optional=False
+            )
+        self.assertEqual(users[hamlet.id]["full_name"], "King Hamlet")
+
+        # So we do if the directory is cleared again while we load it.
+        clear_user_directory(realm.id)
+        with mock.patch(
+            "zerver.lib.user_directory.load_user_directory", side_effect=clear_user_directory
+        ):
+            users = get_users_for_api(
+                realm, hamlet, client_gravatar=False, user_avatar_url_field_optional=False
+            )
+        self.assertEqual(users[hamlet.id]["full_name"], "King Hamlet")
+
     def test_get_user_profile(self) -> None:
         hamlet = self.example_user("hamlet")
         iago = self.example_user("iago")
@@ -3209,6 +3328,76 @@ class GetProfileTest(ZulipTestCase):
         )
         self.assertEqual(inaccessible_user_ids, {othello.id})
 
+    def test_cached_user_access_data(self) -> None:
+        polonius = self.example_user("polonius")
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        cordelia = self.example_user("cordelia")
+        desdemona = self.example_user("desdemona")
+        shiva = self.example_user("shiva")
+        realm = polonius.realm
+        self.set_up_db_for_testing_user_access()
+        all_user_ids = list(UserProfile.objects.filter(realm=realm).values_list("id", flat=True))
+
+        def get_user_access() -> list[object]:
+            return [
+                sorted(get_accessible_user_ids(realm, polonius)),
+                sorted(get_accessible_user_ids(realm, polonius, include_deactivated_users=True)),
+                get_inaccessible_user_ids(all_user_ids, polonius),
+                sorted(get_user_ids_who_can_access_user(polonius)),
+                sorted(get_user_ids_who_can_access_user(hamlet)),
+            ]
+
+        def assert_user_access_matches_uncached() -> None:
+            with self.settings(CACHE_ACCESSIBLE_USER_IDS=False):
+                expected = get_user_access()
+            self.assertEqual(get_user_access(), expected)
+
+        with self.settings(CACHE_ACCESSIBLE_USER_IDS=True):
+            assert_user_access_matches_uncached()
+            self.assertIn(othello.id, get_inaccessible_user_ids(all_user_ids, polonius))
+
+            # Once cached, the accessible users are computed without
+            # any database queries.
+            with self.assert_database_query_count(0):
+                get_accessible_user_ids(realm, polonius)
+
+            iago = self.example_user("iago")
+            get_user_access_data(iago)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.subscribe(desdemona, "test_stream1")
+            assert_user_access_matches_uncached()
+            self.assertIn(desdemona.id, get_accessible_user_ids(realm, polonius))
+            # Users not subscribed to the channel keep their cached data.
+            with self.assert_database_query_count(0):
+                get_user_access_data(iago)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.send_personal_message(othello, polonius)
+            assert_user_access_matches_uncached()
+            self.assertNotIn(othello.id, get_inaccessible_user_ids(all_user_ids, polonius))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.send_group_direct_message(polonius, [cordelia, desdemona])
+            assert_user_access_matches_uncached()
+            self.assertIn(cordelia.id, get_accessible_user_ids(realm, polonius))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                do_deactivate_user(shiva, acting_user=None)
+            assert_user_access_matches_uncached()
+            self.assertNotIn(shiva.id, get_accessible_user_ids(realm, polonius))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.unsubscribe(polonius, "test_stream1")
+            assert_user_access_matches_uncached()
+
+            # Deleting direct messages also revokes access.
+            messages = Message.objects.filter(sender=othello, recipient_id=polonius.recipient_id)
+            with self.captureOnCommitCallbacks(execute=True):
+                do_delete_messages(realm, messages, acting_user=None)
+            assert_user_access_matches_uncached()
+            self.assertIn(othello.id, get_inaccessible_user_ids(all_user_ids, polonius))
+
     def test_get_users_for_spectators(self) -> None:
         # Checks that spectators can fetch users data.
         hamlet = self.example_user("hamlet")
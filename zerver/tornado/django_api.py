@@ -15,6 +15,7 @@ from urllib3.util import Retry
 
 from zerver.lib.partial import partial
 from zerver.lib.queue import queue_json_publish_rollback_unsafe
+from zerver.lib.realm_snapshot import flush_realm_snapshot_for_event
 from zerver.models import Client, Realm, UserProfile
 from zerver.models.users import get_user_profile_narrow_by_id
 from zerver.tornado.sharding import (
@@ -207,6 +208,8 @@ def send_event_rollback_unsafe(
 ) -> None:
     """`users` is a list of user IDs, or in some special cases like message
     send/update or embeds, dictionaries containing extra data."""
+    flush_realm_snapshot_for_event(realm.id, event["type"])
+
     realm_ports = get_realm_tornado_ports(realm)
     if len(realm_ports) == 1:
         port_user_map = {realm_ports[0]: list(users)}
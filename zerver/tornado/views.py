@@ -12,6 +12,7 @@ from typing_extensions import ParamSpec
 from zerver.decorator import internal_api_view, process_client
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.queue import get_queue_client
+from zerver.lib.register_admission import is_register_saturated, record_deferred_reloads
 from zerver.lib.request import RequestNotes
 from zerver.lib.response import AsynchronousResponse, json_success
 from zerver.lib.sessions import narrow_request_user
@@ -25,6 +26,7 @@ from zerver.tornado.event_queue import (
     process_notification,
     send_web_reload_client_events,
 )
+from zerver.tornado.event_queue import web_reload_clients as web_reload_clients_queue
 from zerver.tornado.sharding import get_user_tornado_port, notify_tornado_queue_name
 
 P = ParamSpec("P")
@@ -55,6 +57,13 @@ def web_reload_clients(
     client_count: Json[int] | None = None,
     immediate: Json[bool] = False,
 ) -> HttpResponse:
+    if client_count is not None and web_reload_clients_queue and is_register_saturated():
+        # Reloading clients will make them all call /register, so we
+        # hold off while it's saturated; scripts/reload-clients will
+        # try again shortly.
+        record_deferred_reloads(min(client_count, len(web_reload_clients_queue)))
+        return json_success(request, {"sent_events": 0, "complete": False})
+
     sent_events = in_tornado_thread(send_web_reload_client_events)(
         immediate=immediate, count=client_count
     )
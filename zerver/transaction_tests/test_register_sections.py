@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.test import override_settings
+from typing_extensions import override
+
+from zerver.lib import register_sections
+from zerver.lib.events import fetch_initial_state_data
+from zerver.lib.register_sections import RegisterSectionFetcher, shutdown_register_section_executor
+from zerver.lib.test_classes import ZulipTransactionTestCase
+
+
+class RegisterSectionThreadsTest(ZulipTransactionTestCase):
+    @override
+    def tearDown(self) -> None:
+        shutdown_register_section_executor()
+        super().tearDown()
+
+    def test_sections_fetched_in_threads(self) -> None:
+        hamlet = self.example_user("hamlet")
+        event_types = [
+            "alert_words",
+            "drafts",
+            "message",
+            "starred_messages",
+            "update_message_flags",
+        ]
+        expected = fetch_initial_state_data(hamlet, realm=hamlet.realm, event_types=event_types)
+
+        with override_settings(REGISTER_SECTION_THREADS=2):
+            state = fetch_initial_state_data(hamlet, realm=hamlet.realm, event_types=event_types)
+            self.assertIsInstance(register_sections.executor, ThreadPoolExecutor)
+        self.assertEqual(state, expected)
+
+    @override_settings(REGISTER_SECTION_THREADS=1)
+    def test_thread_connections_persist_until_shutdown(self) -> None:
+        def get_thread_connection() -> BaseDatabaseWrapper:
+            thread_connection = connections[DEFAULT_DB_ALIAS]
+            thread_connection.ensure_connection()
+            return thread_connection
+
+        state: dict[str, BaseDatabaseWrapper] = {}
+        fetcher = RegisterSectionFetcher(state)
+        fetcher.submit("first", get_thread_connection)
+        fetcher.submit("second", get_thread_connection)
+        fetcher.wait()
+
+        # Both sections ran in the pool's only thread, on its own
+        # connection, which stays open between sections.
+        thread_connection = state["first"]
+        self.assertIs(state["second"], thread_connection)
+        self.assertIsNot(thread_connection, connections[DEFAULT_DB_ALIAS])
+        self.assertIsNotNone(thread_connection.connection)
+
+        shutdown_register_section_executor()
+        self.assertIsNone(thread_connection.connection)
@@ -1,4 +1,5 @@
 import threading
+import time
 from typing import Any
 from unittest import mock
 
@@ -12,7 +13,14 @@ from zerver.lib.exceptions import JsonableError
 from zerver.lib.test_classes import ZulipTransactionTestCase
 from zerver.lib.test_helpers import HostRequestMock
 from zerver.lib.user_groups import access_user_group_for_update
-from zerver.models import NamedUserGroup, Realm, UserGroup, UserProfile
+from zerver.models import (
+    GroupGroupMembership,
+    NamedUserGroup,
+    Realm,
+    RecursiveGroupGroupMembership,
+    UserGroup,
+    UserProfile,
+)
 from zerver.models.realms import get_realm
 from zerver.views.user_groups import update_subgroups_of_user_group
 
@@ -215,3 +223,57 @@ have no control over the scheduler when the barrier timeouts.
             ),
             success_count=2,
         )
+
+    def test_concurrent_subgroup_closure_updates(self) -> None:
+        realm = get_realm("zulip")
+        iago = self.example_user("iago")
+        groups = [
+            check_add_user_group(realm, f"closure #{i}", [], acting_user=iago) for i in range(3)
+        ]
+        self.created_user_groups.extend(groups)
+        barrier = threading.Barrier(parties=2, timeout=3)
+
+        def add_subgroup(supergroup: NamedUserGroup, subgroup: NamedUserGroup, first: bool) -> None:
+            try:
+                with transaction.atomic(durable=True):
+                    if first:
+                        GroupGroupMembership.objects.create(
+                            supergroup=supergroup, subgroup=subgroup
+                        )
+                        barrier.wait()
+                        # Give the other thread time to add its membership
+                        # before we commit ours; it should wait for us in
+                        # the closure trigger.
+                        time.sleep(0.5)
+                    else:
+                        barrier.wait()
+                        GroupGroupMembership.objects.create(
+                            supergroup=supergroup, subgroup=subgroup
+                        )
+            finally:
+                connections.close_all()
+
+        # Neither transaction can see the other's membership, so unless
+        # the trigger serializes them, neither would record that
+        # groups[2] is a subgroup of groups[0].
+        threads = [
+            threading.Thread(target=add_subgroup, args=(groups[0], groups[1], True)),
+            threading.Thread(target=add_subgroup, args=(groups[1], groups[2], False)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(
+            set(
+                RecursiveGroupGroupMembership.objects.filter(
+                    supergroup__in=[group.id for group in groups]
+                ).values_list("supergroup_id", "subgroup_id", "path_count")
+            ),
+            {
+                (groups[0].id, groups[1].id, 1),
+                (groups[0].id, groups[2].id, 1),
+                (groups[1].id, groups[2].id, 1),
+            },
+        )
@@ -5,13 +5,15 @@ from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.http import HttpRequest, HttpResponse
 from django.utils.translation import gettext as _
-from pydantic import Json
+from pydantic import Json, NonNegativeInt
 
 from zerver.context_processors import get_valid_realm_from_request
 from zerver.lib.compatibility import is_pronouns_field_type_supported
 from zerver.lib.events import DEFAULT_CLIENT_CAPABILITIES, ClientCapabilities, do_events_register
 from zerver.lib.exceptions import JsonableError, MissingAuthenticationError
 from zerver.lib.narrow_helpers import narrow_dataclasses_from_tuples
+from zerver.lib.register_admission import register_admission
+from zerver.lib.register_sections import format_server_timing
 from zerver.lib.request import RequestNotes
 from zerver.lib.response import json_success
 from zerver.lib.typed_endpoint import ApiParamConfig, DocumentationStatus, typed_endpoint
@@ -54,6 +56,7 @@ def events_register_backend(
         Json[int], ApiParamConfig(documentation_status=DocumentationStatus.DOCUMENTATION_PENDING)
     ] = 0,
     slim_presence: Json[bool] = False,
+    subscription_state_version: Json[NonNegativeInt] | None = None,
 ) -> HttpResponse:
     if narrow is None:
         narrow = []
@@ -113,24 +116,33 @@ def events_register_backend(
     #       but we will still need to support tuples for a long time.
     modern_narrow = narrow_dataclasses_from_tuples(narrow)
 
-    ret = do_events_register(
-        user_profile,
-        realm,
-        client,
-        apply_markdown,
-        client_gravatar,
-        slim_presence,
-        None,
-        presence_history_limit_days,
-        event_types,
-        queue_lifespan_secs,
-        all_public_streams,
-        narrow=modern_narrow,
-        include_subscribers=parsed_include_subscribers,
-        include_streams=include_streams,
-        client_capabilities=client_capabilities,
-        fetch_event_types=fetch_event_types,
-        spectator_requested_language=spectator_requested_language,
-        pronouns_field_type_supported=pronouns_field_type_supported,
-    )
-    return json_success(request, data=ret)
+    # In development, report how long each section took to fetch.
+    section_timings: dict[str, float] | None = {} if settings.DEBUG else None
+
+    with register_admission(realm):
+        ret = do_events_register(
+            user_profile,
+            realm,
+            client,
+            apply_markdown,
+            client_gravatar,
+            slim_presence,
+            None,
+            presence_history_limit_days,
+            event_types,
+            queue_lifespan_secs,
+            all_public_streams,
+            narrow=modern_narrow,
+            include_subscribers=parsed_include_subscribers,
+            include_streams=include_streams,
+            client_capabilities=client_capabilities,
+            fetch_event_types=fetch_event_types,
+            spectator_requested_language=spectator_requested_language,
+            pronouns_field_type_supported=pronouns_field_type_supported,
+            subscription_state_version=subscription_state_version,
+            section_timings=section_timings,
+        )
+    response = json_success(request, data=ret)
+    if section_timings:
+        response["Server-Timing"] = format_server_timing(section_timings)
+    return response
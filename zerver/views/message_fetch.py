@@ -1,10 +1,10 @@
-from collections.abc import Iterable
-from typing import Annotated
+from collections.abc import Iterable, Sequence
+from typing import Annotated, Any, Literal
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.db import connection, transaction
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, HttpResponseBase
 from django.utils.translation import gettext as _
 from pydantic import Json, NonNegativeInt
 from sqlalchemy.sql import column, func
@@ -16,20 +16,30 @@ from zerver.lib.exceptions import (
     JsonableError,
     MissingAuthenticationError,
 )
-from zerver.lib.message import get_first_visible_message_id, messages_for_ids
+from zerver.lib.lazy_user_messages import get_lazy_user_message_flags
+from zerver.lib.message import (
+    get_first_visible_message_id,
+    messages_for_ids,
+    serialized_messages_for_ids_in_chunks,
+)
 from zerver.lib.narrow import (
     NarrowParameter,
     add_narrow_conditions,
     clean_narrow_for_message_fetch,
+    decode_message_cursor,
+    encode_message_cursor,
     fetch_messages,
     get_base_query_for_search,
+    get_message_window_cache,
+    get_search_operand,
     is_spectator_compatible,
     is_web_public_narrow,
     parse_anchor_value,
     update_narrow_terms_containing_empty_topic_fallback_name,
 )
 from zerver.lib.request import RequestNotes
-from zerver.lib.response import json_success
+from zerver.lib.response import json_success, json_success_streaming
+from zerver.lib.search_highlight import get_search_match_positions
 from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
 from zerver.lib.topic import MATCH_TOPIC
 from zerver.lib.topic_sqlalchemy import topic_column_sa
@@ -37,6 +47,7 @@ from zerver.lib.typed_endpoint import ApiParamConfig, typed_endpoint
 from zerver.models import UserMessage, UserProfile
 
 MAX_MESSAGES_PER_FETCH = 5000
+MESSAGES_STREAMING_CHUNK_SIZE = 500
 
 
 def highlight_string(text: str, locs: Iterable[tuple[int, int]]) -> str:
@@ -88,6 +99,22 @@ def get_search_fields(
     }
 
 
+def get_search_fields_for_rows(
+    search_operand: str, rows: Sequence[tuple[int, str, str]]
+) -> dict[int, dict[str, str]]:
+    """Highlights the matches of the search in the (message_id,
+    escaped_topic_name, rendered_content) rows; see
+    zerver.lib.search_highlight."""
+    texts = [text for _message_id, topic, content in rows for text in (content, topic)]
+    matches = get_search_match_positions(search_operand, texts)
+    return {
+        message_id: get_search_fields(
+            rendered_content, escaped_topic_name, matches[2 * i], matches[2 * i + 1]
+        )
+        for i, (message_id, escaped_topic_name, rendered_content) in enumerate(rows)
+    }
+
+
 def clean_narrow_for_web_public_api(
     narrow: list[NarrowParameter] | None,
 ) -> list[NarrowParameter] | None:
@@ -117,13 +144,16 @@ def get_messages_backend(
         Json[list[NonNegativeInt] | None], ApiParamConfig("message_ids")
     ] = None,
     include_anchor: Json[bool] = True,
+    include_cursor: Json[bool] = False,
+    message_cursor: Annotated[str | None, ApiParamConfig("cursor")] = None,
     narrow: Json[list[NarrowParameter] | None] = None,
     num_after: Json[NonNegativeInt] = 0,
     num_before: Json[NonNegativeInt] = 0,
+    search_mode: Literal["default", "ranked"] = "default",
     use_first_unread_anchor_val: Annotated[
         Json[bool], ApiParamConfig("use_first_unread_anchor")
     ] = False,
-) -> HttpResponse:
+) -> HttpResponseBase:
     # User has to either provide message_ids or both num_before and num_after.
     if (
         num_before or num_after or anchor_val is not None or use_first_unread_anchor_val
@@ -141,13 +171,42 @@ def get_messages_backend(
     elif client_requested_message_ids is not None:
         include_anchor = False
 
+    # A cursor continues fetching in one direction from the last
+    # message of a previous response, in place of an anchor.
+    if message_cursor is not None:
+        include_cursor = True
+        if anchor_val is not None or use_first_unread_anchor_val:
+            raise IncompatibleParametersError(["anchor", "cursor"])
+    if include_cursor:
+        if client_requested_message_ids is not None:
+            raise IncompatibleParametersError(["message_ids", "cursor"])
+        if search_mode == "ranked":
+            raise IncompatibleParametersError(["search_mode", "cursor"])
+        if (num_before > 0) == (num_after > 0):
+            raise JsonableError(
+                _("Fetching with a cursor requires exactly one of num_before and num_after.")
+            )
+
     anchor = None
-    if client_requested_message_ids is None:
+    if client_requested_message_ids is None and message_cursor is None:
         anchor = parse_anchor_value(anchor_val, use_first_unread_anchor_val)
 
     realm = get_valid_realm_from_request(request)
     narrow = clean_narrow_for_message_fetch(narrow, realm, maybe_user_profile)
 
+    ranked_search = search_mode == "ranked"
+    if ranked_search:
+        if get_search_operand(narrow) is None:
+            raise JsonableError(_("Ranked search requires a search term."))
+        # Ranked results are the most relevant messages before the
+        # anchor, so they can't extend after it.
+        if client_requested_message_ids is not None:
+            raise IncompatibleParametersError(["message_ids", "search_mode"])
+        if num_after > 0:
+            raise IncompatibleParametersError(["num_after", "search_mode"])
+        if anchor is None:
+            raise IncompatibleParametersError(["anchor", "search_mode"])
+
     num_of_messages_requested = num_before + num_after
     if client_requested_message_ids is not None:
         num_of_messages_requested = len(client_requested_message_ids)
@@ -194,6 +253,15 @@ def get_messages_backend(
 
     assert realm is not None
 
+    if message_cursor is not None:
+        last_message_id, direction = decode_message_cursor(message_cursor, narrow)
+        if (direction == "older") != (num_before > 0):
+            raise IncompatibleParametersError(
+                ["cursor", "num_after" if direction == "older" else "num_before"]
+            )
+        anchor = last_message_id
+        include_anchor = False
+
     if is_web_public_query:
         # client_gravatar here is just the user-requested value. "finalize_payload" function
         # is responsible for sending avatar_url based on each individual sender's
@@ -212,6 +280,18 @@ def get_messages_backend(
         assert log_data is not None
         log_data["extra"] = "[{}]".format(",".join(verbose_operators))
 
+    window_cache = None
+    if client_requested_message_ids is None:
+        window_cache = get_message_window_cache(
+            narrow=narrow,
+            user_profile=user_profile,
+            is_web_public_query=is_web_public_query,
+            anchor=anchor,
+            include_anchor=include_anchor,
+            num_before=num_before,
+            num_after=num_after,
+        )
+
     with transaction.atomic(durable=True):
         # We're about to perform a search, and then get results from
         # it; this is done across multiple queries.  To prevent race
@@ -247,6 +327,8 @@ def get_messages_backend(
             num_before=num_before,
             num_after=num_after,
             client_requested_message_ids=client_requested_message_ids,
+            window_cache=window_cache,
+            ranked_search=ranked_search,
         )
 
         anchor = query_info.anchor
@@ -279,6 +361,19 @@ def get_messages_backend(
             )
             user_message_flags = {um.message_id: um.flags_list() for um in um_rows}
 
+            # Messages in streams with lazy_user_messages enabled were
+            # received by the user despite not having a UserMessage row.
+            lazy_flags = get_lazy_user_message_flags(
+                user_profile,
+                [
+                    message_id
+                    for message_id in result_message_ids
+                    if message_id not in user_message_flags
+                ],
+            )
+            for message_id, flags in lazy_flags.items():
+                user_message_flags[message_id] = UserMessage.flags_list_for_flags(flags)
+
             for message_id in result_message_ids:
                 if message_id not in user_message_flags:
                     user_message_flags[message_id] = ["read", "historical"]
@@ -291,24 +386,48 @@ def get_messages_backend(
 
         search_fields: dict[int, dict[str, str]] = {}
         if is_search:
-            for row in rows:
-                message_id = row[0]
-                (escaped_topic_name, rendered_content, content_matches, topic_matches) = row[-4:]
-                search_fields[message_id] = get_search_fields(
-                    rendered_content, escaped_topic_name, content_matches, topic_matches
-                )
+            search_operand = get_search_operand(narrow)
+            assert search_operand is not None
+            search_fields = get_search_fields_for_rows(
+                search_operand, [(row[0], row[-2], row[-1]) for row in rows]
+            )
 
-        message_list = messages_for_ids(
-            message_ids=result_message_ids,
-            user_message_flags=user_message_flags,
-            search_fields=search_fields,
-            apply_markdown=apply_markdown,
-            client_gravatar=client_gravatar,
-            allow_empty_topic_name=allow_empty_topic_name,
-            message_edit_history_visibility_policy=realm.message_edit_history_visibility_policy,
-            user_profile=user_profile,
-            realm=realm,
-        )
+        # Large pages of messages are serialized a chunk at a time, so
+        # that we hold the whole page only as compact JSON, rather than
+        # as message dicts, which are several times larger; the
+        # response then writes out the serialized chunks in turn.  We
+        # serialize the whole page inside this transaction, so that
+        # the messages are consistent with the search, and errors are
+        # reported before we start writing a successful response.
+        stream_messages = len(result_message_ids) > MESSAGES_STREAMING_CHUNK_SIZE
+        if stream_messages:
+            message_list: list[dict[str, Any]] = []
+            serialized_messages = list(
+                serialized_messages_for_ids_in_chunks(
+                    message_ids=result_message_ids,
+                    chunk_size=MESSAGES_STREAMING_CHUNK_SIZE,
+                    user_message_flags=user_message_flags,
+                    search_fields=search_fields,
+                    apply_markdown=apply_markdown,
+                    client_gravatar=client_gravatar,
+                    allow_empty_topic_name=allow_empty_topic_name,
+                    message_edit_history_visibility_policy=realm.message_edit_history_visibility_policy,
+                    user_profile=user_profile,
+                    realm=realm,
+                )
+            )
+        else:
+            message_list = messages_for_ids(
+                message_ids=result_message_ids,
+                user_message_flags=user_message_flags,
+                search_fields=search_fields,
+                apply_markdown=apply_markdown,
+                client_gravatar=client_gravatar,
+                allow_empty_topic_name=allow_empty_topic_name,
+                message_edit_history_visibility_policy=realm.message_edit_history_visibility_policy,
+                user_profile=user_profile,
+                realm=realm,
+            )
 
     if client_requested_message_ids is not None:
         ret = dict(
@@ -331,7 +450,21 @@ def get_messages_backend(
             history_limited=query_info.history_limited,
             anchor=anchor,
         )
-
+        if include_cursor:
+            next_cursor = None
+            if num_before > 0 and not query_info.found_oldest and result_message_ids:
+                next_cursor = encode_message_cursor(narrow, min(result_message_ids), "older")
+            elif num_after > 0 and not query_info.found_newest and result_message_ids:
+                next_cursor = encode_message_cursor(narrow, max(result_message_ids), "newer")
+            ret["next_cursor"] = next_cursor
+
+    if stream_messages:
+        return json_success_streaming(
+            request,
+            data=ret,
+            streamed_key="messages",
+            streamed_chunks=serialized_messages,
+        )
     return json_success(request, data=ret)
 
 
@@ -369,19 +502,24 @@ def messages_in_narrow_backend(
             column("rendered_content", Text),
         )
 
-    search_fields = {}
     with get_sqlalchemy_connection() as sa_conn:
-        for row in sa_conn.execute(query).mappings():
-            message_id = row["message_id"]
-            escaped_topic_name: str = row["escaped_topic_name"]
-            rendered_content: str = row["rendered_content"]
-            content_matches = row.get("content_matches", [])
-            topic_matches = row.get("topic_matches", [])
-            search_fields[str(message_id)] = get_search_fields(
-                rendered_content,
-                escaped_topic_name,
-                content_matches,
-                topic_matches,
-            )
-
-    return json_success(request, data={"messages": search_fields})
+        rows = [
+            (row["message_id"], row["escaped_topic_name"], row["rendered_content"])
+            for row in sa_conn.execute(query).mappings()
+        ]
+
+    search_operand = get_search_operand(updated_narrow)
+    if search_operand is not None:
+        search_fields = get_search_fields_for_rows(search_operand, rows)
+    else:
+        search_fields = {
+            message_id: get_search_fields(rendered_content, escaped_topic_name, [], [])
+            for message_id, escaped_topic_name, rendered_content in rows
+        }
+
+    return json_success(
+        request,
+        data={
+            "messages": {str(message_id): fields for message_id, fields in search_fields.items()}
+        },
+    )
@@ -5,8 +5,9 @@ from django.utils.translation import gettext as _
 from pydantic import Json, NonNegativeInt
 
 from zerver.actions.message_flags import (
+    MarkAsReadProgress,
     do_mark_all_as_read,
-    do_mark_stream_messages_as_read,
+    do_mark_stream_messages_as_read_in_batches,
     do_update_message_flags,
 )
 from zerver.lib.exceptions import JsonableError
@@ -16,6 +17,7 @@ from zerver.lib.narrow import (
     parse_anchor_value,
     update_narrow_terms_containing_empty_topic_fallback_name,
 )
+from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.request import RequestNotes
 from zerver.lib.response import json_success
 from zerver.lib.streams import access_stream_by_id
@@ -136,6 +138,11 @@ def mark_all_as_read(request: HttpRequest, user_profile: UserProfile) -> HttpRes
     request_notes = RequestNotes.get_notes(request)
     count = do_mark_all_as_read(user_profile, timeout=50)
     if count is None:
+        # Finish the job in the background; the client will see its
+        # progress through update_message_flags events.
+        queue_event_on_commit(
+            "deferred_work", {"type": "mark_all_as_read", "user_profile_id": user_profile.id}
+        )
         return json_success(request, data={"complete": False})
 
     log_data_str = f"[{count} updated]"
@@ -145,15 +152,38 @@ def mark_all_as_read(request: HttpRequest, user_profile: UserProfile) -> HttpRes
     return json_success(request, data={"complete": True})
 
 
+def maybe_defer_mark_stream_messages_as_read(
+    user_profile: UserProfile,
+    stream_recipient_id: int,
+    topic_name: str | None,
+    progress: MarkAsReadProgress,
+) -> None:
+    if progress.complete:
+        return
+    queue_event_on_commit(
+        "deferred_work",
+        {
+            "type": "mark_stream_messages_as_read",
+            "user_profile_id": user_profile.id,
+            "stream_recipient_ids": [stream_recipient_id],
+            "topic_name": topic_name,
+            "after_message_id": progress.last_message_id,
+        },
+    )
+
+
 @typed_endpoint
 def mark_stream_as_read(
     request: HttpRequest, user_profile: UserProfile, *, stream_id: Json[int]
 ) -> HttpResponse:
     stream, _sub = access_stream_by_id(user_profile, stream_id)
     assert stream.recipient_id is not None
-    count = do_mark_stream_messages_as_read(user_profile, stream.recipient_id)
+    progress = do_mark_stream_messages_as_read_in_batches(
+        user_profile, stream.recipient_id, timeout=50
+    )
+    maybe_defer_mark_stream_messages_as_read(user_profile, stream.recipient_id, None, progress)
 
-    log_data_str = f"[{count} updated]"
+    log_data_str = f"[{progress.count} updated]"
     log_data = RequestNotes.get_notes(request).log_data
     assert log_data is not None
     log_data["extra"] = log_data_str
@@ -183,9 +213,14 @@ def mark_topic_as_read(
         if not topic_exists:
             raise JsonableError(_("No such topic '{topic}'").format(topic=topic_name))
 
-    count = do_mark_stream_messages_as_read(user_profile, stream.recipient_id, topic_name)
+    progress = do_mark_stream_messages_as_read_in_batches(
+        user_profile, stream.recipient_id, topic_name, timeout=50
+    )
+    maybe_defer_mark_stream_messages_as_read(
+        user_profile, stream.recipient_id, topic_name, progress
+    )
 
-    log_data_str = f"[{count} updated]"
+    log_data_str = f"[{progress.count} updated]"
     log_data = RequestNotes.get_notes(request).log_data
     assert log_data is not None
     log_data["extra"] = log_data_str
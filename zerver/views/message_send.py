@@ -1,23 +1,28 @@
 from collections.abc import Iterable, Sequence
 from email.headerregistry import Address
-from typing import Annotated, Literal, cast
+from typing import Annotated, Any, Literal, cast
 
 from django.core import validators
 from django.core.exceptions import ValidationError
 from django.http import HttpRequest, HttpResponse
 from django.utils.translation import gettext as _
-from pydantic import Json
+from pydantic import BaseModel, Json, StringConstraints
 
 from zerver.actions.message_send import (
+    BatchMessageSpec,
     check_send_message,
+    check_send_message_batch,
     compute_irc_user_fullname,
     compute_jabber_user_fullname,
     create_mirror_user_if_needed,
     extract_private_recipients,
     extract_stream_indicator,
+    get_validated_emails,
+    get_validated_user_ids,
 )
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.markdown import render_message_markdown
+from zerver.lib.rate_limiter import rate_limit_user
 from zerver.lib.request import RequestNotes
 from zerver.lib.response import json_success
 from zerver.lib.typed_endpoint import (
@@ -243,6 +248,115 @@ def send_message_backend(
     return json_success(request, data=data)
 
 
+# Each message in a batch is charged against the sender's API rate
+# limit, so this mostly bounds the size of a single transaction.
+MAX_MESSAGES_PER_BATCH = 100
+
+
+class BatchMessageData(BaseModel):
+    type: Literal["direct", "private", "stream", "channel"]
+    to: int | str | list[int] | list[str]
+    topic: Annotated[str | None, StringConstraints(strip_whitespace=True)] = None
+    content: str
+    local_id: str | None = None
+    queue_id: str | None = None
+
+
+def batch_message_spec(message: BatchMessageData) -> BatchMessageSpec:
+    if message.type in ("direct", "private"):
+        recipient_type_name = "private"
+        if isinstance(message.to, int):
+            message_to: Sequence[int] | Sequence[str] = [message.to]
+        elif isinstance(message.to, str):
+            message_to = extract_private_recipients(message.to)
+        elif message.to and isinstance(message.to[0], str):
+            message_to = get_validated_emails(cast(list[str], message.to))
+        else:
+            message_to = get_validated_user_ids(cast(list[int], message.to))
+    else:
+        recipient_type_name = "stream"
+        if isinstance(message.to, int | str):
+            message_to = [message.to]
+        elif len(message.to) == 1:
+            # Like POST /messages, we accept a list of exactly one
+            # channel.
+            message_to = message.to
+        else:
+            raise JsonableError(_("Expected exactly one channel"))
+
+    return BatchMessageSpec(
+        recipient_type_name=recipient_type_name,
+        message_to=message_to,
+        topic_name=message.topic,
+        message_content=message.content,
+        local_id=message.local_id,
+        sender_queue_id=message.queue_id,
+    )
+
+
+@typed_endpoint
+def send_messages_batch_backend(
+    request: HttpRequest,
+    user_profile: UserProfile,
+    *,
+    messages: Json[list[BatchMessageData]],
+    read_by_sender: Json[bool] | None = None,
+) -> HttpResponse:
+    if not messages:
+        raise JsonableError(_("No messages to send."))
+    if len(messages) > MAX_MESSAGES_PER_BATCH:
+        raise JsonableError(
+            _("Too many messages in batch; the maximum is {max_messages}.").format(
+                max_messages=MAX_MESSAGES_PER_BATCH
+            )
+        )
+
+    # The request itself was charged against the rate limit when it
+    # was authenticated; charge for the remaining messages up front,
+    # so that a batch costs the same as sending its messages one at a
+    # time.
+    for _unused in range(len(messages) - 1):
+        rate_limit_user(request, user_profile, domain="api_by_user")
+
+    client = RequestNotes.get_notes(request).client
+    assert client is not None
+
+    if read_by_sender is None:
+        read_by_sender = client.default_read_by_sender()
+
+    specs: list[BatchMessageSpec | JsonableError] = []
+    for message in messages:
+        try:
+            specs.append(batch_message_spec(message))
+        except JsonableError as e:
+            specs.append(e)
+
+    sent_results = iter(
+        check_send_message_batch(
+            user_profile,
+            client,
+            [spec for spec in specs if isinstance(spec, BatchMessageSpec)],
+            read_by_sender=read_by_sender,
+        )
+    )
+
+    results: list[dict[str, Any]] = []
+    for spec in specs:
+        result = next(sent_results) if isinstance(spec, BatchMessageSpec) else spec
+        if isinstance(result, JsonableError):
+            results.append({"result": "error", "msg": result.msg, **result.data})
+            continue
+
+        message_result: dict[str, Any] = {"result": "success", "id": result.message_id}
+        if result.automatic_new_visibility_policy:
+            message_result["automatic_new_visibility_policy"] = (
+                result.automatic_new_visibility_policy
+            )
+        results.append(message_result)
+
+    return json_success(request, data={"messages": results})
+
+
 @typed_endpoint
 def zcommand_backend(
     request: HttpRequest, user_profile: UserProfile, *, command: str
@@ -13,11 +13,16 @@ from django.utils.translation import override as override_language
 from typing_extensions import override
 
 from zerver.actions.data_import import import_slack_data
-from zerver.actions.message_flags import do_mark_stream_messages_as_read
+from zerver.actions.message_flags import (
+    do_mark_all_as_read,
+    do_mark_stream_messages_as_read_in_batches,
+)
 from zerver.actions.message_send import internal_send_private_message
 from zerver.actions.realm_export import notify_realm_export
 from zerver.actions.realm_settings import scrub_deactivated_realm
+from zerver.lib.cache import flush_realm_message_window_cache, flush_realm_unread_data_cache
 from zerver.lib.export import export_realm_wrapper
+from zerver.lib.message import get_last_message_id
 from zerver.lib.push_notifications import clear_push_device_tokens
 from zerver.lib.queue import queue_json_publish_rollback_unsafe, retry_event
 from zerver.lib.remote_server import (
@@ -26,7 +31,15 @@ from zerver.lib.remote_server import (
 )
 from zerver.lib.soft_deactivation import reactivate_user_if_soft_deactivated
 from zerver.lib.upload import handle_reupload_emojis_event
-from zerver.models import Message, Realm, RealmAuditLog, RealmExport, Stream, UserMessage
+from zerver.models import (
+    Message,
+    Realm,
+    RealmAuditLog,
+    RealmExport,
+    Stream,
+    Subscription,
+    UserMessage,
+)
 from zerver.models.users import get_system_bot, get_user_profile_by_id
 from zerver.worker.base import QueueProcessingWorker, assign_queue
 
@@ -57,14 +70,54 @@ class DeferredWorker(QueueProcessingWorker):
                 event["stream_recipient_ids"],
             )
 
-            for recipient_id in event["stream_recipient_ids"]:
-                count = do_mark_stream_messages_as_read(user_profile, recipient_id)
+            # Events requeued below, or queued for requests which
+            # timed out, resume from after_message_id in the first
+            # stream.  If the worker is restarted while processing the
+            # event, it is redelivered and resumes from the same
+            # place; already-read messages are skipped cheaply.
+            after_message_id = event.get("after_message_id", 0)
+            recipient_ids = event["stream_recipient_ids"]
+            while recipient_ids:
+                recipient_id = recipient_ids[0]
+                progress = do_mark_stream_messages_as_read_in_batches(
+                    user_profile,
+                    recipient_id,
+                    event.get("topic_name"),
+                    after_message_id=after_message_id,
+                    timeout=max(0, 30 - (time.time() - start)),
+                )
                 logger.info(
                     "Marked %s messages as read for user %s, stream_recipient_id %s",
-                    count,
+                    progress.count,
                     user_profile.id,
                     recipient_id,
                 )
+                if not progress.complete:
+                    # Like mark_stream_messages_as_read_for_everyone
+                    # below, we requeue long-running work so that other
+                    # deferred work can make progress.
+                    queue_json_publish_rollback_unsafe(
+                        "deferred_work",
+                        {
+                            **event,
+                            "stream_recipient_ids": recipient_ids,
+                            "after_message_id": progress.last_message_id,
+                        },
+                    )
+                    break
+                recipient_ids = recipient_ids[1:]
+                after_message_id = 0
+        elif event["type"] == "mark_all_as_read":
+            user_profile = get_user_profile_by_id(event["user_profile_id"])
+            count = do_mark_all_as_read(user_profile, timeout=30)
+            if count is None:
+                queue_json_publish_rollback_unsafe("deferred_work", event)
+            else:
+                logger.info(
+                    "Marked all %s remaining messages as read for user %s",
+                    count,
+                    user_profile.id,
+                )
         elif event["type"] == "mark_stream_messages_as_read_for_everyone":
             logger.info(
                 "Marking messages as read for all users, stream_recipient_id %s",
@@ -72,6 +125,13 @@ class DeferredWorker(QueueProcessingWorker):
             )
             stream = Stream.objects.get(recipient_id=event["stream_recipient_id"])
             # This event is generated by the stream deactivation code path.
+            if stream.lazy_user_messages:
+                # Lazily stored messages are marked as read by
+                # advancing the subscriptions' read watermarks.
+                Subscription.objects.filter(
+                    recipient_id=event["stream_recipient_id"],
+                    lazy_read_message_id__isnull=False,
+                ).update(lazy_read_message_id=get_last_message_id())
             batch_size = 50
             start_time = time.perf_counter()
             min_id = event.get("min_id", 0)
@@ -91,6 +151,8 @@ class DeferredWorker(QueueProcessingWorker):
                     UserMessage.select_for_update_query().filter(message__in=messages).extra(  # noqa: S610
                         where=[UserMessage.where_unread()]
                     ).update(flags=F("flags").bitor(UserMessage.flags.read))
+                    flush_realm_unread_data_cache(stream.realm_id)
+                    flush_realm_message_window_cache(stream.realm_id)
                 total_messages += len(messages)
                 if len(messages) < batch_size:
                     break
@@ -1,22 +1,27 @@
 # Documented in https://zulip.readthedocs.io/en/latest/subsystems/queuing.html
 import logging
-from collections.abc import Mapping
 from typing import Any
 
 from typing_extensions import override
 
-from zerver.actions.user_activity import do_update_user_activity_interval
+from zerver.actions.user_activity import do_update_user_activity_intervals
 from zerver.lib.timestamp import timestamp_to_datetime
-from zerver.models.users import get_user_profile_by_id
-from zerver.worker.base import QueueProcessingWorker, assign_queue
+from zerver.lib.write_coalescing import record_coalesced_writes
+from zerver.worker.base import LoopQueueProcessingWorker, assign_queue
 
 logger = logging.getLogger(__name__)
 
 
 @assign_queue("user_activity_interval")
-class UserActivityIntervalWorker(QueueProcessingWorker):
+class UserActivityIntervalWorker(LoopQueueProcessingWorker):
+    """Clients report user activity about once a minute, and each
+    report extends the user's activity interval; so we merge the
+    reports of each user in a batch before writing them, with a
+    single query for the whole batch."""
+
     @override
-    def consume(self, event: Mapping[str, Any]) -> None:
-        user_profile = get_user_profile_by_id(event["user_profile_id"])
-        log_time = timestamp_to_datetime(event["time"])
-        do_update_user_activity_interval(user_profile, log_time)
+    def consume_batch(self, events: list[dict[str, Any]]) -> None:
+        intervals_written = do_update_user_activity_intervals(
+            (event["user_profile_id"], timestamp_to_datetime(event["time"])) for event in events
+        )
+        record_coalesced_writes("user_activity_interval", len(events) - intervals_written)
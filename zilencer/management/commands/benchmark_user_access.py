@@ -0,0 +1,73 @@
+import time
+from collections.abc import Callable
+from typing import Any
+
+from django.core.management.base import CommandError, CommandParser
+from django.test import override_settings
+from typing_extensions import override
+
+from zerver.lib.cache import cache_delete, realm_accessible_user_ids_generation_cache_key
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.users import (
+    all_users_accessible_by_everyone_in_realm,
+    get_accessible_user_ids,
+    get_inaccessible_user_ids,
+    get_user_ids_who_can_access_user,
+)
+from zerver.models import UserProfile
+
+
+def time_per_user(run: Callable[[UserProfile], object], users: list[UserProfile]) -> float:
+    start = time.perf_counter()
+    for user in users:
+        run(user)
+    return (time.perf_counter() - start) / len(users)
+
+
+class Command(ZulipBaseCommand):
+    help = """Benchmark computing which users the guests in an organization can
+access, with and without CACHE_ACCESSIBLE_USER_IDS.
+
+This is most interesting for organizations with many guests, who share
+channels and direct messages with many other users."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--guests", type=int, default=100, help="The number of guests to time.")
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        if all_users_accessible_by_everyone_in_realm(realm):
+            raise CommandError("Guests in this organization can access all users.")
+
+        guests = list(
+            UserProfile.objects.filter(
+                realm=realm, role=UserProfile.ROLE_GUEST, is_active=True
+            ).order_by("id")[: options["guests"]]
+        )
+        if not guests:
+            raise CommandError("This organization has no active guests.")
+        user_ids = list(
+            UserProfile.objects.filter(realm=realm, is_active=True).values_list("id", flat=True)
+        )
+
+        benchmarks: dict[str, Callable[[UserProfile], object]] = {
+            "get_accessible_user_ids": lambda guest: get_accessible_user_ids(realm, guest),
+            "get_inaccessible_user_ids": lambda guest: get_inaccessible_user_ids(user_ids, guest),
+            "get_user_ids_who_can_access_user": get_user_ids_who_can_access_user,
+        }
+        print(f"Timing {len(guests)} guests, with {len(user_ids)} active users in total.")
+        for name, run in benchmarks.items():
+            with override_settings(CACHE_ACCESSIBLE_USER_IDS=False):
+                uncached = time_per_user(run, guests)
+            with override_settings(CACHE_ACCESSIBLE_USER_IDS=True):
+                cache_delete(realm_accessible_user_ids_generation_cache_key(realm.id))
+                cold = time_per_user(run, guests)
+                warm = time_per_user(run, guests)
+            print(
+                f"{name}: {uncached * 1000:.2f}ms uncached, "
+                f"{cold * 1000:.2f}ms with a cold cache, {warm * 1000:.2f}ms with a warm cache"
+            )
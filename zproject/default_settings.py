@@ -591,6 +591,12 @@ USER_LIMIT_FOR_SENDING_PRESENCE_UPDATE_EVENTS = 100
 # a database write each time a client sends a presence update.
 PRESENCE_UPDATE_MIN_FREQ_SECONDS = 55
 
+# Whether to skip presence updates which wouldn't change the database
+# state (see PRESENCE_UPDATE_MIN_FREQ_SECONDS), based on what was last
+# written for the user in the cache, rather than locking the user's
+# presence row on every heartbeat.
+PRESENCE_WRITE_COALESCING = False
+
 # Controls the timedelta between last_connected_time and last_active_time
 # within which the user should be considered ACTIVE for the purposes of
 # legacy presence events. That is - when sending a presence update about a user to clients,
@@ -602,6 +608,11 @@ PRESENCE_LEGACY_EVENT_OFFSET_FOR_ACTIVITY_SECONDS = 70
 # passes it to the web app in page_params.
 PRESENCE_HISTORY_LIMIT_DAYS_FOR_WEB_APP = 365
 
+# Whether to serve presence data (for clients using the modern
+# presence API) from a copy of each organization's presence data kept
+# in Redis, rather than querying the database on every presence poll.
+PRESENCE_REDIS_STORE = False
+
 # How many days deleted messages data should be kept before being
 # permanently deleted.
 ARCHIVED_DATA_VACUUMING_DELAY_DAYS = 30
@@ -623,6 +634,80 @@ LANDING_PAGE_NAVBAR_MESSAGE: str | None = None
 # returning users would still be caught-up normally.
 AUTO_CATCH_UP_SOFT_DEACTIVATED_USERS = True
 
+# Whether the server honors the per-channel lazy_user_messages mode,
+# where subscribers' plain unread messages in very large public
+# channels are tracked with a read watermark on the Subscription
+# rather than with one UserMessage row per message.  Channels are
+# switched into this mode with the `lazy_user_messages` management
+# command.
+LAZY_USER_MESSAGE_STREAMS = False
+
+# Whether to cache each user's unread message data in memcached for
+# /register, so that only messages newer than the cached snapshot need
+# to be queried.  Most useful for servers whose users have many
+# thousands of unread messages.
+CACHE_UNREAD_MESSAGE_DATA = False
+
+# Whether to cache the sections of the /register response which are
+# the same for every user in an organization, like its user groups and
+# custom profile fields, so that they're computed once per organization
+# when many clients register at once (e.g. after a restart).
+CACHE_REGISTER_REALM_SNAPSHOT = False
+
+# How many threads to fetch independent sections of the /register
+# response (drafts, unread messages, presence data, etc.) on
+# concurrently, each with its own database connection.  0 computes
+# them inline, in the request's thread.
+REGISTER_SECTION_THREADS = 0
+
+# The maximum number of /register requests to process at once across
+# the server; others are asked to retry after a jittered delay, which
+# spreads out the herd of clients reconnecting after a restart.  0
+# means no limit.
+REGISTER_MAX_CONCURRENT = 0
+
+# Whether group-based permission checks (can_send_message_group and
+# the like) load each user's recursive group memberships once per
+# request, and answer every check during the request from memory.
+PER_REQUEST_GROUP_MEMBERSHIP_CACHE = False
+
+# Whether to cache, for each user, the users they share a subscription
+# or direct messages with, which determine which users guests can
+# access in organizations where they can't access all users, and who
+# can access each user.  Most useful for organizations with many
+# guests, where this is otherwise computed for every message fetch,
+# presence update and the like.
+CACHE_ACCESSIBLE_USER_IDS = False
+
+# Whether to serve the list of users in an organization (GET /users,
+# and the users in the /register response) from a pre-formatted copy
+# kept in Redis, which is patched as users change, rather than
+# formatting every user in the organization for each request.
+REALM_USER_DIRECTORY = False
+
+# Whether to cache the message IDs found for each window of a narrow
+# that a user fetches with GET /messages, so that clients refetching
+# the same windows don't need to query the database.
+CACHE_MESSAGE_WINDOWS = False
+
+# Whether full-text searches also match the user's own messages which
+# process_fts_updates has not indexed yet, by searching their content
+# directly, so that users can always find messages they just sent.
+# This costs a lookup in the fts_update_log table for each search.
+SEARCH_UNINDEXED_OWN_MESSAGES = False
+
+# The number of compiled narrow queries (GET /messages) to cache per
+# process; queries for narrows with the same structure share an entry.
+NARROW_QUERY_CACHE_SIZE = 500
+
+# Opt-in sampling of the query plans of slow narrow queries, which
+# re-runs the given fraction of narrow queries slower than
+# NARROW_EXPLAIN_SLOW_QUERY_TIME seconds under EXPLAIN (ANALYZE,
+# BUFFERS), and aggregates the results by narrow shape.  See the
+# `narrow_query_plans` management command.
+NARROW_EXPLAIN_SAMPLE_RATE = 0.0
+NARROW_EXPLAIN_SLOW_QUERY_TIME = 1.0
+
 # Enables Google Analytics on selected portico pages.
 GOOGLE_ANALYTICS_ID: str | None = None
 
@@ -90,7 +90,12 @@ from zerver.views.message_flags import (
     update_message_flags_for_narrow,
 )
 from zerver.views.message_report import report_message_backend
-from zerver.views.message_send import render_message_backend, send_message_backend, zcommand_backend
+from zerver.views.message_send import (
+    render_message_backend,
+    send_message_backend,
+    send_messages_batch_backend,
+    zcommand_backend,
+)
 from zerver.views.message_summary import get_messages_summary
 from zerver.views.muted_users import mute_user, unmute_user
 from zerver.views.navigation_views import (
@@ -423,6 +428,7 @@ v1_api_and_json_patterns = [
         ),
     ),
     rest_path("messages/render", POST=render_message_backend),
+    rest_path("messages/batch", POST=send_messages_batch_backend),
     rest_path("messages/flags", POST=update_message_flags),
     rest_path("messages/flags/narrow", POST=update_message_flags_for_narrow),
     rest_path("messages/<int:message_id>/history", GET=get_message_edit_history),